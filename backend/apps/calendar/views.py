@@ -13,6 +13,7 @@ from .serializers import (
     CalendarStatsSerializer
 )
 from apps.reservations.models import Reservation, ReservationStatus
+from apps.reservations.services.occupancy import OccupancyGrid
 from apps.rooms.models import Room, RoomStatus
 from apps.core.models import Hotel
 
@@ -138,18 +139,15 @@ class CalendarEventViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Obtener habitaciones del hotel
-        rooms = Room.objects.filter(
-            hotel_id=hotel_id,
-            is_active=True
-        ).select_related('hotel').order_by('floor', 'name')
-        
-        # Obtener todas las reservas en el rango de fechas
-        reservations = Reservation.objects.filter(
-            hotel_id=hotel_id,
-            check_in__lte=end_date,
-            check_out__gt=start_date
-        ).select_related('room').order_by('check_in')
+        # Ocupación de la ventana [start_date, end_date] en pocas queries (todos los estados)
+        grid = OccupancyGrid.load(
+            hotel_id,
+            start_date,
+            end_date + timedelta(days=1),
+            statuses=None,
+            include_blocks=False,
+            keep_reservations=True,
+        )
         
         # Crear matriz de habitaciones x fechas
         result = []
@@ -161,14 +159,8 @@ class CalendarEventViewSet(viewsets.ModelViewSet):
                 'rooms': []
             }
             
-            for room in rooms:
-                # Buscar reserva para esta habitación en esta fecha
-                room_reservation = None
-                for reservation in reservations:
-                    if (reservation.room_id == room.id and 
-                        reservation.check_in <= current_date < reservation.check_out):
-                        room_reservation = reservation
-                        break
+            for room in grid.rooms:
+                room_reservation = grid.reservation_on(room.id, current_date)
                 
                 room_data = {
                     'room_id': room.id,
@@ -536,19 +528,8 @@ def availability_matrix(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Obtener habitaciones
-    rooms = Room.objects.filter(
-        hotel_id=hotel_id,
-        is_active=True
-    ).order_by('floor', 'name')
-    
-    # Obtener reservas activas
-    active_reservations = Reservation.objects.filter(
-        hotel_id=hotel_id,
-        status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN],
-        check_in__lt=end_date,
-        check_out__gt=start_date
-    ).select_related('room')
+    # Ocupación (reservas activas y bloqueos) de la ventana [start_date, end_date]
+    grid = OccupancyGrid.load(hotel_id, start_date, end_date + timedelta(days=1))
     
     # Crear matriz de disponibilidad
     matrix = []
@@ -560,20 +541,14 @@ def availability_matrix(request):
             'rooms': []
         }
         
-        for room in rooms:
-            # Verificar si la habitación está ocupada en esta fecha
-            is_occupied = any(
-                res.room_id == room.id and res.check_in <= current_date < res.check_out
-                for res in active_reservations
-            )
-            
+        for room in grid.rooms:
             day_data['rooms'].append({
                 'room_id': room.id,
                 'room_name': room.name,
                 'room_number': room.number,
                 'room_floor': room.floor,
                 'room_type': room.room_type,
-                'is_available': not is_occupied,
+                'is_available': grid.is_free(room.id, current_date, current_date + timedelta(days=1)),
                 'status': room.status
             })
         
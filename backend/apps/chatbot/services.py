@@ -17,9 +17,9 @@ from apps.reservations.models import (
     Reservation,
     ReservationChannel,
     ReservationStatus,
-    RoomBlock,
 )
 from apps.reservations.serializers import ReservationSerializer
+from apps.reservations.services.inventory import available_rooms
 from apps.reservations.services.pricing import (
     generate_nights_for_reservation,
     recalc_reservation_totals,
@@ -723,36 +723,19 @@ class WhatsappChatbotService:
     def _find_available_room(
         self, hotel: Hotel, check_in: date, check_out: date, guests: int
     ) -> Optional[Room]:
-        active_status = [
-            ReservationStatus.PENDING,
-            ReservationStatus.CONFIRMED,
-            ReservationStatus.CHECK_IN,
-        ]
-        rooms = (
+        # Una sola query: libres en el rango según el inventario diario (reservas activas + bloqueos)
+        rooms = available_rooms(
             Room.objects.filter(hotel=hotel, is_active=True)
             .exclude(status=RoomStatus.OUT_OF_SERVICE)
-            .order_by("max_capacity", "id")
+            .order_by("max_capacity", "id"),
+            check_in,
+            check_out,
+            hotel_id=hotel.id,
         )
         for room in rooms:
             max_capacity = room.max_capacity or room.capacity or 1
             if guests > max_capacity:
                 continue
-            overlap = Reservation.objects.filter(
-                room=room,
-                status__in=active_status,
-                check_in__lt=check_out,
-                check_out__gt=check_in,
-            ).exists()
-            if overlap:
-                continue
-            blocked = RoomBlock.objects.filter(
-                room=room,
-                is_active=True,
-                start_date__lt=check_out,
-                end_date__gt=check_in,
-            ).exists()
-            if blocked:
-                continue
             return room
         return None
 
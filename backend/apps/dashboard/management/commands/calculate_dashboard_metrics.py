@@ -66,32 +66,23 @@ class Command(BaseCommand):
             )
             return
 
-        days = options['days']
-        total_metrics = 0
+        days = max(options['days'], 1)
+        dates = [target_date - timedelta(days=i) for i in range(days)]
         
-        for hotel in hotels:
-            self.stdout.write(f'Calculando métricas para {hotel.name}...')
-            
-            # Calcular métricas para el rango de días
-            for i in range(days):
-                current_date = target_date - timedelta(days=i)
-                
-                try:
-                    metrics = DashboardMetrics.calculate_metrics(hotel, current_date)
-                    total_metrics += 1
-                    
-                    self.stdout.write(
-                        f'  ✓ Métricas calculadas para {current_date}: '
-                        f'Ocupación {metrics.occupancy_rate}%, '
-                        f'Ingresos ${metrics.total_revenue}'
-                    )
-                    
-                except Exception as e:
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f'  ✗ Error calculando métricas para {current_date}: {str(e)}'
-                        )
-                    )
+        try:
+            total_metrics = DashboardMetrics.calculate_metrics_bulk([hotel.id for hotel in hotels], dates)
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'  ✗ Error calculando métricas: {str(e)}')
+            )
+            return
+        
+        for metrics in DashboardMetrics.objects.filter(hotel__in=hotels, date=target_date).select_related('hotel'):
+            self.stdout.write(
+                f'  ✓ {metrics.hotel.name} ({target_date}): '
+                f'Ocupación {metrics.occupancy_rate}%, '
+                f'Ingresos ${metrics.total_revenue}'
+            )
 
         self.stdout.write(
             self.style.SUCCESS(
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0002_auto_20250929_2237'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dashboardmetrics',
+            name='commissions_checkin',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='dashboardmetrics',
+            name='gross_collected',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='dashboardmetrics',
+            name='net_collected',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='dashboardmetrics',
+            name='nights_sold',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dashboardmetrics',
+            name='refunds',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='dashboardmetrics',
+            name='revenue_night',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='dashboardmetrics',
+            name='room_type_occupancy',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
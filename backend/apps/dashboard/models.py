@@ -1,10 +1,6 @@
 from django.db import models
 from apps.core.models import Hotel
-from apps.rooms.models import Room
-from apps.reservations.models import Reservation, ReservationStatus
-from django.db.models import Count, Sum, Avg, Q
-from datetime import date, timedelta
-from decimal import Decimal
+from datetime import date
 
 class DashboardMetrics(models.Model):
     hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name="dashboard_metrics")
@@ -43,6 +39,16 @@ class DashboardMetrics(models.Model):
     double_rooms_occupied = models.PositiveIntegerField(default=0)
     triple_rooms_occupied = models.PositiveIntegerField(default=0)
     suite_rooms_occupied = models.PositiveIntegerField(default=0)
+    # Ocupación por tipo para cualquier tipo configurado: {room_type: habitaciones ocupadas}
+    room_type_occupancy = models.JSONField(default=dict, blank=True)
+    
+    # Agregados del día (noches vendidas, comisiones por check-in y cobros de caja)
+    nights_sold = models.PositiveIntegerField(default=0)
+    revenue_night = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    commissions_checkin = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    gross_collected = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    refunds = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    net_collected = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -65,122 +71,62 @@ class DashboardMetrics(models.Model):
         """Calcula y actualiza las métricas para un hotel en una fecha específica"""
         if target_date is None:
             target_date = date.today()
-        
-        # Obtener o crear el registro de métricas
-        metrics, created = cls.objects.get_or_create(
-            hotel=hotel,
-            date=target_date,
-            defaults={}
-        )
-        
-        # Calcular métricas de habitaciones
-        rooms = Room.objects.filter(hotel=hotel, is_active=True)
-        metrics.total_rooms = rooms.count()
-        metrics.available_rooms = rooms.filter(status='available').count()
-        metrics.occupied_rooms = rooms.filter(status='occupied').count()
-        metrics.maintenance_rooms = rooms.filter(status='maintenance').count()
-        metrics.out_of_service_rooms = rooms.filter(status='out_of_service').count()
-        metrics.reserved_rooms = rooms.filter(status='reserved').count()
-        
-        # Calcular métricas de reservas
-        reservations = Reservation.objects.filter(hotel=hotel)
-        metrics.total_reservations = reservations.count()
-        metrics.pending_reservations = reservations.filter(status=ReservationStatus.PENDING).count()
-        metrics.confirmed_reservations = reservations.filter(status=ReservationStatus.CONFIRMED).count()
-        metrics.cancelled_reservations = reservations.filter(status=ReservationStatus.CANCELLED).count()
-        
-        # Reservas para el día específico
-        # Llegadas de hoy (programadas + realizadas)
-        metrics.check_in_today = reservations.filter(
-            check_in=target_date,
-            status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN]
-        ).count()
-        
-        metrics.check_out_today = reservations.filter(
-            check_out=target_date,
-            status__in=[ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT]
-        ).count()
-        
-        metrics.no_show_today = reservations.filter(
-            check_in=target_date,
-            status=ReservationStatus.NO_SHOW
-        ).count()
-        
-        # Calcular métricas de huéspedes
-        metrics.total_guests = reservations.aggregate(
-            total=Sum('guests')
-        )['total'] or 0
-        
-        metrics.guests_checked_in = reservations.filter(
-            status=ReservationStatus.CHECK_IN
-        ).aggregate(
-            total=Sum('guests')
-        )['total'] or 0
-        
-        metrics.guests_expected_today = reservations.filter(
-            check_in=target_date,
-            status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN]
-        ).aggregate(
-            total=Sum('guests')
-        )['total'] or 0
-        
-        metrics.guests_departing_today = reservations.filter(
-            check_out=target_date,
-            status__in=[ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT]
-        ).aggregate(
-            total=Sum('guests')
-        )['total'] or 0
-        
-        # Calcular métricas financieras (ingreso diario por fecha objetivo)
-        # Consideramos reservas activas ese día (in-house) y prorrateamos el total por noche
-        reservations_in_house = reservations.filter(
-            status__in=[ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT],
-            check_in__lte=target_date,
-            check_out__gt=target_date,
+        cls.calculate_metrics_bulk([hotel.id], [target_date])
+        return cls.objects.get(hotel=hotel, date=target_date)
+
+    @classmethod
+    def calculate_metrics_bulk(cls, hotel_ids, dates):
+        """
+        Calcula y guarda las métricas de varios hoteles y fechas con el rollup agrupado
+        (cantidad de queries constante) y un único upsert. Devuelve la cantidad de filas.
+        """
+        from .rollup import LEGACY_ROOM_TYPES, compute_metrics_rollup
+
+        rollup = compute_metrics_rollup(hotel_ids, dates)
+        if not rollup:
+            return 0
+        objs = []
+        for (hotel_id, target_date), values in rollup.items():
+            by_type = values["room_type_occupancy"]
+            for room_type in LEGACY_ROOM_TYPES:
+                values[f"{room_type}_rooms_occupied"] = by_type.get(room_type, 0)
+            objs.append(cls(hotel_id=hotel_id, date=target_date, **values))
+        cls.objects.bulk_create(
+            objs,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=["hotel", "date"],
+            update_fields=sorted(METRIC_FIELDS) + ["updated_at"],
         )
+        return len(objs)
+
+    @classmethod
+    def refresh_dated_metrics_bulk(cls, hotel_ids, dates):
+        """
+        Recalcula en las filas ya materializadas sólo las métricas que dependen de la fecha
+        (llegadas, salidas, ingresos, noches, comisiones, cobros). Las de estado actual
+        (SNAPSHOT_FIELDS) quedan como se guardaron y la tarifa promedio se recalcula con las
+        habitaciones ocupadas guardadas. Devuelve la cantidad de filas.
+        """
+        from .rollup import SNAPSHOT_FIELDS, TWO_PLACES, compute_metrics_rollup
+
+        rows = list(cls.objects.filter(hotel_id__in=hotel_ids, date__in=dates))
+        if not rows:
+            return 0
+        rollup = compute_metrics_rollup({row.hotel_id for row in rows}, {row.date for row in rows})
+        update_fields = sorted(METRIC_FIELDS - set(SNAPSHOT_FIELDS))
+        for row in rows:
+            values = rollup[(row.hotel_id, row.date)]
+            for field in update_fields:
+                setattr(row, field, values[field])
+            row.average_room_rate = (
+                (row.total_revenue / row.occupied_rooms).quantize(TWO_PLACES) if row.occupied_rooms else 0
+            )
+        cls.objects.bulk_update(rows, update_fields + ["updated_at"], batch_size=500)
+        return len(rows)
 
-        revenue_day = Decimal('0.00')
-        for r in reservations_in_house.only('check_in', 'check_out', 'total_price'):
-            nights = (r.check_out - r.check_in).days
-            if nights > 0:
-                revenue_day += (r.total_price or Decimal('0.00')) / Decimal(nights)
-            else:
-                revenue_day += (r.total_price or Decimal('0.00'))
 
-        metrics.total_revenue = revenue_day.quantize(Decimal('0.01'))
-        
-        # Calcular tarifa promedio por habitación (Decimal con 2 decimales)
-        if metrics.occupied_rooms > 0:
-            metrics.average_room_rate = (metrics.total_revenue / Decimal(metrics.occupied_rooms)).quantize(Decimal('0.01'))
-        else:
-            metrics.average_room_rate = Decimal('0.00')
-        
-        # Calcular tasa de ocupación (Decimal con 2 decimales)
-        if metrics.total_rooms > 0:
-            metrics.occupancy_rate = (Decimal(metrics.occupied_rooms) / Decimal(metrics.total_rooms) * Decimal('100')).quantize(Decimal('0.01'))
-        else:
-            metrics.occupancy_rate = Decimal('0.00')
-        
-        # Calcular ocupación por tipo de habitación
-        metrics.single_rooms_occupied = rooms.filter(
-            room_type='single',
-            status='occupied'
-        ).count()
-        
-        metrics.double_rooms_occupied = rooms.filter(
-            room_type='double',
-            status='occupied'
-        ).count()
-        
-        metrics.triple_rooms_occupied = rooms.filter(
-            room_type='triple',
-            status='occupied'
-        ).count()
-        
-        metrics.suite_rooms_occupied = rooms.filter(
-            room_type='suite',
-            status='occupied'
-        ).count()
-        
-        metrics.save()
-        return metrics
+METRIC_FIELDS = {
+    f.name for f in DashboardMetrics._meta.concrete_fields
+    if f.name not in ("id", "hotel", "date", "created_at", "updated_at")
+}
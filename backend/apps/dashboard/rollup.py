@@ -0,0 +1,289 @@
+"""
+Rollup de métricas del dashboard para muchos hoteles y fechas a la vez.
+
+En lugar de ~25 queries por hotel y por fecha, cada bloque de métricas sale de una
+query agrupada con agregación condicional (por hotel, o por hotel + fecha):
+
+- habitaciones: Room agrupado por (hotel, status, room_type)  -> tipos dinámicos
+- reservas: Reservation agrupado por hotel (totales) y por (hotel, check_in) /
+  (hotel, check_out) para llegadas, salidas y no-shows del día
+- ingresos prorrateados: una sola lectura de reservas in-house del rango
+- noches vendidas: ReservationNight agrupado por (hotel, date)
+- comisiones por check-in: ChannelCommission agrupado por (hotel, check_in)
+- cobros: Payment agrupado por (hotel, date)
+
+La cantidad de queries es constante: no depende de hoteles x días x métricas.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Tuple
+
+from django.db.models import Count, Q, Sum
+
+from apps.rooms.models import Room
+from apps.reservations.models import ChannelCommission, Payment, Reservation, ReservationNight, ReservationStatus
+
+ARRIVAL_STATUSES = [ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN]
+DEPARTURE_STATUSES = [ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT]
+IN_HOUSE_STATUSES = [ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT]
+COMMISSION_STATUSES = [
+    ReservationStatus.PENDING,
+    ReservationStatus.CONFIRMED,
+    ReservationStatus.CHECK_IN,
+    ReservationStatus.CHECK_OUT,
+]
+
+# Tipos históricos con columna propia en DashboardMetrics (se siguen completando)
+LEGACY_ROOM_TYPES = ("single", "double", "triple", "suite")
+
+ROOM_STATUS_FIELDS = {
+    "available": "available_rooms",
+    "occupied": "occupied_rooms",
+    "maintenance": "maintenance_rooms",
+    "out_of_service": "out_of_service_rooms",
+    "reserved": "reserved_rooms",
+}
+
+# Campos que salen del estado actual (Room.status y totales vigentes del hotel), no de la fecha:
+# sólo describen el día en que se calculan, así que al refrescar otro día se conservan
+SNAPSHOT_FIELDS = (
+    "total_rooms",
+    *ROOM_STATUS_FIELDS.values(),
+    *(f"{room_type}_rooms_occupied" for room_type in LEGACY_ROOM_TYPES),
+    "room_type_occupancy",
+    "occupancy_rate",
+    "total_reservations",
+    "pending_reservations",
+    "confirmed_reservations",
+    "cancelled_reservations",
+    "total_guests",
+    "guests_checked_in",
+)
+
+TWO_PLACES = Decimal("0.01")
+
+
+def _empty_row() -> dict:
+    return {
+        "total_rooms": 0,
+        "available_rooms": 0,
+        "occupied_rooms": 0,
+        "maintenance_rooms": 0,
+        "out_of_service_rooms": 0,
+        "reserved_rooms": 0,
+        "total_reservations": 0,
+        "pending_reservations": 0,
+        "confirmed_reservations": 0,
+        "cancelled_reservations": 0,
+        "check_in_today": 0,
+        "check_out_today": 0,
+        "no_show_today": 0,
+        "total_guests": 0,
+        "guests_checked_in": 0,
+        "guests_expected_today": 0,
+        "guests_departing_today": 0,
+        "total_revenue": Decimal("0.00"),
+        "average_room_rate": Decimal("0.00"),
+        "occupancy_rate": Decimal("0.00"),
+        "room_type_occupancy": {},
+        "nights_sold": 0,
+        "revenue_night": Decimal("0.00"),
+        "commissions_checkin": Decimal("0.00"),
+        "gross_collected": Decimal("0.00"),
+        "refunds": Decimal("0.00"),
+        "net_collected": Decimal("0.00"),
+    }
+
+
+def _room_rollup(hotel_ids: List[int]) -> Dict[int, dict]:
+    """Inventario actual por hotel (snapshot de Room.status, igual que el cálculo histórico)."""
+    result: Dict[int, dict] = defaultdict(lambda: {"by_status": {}, "total": 0, "occupied_by_type": {}, "rooms_by_type": {}})
+    rows = (
+        Room.objects.filter(hotel_id__in=hotel_ids, is_active=True)
+        .values("hotel_id", "status", "room_type")
+        .annotate(n=Count("id"))
+    )
+    for row in rows:
+        entry = result[row["hotel_id"]]
+        entry["total"] += row["n"]
+        entry["by_status"][row["status"]] = entry["by_status"].get(row["status"], 0) + row["n"]
+        room_type = row["room_type"] or ""
+        entry["rooms_by_type"][room_type] = entry["rooms_by_type"].get(room_type, 0) + row["n"]
+        if row["status"] == "occupied":
+            entry["occupied_by_type"][room_type] = entry["occupied_by_type"].get(room_type, 0) + row["n"]
+    return result
+
+
+def _reservation_totals(hotel_ids: List[int]) -> Dict[int, dict]:
+    rows = (
+        Reservation.objects.filter(hotel_id__in=hotel_ids)
+        .values("hotel_id")
+        .annotate(
+            total_reservations=Count("id"),
+            pending_reservations=Count("id", filter=Q(status=ReservationStatus.PENDING)),
+            confirmed_reservations=Count("id", filter=Q(status=ReservationStatus.CONFIRMED)),
+            cancelled_reservations=Count("id", filter=Q(status=ReservationStatus.CANCELLED)),
+            total_guests=Sum("guests"),
+            guests_checked_in=Sum("guests", filter=Q(status=ReservationStatus.CHECK_IN)),
+        )
+    )
+    return {row.pop("hotel_id"): row for row in rows}
+
+
+def _arrivals(hotel_ids: List[int], dates: List[date]) -> Dict[Tuple[int, date], dict]:
+    rows = (
+        Reservation.objects.filter(hotel_id__in=hotel_ids, check_in__range=(dates[0], dates[-1]))
+        .values("hotel_id", "check_in")
+        .annotate(
+            check_in_today=Count("id", filter=Q(status__in=ARRIVAL_STATUSES)),
+            guests_expected_today=Sum("guests", filter=Q(status__in=ARRIVAL_STATUSES)),
+            no_show_today=Count("id", filter=Q(status=ReservationStatus.NO_SHOW)),
+        )
+    )
+    return {(row.pop("hotel_id"), row.pop("check_in")): row for row in rows}
+
+
+def _departures(hotel_ids: List[int], dates: List[date]) -> Dict[Tuple[int, date], dict]:
+    rows = (
+        Reservation.objects.filter(hotel_id__in=hotel_ids, check_out__range=(dates[0], dates[-1]), status__in=DEPARTURE_STATUSES)
+        .values("hotel_id", "check_out")
+        .annotate(check_out_today=Count("id"), guests_departing_today=Sum("guests"))
+    )
+    return {(row.pop("hotel_id"), row.pop("check_out")): row for row in rows}
+
+
+def _prorated_revenue(hotel_ids: List[int], dates: List[date]) -> Dict[Tuple[int, date], Decimal]:
+    """
+    Total de cada reserva in-house prorrateado por noche (una sola query para todo el rango).
+    Una reserva sin noches (check_out <= check_in) suma su total completo al día del check-in.
+    """
+    wanted = set(dates)
+    first, last = min(dates), max(dates)
+    revenue: Dict[Tuple[int, date], Decimal] = defaultdict(lambda: Decimal("0.00"))
+    rows = Reservation.objects.filter(
+        Q(check_out__gt=first) | Q(check_in__gte=first),
+        hotel_id__in=hotel_ids,
+        status__in=IN_HOUSE_STATUSES,
+        check_in__lte=last,
+    ).order_by().values_list("hotel_id", "check_in", "check_out", "total_price")
+    for hotel_id, check_in, check_out, total_price in rows:
+        nights = (check_out - check_in).days
+        if nights <= 0:
+            if check_in in wanted:
+                revenue[(hotel_id, check_in)] += total_price or Decimal("0.00")
+            continue
+        per_night = (total_price or Decimal("0.00")) / Decimal(nights)
+        d = max(check_in, first)
+        end = min(check_out - timedelta(days=1), last)
+        while d <= end:
+            if d in wanted:
+                revenue[(hotel_id, d)] += per_night
+            d += timedelta(days=1)
+    return revenue
+
+
+def _nights(hotel_ids: List[int], dates: List[date]) -> Dict[Tuple[int, date], dict]:
+    rows = (
+        ReservationNight.objects.filter(hotel_id__in=hotel_ids, date__range=(dates[0], dates[-1]))
+        .values("hotel_id", "date")
+        .annotate(nights_sold=Count("id"), revenue_night=Sum("total_night"))
+    )
+    return {(row.pop("hotel_id"), row.pop("date")): row for row in rows}
+
+
+def _commissions(hotel_ids: List[int], dates: List[date]) -> Dict[Tuple[int, date], Decimal]:
+    rows = (
+        ChannelCommission.objects.filter(
+            reservation__hotel_id__in=hotel_ids,
+            reservation__check_in__range=(dates[0], dates[-1]),
+            reservation__status__in=COMMISSION_STATUSES,
+        )
+        .values("reservation__hotel_id", "reservation__check_in")
+        .annotate(amount=Sum("amount"))
+    )
+    return {(row["reservation__hotel_id"], row["reservation__check_in"]): row["amount"] or Decimal("0.00") for row in rows}
+
+
+def _payments(hotel_ids: List[int], dates: List[date]) -> Dict[Tuple[int, date], dict]:
+    rows = (
+        Payment.objects.filter(reservation__hotel_id__in=hotel_ids, date__range=(dates[0], dates[-1]))
+        .values("reservation__hotel_id", "date")
+        .annotate(
+            gross=Sum("amount", filter=Q(amount__gt=0)),
+            refunds=Sum("amount", filter=Q(amount__lt=0)),
+            net=Sum("amount"),
+        )
+    )
+    return {(row["reservation__hotel_id"], row["date"]): row for row in rows}
+
+
+def compute_metrics_rollup(hotel_ids: Iterable[int], dates: Iterable[date]) -> Dict[Tuple[int, date], dict]:
+    """
+    Calcula todas las métricas de DashboardMetrics para cada (hotel, fecha).
+
+    Devuelve {(hotel_id, date): {campo: valor}} con los mismos criterios que el cálculo
+    por hotel/fecha histórico, más `room_type_occupancy` (tipos dinámicos) y los
+    agregados nocturnos, de comisiones y de cobros del día.
+    """
+    hotel_ids = sorted({int(h) for h in hotel_ids})
+    dates = sorted(set(dates))
+    if not hotel_ids or not dates:
+        return {}
+
+    rooms = _room_rollup(hotel_ids)
+    totals = _reservation_totals(hotel_ids)
+    arrivals = _arrivals(hotel_ids, dates)
+    departures = _departures(hotel_ids, dates)
+    revenue = _prorated_revenue(hotel_ids, dates)
+    nights = _nights(hotel_ids, dates)
+    commissions = _commissions(hotel_ids, dates)
+    payments = _payments(hotel_ids, dates)
+
+    result: Dict[Tuple[int, date], dict] = {}
+    for hotel_id in hotel_ids:
+        room_info = rooms.get(hotel_id) or {"by_status": {}, "total": 0, "occupied_by_type": {}, "rooms_by_type": {}}
+        hotel_totals = totals.get(hotel_id, {})
+        for d in dates:
+            key = (hotel_id, d)
+            row = _empty_row()
+
+            row["total_rooms"] = room_info["total"]
+            for status, field in ROOM_STATUS_FIELDS.items():
+                row[field] = room_info["by_status"].get(status, 0)
+            row["room_type_occupancy"] = {
+                room_type: room_info["occupied_by_type"].get(room_type, 0)
+                for room_type in sorted(room_info["rooms_by_type"])
+            }
+
+            for field in ("total_reservations", "pending_reservations", "confirmed_reservations", "cancelled_reservations",
+                          "total_guests", "guests_checked_in"):
+                row[field] = hotel_totals.get(field) or 0
+            for field, value in arrivals.get(key, {}).items():
+                row[field] = value or 0
+            for field, value in departures.get(key, {}).items():
+                row[field] = value or 0
+
+            row["total_revenue"] = revenue.get(key, Decimal("0.00")).quantize(TWO_PLACES)
+            if row["occupied_rooms"] > 0:
+                row["average_room_rate"] = (row["total_revenue"] / Decimal(row["occupied_rooms"])).quantize(TWO_PLACES)
+            if row["total_rooms"] > 0:
+                row["occupancy_rate"] = (
+                    Decimal(row["occupied_rooms"]) / Decimal(row["total_rooms"]) * Decimal("100")
+                ).quantize(TWO_PLACES)
+
+            night_row = nights.get(key)
+            if night_row:
+                row["nights_sold"] = night_row["nights_sold"] or 0
+                row["revenue_night"] = Decimal(night_row["revenue_night"] or 0).quantize(TWO_PLACES)
+            row["commissions_checkin"] = Decimal(commissions.get(key, Decimal("0.00"))).quantize(TWO_PLACES)
+            pay_row = payments.get(key)
+            if pay_row:
+                row["gross_collected"] = Decimal(pay_row["gross"] or 0).quantize(TWO_PLACES)
+                row["refunds"] = Decimal(abs(pay_row["refunds"] or 0)).quantize(TWO_PLACES)
+                row["net_collected"] = Decimal(pay_row["net"] or 0).quantize(TWO_PLACES)
+
+            result[key] = row
+    return result
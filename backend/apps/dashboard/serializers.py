@@ -37,6 +37,13 @@ class DashboardMetricsSerializer(serializers.ModelSerializer):
             'double_rooms_occupied',
             'triple_rooms_occupied',
             'suite_rooms_occupied',
+            'room_type_occupancy',
+            'nights_sold',
+            'revenue_night',
+            'commissions_checkin',
+            'gross_collected',
+            'refunds',
+            'net_collected',
             'created_at',
             'updated_at'
         ]
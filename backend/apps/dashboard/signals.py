@@ -0,0 +1,101 @@
+"""
+Refresco incremental del rollup del dashboard a partir de escrituras.
+
+Cada cambio en reservas, pagos, comisiones o habitaciones encola (tras el commit) el
+recálculo del bucket de hoy del hotel y de los días ya materializados que el cambio
+toca. Las ráfagas se coalescen por hotel y tramo con una clave de caché.
+"""
+from __future__ import annotations
+
+import logging
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.reservations.models import ChannelCommission, Payment, Reservation
+from apps.rooms.models import Room
+from .tasks import refresh_dashboard_metrics_for_hotel
+
+logger = logging.getLogger(__name__)
+
+# Ventana de coalescencia: la tarea corre después de que vence la clave, así ve
+# todas las escrituras que la clave absorbió.
+REFRESH_DEBOUNCE_SECONDS = 10
+
+
+def queue_metrics_refresh(hotel_id, start=None, end=None) -> bool:
+    """Encola el refresco del rollup de un hotel (hoy + días materializados de [start, end])."""
+    if not hotel_id:
+        return False
+    start_str = start.isoformat() if hasattr(start, "isoformat") else start
+    end_str = end.isoformat() if hasattr(end, "isoformat") else end
+    throttle_key = f"dashboard:refresh:{hotel_id}:{start_str}:{end_str}"
+
+    def _enqueue():
+        # El throttle se toma recién con el commit: una transacción revertida no frena el
+        # refresco de la siguiente escritura que sí confirma
+        try:
+            if not cache.add(throttle_key, True, timeout=REFRESH_DEBOUNCE_SECONDS):
+                return
+        except Exception as e:
+            logger.debug(f"No se pudo coalescer el refresco del dashboard (hotel {hotel_id}): {e}")
+        try:
+            refresh_dashboard_metrics_for_hotel.apply_async(
+                args=[hotel_id, start_str, end_str], countdown=REFRESH_DEBOUNCE_SECONDS + 2
+            )
+        except Exception as e:
+            logger.warning(f"No se pudo encolar el refresco del dashboard (hotel {hotel_id}): {e}")
+
+    transaction.on_commit(_enqueue)
+    return True
+
+
+@receiver(post_save, sender=Reservation)
+def reservation_metrics_post_save(sender, instance: Reservation, **kwargs):
+    prev = getattr(instance, "_prev", None)
+    start, end = instance.check_in, instance.check_out
+    if prev is not None and prev.hotel_id == instance.hotel_id and prev.check_in and prev.check_out:
+        start, end = min(start, prev.check_in), max(end, prev.check_out)
+    elif prev is not None:
+        queue_metrics_refresh(prev.hotel_id, prev.check_in, prev.check_out)
+    queue_metrics_refresh(instance.hotel_id, start, end)
+
+
+@receiver(post_delete, sender=Reservation)
+def reservation_metrics_post_delete(sender, instance: Reservation, **kwargs):
+    queue_metrics_refresh(instance.hotel_id, instance.check_in, instance.check_out)
+
+
+def _commission_span(instance: ChannelCommission):
+    try:
+        reservation = instance.reservation
+    except Reservation.DoesNotExist:
+        return None
+    return reservation.hotel_id, reservation.check_in
+
+
+@receiver(post_save, sender=ChannelCommission)
+@receiver(post_delete, sender=ChannelCommission)
+def channel_commission_metrics_changed(sender, instance: ChannelCommission, **kwargs):
+    span = _commission_span(instance)
+    if span:
+        hotel_id, check_in = span
+        queue_metrics_refresh(hotel_id, check_in, check_in)
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def payment_metrics_changed(sender, instance: Payment, **kwargs):
+    try:
+        hotel_id = instance.reservation.hotel_id
+    except Reservation.DoesNotExist:
+        return
+    queue_metrics_refresh(hotel_id, instance.date, instance.date)
+
+
+@receiver(post_save, sender=Room)
+def room_metrics_post_save(sender, instance: Room, **kwargs):
+    # El inventario por estado es un snapshot: solo afecta el bucket de hoy
+    queue_metrics_refresh(instance.hotel_id)
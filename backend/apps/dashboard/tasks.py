@@ -12,9 +12,41 @@ def calculate_dashboard_metrics_for_date(self, target_date_str: str | None = Non
     Si no se provee fecha, usa la fecha actual.
     """
     target_date = date.fromisoformat(target_date_str) if target_date_str else date.today()
-    hotels = Hotel.objects.filter(is_active=True)
-    for hotel in hotels:
-        DashboardMetrics.calculate_metrics(hotel, target_date)
+    hotel_ids = list(Hotel.objects.filter(is_active=True).values_list("id", flat=True))
+    return DashboardMetrics.calculate_metrics_bulk(hotel_ids, [target_date])
+
+
+@shared_task(bind=True, autoretry_for=(ProgrammingError, OperationalError), retry_backoff=5, retry_jitter=True, retry_kwargs={"max_retries": 5})
+def calculate_dashboard_metrics_for_range(self, start_date_str: str, end_date_str: str):
+    """Calcula métricas de todos los hoteles para cada fecha de [start, end] en un solo rollup."""
+    start = date.fromisoformat(start_date_str)
+    end = date.fromisoformat(end_date_str)
+    dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    hotel_ids = list(Hotel.objects.filter(is_active=True).values_list("id", flat=True))
+    return DashboardMetrics.calculate_metrics_bulk(hotel_ids, dates)
+
+
+@shared_task(bind=True, autoretry_for=(ProgrammingError, OperationalError), retry_backoff=5, retry_jitter=True, retry_kwargs={"max_retries": 5})
+def refresh_dashboard_metrics_for_hotel(self, hotel_id: int, start_date_str: str | None = None, end_date_str: str | None = None):
+    """Recalcula el bucket de hoy de un hotel y los días ya materializados de [start, end].
+
+    Lo encolan las señales de escritura (reservas, pagos, comisiones, habitaciones); los días
+    sin fila todavía se materializan a demanda desde las vistas. El estado actual de las
+    habitaciones sólo se aplica a hoy: en los demás días se conserva el que se guardó.
+    """
+    today = date.today()
+    count = DashboardMetrics.calculate_metrics_bulk([hotel_id], [today])
+    if start_date_str and end_date_str:
+        dates = (
+            DashboardMetrics.objects.filter(
+                hotel_id=hotel_id,
+                date__range=(date.fromisoformat(start_date_str), date.fromisoformat(end_date_str)),
+            )
+            .exclude(date=today)
+            .values_list("date", flat=True)
+        )
+        count += DashboardMetrics.refresh_dated_metrics_bulk([hotel_id], list(dates))
+    return count
 
 
 @shared_task
@@ -25,11 +57,9 @@ def calculate_dashboard_metrics_daily():
 
 @shared_task
 def backfill_dashboard_metrics(days: int = 7):
-    """Rellena métricas hacia atrás N días para todos los hoteles."""
+    """Rellena métricas hacia atrás N días para todos los hoteles (un único rollup)."""
     today = date.today()
-    for i in range(days):
-        target_date = today - timedelta(days=i)
-        calculate_dashboard_metrics_for_date.apply_async(kwargs={"target_date_str": target_date.isoformat()})
-
-
-
+    calculate_dashboard_metrics_for_range.apply_async(kwargs={
+        "start_date_str": (today - timedelta(days=max(days, 1) - 1)).isoformat(),
+        "end_date_str": today.isoformat(),
+    })
@@ -1,4 +1,5 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.utils import timezone
 from datetime import date, timedelta
 from decimal import Decimal
@@ -7,6 +8,7 @@ from apps.core.models import Hotel
 from apps.rooms.models import Room, RoomStatus
 from apps.reservations.models import Reservation, ReservationStatus
 from .models import DashboardMetrics
+from .trends import ensure_daily_metrics, trend_series
 
 class DashboardMetricsModelTest(TestCase):
     def setUp(self):
@@ -175,3 +177,214 @@ class DashboardMetricsViewTest(TestCase):
             self.assertIn('date', day_data)
             self.assertIn('occupancy_rate', day_data)
             self.assertIn('total_revenue', day_data)
+
+
+class DashboardMetricsRollupTest(TestCase):
+    def setUp(self):
+        from apps.core.models import Currency
+        from apps.reservations.models import ChannelCommission, Payment
+
+        self.currency = Currency.objects.create(code="ARS", name="Peso")
+        self.today = date.today()
+        self.hotels = [
+            Hotel.objects.create(name=f"Hotel Rollup {i}", email=f"rollup{i}@hotel.com") for i in range(2)
+        ]
+        for hotel in self.hotels:
+            for number, (room_type, room_status) in enumerate(
+                [("single", RoomStatus.OCCUPIED), ("loft", RoomStatus.OCCUPIED), ("loft", RoomStatus.AVAILABLE)]
+            ):
+                Room.objects.create(
+                    name=f"{hotel.id}-{number}", hotel=hotel, floor=1, room_type=room_type, number=100 + number,
+                    base_price=Decimal('100.00'), base_currency=self.currency, capacity=2, max_capacity=2,
+                    status=room_status,
+                )
+        hotel = self.hotels[0]
+        room = hotel.rooms.first()
+        self.in_house = Reservation.objects.create(
+            hotel=hotel, room=room, guests=2,
+            guests_data=[{'name': 'Ana', 'email': 'ana@test.com', 'is_primary': True}],
+            check_in=self.today, check_out=self.today + timedelta(days=4),
+            status=ReservationStatus.CHECK_IN, total_price=Decimal('400.00'),
+        )
+        ChannelCommission.objects.create(reservation=self.in_house, channel='booking', amount=Decimal('40.00'))
+        Payment.objects.create(reservation=self.in_house, date=self.today, amount=Decimal('300.00'))
+        Payment.objects.create(reservation=self.in_house, date=self.today, amount=Decimal('-50.00'))
+
+    def test_rollup_values(self):
+        DashboardMetrics.calculate_metrics_bulk([h.id for h in self.hotels], [self.today, self.today + timedelta(days=1)])
+        metrics = DashboardMetrics.objects.get(hotel=self.hotels[0], date=self.today)
+        self.assertEqual(metrics.total_rooms, 3)
+        self.assertEqual(metrics.occupied_rooms, 2)
+        self.assertEqual(metrics.room_type_occupancy, {"loft": 1, "single": 1})
+        self.assertEqual(metrics.single_rooms_occupied, 1)
+        self.assertEqual(metrics.check_in_today, 1)
+        self.assertEqual(metrics.guests_expected_today, 2)
+        self.assertEqual(metrics.total_revenue, Decimal('100.00'))
+        self.assertEqual(metrics.commissions_checkin, Decimal('40.00'))
+        self.assertEqual(metrics.gross_collected, Decimal('300.00'))
+        self.assertEqual(metrics.refunds, Decimal('50.00'))
+        self.assertEqual(metrics.net_collected, Decimal('250.00'))
+        self.assertEqual(metrics.nights_sold, self.in_house.nights.filter(date=self.today).count())
+
+        tomorrow = DashboardMetrics.objects.get(hotel=self.hotels[0], date=self.today + timedelta(days=1))
+        self.assertEqual(tomorrow.check_in_today, 0)
+        self.assertEqual(tomorrow.total_revenue, Decimal('100.00'))
+        self.assertEqual(tomorrow.commissions_checkin, Decimal('0.00'))
+
+        other = DashboardMetrics.objects.get(hotel=self.hotels[1], date=self.today)
+        self.assertEqual(other.total_reservations, 0)
+        self.assertEqual(other.total_revenue, Decimal('0.00'))
+
+    def test_reservation_without_nights_credits_total_to_check_in(self):
+        day_use = Reservation.objects.create(
+            hotel=self.hotels[1], room=self.hotels[1].rooms.first(), guests=1,
+            guests_data=[{'name': 'Beto', 'email': 'beto@test.com', 'is_primary': True}],
+            check_in=self.today, check_out=self.today + timedelta(days=1),
+            status=ReservationStatus.CHECK_OUT,
+        )
+        # Sin noches (check_out == check_in): sólo se llega con un update directo
+        Reservation.objects.filter(pk=day_use.pk).update(check_out=self.today, total_price=Decimal('80.00'))
+        DashboardMetrics.calculate_metrics_bulk([self.hotels[1].id], [self.today, self.today + timedelta(days=1)])
+        self.assertEqual(DashboardMetrics.objects.get(hotel=self.hotels[1], date=self.today).total_revenue, Decimal('80.00'))
+        self.assertEqual(
+            DashboardMetrics.objects.get(hotel=self.hotels[1], date=self.today + timedelta(days=1)).total_revenue,
+            Decimal('0.00'),
+        )
+
+    def test_single_hotel_matches_bulk_and_updates_in_place(self):
+        first = DashboardMetrics.calculate_metrics(self.hotels[0], self.today)
+        DashboardMetrics.calculate_metrics_bulk([self.hotels[0].id], [self.today])
+        self.assertEqual(DashboardMetrics.objects.filter(hotel=self.hotels[0]).count(), 1)
+        self.assertEqual(DashboardMetrics.objects.get(pk=first.pk).total_revenue, first.total_revenue)
+
+    def test_query_count_does_not_depend_on_hotels_or_days(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        dates = [self.today - timedelta(days=i) for i in range(30)]
+        with CaptureQueriesContext(connection) as ctx:
+            DashboardMetrics.calculate_metrics_bulk([h.id for h in self.hotels], dates)
+        selects = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 8)
+        self.assertEqual(DashboardMetrics.objects.count(), 60)
+
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "dashboard-tests"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class DashboardTrendsRollupTest(TestCase):
+    def setUp(self):
+        from apps.core.models import Currency
+
+        cache.clear()
+        self.currency = Currency.objects.create(code="ARS", name="Peso")
+        self.today = date.today()
+        self.hotels = [
+            Hotel.objects.create(name=f"Hotel Trends {i}", email=f"trends{i}@hotel.com") for i in range(3)
+        ]
+        for hotel in self.hotels:
+            for number in range(2):
+                Room.objects.create(
+                    name=f"{hotel.id}-{number}", hotel=hotel, floor=1, room_type="double", number=200 + number,
+                    base_price=Decimal('100.00'), base_currency=self.currency, capacity=2, max_capacity=2,
+                    status=RoomStatus.OCCUPIED if number == 0 else RoomStatus.AVAILABLE,
+                )
+        hotel = self.hotels[0]
+        self.reservation = Reservation.objects.create(
+            hotel=hotel, room=hotel.rooms.first(), guests=2,
+            guests_data=[{'name': 'Ana', 'email': 'ana@test.com', 'is_primary': True}],
+            check_in=self.today - timedelta(days=2), check_out=self.today + timedelta(days=2),
+            status=ReservationStatus.CHECK_IN, total_price=Decimal('400.00'),
+        )
+
+    def test_trend_buckets_sum_daily_rows(self):
+        start = self.today - timedelta(days=13)
+        ensure_daily_metrics([h.id for h in self.hotels], start, self.today)
+        self.assertEqual(DashboardMetrics.objects.count(), 3 * 14)
+
+        daily = trend_series([h.id for h in self.hotels], start, self.today, "day")
+        weekly = trend_series([h.id for h in self.hotels], start, self.today, "week")
+        monthly = trend_series([h.id for h in self.hotels], start, self.today, "month")
+        self.assertEqual(len(daily), 14)
+        self.assertTrue(all(point["date"].weekday() == 0 for point in weekly))
+        self.assertTrue(all(point["date"].day == 1 for point in monthly))
+        for series in (weekly, monthly):
+            self.assertEqual(sum(p["total_revenue"] for p in series), sum(p["total_revenue"] for p in daily))
+        self.assertEqual(daily[-1]["total_revenue"], Decimal('100.00'))
+        self.assertEqual(daily[-1]["occupancy_rate"], Decimal('50.00'))
+
+    def test_trends_view_query_count_does_not_depend_on_range(self):
+        from django.contrib.auth import get_user_model
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user(username="trends", password="x"))
+        client.get('/api/dashboard/trends/?days=30')
+        counts = []
+        for days in (30, 365):
+            ensure_daily_metrics([h.id for h in self.hotels], self.today - timedelta(days=days - 1), self.today)
+            with CaptureQueriesContext(connection) as ctx:
+                response = client.get(f'/api/dashboard/trends/?days={days}&granularity=week')
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+        response = client.get('/api/dashboard/trends/?granularity=year')
+        self.assertEqual(response.status_code, 400)
+
+        hotel = self.hotels[0]
+        start = (self.today - timedelta(days=2)).isoformat()
+        response = client.get(f'/api/dashboard/summary/?hotel_id={hotel.id}&start_date={start}&end_date={self.today.isoformat()}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.json()['total_revenue']), Decimal('300.00'))
+        self.assertEqual(response.json()['total_rooms'], 2)
+
+    def test_write_events_refresh_today_bucket_coalesced(self):
+        from unittest import mock
+        from apps.reservations.models import ChannelCommission
+        from .tasks import refresh_dashboard_metrics_for_hotel
+
+        hotel = self.hotels[0]
+        check_in = self.reservation.check_in
+        DashboardMetrics.calculate_metrics_bulk([hotel.id], [check_in, self.today])
+        cache.clear()
+        with mock.patch.object(refresh_dashboard_metrics_for_hotel, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                commission = ChannelCommission.objects.create(reservation=self.reservation, channel='booking', amount=Decimal('30.00'))
+                commission.amount = Decimal('45.00')
+                commission.save()
+        self.assertEqual(apply_async.call_count, 1)
+        args = apply_async.call_args.kwargs["args"]
+        self.assertEqual(args, [hotel.id, check_in.isoformat(), check_in.isoformat()])
+
+        # El estado actual de las habitaciones sólo pisa el bucket de hoy, no la ocupación histórica
+        Room.objects.filter(hotel=hotel).update(status=RoomStatus.OCCUPIED)
+        refresh_dashboard_metrics_for_hotel(*args)
+        metrics = DashboardMetrics.objects.get(hotel=hotel, date=check_in)
+        self.assertEqual(metrics.commissions_checkin, Decimal('45.00'))
+        self.assertEqual((metrics.occupied_rooms, metrics.occupancy_rate), (1, Decimal('50.00')))
+        self.assertEqual(metrics.average_room_rate, metrics.total_revenue)
+        today_metrics = DashboardMetrics.objects.get(hotel=hotel, date=self.today)
+        self.assertEqual(today_metrics.occupancy_rate, Decimal('100.00'))
+
+    def test_rolled_back_write_does_not_throttle_next_refresh(self):
+        from unittest import mock
+        from django.db import transaction
+        from .signals import queue_metrics_refresh
+        from .tasks import refresh_dashboard_metrics_for_hotel
+
+        hotel = self.hotels[0]
+        with mock.patch.object(refresh_dashboard_metrics_for_hotel, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        queue_metrics_refresh(hotel.id, self.today, self.today)
+                        raise RuntimeError("rollback")
+                except RuntimeError:
+                    pass
+            with self.captureOnCommitCallbacks(execute=True):
+                queue_metrics_refresh(hotel.id, self.today, self.today)
+        self.assertEqual(apply_async.call_count, 1)
@@ -0,0 +1,184 @@
+"""
+Series de tendencia del dashboard servidas desde el rollup diario (DashboardMetrics).
+
+Cada fila de DashboardMetrics es el bucket diario ya materializado por hotel; las
+vistas de tendencias y resumen leen un rango con una sola query agrupada:
+
+- trend_series: buckets diarios / semanales / mensuales (GROUP BY fecha truncada)
+- range_summary: totales del rango + valores del último día (agregación condicional)
+
+ensure_daily_metrics completa solo los (hotel, fecha) que falten con un único rollup, y
+el bucket del día en curso se mantiene al día desde señales de escritura
+(ver apps.dashboard.signals), así que el costo por request no crece con
+fechas x hoteles.
+"""
+from __future__ import annotations
+
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List
+
+from django.db.models import F, Q, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+from .models import DashboardMetrics
+
+GRANULARITIES = {
+    "day": None,
+    "week": TruncWeek,
+    "month": TruncMonth,
+}
+
+TWO_PLACES = Decimal("0.01")
+
+# Campos que se suman en todo el rango
+RANGE_SUM_FIELDS = (
+    "occupied_rooms",
+    "reserved_rooms",
+    "total_reservations",
+    "pending_reservations",
+    "confirmed_reservations",
+    "cancelled_reservations",
+    "total_revenue",
+    "revenue_night",
+    "nights_sold",
+    "gross_collected",
+    "refunds",
+    "net_collected",
+)
+
+# Campos que se toman solo del último día del rango (snapshot / KPIs del día)
+LAST_DAY_FIELDS = (
+    "total_rooms",
+    "available_rooms",
+    "occupied_rooms",
+    "maintenance_rooms",
+    "out_of_service_rooms",
+    "reserved_rooms",
+    "total_reservations",
+    "pending_reservations",
+    "confirmed_reservations",
+    "cancelled_reservations",
+    "check_in_today",
+    "check_out_today",
+    "no_show_today",
+    "total_guests",
+    "guests_checked_in",
+    "guests_expected_today",
+    "guests_departing_today",
+    "total_revenue",
+    "revenue_night",
+    "nights_sold",
+    "commissions_checkin",
+)
+
+
+def _dates(start: date, end: date) -> List[date]:
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def _ratio(numerator, denominator, scale: Decimal = Decimal("1")) -> Decimal:
+    if not denominator:
+        return Decimal("0.00")
+    return (Decimal(numerator) / Decimal(denominator) * scale).quantize(TWO_PLACES)
+
+
+def ensure_daily_metrics(hotel_ids: Iterable[int], start: date, end: date) -> int:
+    """
+    Materializa los buckets diarios faltantes de [start, end] con un único rollup.
+
+    El camino habitual (todo materializado) cuesta una sola query de conteo.
+    """
+    hotel_ids = sorted({int(h) for h in hotel_ids})
+    if not hotel_ids or end < start:
+        return 0
+    dates = _dates(start, end)
+    metrics = DashboardMetrics.objects.filter(hotel_id__in=hotel_ids, date__range=(start, end))
+    if metrics.count() >= len(hotel_ids) * len(dates):
+        return 0
+
+    present: Dict[int, set] = {hotel_id: set() for hotel_id in hotel_ids}
+    for hotel_id, d in metrics.values_list("hotel_id", "date"):
+        present[hotel_id].add(d)
+    missing_hotels = [hotel_id for hotel_id in hotel_ids if len(present[hotel_id]) < len(dates)]
+    missing_dates = sorted({d for d in dates for hotel_id in missing_hotels if d not in present[hotel_id]})
+    # Recalcular un par (hotel, fecha) existente es idempotente: un solo rollup alcanza
+    return DashboardMetrics.calculate_metrics_bulk(missing_hotels, missing_dates)
+
+
+def trend_series(hotel_ids: Iterable[int], start: date, end: date, granularity: str = "day") -> List[dict]:
+    """
+    Serie de tendencia agregada para los hoteles dados, en buckets de día, semana o mes.
+
+    Una sola query agrupada sobre DashboardMetrics. Los ratios de buckets semanales /
+    mensuales se calculan sobre noches-habitación (suma de ocupadas / suma de totales).
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Granularidad inválida: {granularity}")
+    trunc = GRANULARITIES[granularity]
+    bucket = F("date") if trunc is None else trunc("date")
+
+    rows = (
+        DashboardMetrics.objects.filter(hotel_id__in=list(hotel_ids), date__range=(start, end))
+        .annotate(bucket=bucket)
+        .values("bucket")
+        .annotate(
+            total_rooms=Sum("total_rooms"),
+            occupied_rooms=Sum("occupied_rooms"),
+            total_revenue=Sum("total_revenue"),
+            total_guests=Sum("total_guests"),
+            check_in_today=Sum("check_in_today"),
+            check_out_today=Sum("check_out_today"),
+            commissions=Sum("commissions_checkin"),
+            nights_sold=Sum("nights_sold"),
+            revenue_night=Sum("revenue_night"),
+        )
+        .order_by("bucket")
+    )
+
+    series = []
+    for row in rows:
+        total_revenue = Decimal(row["total_revenue"] or 0).quantize(TWO_PLACES)
+        commissions = Decimal(row["commissions"] or 0).quantize(TWO_PLACES)
+        total_rooms = row["total_rooms"] or 0
+        occupied_rooms = row["occupied_rooms"] or 0
+        nights_sold = row["nights_sold"] or 0
+        bucket_date = row["bucket"]
+        if hasattr(bucket_date, "date"):
+            bucket_date = bucket_date.date()
+        series.append({
+            "date": bucket_date,
+            "occupancy_rate": _ratio(occupied_rooms, total_rooms, Decimal("100")),
+            "total_revenue": total_revenue,
+            "average_room_rate": _ratio(total_revenue, occupied_rooms),
+            "revpar": _ratio(total_revenue, total_rooms),
+            "total_guests": row["total_guests"] or 0,
+            "check_in_today": row["check_in_today"] or 0,
+            "check_out_today": row["check_out_today"] or 0,
+            "net_revenue": (total_revenue - commissions).quantize(TWO_PLACES),
+            "commissions": commissions,
+            "nights_sold": nights_sold,
+            "adr_night": _ratio(row["revenue_night"] or 0, nights_sold),
+        })
+    return series
+
+
+def range_summary(hotel_ids: Iterable[int], start: date, end: date) -> dict:
+    """
+    Totales de [start, end] y valores del último día para los hoteles dados (una query).
+
+    Devuelve {"range": {campo: suma}, "last": {campo: valor de `end`}}.
+    """
+    last_day = Q(date=end)
+    aggregates = {f"range_{field}": Sum(field) for field in RANGE_SUM_FIELDS}
+    aggregates.update({f"last_{field}": Sum(field, filter=last_day) for field in LAST_DAY_FIELDS})
+
+    values = DashboardMetrics.objects.filter(
+        hotel_id__in=list(hotel_ids), date__range=(start, end)
+    ).aggregate(**aggregates)
+
+    result = {"range": {}, "last": {}}
+    for key, value in values.items():
+        scope, field = key.split("_", 1)
+        result[scope][field] = value or 0
+    return result
@@ -7,6 +7,8 @@ from datetime import date, timedelta
 from decimal import Decimal
 
 from .models import DashboardMetrics
+from .rollup import LEGACY_ROOM_TYPES
+from .trends import GRANULARITIES, ensure_daily_metrics, range_summary, trend_series
 from .serializers import (
     DashboardMetricsSerializer, 
     DashboardSummarySerializer, 
@@ -61,6 +63,30 @@ def _compute_revenue_for_day(hotels_qs, target_date):
     return total.quantize(Decimal('0.01'))
 
 
+def _room_type_breakdown(rooms_qs, with_available=False):
+    """{room_type: {total, occupied, available}} con los tipos existentes (más los históricos)."""
+    breakdown = {
+        room_type: {'total': 0, 'occupied': 0, 'available': 0}
+        for room_type in LEGACY_ROOM_TYPES
+    }
+    rows = rooms_qs.values('room_type').annotate(
+        total=Count('id'),
+        available=Count('id', filter=Q(status='available')),
+    )
+    for row in rows:
+        entry = breakdown.setdefault(row['room_type'] or '', {'total': 0, 'occupied': 0, 'available': 0})
+        entry['total'] += row['total']
+        if with_available:
+            entry['available'] += row['available']
+    return breakdown
+
+def _metric_room_type_occupancy(metric):
+    """Ocupación por tipo de una métrica; filas viejas sin JSON usan las columnas históricas."""
+    if metric.room_type_occupancy:
+        return metric.room_type_occupancy
+    return {room_type: getattr(metric, f'{room_type}_rooms_occupied') for room_type in LEGACY_ROOM_TYPES}
+
+
 class DashboardMetricsListCreateView(generics.ListCreateAPIView):
     """Vista para listar y crear métricas del dashboard"""
     serializer_class = DashboardMetricsSerializer
@@ -88,6 +114,62 @@ class DashboardMetricsDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = DashboardMetrics.objects.all()
     serializer_class = DashboardMetricsSerializer
 
+def _summary_from_rollup(hotel_ids, start_date, end_date, average_occupied=False):
+    """
+    Métricas del resumen para [start_date, end_date] leídas del rollup diario.
+
+    Los totales del rango (ocupación, ingresos, noches, cobros) se suman; el inventario
+    y los KPIs del día (llegadas, salidas, huéspedes, comisiones) salen de end_date.
+    Una fecha única es el caso start_date == end_date.
+    """
+    ensure_daily_metrics(hotel_ids, start_date, end_date)
+    rollup = range_summary(hotel_ids, start_date, end_date)
+    totals, last = rollup['range'], rollup['last']
+    dates_count = (end_date - start_date).days + 1
+
+    total_rooms = last['total_rooms']
+    occupied_rooms = totals['occupied_rooms']
+    avg_occupied_rooms = occupied_rooms / dates_count
+    total_revenue = Decimal(totals['total_revenue']).quantize(Decimal('0.01'))
+    revenue_night = Decimal(totals['revenue_night']).quantize(Decimal('0.01'))
+    nights_sold = totals['nights_sold']
+    commissions_checkin = Decimal(last['commissions_checkin']).quantize(Decimal('0.01'))
+
+    return {
+        'total_rooms': total_rooms,
+        'available_rooms': last['available_rooms'],
+        'occupied_rooms': avg_occupied_rooms if average_occupied else occupied_rooms,
+        'maintenance_rooms': last['maintenance_rooms'],
+        'out_of_service_rooms': last['out_of_service_rooms'],
+        'reserved_rooms': totals['reserved_rooms'],
+        'total_reservations': totals['total_reservations'],
+        'pending_reservations': totals['pending_reservations'],
+        'confirmed_reservations': totals['confirmed_reservations'],
+        'cancelled_reservations': totals['cancelled_reservations'],
+        'check_in_today': last['check_in_today'],
+        'check_out_today': last['check_out_today'],
+        'no_show_today': last['no_show_today'],
+        'total_guests': last['total_guests'],
+        'guests_checked_in': last['guests_checked_in'],
+        'guests_expected_today': last['guests_expected_today'],
+        'guests_departing_today': last['guests_departing_today'],
+        'total_revenue': total_revenue,
+        'average_room_rate': (total_revenue / Decimal(avg_occupied_rooms)).quantize(Decimal('0.01')) if avg_occupied_rooms > 0 else Decimal('0.00'),
+        'occupancy_rate': (Decimal(avg_occupied_rooms) / Decimal(total_rooms) * Decimal('100')).quantize(Decimal('0.01')) if total_rooms > 0 else Decimal('0.00'),
+        'revpar': (total_revenue / Decimal(total_rooms * dates_count)).quantize(Decimal('0.01')) if total_rooms > 0 else Decimal('0.00'),
+        # Extensiones
+        'revenue_night': revenue_night,
+        'nights_sold': nights_sold,
+        'adr_night': (revenue_night / Decimal(nights_sold)).quantize(Decimal('0.01')) if nights_sold else Decimal('0.00'),
+        'commissions_checkin': commissions_checkin,
+        'revenue_net_checkin': (total_revenue - commissions_checkin).quantize(Decimal('0.01')),
+        # Cobros (caja) en el período seleccionado (por Payment.date)
+        'cash_gross_collected': Decimal(totals['gross_collected']).quantize(Decimal('0.01')),
+        'cash_refunds': Decimal(totals['refunds']).quantize(Decimal('0.01')),
+        'cash_net_collected': Decimal(totals['net_collected']).quantize(Decimal('0.01')),
+    }
+
+
 @api_view(['GET'])
 def dashboard_summary(request):
     """Obtiene un resumen de métricas para un hotel específico o global.
@@ -123,439 +205,44 @@ def dashboard_summary(request):
                 {'error': 'Formato de fecha inválido'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
+        start_date = end_date = target_date
     
     # Si no hay hotel_id, calcular métricas globales
     if not hotel_id:
         # Obtener todos los hoteles activos
         hotels = Hotel.objects.filter(is_active=True)
-        if not hotels.exists():
+        hotel_ids = list(hotels.values_list('id', flat=True))
+        if not hotel_ids:
             return Response(
                 {'error': 'No hay hoteles disponibles'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
-        
-        # Si se usa rango de fechas, calcular métricas agregadas
-        if use_date_range:
-            # Agregar métricas de todas las fechas del rango
-            total_rooms = 0
-            available_rooms = 0
-            occupied_rooms = 0
-            maintenance_rooms = 0
-            out_of_service_rooms = 0
-            reserved_rooms = 0
-            total_reservations = 0
-            pending_reservations = 0
-            confirmed_reservations = 0
-            cancelled_reservations = 0
-            check_in_today = 0
-            check_out_today = 0
-            no_show_today = 0
-            total_guests = 0
-            guests_checked_in = 0
-            guests_expected_today = 0
-            guests_departing_today = 0
-            total_revenue = Decimal('0.00')
-            revenue_night = Decimal('0.00')
-            nights_sold = 0
-            
-            # Iterar sobre todas las fechas del rango
-            current_date = start_date
-            dates_count = 0
-            while current_date <= end_date:
-                dates_count += 1
-                for hotel in hotels:
-                    metrics = DashboardMetrics.objects.filter(hotel=hotel, date=current_date).first()
-                    if not metrics:
-                        metrics = DashboardMetrics.calculate_metrics(hotel, current_date)
-                    # Para rangos, acumulamos valores
-                    if current_date == end_date:  # Solo contamos habitaciones en la última fecha
-                        total_rooms += metrics.total_rooms
-                        available_rooms += metrics.available_rooms
-                        maintenance_rooms += metrics.maintenance_rooms
-                        out_of_service_rooms += metrics.out_of_service_rooms
-                    occupied_rooms += metrics.occupied_rooms
-                    reserved_rooms += metrics.reserved_rooms
-                    total_reservations += metrics.total_reservations
-                    pending_reservations += metrics.pending_reservations
-                    confirmed_reservations += metrics.confirmed_reservations
-                    cancelled_reservations += metrics.cancelled_reservations
-                    check_in_today += metrics.check_in_today if current_date == end_date else 0
-                    check_out_today += metrics.check_out_today if current_date == end_date else 0
-                    no_show_today += metrics.no_show_today if current_date == end_date else 0
-                    total_guests += metrics.total_guests if current_date == end_date else 0
-                    guests_checked_in += metrics.guests_checked_in if current_date == end_date else 0
-                    guests_expected_today += metrics.guests_expected_today if current_date == end_date else 0
-                    guests_departing_today += metrics.guests_departing_today if current_date == end_date else 0
-                    total_revenue += metrics.total_revenue
-                
-                # Extensiones nocturnas para el rango completo
-                nights_day = ReservationNight.objects.filter(hotel__in=hotels, date=current_date)
-                revenue_night += nights_day.aggregate(s=Sum('total_night'))['s'] or Decimal('0.00')
-                nights_sold += nights_day.count()
-                
-                current_date += timedelta(days=1)
-            
-            # Calcular promedios para el rango
-            avg_occupied_rooms = occupied_rooms / dates_count if dates_count > 0 else 0
-            adr_night = (revenue_night / Decimal(nights_sold)).quantize(Decimal('0.01')) if nights_sold else Decimal('0.00')
-            average_room_rate = (total_revenue / Decimal(avg_occupied_rooms)).quantize(Decimal('0.01')) if avg_occupied_rooms > 0 else Decimal('0.00')
-            occupancy_rate = (Decimal(avg_occupied_rooms) / Decimal(total_rooms) * Decimal('100')).quantize(Decimal('0.01')) if total_rooms > 0 else Decimal('0.00')
-            revpar = (total_revenue / Decimal(total_rooms * dates_count)).quantize(Decimal('0.01')) if total_rooms > 0 and dates_count > 0 else Decimal('0.00')
-            
-            # Comisiones solo del último día
-            checkin_qs = Reservation.objects.filter(
-                hotel__in=hotels,
-                check_in=target_date,
-                status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT]
-            )
-            commissions_checkin = ChannelCommission.objects.filter(reservation__in=checkin_qs).aggregate(s=Sum('amount'))['s'] or Decimal('0.00')
-            revenue_net_checkin = (total_revenue - commissions_checkin).quantize(Decimal('0.01'))
-        else:
-            # Comportamiento original: una sola fecha
-            total_rooms = 0
-            available_rooms = 0
-            occupied_rooms = 0
-            maintenance_rooms = 0
-            out_of_service_rooms = 0
-            reserved_rooms = 0
-            total_reservations = 0
-            pending_reservations = 0
-            confirmed_reservations = 0
-            cancelled_reservations = 0
-            check_in_today = 0
-            check_out_today = 0
-            no_show_today = 0
-            total_guests = 0
-            guests_checked_in = 0
-            guests_expected_today = 0
-            guests_departing_today = 0
-            total_revenue = Decimal('0.00')
-            revenue_night = Decimal('0.00')
-            nights_sold = 0
-            adr_night = Decimal('0.00')
-            commissions_checkin = Decimal('0.00')
-            revenue_net_checkin = Decimal('0.00')
-            
-            for hotel in hotels:
-                metrics = DashboardMetrics.objects.filter(hotel=hotel, date=target_date).first()
-                if not metrics:
-                    metrics = DashboardMetrics.calculate_metrics(hotel, target_date)
-                total_rooms += metrics.total_rooms
-                available_rooms += metrics.available_rooms
-                occupied_rooms += metrics.occupied_rooms
-                maintenance_rooms += metrics.maintenance_rooms
-                out_of_service_rooms += metrics.out_of_service_rooms
-                reserved_rooms += metrics.reserved_rooms
-                total_reservations += metrics.total_reservations
-                pending_reservations += metrics.pending_reservations
-                confirmed_reservations += metrics.confirmed_reservations
-                cancelled_reservations += metrics.cancelled_reservations
-                check_in_today += metrics.check_in_today
-                check_out_today += metrics.check_out_today
-                no_show_today += metrics.no_show_today
-                total_guests += metrics.total_guests
-                guests_checked_in += metrics.guests_checked_in
-                guests_expected_today += metrics.guests_expected_today
-                guests_departing_today += metrics.guests_departing_today
-                total_revenue += metrics.total_revenue
-            
-            # Extensiones nocturnas / ADR nocturno
-            nights_qs = ReservationNight.objects.filter(hotel__in=hotels, date=target_date)
-            revenue_night = nights_qs.aggregate(s=Sum('total_night'))['s'] or Decimal('0.00')
-            nights_sold = nights_qs.count()
-            adr_night = (revenue_night / Decimal(nights_sold)).quantize(Decimal('0.01')) if nights_sold else Decimal('0.00')
-            
-            # Comisiones por check-in del día y neto
-            checkin_qs = Reservation.objects.filter(
-                hotel__in=hotels,
-                check_in=target_date,
-                status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT]
-            )
-            commissions_checkin = ChannelCommission.objects.filter(reservation__in=checkin_qs).aggregate(s=Sum('amount'))['s'] or Decimal('0.00')
-            revenue_net_checkin = (total_revenue - commissions_checkin).quantize(Decimal('0.01'))
-            
-            # Calcular promedios
-            average_room_rate = (total_revenue / Decimal(occupied_rooms)).quantize(Decimal('0.01')) if occupied_rooms > 0 else Decimal('0.00')
-            occupancy_rate = (Decimal(occupied_rooms) / Decimal(total_rooms) * Decimal('100')).quantize(Decimal('0.01')) if total_rooms > 0 else Decimal('0.00')
-            revpar = (total_revenue / Decimal(total_rooms)).quantize(Decimal('0.01')) if total_rooms > 0 else Decimal('0.00')
-
-        # LOS promedio (en-house en fecha objetivo)
-        inhouse_qs = Reservation.objects.filter(
-            hotel__in=hotels,
-            status__in=[ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT],
-            check_in__lte=target_date,
-            check_out__gt=target_date,
-        ).only('check_in', 'check_out')
-        los_sum = 0
-        los_count = 0
-        for r in inhouse_qs:
-            nights = (r.check_out - r.check_in).days
-            if nights > 0:
-                los_sum += nights
-                los_count += 1
-        avg_length_of_stay_days = (Decimal(los_sum) / Decimal(los_count)).quantize(Decimal('0.01')) if los_count else Decimal('0.00')
-
-        # Lead time promedio (para llegadas del día)
-        lt_sum = 0
-        lt_count = 0
-        for r in checkin_qs.only('created_at', 'check_in'):
-            try:
-                lt_days = (r.check_in - r.created_at.date()).days
-                if lt_days >= 0:
-                    lt_sum += lt_days
-                    lt_count += 1
-            except Exception:
-                continue
-        lead_time_avg_days = (Decimal(lt_sum) / Decimal(lt_count)).quantize(Decimal('0.01')) if lt_count else Decimal('0.00')
-
-        # Pickup (nuevas reservas creadas)
-        pickup_today = Reservation.objects.filter(
-            hotel__in=hotels,
-            created_at__date=target_date,
-            check_in__gte=target_date,
-            status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN],
-        ).count()
-        pickup_7d = Reservation.objects.filter(
-            hotel__in=hotels,
-            created_at__date__range=[target_date - timedelta(days=6), target_date],
-            check_in__gte=target_date,
-            status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN],
-        ).count()
-
-        # On The Books próximos 30 días (noches e ingresos)
-        otb_end = target_date + timedelta(days=29)
-        otb_qs = ReservationNight.objects.filter(hotel__in=hotels, date__range=[target_date, otb_end])
-        otb_next_30d_nights = otb_qs.count()
-        otb_next_30d_revenue = (otb_qs.aggregate(s=Sum('total_night'))['s'] or Decimal('0.00')).quantize(Decimal('0.01'))
-
-        # Tasa de cancelación últimos 30 días (cancelled / creadas)
-        win_start = target_date - timedelta(days=29)
-        created_30d = Reservation.objects.filter(hotel__in=hotels, created_at__date__range=[win_start, target_date]).count()
-        cancelled_30d = Reservation.objects.filter(hotel__in=hotels, status=ReservationStatus.CANCELLED, updated_at__date__range=[win_start, target_date]).count()
-        cancellation_rate_30d = (Decimal(cancelled_30d) / Decimal(created_30d) * Decimal('100')).quantize(Decimal('0.01')) if created_30d else Decimal('0.00')
-        
-        # Cobros (caja) en el período seleccionado (por Payment.date)
-        if use_date_range:
-            cash = _compute_cash_collections(hotels, start_date, end_date)
-        else:
-            cash = _compute_cash_collections(hotels, target_date, target_date)
-        
-        # Crear resumen global
         summary_data = {
             'hotel_id': None,
             'hotel_name': 'Todos los Hoteles',
             'date': target_date,
-            'total_rooms': total_rooms,
-            'available_rooms': available_rooms,
-            'occupied_rooms': occupied_rooms,
-            'maintenance_rooms': maintenance_rooms,
-            'out_of_service_rooms': out_of_service_rooms,
-            'reserved_rooms': reserved_rooms,
-            'total_reservations': total_reservations,
-            'pending_reservations': pending_reservations,
-            'confirmed_reservations': confirmed_reservations,
-            'cancelled_reservations': cancelled_reservations,
-            'check_in_today': check_in_today,
-            'check_out_today': check_out_today,
-            'no_show_today': no_show_today,
-            'total_guests': total_guests,
-            'guests_checked_in': guests_checked_in,
-            'guests_expected_today': guests_expected_today,
-            'guests_departing_today': guests_departing_today,
-            'total_revenue': total_revenue,
-            'average_room_rate': average_room_rate,
-            'occupancy_rate': occupancy_rate,
-            'revpar': revpar,
-            # Extensiones
-            'revenue_night': revenue_night,
-            'nights_sold': nights_sold,
-            'adr_night': adr_night,
-            'commissions_checkin': commissions_checkin,
-            'revenue_net_checkin': revenue_net_checkin,
-            # KPIs adicionales
-            'avg_length_of_stay_days': avg_length_of_stay_days,
-            'lead_time_avg_days': lead_time_avg_days,
-            'pickup_today': pickup_today,
-            'pickup_7d': pickup_7d,
-            'otb_next_30d_nights': otb_next_30d_nights,
-            'otb_next_30d_revenue': otb_next_30d_revenue,
-            'cancellation_rate_30d': cancellation_rate_30d,
-            'cash_gross_collected': cash['gross_collected'],
-            'cash_refunds': cash['refunds'],
-            'cash_net_collected': cash['net_collected'],
-        }
-        
-        serializer = DashboardSummarySerializer(summary_data)
-        return Response(serializer.data)
-    
-    try:
-        hotel = Hotel.objects.get(id=hotel_id)
-    except Hotel.DoesNotExist:
-        return Response(
-            {'error': 'Hotel no encontrado'}, 
-            status=status.HTTP_404_NOT_FOUND
-        )
-    
-    # Si se usa rango de fechas para hotel específico, calcular métricas agregadas
-    if use_date_range:
-        # Agregar métricas de todas las fechas del rango
-        total_rooms = 0
-        available_rooms = 0
-        occupied_rooms = 0
-        maintenance_rooms = 0
-        out_of_service_rooms = 0
-        reserved_rooms = 0
-        total_reservations = 0
-        pending_reservations = 0
-        confirmed_reservations = 0
-        cancelled_reservations = 0
-        check_in_today = 0
-        check_out_today = 0
-        no_show_today = 0
-        total_guests = 0
-        guests_checked_in = 0
-        guests_expected_today = 0
-        guests_departing_today = 0
-        total_revenue = Decimal('0.00')
-        revenue_night = Decimal('0.00')
-        nights_sold = 0
-        
-        # Iterar sobre todas las fechas del rango
-        current_date = start_date
-        dates_count = 0
-        while current_date <= end_date:
-            dates_count += 1
-            metrics = DashboardMetrics.objects.filter(hotel=hotel, date=current_date).first()
-            if not metrics:
-                metrics = DashboardMetrics.calculate_metrics(hotel, current_date)
-            # Para rangos, acumulamos valores
-            if current_date == end_date:  # Solo contamos habitaciones en la última fecha
-                total_rooms += metrics.total_rooms
-                available_rooms += metrics.available_rooms
-                maintenance_rooms += metrics.maintenance_rooms
-                out_of_service_rooms += metrics.out_of_service_rooms
-            occupied_rooms += metrics.occupied_rooms
-            reserved_rooms += metrics.reserved_rooms
-            total_reservations += metrics.total_reservations
-            pending_reservations += metrics.pending_reservations
-            confirmed_reservations += metrics.confirmed_reservations
-            cancelled_reservations += metrics.cancelled_reservations
-            check_in_today += metrics.check_in_today if current_date == end_date else 0
-            check_out_today += metrics.check_out_today if current_date == end_date else 0
-            no_show_today += metrics.no_show_today if current_date == end_date else 0
-            total_guests += metrics.total_guests if current_date == end_date else 0
-            guests_checked_in += metrics.guests_checked_in if current_date == end_date else 0
-            guests_expected_today += metrics.guests_expected_today if current_date == end_date else 0
-            guests_departing_today += metrics.guests_departing_today if current_date == end_date else 0
-            total_revenue += metrics.total_revenue
-            
-            # Extensiones nocturnas para el rango completo
-            nights_day = ReservationNight.objects.filter(hotel=hotel, date=current_date)
-            revenue_night += nights_day.aggregate(s=Sum('total_night'))['s'] or Decimal('0.00')
-            nights_sold += nights_day.count()
-            
-            current_date += timedelta(days=1)
-        
-        # Calcular promedios para el rango
-        avg_occupied_rooms = occupied_rooms / dates_count if dates_count > 0 else 0
-        adr_night = (revenue_night / Decimal(nights_sold)).quantize(Decimal('0.01')) if nights_sold else Decimal('0.00')
-        average_room_rate = (total_revenue / Decimal(avg_occupied_rooms)).quantize(Decimal('0.01')) if avg_occupied_rooms > 0 else Decimal('0.00')
-        occupancy_rate = (Decimal(avg_occupied_rooms) / Decimal(total_rooms) * Decimal('100')).quantize(Decimal('0.01')) if total_rooms > 0 else Decimal('0.00')
-        revpar = (total_revenue / Decimal(total_rooms * dates_count)).quantize(Decimal('0.01')) if total_rooms > 0 and dates_count > 0 else Decimal('0.00')
-        
-        # Comisiones solo del último día
-        checkin_qs = Reservation.objects.filter(
-            hotel=hotel,
-            check_in=target_date,
-            status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT]
-        )
-        commissions_checkin = ChannelCommission.objects.filter(reservation__in=checkin_qs).aggregate(s=Sum('amount'))['s'] or Decimal('0.00')
-        revenue_net_checkin = (total_revenue - commissions_checkin).quantize(Decimal('0.01'))
-        cash = _compute_cash_collections(Hotel.objects.filter(id=hotel.id), start_date, end_date)
-        
-        summary_data = {
-            'hotel_id': hotel.id,
-            'hotel_name': hotel.name,
-            'date': target_date,
-            'total_rooms': total_rooms,
-            'available_rooms': available_rooms,
-            'occupied_rooms': avg_occupied_rooms,
-            'occupancy_rate': occupancy_rate,
-            'total_reservations': total_reservations,
-            'check_in_today': check_in_today,
-            'check_out_today': check_out_today,
-            'total_guests': total_guests,
-            'guests_checked_in': guests_checked_in,
-            'guests_expected_today': guests_expected_today,
-            'guests_departing_today': guests_departing_today,
-            'total_revenue': total_revenue,
-            'average_room_rate': average_room_rate,
-            'revpar': revpar,
-            'revenue_night': revenue_night,
-            'nights_sold': nights_sold,
-            'adr_night': adr_night,
-            'commissions_checkin': commissions_checkin,
-            'revenue_net_checkin': revenue_net_checkin,
-            'cash_gross_collected': cash['gross_collected'],
-            'cash_refunds': cash['refunds'],
-            'cash_net_collected': cash['net_collected'],
+            **_summary_from_rollup(hotel_ids, start_date, end_date),
         }
     else:
-        # Comportamiento original: una sola fecha
-        # Calcular/obtener métricas para la fecha especificada
-        metrics = DashboardMetrics.objects.filter(hotel=hotel, date=target_date).first()
-        if not metrics:
-            metrics = DashboardMetrics.calculate_metrics(hotel, target_date)
-        
-        # Extensiones financieras desde módulo de pricing
-        nights_qs = ReservationNight.objects.filter(hotel=hotel, date=target_date)
-        revenue_night = nights_qs.aggregate(s=Sum('total_night'))['s'] or Decimal('0.00')
-        nights_sold = nights_qs.count()
-        adr_night = (revenue_night / Decimal(nights_sold)).quantize(Decimal('0.01')) if nights_sold else Decimal('0.00')
-
-        # Llegadas de hoy incluyen pendientes/confirmadas/check-in
-        checkin_qs = Reservation.objects.filter(
-            hotel=hotel,
-            check_in=target_date,
-            status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT]
-        )
-        commissions_checkin = ChannelCommission.objects.filter(reservation__in=checkin_qs).aggregate(s=Sum('amount'))['s'] or Decimal('0.00')
-        revenue_net_checkin = (metrics.total_revenue - commissions_checkin).quantize(Decimal('0.01'))
-        cash = _compute_cash_collections(Hotel.objects.filter(id=hotel.id), target_date, target_date)
-
-        # Crear resumen
+        try:
+            hotel = Hotel.objects.get(id=hotel_id)
+        except Hotel.DoesNotExist:
+            return Response(
+                {'error': 'Hotel no encontrado'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        hotels = Hotel.objects.filter(id=hotel.id)
         summary_data = {
             'hotel_id': hotel.id,
             'hotel_name': hotel.name,
             'date': target_date,
-            'total_rooms': metrics.total_rooms,
-            'available_rooms': metrics.available_rooms,
-            'occupied_rooms': metrics.occupied_rooms,
-            'occupancy_rate': metrics.occupancy_rate,
-            'total_reservations': metrics.total_reservations,
-            'check_in_today': metrics.check_in_today,
-            'check_out_today': metrics.check_out_today,
-            'total_guests': metrics.total_guests,
-            'guests_checked_in': metrics.guests_checked_in,
-            'guests_expected_today': metrics.guests_expected_today,
-            'guests_departing_today': metrics.guests_departing_today,
-            'total_revenue': metrics.total_revenue,
-            'average_room_rate': metrics.average_room_rate,
-            'revpar': (metrics.total_revenue / Decimal(metrics.total_rooms)).quantize(Decimal('0.01')) if metrics.total_rooms > 0 else Decimal('0.00'),
-            'revenue_night': revenue_night,
-            'nights_sold': nights_sold,
-            'adr_night': adr_night,
-            'commissions_checkin': commissions_checkin,
-            'revenue_net_checkin': revenue_net_checkin,
-            'cash_gross_collected': cash['gross_collected'],
-            'cash_refunds': cash['refunds'],
-            'cash_net_collected': cash['net_collected'],
+            **_summary_from_rollup([hotel.id], start_date, end_date, average_occupied=bool(use_date_range)),
         }
 
-    # KPIs adicionales por hotel
+    # KPIs adicionales (consultas acotadas a la fecha objetivo, no dependen del rango)
     # LOS promedio (en-house en fecha objetivo)
     inhouse_qs = Reservation.objects.filter(
-        hotel=hotel,
+        hotel__in=hotels,
         status__in=[ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT],
         check_in__lte=target_date,
         check_out__gt=target_date,
@@ -570,6 +257,11 @@ def dashboard_summary(request):
     summary_data['avg_length_of_stay_days'] = (Decimal(los_sum) / Decimal(los_count)).quantize(Decimal('0.01')) if los_count else Decimal('0.00')
 
     # Lead time promedio (para llegadas del día)
+    checkin_qs = Reservation.objects.filter(
+        hotel__in=hotels,
+        check_in=target_date,
+        status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT]
+    )
     lt_sum = 0
     lt_count = 0
     for r in checkin_qs.only('created_at', 'check_in'):
@@ -584,13 +276,13 @@ def dashboard_summary(request):
 
     # Pickup (nuevas reservas creadas)
     summary_data['pickup_today'] = Reservation.objects.filter(
-        hotel=hotel,
+        hotel__in=hotels,
         created_at__date=target_date,
         check_in__gte=target_date,
         status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN],
     ).count()
     summary_data['pickup_7d'] = Reservation.objects.filter(
-        hotel=hotel,
+        hotel__in=hotels,
         created_at__date__range=[target_date - timedelta(days=6), target_date],
         check_in__gte=target_date,
         status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN],
@@ -598,14 +290,16 @@ def dashboard_summary(request):
 
     # On The Books próximos 30 días (noches e ingresos)
     otb_end = target_date + timedelta(days=29)
-    otb_qs = ReservationNight.objects.filter(hotel=hotel, date__range=[target_date, otb_end])
-    summary_data['otb_next_30d_nights'] = otb_qs.count()
-    summary_data['otb_next_30d_revenue'] = (otb_qs.aggregate(s=Sum('total_night'))['s'] or Decimal('0.00')).quantize(Decimal('0.01'))
+    otb = ReservationNight.objects.filter(hotel__in=hotels, date__range=[target_date, otb_end]).aggregate(
+        nights=Count('id'), revenue=Sum('total_night')
+    )
+    summary_data['otb_next_30d_nights'] = otb['nights']
+    summary_data['otb_next_30d_revenue'] = (otb['revenue'] or Decimal('0.00')).quantize(Decimal('0.01'))
 
-    # Tasa de cancelación últimos 30 días
+    # Tasa de cancelación últimos 30 días (cancelled / creadas)
     win_start = target_date - timedelta(days=29)
-    created_30d = Reservation.objects.filter(hotel=hotel, created_at__date__range=[win_start, target_date]).count()
-    cancelled_30d = Reservation.objects.filter(hotel=hotel, status=ReservationStatus.CANCELLED, updated_at__date__range=[win_start, target_date]).count()
+    created_30d = Reservation.objects.filter(hotel__in=hotels, created_at__date__range=[win_start, target_date]).count()
+    cancelled_30d = Reservation.objects.filter(hotel__in=hotels, status=ReservationStatus.CANCELLED, updated_at__date__range=[win_start, target_date]).count()
     summary_data['cancellation_rate_30d'] = (Decimal(cancelled_30d) / Decimal(created_30d) * Decimal('100')).quantize(Decimal('0.01')) if created_30d else Decimal('0.00')
     
     serializer = DashboardSummarySerializer(summary_data)
@@ -613,104 +307,37 @@ def dashboard_summary(request):
 
 @api_view(['GET'])
 def dashboard_trends(request):
-    """Obtiene tendencias de métricas para un rango de fechas"""
+    """Obtiene tendencias de métricas para un rango de fechas.
+
+    Acepta granularity=day|week|month (por defecto day); cada punto es el inicio del bucket.
+    """
     hotel_id = request.query_params.get('hotel_id')
     start_date = request.query_params.get('start_date')
     end_date = request.query_params.get('end_date')
     days = int(request.query_params.get('days', 30))
+    granularity = request.query_params.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        return Response(
+            {'error': f"granularity debe ser uno de: {', '.join(GRANULARITIES)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
-    # Si no hay hotel_id, calcular tendencias globales
-    if not hotel_id:
-        # Determinar rango de fechas
-        if start_date and end_date:
-            start_date = date.fromisoformat(start_date)
-            end_date = date.fromisoformat(end_date)
-        else:
-            end_date = date.today()
-            start_date = end_date - timedelta(days=days-1)
-        
-        # Obtener todos los hoteles activos
-        hotels = Hotel.objects.filter(is_active=True)
-        if not hotels.exists():
+    if hotel_id:
+        try:
+            hotel_ids = [Hotel.objects.get(id=hotel_id).id]
+        except Hotel.DoesNotExist:
             return Response(
-                {'error': 'No hay hoteles disponibles'}, 
+                {'error': 'Hotel no encontrado'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
-        
-        # Calcular tendencias globales
-        trends_data = []
-        current_date = start_date
-        
-        while current_date <= end_date:
-            # Sumar métricas de todos los hoteles para esta fecha
-            daily_total_rooms = 0
-            daily_occupied_rooms = 0
-            daily_total_revenue = Decimal('0.00')
-            daily_total_guests = 0
-            daily_check_in = 0
-            daily_check_out = 0
-
-            daily_metrics = DashboardMetrics.objects.filter(hotel__in=hotels, date=current_date)
-            if not daily_metrics.exists():
-                # Calcular métricas para cada hotel si no existen
-                for hotel in hotels:
-                    DashboardMetrics.calculate_metrics(hotel, current_date)
-                # Volver a consultar las métricas recién creadas
-                daily_metrics = DashboardMetrics.objects.filter(hotel__in=hotels, date=current_date)
-            
-            if daily_metrics.exists():
-                for metric in daily_metrics:
-                    daily_total_rooms += metric.total_rooms
-                    daily_occupied_rooms += metric.occupied_rooms
-                    daily_total_revenue += metric.total_revenue
-                    daily_total_guests += metric.total_guests
-                    daily_check_in += metric.check_in_today
-                    daily_check_out += metric.check_out_today
-
-            # Métricas financieras extendidas por día
-            nights_qs = ReservationNight.objects.filter(hotel__in=hotels, date=current_date)
-            revenue_night = nights_qs.aggregate(s=Sum('total_night'))['s'] or Decimal('0.00')
-            nights_sold = nights_qs.count()
-            adr_night = (revenue_night / Decimal(nights_sold)).quantize(Decimal('0.01')) if nights_sold else Decimal('0.00')
-            checkin_qs = Reservation.objects.filter(
-                hotel__in=hotels,
-                check_in=current_date,
-                status__in=[ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT]
+    else:
+        # Sin hotel_id: tendencias globales de todos los hoteles activos
+        hotel_ids = list(Hotel.objects.filter(is_active=True).values_list('id', flat=True))
+        if not hotel_ids:
+            return Response(
+                {'error': 'No hay hoteles disponibles'}, 
+                status=status.HTTP_404_NOT_FOUND
             )
-            commissions = ChannelCommission.objects.filter(reservation__in=checkin_qs).aggregate(s=Sum('amount'))['s'] or Decimal('0.00')
-            net_revenue = (daily_total_revenue - commissions).quantize(Decimal('0.01')) if daily_total_revenue is not None else Decimal('0.00')
-
-            # Calcular promedios
-            daily_average_room_rate = (daily_total_revenue / Decimal(daily_occupied_rooms)).quantize(Decimal('0.01')) if daily_occupied_rooms > 0 else Decimal('0.00')
-            daily_occupancy_rate = (Decimal(daily_occupied_rooms) / Decimal(daily_total_rooms) * Decimal('100')).quantize(Decimal('0.01')) if daily_total_rooms > 0 else Decimal('0.00')
-
-            trends_data.append({
-                'date': current_date,
-                'occupancy_rate': daily_occupancy_rate,
-                'total_revenue': daily_total_revenue,
-                'average_room_rate': daily_average_room_rate,
-                'revpar': (daily_total_revenue / Decimal(daily_total_rooms)).quantize(Decimal('0.01')) if daily_total_rooms > 0 else Decimal('0.00'),
-                'total_guests': daily_total_guests,
-                'check_in_today': daily_check_in,
-                'check_out_today': daily_check_out,
-                'net_revenue': net_revenue,
-                'commissions': commissions,
-                'nights_sold': nights_sold,
-                'adr_night': adr_night,
-            })
-
-            current_date += timedelta(days=1)
-        
-        serializer = DashboardTrendsSerializer(trends_data, many=True)
-        return Response(serializer.data)
-    
-    try:
-        hotel = Hotel.objects.get(id=hotel_id)
-    except Hotel.DoesNotExist:
-        return Response(
-            {'error': 'Hotel no encontrado'}, 
-            status=status.HTTP_404_NOT_FOUND
-        )
     
     # Determinar rango de fechas
     if start_date and end_date:
@@ -720,54 +347,9 @@ def dashboard_trends(request):
         end_date = date.today()
         start_date = end_date - timedelta(days=days-1)
     
-    # Obtener métricas para el rango de fechas
-    metrics = DashboardMetrics.objects.filter(
-        hotel=hotel,
-        date__range=[start_date, end_date]
-    ).order_by('date')
-    
-    # Si no hay métricas, calcularlas
-    if not metrics.exists():
-        current_date = start_date
-        while current_date <= end_date:
-            DashboardMetrics.calculate_metrics(hotel, current_date)
-            current_date += timedelta(days=1)
-        
-        metrics = DashboardMetrics.objects.filter(
-            hotel=hotel,
-            date__range=[start_date, end_date]
-        ).order_by('date')
-    
-    # Serializar tendencias
-    trends_data = []
-    for metric in metrics:
-        # Extensiones por día (hotel específico)
-        nights_qs = ReservationNight.objects.filter(hotel=hotel, date=metric.date)
-        revenue_night = nights_qs.aggregate(s=Sum('total_night'))['s'] or Decimal('0.00')
-        nights_sold = nights_qs.count()
-        adr_night = (revenue_night / Decimal(nights_sold)).quantize(Decimal('0.01')) if nights_sold else Decimal('0.00')
-        checkin_qs = Reservation.objects.filter(
-            hotel=hotel,
-            check_in=metric.date,
-            status__in=[ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN, ReservationStatus.CHECK_OUT]
-        )
-        commissions = ChannelCommission.objects.filter(reservation__in=checkin_qs).aggregate(s=Sum('amount'))['s'] or Decimal('0.00')
-        net_revenue = (metric.total_revenue - commissions).quantize(Decimal('0.01'))
-
-        trends_data.append({
-            'date': metric.date,
-            'occupancy_rate': metric.occupancy_rate,
-            'total_revenue': metric.total_revenue,
-            'average_room_rate': metric.average_room_rate,
-            'revpar': (metric.total_revenue / Decimal(metric.total_rooms)).quantize(Decimal('0.01')) if metric.total_rooms > 0 else Decimal('0.00'),
-            'total_guests': metric.total_guests,
-            'check_in_today': metric.check_in_today,
-            'check_out_today': metric.check_out_today,
-            'net_revenue': net_revenue,
-            'commissions': commissions,
-            'nights_sold': nights_sold,
-            'adr_night': adr_night,
-        })
+    # Completar buckets diarios faltantes (un rollup) y leer la serie con una query agrupada
+    ensure_daily_metrics(hotel_ids, start_date, end_date)
+    trends_data = trend_series(hotel_ids, start_date, end_date, granularity)
     
     serializer = DashboardTrendsSerializer(trends_data, many=True)
     return Response(serializer.data)
@@ -796,31 +378,18 @@ def dashboard_occupancy_by_room_type(request):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Calcular ocupación global por tipo respetando la fecha
-        occupancy_by_type = {
-            'single': {'total': 0, 'occupied': 0, 'available': 0},
-            'double': {'total': 0, 'occupied': 0, 'available': 0},
-            'triple': {'total': 0, 'occupied': 0, 'available': 0},
-            'suite': {'total': 0, 'occupied': 0, 'available': 0}
-        }
-
-        # Totales por tipo (inventario actual)
-        occupancy_by_type['single']['total'] = Room.objects.filter(room_type='single', is_active=True).count()
-        occupancy_by_type['double']['total'] = Room.objects.filter(room_type='double', is_active=True).count()
-        occupancy_by_type['triple']['total'] = Room.objects.filter(room_type='triple', is_active=True).count()
-        occupancy_by_type['suite']['total'] = Room.objects.filter(room_type='suite', is_active=True).count()
+        # Totales por tipo (inventario actual, tipos dinámicos)
+        occupancy_by_type = _room_type_breakdown(Room.objects.filter(is_active=True))
 
         daily_metrics = DashboardMetrics.objects.filter(hotel__in=hotels, date=target_date)
         if not daily_metrics.exists():
-            for hotel in hotels:
-                DashboardMetrics.calculate_metrics(hotel, target_date)
+            DashboardMetrics.calculate_metrics_bulk(hotels.values_list('id', flat=True), [target_date])
             daily_metrics = DashboardMetrics.objects.filter(hotel__in=hotels, date=target_date)
 
         for metric in daily_metrics:
-            occupancy_by_type['single']['occupied'] += metric.single_rooms_occupied
-            occupancy_by_type['double']['occupied'] += metric.double_rooms_occupied
-            occupancy_by_type['triple']['occupied'] += metric.triple_rooms_occupied
-            occupancy_by_type['suite']['occupied'] += metric.suite_rooms_occupied
+            for room_type, occupied in _metric_room_type_occupancy(metric).items():
+                occupancy_by_type.setdefault(room_type, {'total': 0, 'occupied': 0, 'available': 0})
+                occupancy_by_type[room_type]['occupied'] += occupied
 
         for key in list(occupancy_by_type.keys()):
             total = occupancy_by_type[key]['total']
@@ -846,49 +415,11 @@ def dashboard_occupancy_by_room_type(request):
     # Calcular métricas para la fecha especificada
     metrics = DashboardMetrics.calculate_metrics(hotel, target_date)
     
-    # Obtener ocupación por tipo de habitación
-    occupancy_by_type = {
-        'single': {
-            'total': Room.objects.filter(hotel=hotel, room_type='single', is_active=True).count(),
-            'occupied': metrics.single_rooms_occupied,
-            'available': Room.objects.filter(
-                hotel=hotel, 
-                room_type='single', 
-                is_active=True,
-                status='available'
-            ).count()
-        },
-        'double': {
-            'total': Room.objects.filter(hotel=hotel, room_type='double', is_active=True).count(),
-            'occupied': metrics.double_rooms_occupied,
-            'available': Room.objects.filter(
-                hotel=hotel, 
-                room_type='double', 
-                is_active=True,
-                status='available'
-            ).count()
-        },
-        'triple': {
-            'total': Room.objects.filter(hotel=hotel, room_type='triple', is_active=True).count(),
-            'occupied': metrics.triple_rooms_occupied,
-            'available': Room.objects.filter(
-                hotel=hotel, 
-                room_type='triple', 
-                is_active=True,
-                status='available'
-            ).count()
-        },
-        'suite': {
-            'total': Room.objects.filter(hotel=hotel, room_type='suite', is_active=True).count(),
-            'occupied': metrics.suite_rooms_occupied,
-            'available': Room.objects.filter(
-                hotel=hotel, 
-                room_type='suite', 
-                is_active=True,
-                status='available'
-            ).count()
-        }
-    }
+    # Ocupación por tipo de habitación (total y disponibles en una sola query agrupada)
+    occupancy_by_type = _room_type_breakdown(Room.objects.filter(hotel=hotel, is_active=True), with_available=True)
+    for room_type, occupied in _metric_room_type_occupancy(metrics).items():
+        occupancy_by_type.setdefault(room_type, {'total': 0, 'occupied': 0, 'available': 0})
+        occupancy_by_type[room_type]['occupied'] = occupied
     
     return Response(occupancy_by_type)
 
@@ -74,6 +74,7 @@ class Command(BaseCommand):
                 cache_key_sign = f"afip_sign_{config.hotel.id}_{config.environment}"
                 cache.delete(cache_key_token)
                 cache.delete(cache_key_sign)
+                cache.delete(f"afip_ta_{config.hotel.id}_{config.environment}")
                 
                 self.stdout.write(
                     self.style.SUCCESS(
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoicing', '0005_remove_afipconfig_last_receipt_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='afip_number',
+            field=models.PositiveIntegerField(blank=True, help_text='Número de comprobante (CbteDesde) enviado a AFIP; se guarda antes de FECAESolicitar', null=True),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.utils import timezone
@@ -180,9 +180,27 @@ class AfipConfig(models.Model):
             raise ValidationError({'point_of_sale': 'El punto de venta debe estar entre 1 y 9999'})
     
     def get_next_invoice_number(self) -> int:
-        """Obtiene el próximo número de factura"""
+        """Obtiene el próximo número de factura (solo consulta, no lo reserva)"""
         return self.last_invoice_number + 1
     
+    def allocate_invoice_number(self) -> int:
+        """
+        Reserva el próximo número de factura del punto de venta
+        
+        UPDATE atómico sobre la fila de la configuración (hotel + punto de venta): la fila
+        queda bloqueada hasta el commit de la transacción del llamador, así dos facturas
+        concurrentes no comparten número y un rollback libera el número (serie sin huecos).
+        Debe llamarse dentro del transaction.atomic() que crea la factura.
+        """
+        with transaction.atomic():
+            type(self).objects.filter(pk=self.pk).update(
+                last_invoice_number=models.F('last_invoice_number') + 1,
+                last_cae_date=timezone.now(),
+            )
+            number = type(self).objects.values_list('last_invoice_number', flat=True).get(pk=self.pk)
+        self.last_invoice_number = number
+        return number
+    
     def format_invoice_number(self, invoice_number: int) -> str:
         """
         Formatea el número de factura como "0001-00001234"
@@ -192,11 +210,13 @@ class AfipConfig(models.Model):
         return f"{point_of_sale_str}-{invoice_number_str}"
     
     def update_invoice_number(self, invoice_number: int):
-        """Actualiza el último número de factura emitido"""
+        """Actualiza el último número de factura emitido (nunca retrocede, aun con la instancia desactualizada)"""
         if invoice_number > self.last_invoice_number:
             self.last_invoice_number = invoice_number
             self.last_cae_date = timezone.now()
-            self.save(update_fields=['last_invoice_number', 'last_cae_date'])
+            type(self).objects.filter(pk=self.pk, last_invoice_number__lt=invoice_number).update(
+                last_invoice_number=invoice_number, last_cae_date=self.last_cae_date,
+            )
 
 
 class Invoice(models.Model):
@@ -271,6 +291,11 @@ class Invoice(models.Model):
         blank=True,
         help_text="Fecha de vencimiento del CAE"
     )
+    afip_number = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Número de comprobante (CbteDesde) enviado a AFIP; se guarda antes de FECAESolicitar"
+    )
     
     # Montos
     total = models.DecimalField(
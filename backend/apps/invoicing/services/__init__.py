@@ -2,7 +2,7 @@
 from .afip_auth_service import AfipAuthService, AfipAuthError
 from .afip_invoice_service import AfipInvoiceService, AfipInvoiceError
 from .afip_test_service import AfipTestService, AfipTestError
-from .afip_service import AfipService, AfipServiceError
+from .afip_service import AfipService, AfipServiceError, send_invoice_and_record, send_invoice_on_commit
 from .afip_mock_service import AfipMockService, MockAfipAuthService, MockAfipInvoiceService
 from .invoice_generator import InvoiceGeneratorService
 from .invoice_pdf_service import InvoicePDFService, InvoicePDFError
@@ -11,6 +11,8 @@ from .email_service import InvoiceEmailService
 __all__ = [
     'AfipService',
     'AfipServiceError',
+    'send_invoice_and_record',
+    'send_invoice_on_commit',
     'AfipAuthService',
     'AfipAuthError', 
     'AfipInvoiceService',
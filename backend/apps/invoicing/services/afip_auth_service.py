@@ -12,6 +12,7 @@ from django.conf import settings
 from django.core.cache import cache
 from django.utils import timezone
 import requests
+from .afip_ticket_cache import AfipTicketCache, TicketStillValid, is_already_authenticated
 from cryptography import x509
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
@@ -45,122 +46,38 @@ class AfipAuthService:
         self.is_production = config.environment == 'production'
         self.wsaa_url = self.WSAA_PRODUCTION_URL if self.is_production else self.WSAA_HOMOLOGATION_URL
         
-        # Cache keys
-        self.token_cache_key = f"afip_token_{config.hotel.id}_{config.environment}"
-        self.sign_cache_key = f"afip_sign_{config.hotel.id}_{config.environment}"
+        # TA compartido entre procesos (cache + BD, renovación en segundo plano)
+        self.tickets = AfipTicketCache(config)
+        self.token_cache_key = self.tickets.token_key
+        self.sign_cache_key = self.tickets.sign_key
         
     def get_token_and_sign(self) -> Tuple[str, str]:
         """
         Obtiene token y sign válidos para AFIP
         
+        Sirve el TA vigente sin bloquear (encolando su renovación si está por vencer);
+        solo espera cuando no hay TA válido y otro worker lo está pidiendo a WSAA.
+        
         Returns:
             Tuple[str, str]: (token, sign)
             
         Raises:
             AfipAuthError: Si hay error en la autenticación
         """
-        # 1) Verificar cache primero
-        cached_token = cache.get(self.token_cache_key)
-        cached_sign = cache.get(self.sign_cache_key)
-        if cached_token and cached_sign:
-            logger.info(f"Token AFIP obtenido desde cache para hotel {self.config.hotel.id}")
-            return cached_token, cached_sign
-
-        # 2) Verificar persistencia en BD (no expirado)
         try:
-            from django.utils import timezone as dj_tz
-            if getattr(self.config, 'afip_token', None) and getattr(self.config, 'afip_sign', None):
-                exp = getattr(self.config, 'afip_token_expiration', None)
-                if exp and exp > dj_tz.now():
-                    # Repoblar cache y reutilizar
-                    remaining = int((exp - dj_tz.now()).total_seconds())
-                    # limitar el TTL para evitar valores negativos o excesivos
-                    ttl = max(60, min(11 * 60 * 60, remaining))
-                    cache.set(self.token_cache_key, self.config.afip_token, ttl)
-                    cache.set(self.sign_cache_key, self.config.afip_sign, ttl)
-                    logger.info(
-                        f"Token AFIP reutilizado desde BD para hotel {self.config.hotel.id}, vence en {remaining}s"
-                    )
-                    return self.config.afip_token, self.config.afip_sign
-        except Exception as e:
-            logger.warning(f"No se pudo reutilizar TA desde BD: {e}")
-        
-        # 3) Evitar tormenta de logins: lock distribuido
-        lock_key = f"afip_wsaa_lock_{self.config.hotel.id}_{self.config.environment}"
-        got_lock = cache.add(lock_key, True, timeout=120)  # 2 minutos
-        try:
-            if not got_lock:
-                logger.info("Otro proceso está obteniendo TA; esperando reutilización...")
-                # Esperar a que otro proceso persista el TA
-                token_sign = self._wait_for_existing_ta(timeout_seconds=90, interval_seconds=5)
-                if token_sign is not None:
-                    token, sign = token_sign
-                    return token, sign
-                # Si no apareció, intentar igualmente generar nosotros
-                logger.info("TA no apareció; intentando generar uno nuevo nosotros")
-
-            # Generar nuevo token
-            token, sign, gen_dt, exp_dt = self._generate_new_token()
-            
-            # Guardar en cache hasta expiración (cap a 11h)
-            from django.utils import timezone as dj_tz
-            now = dj_tz.now()
-            if exp_dt and exp_dt > now:
-                cache_timeout = int(min(11 * 60 * 60, (exp_dt - now).total_seconds()))
-            else:
-                cache_timeout = 11 * 60 * 60
-            cache.set(self.token_cache_key, token, cache_timeout)
-            cache.set(self.sign_cache_key, sign, cache_timeout)
-
-            # Persistir en BD
-            try:
-                update_fields = []
-                if hasattr(self.config, 'afip_token'):
-                    self.config.afip_token = token; update_fields.append('afip_token')
-                if hasattr(self.config, 'afip_sign'):
-                    self.config.afip_sign = sign; update_fields.append('afip_sign')
-                if hasattr(self.config, 'afip_token_generation') and gen_dt:
-                    self.config.afip_token_generation = gen_dt; update_fields.append('afip_token_generation')
-                if hasattr(self.config, 'afip_token_expiration') and exp_dt:
-                    self.config.afip_token_expiration = exp_dt; update_fields.append('afip_token_expiration')
-                if update_fields:
-                    self.config.save(update_fields=update_fields or None)
-            except Exception as e:
-                logger.warning(f"No se pudo persistir TA en BD: {e}")
-            
-            logger.info(f"Token AFIP generado exitosamente para hotel {self.config.hotel.id}")
-            return token, sign
-            
+            return self.tickets.get(self._generate_new_token)
         except Exception as e:
             logger.error(f"Error generando token AFIP para hotel {self.config.hotel.id}: {str(e)}")
             raise AfipAuthError(f"Error en autenticación AFIP: {str(e)}")
-        finally:
-            if got_lock:
-                cache.delete(lock_key)
 
-    def _wait_for_existing_ta(self, timeout_seconds: int = 60, interval_seconds: int = 5) -> Optional[Tuple[str, str]]:
+    def renew_ticket(self) -> bool:
         """
-        Espera a que aparezca un TA en cache/BD durante un tiempo, útil cuando WSAA
-        responde alreadyAuthenticated pero otra instancia está persistiendo el TA.
+        Renueva el TA antes de su vencimiento (tarea en segundo plano)
+        
+        Returns:
+            bool: True si se pidió un TA nuevo a WSAA
         """
-        from time import sleep
-        from django.utils import timezone as dj_tz
-        deadline = dj_tz.now() + timedelta(seconds=timeout_seconds)
-        while dj_tz.now() < deadline:
-            # Intentar leer desde cache
-            cached_token = cache.get(self.token_cache_key)
-            cached_sign = cache.get(self.sign_cache_key)
-            if cached_token and cached_sign:
-                logger.info("TA encontrado en cache durante espera")
-                return cached_token, cached_sign
-            # Intentar desde BD
-            if getattr(self.config, 'afip_token', None) and getattr(self.config, 'afip_sign', None):
-                exp = getattr(self.config, 'afip_token_expiration', None)
-                if not exp or exp > dj_tz.now():
-                    logger.info("TA encontrado en BD durante espera")
-                    return self.config.afip_token, self.config.afip_sign
-            sleep(interval_seconds)
-        return None
+        return self.tickets.renew(self._generate_new_token)
     
     def _generate_new_token(self) -> Tuple[str, str, Optional[datetime], Optional[datetime]]:
         """
@@ -228,10 +145,6 @@ class AfipAuthService:
             str: Respuesta XML de AFIP
         """
         try:
-            # Pequeño delay para evitar conflictos de TA
-            import time
-            time.sleep(2)
-            
             # Construir CMS (PKCS#7) firmado del XML (TRA)
             signed_cms_b64 = self._sign_xml(login_xml)
             
@@ -312,34 +225,10 @@ class AfipAuthService:
                 logger.error(f"Contenido completo: {text_clean}")
                 
                 # Manejar caso especial: TA ya válido (WSAA Fault: coe.alreadyAuthenticated)
-                if response.status_code == 500 and ("TA valido" in text_clean or "alreadyAuthenticated" in text_clean):
+                if response.status_code == 500 and is_already_authenticated(text_clean):
                     logger.warning("AFIP indica que hay un TA vigente para este CEE/servicio")
-                    # Si tenemos TA persistido y no vencido, reutilizarlo
-                    try:
-                        from django.utils import timezone as dj_tz
-                        if getattr(self.config, 'afip_token', None) and getattr(self.config, 'afip_sign', None):
-                            exp = getattr(self.config, 'afip_token_expiration', None)
-                            if not exp or exp > dj_tz.now():
-                                logger.info("Reutilizando TA persistido localmente (WSAA rechazó nueva emisión)")
-                                token = self.config.afip_token
-                                sign = self.config.afip_sign
-                                gen = getattr(self.config, 'afip_token_generation', dj_tz.now())
-                                exp_dt = exp or (dj_tz.now() + timedelta(hours=6))
-                                simulated_xml = f'''<?xml version="1.0" encoding="UTF-8"?>\n<loginTicketResponse>\n    <token>{token}</token>\n    <sign>{sign}</sign>\n    <generationTime>{gen.isoformat()}</generationTime>\n    <expirationTime>{exp_dt.isoformat()}</expirationTime>\n</loginTicketResponse>'''
-                                return simulated_xml
-                        # Esperar brevemente a que otro proceso persista el TA y reintentar reutilización
-                        logger.info("Esperando aparición de TA local tras alreadyAuthenticated...")
-                        token_sign = self._wait_for_existing_ta(timeout_seconds=60, interval_seconds=5)
-                        if token_sign is not None:
-                            token, sign = token_sign
-                            gen = getattr(self.config, 'afip_token_generation', dj_tz.now())
-                            exp_dt = getattr(self.config, 'afip_token_expiration', dj_tz.now() + timedelta(hours=6))
-                            simulated_xml = f'''<?xml version="1.0" encoding="UTF-8"?>\n<loginTicketResponse>\n    <token>{token}</token>\n    <sign>{sign}</sign>\n    <generationTime>{gen.isoformat()}</generationTime>\n    <expirationTime>{exp_dt.isoformat()}</expirationTime>\n</loginTicketResponse>'''
-                            return simulated_xml
-                    except Exception:
-                        pass
-                    # Sin TA local disponible: no podemos obtenerlo del Fault; esperar expiración o unificar storage
-                    raise AfipAuthError("WSAA indicó TA válido, pero no hay TA local disponible para reutilizar")
+                    # AfipTicketCache sigue sirviendo el TA vigente y no vuelve a pedirlo hasta que venza
+                    raise TicketStillValid(text_clean[:300])
                 
                 raise AfipAuthError(f"AFIP respondió con error HTTP {response.status_code}: {text_clean[:300]}")
             
@@ -457,17 +346,8 @@ class AfipAuthService:
                 fault = root.find('.//faultstring')
                 if fault is not None and fault.text:
                     # Manejo especial: si hay TA válido, intentar reutilizar persistido
-                    msg = fault.text
-                    if 'TA valido' in msg or 'TA válido' in msg:
-                        try:
-                            from django.utils import timezone as dj_tz
-                            if getattr(self.config, 'afip_token', None) and getattr(self.config, 'afip_sign', None):
-                                exp = getattr(self.config, 'afip_token_expiration', None)
-                                if exp and exp > dj_tz.now():
-                                    logger.info("WSAA indica TA vigente; reutilizando TA persistido")
-                                    return self.config.afip_token, self.config.afip_sign, getattr(self.config, 'afip_token_generation', None), exp
-                        except Exception:
-                            pass
+                    if is_already_authenticated(fault.text):
+                        raise TicketStillValid(fault.text)
                     raise AfipAuthError(f"WSAA Fault: {fault.text}")
                 raise AfipAuthError("Respuesta de AFIP no contiene loginCmsReturn")
             raw_content = login_return.text.strip()
@@ -568,6 +448,8 @@ class AfipAuthService:
             logger.info("Token y sign extraídos exitosamente de respuesta AFIP")
             return token, sign, gen_dt, exp_dt
             
+        except TicketStillValid:
+            raise
         except ET.ParseError as e:
             preview = (response_xml or "")[:300]
             logger.error(f"Error parseando respuesta XML de AFIP: {str(e)} | Preview: {preview}")
@@ -580,8 +462,7 @@ class AfipAuthService:
         """
         Limpia el cache de tokens
         """
-        cache.delete(self.token_cache_key)
-        cache.delete(self.sign_cache_key)
+        self.tickets.clear()
         logger.info(f"Cache de tokens AFIP limpiado para hotel {self.config.hotel.id}")
     
     def is_token_valid(self) -> bool:
@@ -591,8 +472,7 @@ class AfipAuthService:
         Returns:
             bool: True si el token es válido
         """
-        cached_token = cache.get(self.token_cache_key)
-        return cached_token is not None
+        return cache.get(self.tickets.ticket_key) is not None
 
 
 class AfipAuthError(Exception):
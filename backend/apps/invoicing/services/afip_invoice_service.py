@@ -4,16 +4,44 @@ Maneja la emisión de comprobantes electrónicos
 """
 
 import logging
+import os
+import threading
 import xml.etree.ElementTree as ET
-from datetime import datetime, timedelta
+from collections import defaultdict
+from datetime import datetime
 from decimal import Decimal
 from typing import Dict, List, Optional, Tuple
+from django.conf import settings
 from django.utils import timezone
 import requests
 from .afip_auth_service import AfipAuthService, AfipAuthError
 
 logger = logging.getLogger(__name__)
 
+WSFE_NS = '{http://ar.gov.afip.dif.FEV1/}'
+
+# Sesión HTTP hacia WSFEv1 compartida por proceso (pool keep-alive)
+_session_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+
+
+def wsfe_session() -> requests.Session:
+    """Sesión keep-alive hacia WSFEv1; una por proceso (se recrea tras un fork de Celery)"""
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=2,
+                pool_maxsize=int(getattr(settings, 'AFIP_HTTP_POOL_MAXSIZE', 4)),
+                max_retries=2,
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session, _session_pid = session, os.getpid()
+        return _session
+
 
 class AfipInvoiceService:
     """
@@ -34,6 +62,9 @@ class AfipInvoiceService:
         'ND': 2,   # Nota de Débito
     }
     
+    # Tope de comprobantes por FECAESolicitar si FECompTotXRequest no responde
+    DEFAULT_MAX_RECORDS_PER_REQUEST = 250
+    
     # Códigos de tipos de documento AFIP
     DOCUMENT_TYPE_CODES = {
         'DNI': 96,
@@ -96,18 +127,248 @@ class AfipInvoiceService:
             logger.error(f"Error enviando factura {invoice.number} a AFIP: {str(e)}")
             raise AfipInvoiceError(f"Error enviando factura: {str(e)}")
     
-    def _validate_invoice(self, invoice):
+    def send_invoices_batch(self, invoices) -> Dict[str, Dict]:
+        """
+        Autoriza varias facturas con FECAESolicitar por lotes (CantReg > 1)
+        
+        Las facturas se agrupan por punto de venta y tipo de comprobante. Por grupo se
+        consulta una sola vez FECompUltimoAutorizado y la numeración sigue localmente;
+        cada request lleva hasta FECompTotXRequest comprobantes. Si un request falla sin
+        respuesta interpretable se vuelve a consultar el último número antes del siguiente.
+        Todas las llamadas usan la sesión keep-alive compartida.
+        
+        Args:
+            invoices: Facturas (Invoice) a autorizar, en el orden de numeración deseado
+            
+        Returns:
+            Dict[str, Dict]: Resultado por id de factura, con 'success' y 'cae',
+            'cae_expiration', 'invoice_number' o 'error'
+        """
+        results: Dict[str, Dict] = {}
+        groups: Dict[Tuple[int, int], List] = defaultdict(list)
+        for invoice in invoices:
+            try:
+                self._validate_invoice(invoice, check_status=False)
+            except AfipInvoiceError as e:
+                results[str(invoice.id)] = {'success': False, 'error': str(e)}
+                continue
+            groups[(self.config.point_of_sale, self.INVOICE_TYPE_CODES[invoice.type])].append(invoice)
+        if not groups:
+            return results
+        
+        try:
+            token, sign = self.auth_service.get_token_and_sign()
+        except AfipAuthError as e:
+            logger.error(f"Error de autenticación AFIP para lote de facturas: {str(e)}")
+            for group in groups.values():
+                for invoice in group:
+                    results[str(invoice.id)] = {'success': False, 'error': f"Error de autenticación: {str(e)}"}
+            return results
+        
+        limit = self._get_max_records_per_request(token, sign)
+        for (pto_vta, cbte_tipo), group in groups.items():
+            last_number = None
+            approved_max = 0
+            # Facturas con número ya enviado a AFIP en un intento sin respuesta: se consulta antes de renumerar
+            pending = []
+            for invoice in group:
+                if invoice.afip_number:
+                    recovered = self._recover_voucher(invoice, token, sign, cbte_tipo, pto_vta, results)
+                    approved_max = max(approved_max, recovered or 0)
+                    if str(invoice.id) in results:
+                        continue
+                pending.append(invoice)
+            
+            for start in range(0, len(pending), limit):
+                chunk = pending[start:start + limit]
+                if last_number is None:
+                    last_number = self._get_last_authorized_number(token, sign, cbte_tipo, pto_vta)
+                    if last_number is None:
+                        last_number = self.config.get_next_invoice_number() - 1
+                numbered = {last_number + i: invoice for i, invoice in enumerate(chunk, 1)}
+                try:
+                    details = [
+                        self._build_detail_xml(invoice, token, sign, cbte_tipo, number)
+                        for number, invoice in numbered.items()
+                    ]
+                    # El número queda guardado antes del envío para poder recuperar el CAE si se pierde la respuesta
+                    self._save_afip_numbers(numbered.items())
+                    response = self._send_to_afip(self._build_request_xml(token, sign, cbte_tipo, details))
+                    items, errors = self._parse_batch_response(response)
+                except Exception as e:
+                    logger.error(f"Error enviando lote de {len(chunk)} facturas a AFIP: {str(e)}")
+                    for invoice in chunk:
+                        if invoice.afip_number:
+                            recovered = self._recover_voucher(invoice, token, sign, cbte_tipo, pto_vta, results)
+                            approved_max = max(approved_max, recovered or 0)
+                        if results.get(str(invoice.id), {}).get('success'):
+                            continue
+                        results[str(invoice.id)] = {'success': False, 'error': f"Error enviando factura: {str(e)}"}
+                    # No se sabe qué numeró AFIP: volver a consultar antes del próximo lote
+                    last_number = None
+                    continue
+                
+                rejected = []
+                for number, invoice in numbered.items():
+                    item = items.get(number)
+                    if item and (item.get('result') or '').upper() == 'A' and item.get('cae'):
+                        cae_data = {
+                            'cae': item['cae'],
+                            'cae_expiration': item.get('cae_expiration'),
+                            'invoice_number': str(number),
+                        }
+                        results[str(invoice.id)] = self._apply_cae(invoice, cae_data)
+                        approved_max = max(approved_max, number)
+                        last_number = max(last_number, number)
+                    else:
+                        error_msg = (item or {}).get('errors') or errors or ['Error desconocido']
+                        results[str(invoice.id)] = {
+                            'success': False,
+                            'error': f"AFIP rechazó la factura: {', '.join(error_msg)}",
+                        }
+                        if item:
+                            # AFIP respondió por ese número sin autorizarlo: el próximo intento renumera
+                            rejected.append((None, invoice))
+                if rejected:
+                    self._save_afip_numbers(rejected)
+            
+            # Último número emitido: una sola escritura por grupo
+            if approved_max:
+                self.config.update_invoice_number(approved_max)
+        
+        approved = sum(1 for r in results.values() if r['success'])
+        logger.info(f"Lote AFIP: {approved}/{len(results)} facturas autorizadas")
+        return results
+    
+    def _apply_cae(self, invoice, cae_data: Dict) -> Dict:
+        """
+        Guarda en la factura el CAE recibido y arma su resultado de lote
+        
+        Si la factura no se pudo actualizar el resultado lleva 'persisted': False; AFIP ya
+        emitió el CAE, así que el llamador tiene que guardarlo igual.
+        """
+        result = {'success': True, **cae_data}
+        try:
+            self._update_invoice_with_afip_data(invoice, cae_data, update_config=False)
+        except Exception:
+            logger.exception(f"CAE {cae_data['cae']} emitido por AFIP sin poder guardarse en la factura {invoice.id}")
+            result['persisted'] = False
+        return result
+    
+    def _save_afip_numbers(self, numbered):
+        """Guarda (o limpia, con None) el número de comprobante AFIP de cada factura: pares (número, factura)"""
+        invoices = []
+        for number, invoice in numbered:
+            invoice.afip_number = number
+            invoices.append(invoice)
+        if invoices:
+            type(invoices[0]).objects.bulk_update(invoices, ['afip_number'])
+    
+    def _recover_voucher(self, invoice, token: str, sign: str, cbte_tipo: int, pto_vta: int,
+                         results: Dict[str, Dict]) -> Optional[int]:
+        """
+        Busca con FECompConsultar el número ya enviado a AFIP para la factura
+        
+        Si AFIP lo autorizó para esta factura se recupera el CAE y se devuelve el número. Si no
+        tiene registro (o el comprobante es de otro importe) se limpia el número para renumerar.
+        Si la consulta falla se deja el número y la factura queda con error hasta el próximo
+        reintento: nunca se renumera un comprobante que AFIP pudo haber autorizado.
+        """
+        number = invoice.afip_number
+        try:
+            voucher = self._consult_voucher(token, sign, cbte_tipo, pto_vta, number)
+        except Exception as e:
+            logger.error(f"No se pudo consultar en AFIP el comprobante {number} de la factura {invoice.id}: {e}")
+            results[str(invoice.id)] = {
+                'success': False,
+                'error': f"No se pudo confirmar en AFIP el comprobante {number}: {str(e)}",
+            }
+            return None
+        
+        if (
+            voucher
+            and (voucher.get('result') or '').upper() == 'A'
+            and voucher.get('cae')
+            and voucher.get('total') == Decimal(self._format_amount(invoice.total))
+        ):
+            logger.warning(f"Factura {invoice.id}: CAE del comprobante {number} recuperado con FECompConsultar")
+            results[str(invoice.id)] = self._apply_cae(invoice, {
+                'cae': voucher['cae'],
+                'cae_expiration': voucher.get('cae_expiration'),
+                'invoice_number': str(number),
+            })
+            return number
+        
+        self._save_afip_numbers([(None, invoice)])
+        return None
+    
+    def _consult_voucher(self, token: str, sign: str, cbte_tipo: int, pto_vta: int, number: int) -> Optional[Dict]:
+        """
+        Consulta FECompConsultar para un comprobante ya numerado
+        
+        Returns:
+            Optional[Dict]: 'result', 'cae', 'cae_expiration' y 'total' del comprobante,
+            o None si AFIP no tiene registro de ese número (error 602)
+            
+        Raises:
+            AfipInvoiceError: Si la consulta no tiene una respuesta interpretable
+        """
+        headers = {
+            'Content-Type': 'text/xml; charset=utf-8',
+            'SOAPAction': 'http://ar.gov.afip.dif.FEV1/FECompConsultar'
+        }
+        body = f'''<?xml version="1.0" encoding="UTF-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" xmlns:wsfe="http://ar.gov.afip.dif.FEV1/">
+  <soap:Header/>
+  <soap:Body>
+    <wsfe:FECompConsultar>
+      <wsfe:Auth>
+        <wsfe:Token>{token}</wsfe:Token>
+        <wsfe:Sign>{sign}</wsfe:Sign>
+        <wsfe:Cuit>{self.config.cuit}</wsfe:Cuit>
+      </wsfe:Auth>
+      <wsfe:FeCompConsReq>
+        <wsfe:CbteTipo>{cbte_tipo}</wsfe:CbteTipo>
+        <wsfe:CbteNro>{number}</wsfe:CbteNro>
+        <wsfe:PtoVta>{pto_vta}</wsfe:PtoVta>
+      </wsfe:FeCompConsReq>
+    </wsfe:FECompConsultar>
+  </soap:Body>
+</soap:Envelope>'''
+        session = wsfe_session()
+        resp = session.post(self.wsfev1_url, data=body, headers=headers, timeout=(10, 20))
+        try:
+            root = ET.fromstring(resp.text)
+        except ET.ParseError as e:
+            raise AfipInvoiceError(f"Respuesta inválida de FECompConsultar: {e}")
+        
+        result_get = root.find(f'.//{WSFE_NS}ResultGet')
+        if result_get is not None:
+            total = result_get.findtext(f'{WSFE_NS}ImpTotal')
+            return {
+                'result': result_get.findtext(f'{WSFE_NS}Resultado'),
+                'cae': (result_get.findtext(f'{WSFE_NS}CodAutorizacion') or '').strip(),
+                'cae_expiration': result_get.findtext(f'{WSFE_NS}FchVto'),
+                'total': Decimal(total) if total else None,
+            }
+        codes = [(err.findtext(f'{WSFE_NS}Code') or '').strip() for err in root.iter(f'{WSFE_NS}Err')]
+        if '602' in codes:
+            return None
+        raise AfipInvoiceError(f"FECompConsultar sin resultado (errores: {', '.join(codes) or 'ninguno'})")
+    
+    def _validate_invoice(self, invoice, check_status: bool = True):
         """
         Valida la factura antes del envío
         
         Args:
             invoice: Instancia de Invoice
+            check_status: Exigir estado draft (el envío por lotes reclama las facturas antes)
             
         Raises:
             AfipInvoiceError: Si la factura no es válida
         """
         # Validar que la factura esté en estado draft
-        if invoice.status != 'draft':
+        if check_status and invoice.status != 'draft':
             raise AfipInvoiceError(f"La factura debe estar en estado draft, actual: {invoice.status}")
         
         # Validar que tenga items
@@ -152,180 +413,214 @@ class AfipInvoiceService:
             else:
                 next_number = self.config.get_next_invoice_number()
             
-            # Construir XML base
-            # Determinar DocTipo/DocNro según condición IVA del cliente
-            tax_cond = str(getattr(invoice, 'client_tax_condition', '5')).strip()  # default CF
-            raw_doc_type = self._get_document_type_code(getattr(invoice, 'client_document_type', ''))
-            raw_doc_nro = str(getattr(invoice, 'client_document_number', '') or '').strip()
+            detail = self._build_detail_xml(invoice, token, sign, cbte_tipo, next_number)
+            xml_content = self._build_request_xml(token, sign, cbte_tipo, [detail])
+            logger.info(f"XML de factura {invoice.number} construido correctamente")
+            # Log seguro del XML con credenciales enmascaradas (para diagnóstico)
+            try:
+                masked_xml = self._mask_sensitive_xml(xml_content)
+                logger.info("WSFE XML (masked preview 800 chars): %s", masked_xml[:800])
+                logger.info("WSFE XML (masked tail 800 chars): %s", masked_xml[-800:])
+            except Exception:
+                pass
+            return xml_content
+            
+        except Exception as e:
+            logger.error(f"Error construyendo XML de factura {invoice.number}: {str(e)}")
+            raise
+    
+    def _build_request_xml(self, token: str, sign: str, cbte_tipo: int, details: List[List[str]]) -> str:
+        """
+        Arma el FECAESolicitar con uno o más FECAEDetRequest (CantReg = len(details))
+        
+        Args:
+            token: Token de autenticación
+            sign: Sign de autenticación
+            cbte_tipo: Código AFIP del tipo de comprobante
+            details: Líneas XML de cada FECAEDetRequest (ver _build_detail_xml)
+            
+        Returns:
+            str: XML del request
+        """
+        xml_parts = [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"',
+            '               xmlns:wsfe="http://ar.gov.afip.dif.FEV1/">',
+            '    <soap:Header/>',
+            '    <soap:Body>',
+            '        <wsfe:FECAESolicitar>',
+            '            <wsfe:Auth>',
+            f'                <wsfe:Token>{token}</wsfe:Token>',
+            f'                <wsfe:Sign>{sign}</wsfe:Sign>',
+            f'                <wsfe:Cuit>{self.config.cuit}</wsfe:Cuit>',
+            '            </wsfe:Auth>',
+            '            <wsfe:FeCAEReq>',
+            '                <wsfe:FeCabReq>',
+            f'                    <wsfe:CantReg>{len(details)}</wsfe:CantReg>',
+            f'                    <wsfe:PtoVta>{self.config.point_of_sale}</wsfe:PtoVta>',
+            f'                    <wsfe:CbteTipo>{cbte_tipo}</wsfe:CbteTipo>',
+            '                </wsfe:FeCabReq>',
+            '                <wsfe:FeDetReq>',
+        ]
+        for detail in details:
+            xml_parts.extend(detail)
+        xml_parts.extend([
+            '                </wsfe:FeDetReq>',
+            '            </wsfe:FeCAEReq>',
+            '        </wsfe:FECAESolicitar>',
+            '    </soap:Body>',
+            '</soap:Envelope>'
+        ])
+        return '\n'.join(xml_parts)
+    
+    def _build_detail_xml(self, invoice, token: str, sign: str, cbte_tipo: int, number: int) -> List[str]:
+        """
+        Construye el FECAEDetRequest de una factura con el número de comprobante indicado
+        
+        Args:
+            invoice: Instancia de Invoice
+            token: Token de autenticación
+            sign: Sign de autenticación
+            cbte_tipo: Código AFIP del tipo de comprobante
+            number: Número de comprobante (CbteDesde = CbteHasta)
+            
+        Returns:
+            List[str]: Líneas XML del detalle
+        """
+        # Construir XML base
+        # Determinar DocTipo/DocNro según condición IVA del cliente
+        tax_cond = str(getattr(invoice, 'client_tax_condition', '5')).strip()  # default CF
+        raw_doc_type = self._get_document_type_code(getattr(invoice, 'client_document_type', ''))
+        raw_doc_nro = str(getattr(invoice, 'client_document_number', '') or '').strip()
 
-            if tax_cond == '5':  # Consumidor Final
+        if tax_cond == '5':  # Consumidor Final
+            doc_type_code = 99
+            doc_nro = '0'
+        elif tax_cond in ('1', '8'):  # RI o Monotributo → CUIT obligatorio
+            doc_type_code = 80
+            doc_nro = raw_doc_nro if raw_doc_nro and raw_doc_nro.isdigit() else ''
+            if len(doc_nro) != 11:
+                # Si CUIT inválido, degradar a CF para evitar rechazo en homologación
                 doc_type_code = 99
                 doc_nro = '0'
-            elif tax_cond in ('1', '8'):  # RI o Monotributo → CUIT obligatorio
-                doc_type_code = 80
-                doc_nro = raw_doc_nro if raw_doc_nro and raw_doc_nro.isdigit() else ''
-                if len(doc_nro) != 11:
-                    # Si CUIT inválido, degradar a CF para evitar rechazo en homologación
-                    doc_type_code = 99
-                    doc_nro = '0'
-            elif tax_cond == '6':  # Exento
-                # Usar lo provisto, si no hay, degradar a CF
-                doc_type_code = raw_doc_type if raw_doc_type else 96
-                doc_nro = raw_doc_nro if raw_doc_nro and raw_doc_nro.isdigit() else ''
-                if not doc_nro:
-                    doc_type_code = 99
-                    doc_nro = '0'
-            else:
-                # Fallback seguro
+        elif tax_cond == '6':  # Exento
+            # Usar lo provisto, si no hay, degradar a CF
+            doc_type_code = raw_doc_type if raw_doc_type else 96
+            doc_nro = raw_doc_nro if raw_doc_nro and raw_doc_nro.isdigit() else ''
+            if not doc_nro:
                 doc_type_code = 99
                 doc_nro = '0'
+        else:
+            # Fallback seguro
+            doc_type_code = 99
+            doc_nro = '0'
 
-            # Código de condición IVA del receptor (para Opcionales RG 5616)
-            cond_code_map = {
-                '5': 'CF',   # Consumidor Final
-                '1': 'RI',   # Responsable Inscripto
-                '8': 'MO',   # Monotributista
-                '6': 'EX',   # Exento
-            }
-            cond_code = cond_code_map.get(tax_cond, 'CF')
+        # Código de condición IVA del receptor (para Opcionales RG 5616)
+        cond_code_map = {
+            '5': 'CF',   # Consumidor Final
+            '1': 'RI',   # Responsable Inscripto
+            '8': 'MO',   # Monotributista
+            '6': 'EX',   # Exento
+        }
+        cond_code = cond_code_map.get(tax_cond, 'CF')
 
-            # Intentar obtener la condición real del receptor desde AFIP
-            try:
-                resolved_cond = self._get_receptor_tax_condition(token, sign, int(doc_type_code), str(doc_nro))
-                if resolved_cond:
-                    cond_code = str(resolved_cond).strip().upper()
-            except Exception:
-                pass
+        # Intentar obtener la condición real del receptor desde AFIP
+        try:
+            resolved_cond = self._get_receptor_tax_condition_cached(token, sign, int(doc_type_code), str(doc_nro))
+            if resolved_cond:
+                cond_code = str(resolved_cond).strip().upper()
+        except Exception:
+            pass
 
-            # Para Opcional 2101, usar literal según WSDL/SDKs (RI/CF/MO/EX)
-            cond_value = cond_code
+        # Para Opcional 2101, usar literal según WSDL/SDKs (RI/CF/MO/EX)
+        cond_value = cond_code
 
-            # No forzar el CUIT del emisor como receptor en homologación.
-            # Para Consumidor Final (99) mantener DocNro=0, evitando que coincida con el emisor (error 10069).
+        # No forzar el CUIT del emisor como receptor en homologación.
+        # Para Consumidor Final (99) mantener DocNro=0, evitando que coincida con el emisor (error 10069).
 
-            # Determinar Concepto (1=Productos, 2=Servicios, 3=Ambos). Hotelería: Servicios.
-            try:
-                concept_code = int(getattr(invoice, 'concept', 2))
-                if concept_code not in (1, 2, 3):
-                    concept_code = 2
-            except Exception:
+        # Determinar Concepto (1=Productos, 2=Servicios, 3=Ambos). Hotelería: Servicios.
+        try:
+            concept_code = int(getattr(invoice, 'concept', 2))
+            if concept_code not in (1, 2, 3):
                 concept_code = 2
+        except Exception:
+            concept_code = 2
 
-            # Log de parámetros críticos para diagnóstico (sin credenciales)
-            try:
-                # Logear también si 2101 está habilitado (solo una vez por instancia)
-                if not getattr(self, '_optionals_logged', False):
-                    self._log_available_optionals(token, sign)
-                    self._optionals_logged = True
-                logger.info(
-                    "WSFE parámetros – CbteTipo=%s, PtoVta=%s, Concepto=%s, DocTipo=%s, DocNro=%s, CondIVA=%s, ImpTotal=%s, ImpNeto=%s, ImpIVA=%s",
-                    cbte_tipo,
-                    self.config.point_of_sale,
-                    concept_code,
-                    doc_type_code,
-                    doc_nro,
-                    cond_value,
-                    self._format_amount(invoice.total),
-                    self._format_amount(invoice.net_amount),
-                    self._format_amount(invoice.vat_amount),
-                )
-            except Exception:
-                pass
+        # Log de parámetros críticos para diagnóstico (sin credenciales)
+        try:
+            # Logear también si 2101 está habilitado (solo una vez por instancia)
+            if not getattr(self, '_optionals_logged', False):
+                self._log_available_optionals(token, sign)
+                self._optionals_logged = True
+            logger.info(
+                "WSFE parámetros – CbteTipo=%s, PtoVta=%s, Concepto=%s, DocTipo=%s, DocNro=%s, CondIVA=%s, ImpTotal=%s, ImpNeto=%s, ImpIVA=%s",
+                cbte_tipo,
+                self.config.point_of_sale,
+                concept_code,
+                doc_type_code,
+                doc_nro,
+                cond_value,
+                self._format_amount(invoice.total),
+                self._format_amount(invoice.net_amount),
+                self._format_amount(invoice.vat_amount),
+            )
+        except Exception:
+            pass
 
-            xml_parts = [
-                '<?xml version="1.0" encoding="UTF-8"?>',
-                '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"',
-                '               xmlns:wsfe="http://ar.gov.afip.dif.FEV1/">',
-                '    <soap:Header/>',
-                '    <soap:Body>',
-                '        <wsfe:FECAESolicitar>',
-                '            <wsfe:Auth>',
-                f'                <wsfe:Token>{token}</wsfe:Token>',
-                f'                <wsfe:Sign>{sign}</wsfe:Sign>',
-                f'                <wsfe:Cuit>{self.config.cuit}</wsfe:Cuit>',
-                '            </wsfe:Auth>',
-                '            <wsfe:FeCAEReq>',
-                '                <wsfe:FeCabReq>',
-                f'                    <wsfe:CantReg>1</wsfe:CantReg>',
-                f'                    <wsfe:PtoVta>{self.config.point_of_sale}</wsfe:PtoVta>',
-                f'                    <wsfe:CbteTipo>{cbte_tipo}</wsfe:CbteTipo>',
-                '                </wsfe:FeCabReq>',
-                '                <wsfe:FeDetReq>',
-                '                    <wsfe:FECAEDetRequest>',
-                f'                        <wsfe:Concepto>{concept_code}</wsfe:Concepto>',
-                f'                        <wsfe:DocTipo>{doc_type_code}</wsfe:DocTipo>',
-                f'                        <wsfe:DocNro>{doc_nro}</wsfe:DocNro>',
-                f'                        <wsfe:CbteDesde>{next_number}</wsfe:CbteDesde>',
-                f'                        <wsfe:CbteHasta>{next_number}</wsfe:CbteHasta>',
-                f'                        <wsfe:CbteFch>{invoice.issue_date.strftime("%Y%m%d")}</wsfe:CbteFch>',
-                f'                        <wsfe:ImpTotConc>{self._format_amount(Decimal("0.00"))}</wsfe:ImpTotConc>',
-                f'                        <wsfe:ImpNeto>{self._format_amount(invoice.net_amount)}</wsfe:ImpNeto>',
-                f'                        <wsfe:ImpOpEx>{self._format_amount(0)}</wsfe:ImpOpEx>',
-                f'                        <wsfe:ImpIVA>{self._format_amount(invoice.vat_amount)}</wsfe:ImpIVA>',
-                f'                        <wsfe:ImpTrib>{self._format_amount(0)}</wsfe:ImpTrib>',
-                f'                        <wsfe:ImpTotal>{self._format_amount(invoice.total)}</wsfe:ImpTotal>',
-                f'                        <wsfe:FchServDesde>{invoice.issue_date.strftime("%Y%m%d")}</wsfe:FchServDesde>',
-                f'                        <wsfe:FchServHasta>{invoice.issue_date.strftime("%Y%m%d")}</wsfe:FchServHasta>',
-                f'                        <wsfe:FchVtoPago>{invoice.issue_date.strftime("%Y%m%d")}</wsfe:FchVtoPago>',
-                f'                        <wsfe:MonId>PES</wsfe:MonId>',
-                f'                        <wsfe:MonCotiz>1</wsfe:MonCotiz>',
-            ]
-            
-            # Agregar IVA (AlicIva) correctamente
-            if invoice.vat_amount > 0 and invoice.net_amount > 0:
-                iva_id = self._infer_afip_vat_id(invoice.net_amount, invoice.vat_amount)
-                xml_parts.extend([
-                    '                        <wsfe:Iva>',
-                    '                            <wsfe:AlicIva>',
-                    f'                                <wsfe:Id>{iva_id}</wsfe:Id>',
-                    f'                                <wsfe:BaseImp>{self._format_amount(invoice.net_amount)}</wsfe:BaseImp>',
-                    f'                                <wsfe:Importe>{self._format_amount(invoice.vat_amount)}</wsfe:Importe>',
-                    '                            </wsfe:AlicIva>',
-                    '                        </wsfe:Iva>'
-                ])
-            
-            # Agregar Opcionales (RG 5616 - Condición IVA del receptor)
-            # Determinar dinámicamente el Id del opcional para "Condición IVA del receptor" (RG 5616)
-            try:
-                cond_optional_id = self._get_condicion_iva_optional_id(token, sign)
-            except Exception:
-                cond_optional_id = None
-            if cond_optional_id:
-                xml_parts.extend([
-                    '                        <wsfe:Opcionales>',
-                    '                            <wsfe:Opcional>',
-                    f'                                <wsfe:Id>{cond_optional_id}</wsfe:Id>',
-                    f'                                <wsfe:Valor>{cond_value}</wsfe:Valor>',
-                    '                            </wsfe:Opcional>',
-                    '                        </wsfe:Opcionales>',
-                ])
-            else:
-                logger.warning("No se halló Id de opcional para 'Condición IVA del receptor' en FEParamGetTiposOpcional; no se enviará 2101 por no corresponder")
-            
-            # Cerrar XML
+        xml_parts = [
+            '                    <wsfe:FECAEDetRequest>',
+            f'                        <wsfe:Concepto>{concept_code}</wsfe:Concepto>',
+            f'                        <wsfe:DocTipo>{doc_type_code}</wsfe:DocTipo>',
+            f'                        <wsfe:DocNro>{doc_nro}</wsfe:DocNro>',
+            f'                        <wsfe:CbteDesde>{number}</wsfe:CbteDesde>',
+            f'                        <wsfe:CbteHasta>{number}</wsfe:CbteHasta>',
+            f'                        <wsfe:CbteFch>{invoice.issue_date.strftime("%Y%m%d")}</wsfe:CbteFch>',
+            f'                        <wsfe:ImpTotConc>{self._format_amount(Decimal("0.00"))}</wsfe:ImpTotConc>',
+            f'                        <wsfe:ImpNeto>{self._format_amount(invoice.net_amount)}</wsfe:ImpNeto>',
+            f'                        <wsfe:ImpOpEx>{self._format_amount(0)}</wsfe:ImpOpEx>',
+            f'                        <wsfe:ImpIVA>{self._format_amount(invoice.vat_amount)}</wsfe:ImpIVA>',
+            f'                        <wsfe:ImpTrib>{self._format_amount(0)}</wsfe:ImpTrib>',
+            f'                        <wsfe:ImpTotal>{self._format_amount(invoice.total)}</wsfe:ImpTotal>',
+            f'                        <wsfe:FchServDesde>{invoice.issue_date.strftime("%Y%m%d")}</wsfe:FchServDesde>',
+            f'                        <wsfe:FchServHasta>{invoice.issue_date.strftime("%Y%m%d")}</wsfe:FchServHasta>',
+            f'                        <wsfe:FchVtoPago>{invoice.issue_date.strftime("%Y%m%d")}</wsfe:FchVtoPago>',
+            f'                        <wsfe:MonId>PES</wsfe:MonId>',
+            f'                        <wsfe:MonCotiz>1</wsfe:MonCotiz>',
+        ]
+        
+        # Agregar IVA (AlicIva) correctamente
+        if invoice.vat_amount > 0 and invoice.net_amount > 0:
+            iva_id = self._infer_afip_vat_id(invoice.net_amount, invoice.vat_amount)
             xml_parts.extend([
-                '                    </wsfe:FECAEDetRequest>',
-                '                </wsfe:FeDetReq>',
-                '            </wsfe:FeCAEReq>',
-                '        </wsfe:FECAESolicitar>',
-                '    </soap:Body>',
-                '</soap:Envelope>'
+                '                        <wsfe:Iva>',
+                '                            <wsfe:AlicIva>',
+                f'                                <wsfe:Id>{iva_id}</wsfe:Id>',
+                f'                                <wsfe:BaseImp>{self._format_amount(invoice.net_amount)}</wsfe:BaseImp>',
+                f'                                <wsfe:Importe>{self._format_amount(invoice.vat_amount)}</wsfe:Importe>',
+                '                            </wsfe:AlicIva>',
+                '                        </wsfe:Iva>'
             ])
-            
-            xml_content = '\n'.join(xml_parts)
-            logger.info(f"XML de factura {invoice.number} construido correctamente")
-            # Log seguro del XML con credenciales enmascaradas (para diagnóstico)
-            try:
-                masked_xml = self._mask_sensitive_xml(xml_content)
-                logger.info("WSFE XML (masked preview 800 chars): %s", masked_xml[:800])
-                logger.info("WSFE XML (masked tail 800 chars): %s", masked_xml[-800:])
-            except Exception:
-                pass
-            return xml_content
-            
-        except Exception as e:
-            logger.error(f"Error construyendo XML de factura {invoice.number}: {str(e)}")
-            raise
+        
+        # Agregar Opcionales (RG 5616 - Condición IVA del receptor)
+        # Determinar dinámicamente el Id del opcional para "Condición IVA del receptor" (RG 5616)
+        try:
+            cond_optional_id = self._get_condicion_iva_optional_id(token, sign)
+        except Exception:
+            cond_optional_id = None
+        if cond_optional_id:
+            xml_parts.extend([
+                '                        <wsfe:Opcionales>',
+                '                            <wsfe:Opcional>',
+                f'                                <wsfe:Id>{cond_optional_id}</wsfe:Id>',
+                f'                                <wsfe:Valor>{cond_value}</wsfe:Valor>',
+                '                            </wsfe:Opcional>',
+                '                        </wsfe:Opcionales>',
+            ])
+        else:
+            logger.warning("No se halló Id de opcional para 'Condición IVA del receptor' en FEParamGetTiposOpcional; no se enviará 2101 por no corresponder")
+        
+        xml_parts.append('                    </wsfe:FECAEDetRequest>')
+        return xml_parts
     
     def _get_document_type_code(self, document_type: str) -> int:
         """
@@ -406,7 +701,7 @@ class AfipInvoiceService:
     </wsfe:FEParamGetCondicionIvaReceptor>
   </soap:Body>
 </soap:Envelope>'''
-            session = requests.Session()
+            session = wsfe_session()
             resp = session.post(self.wsfev1_url, data=body, headers=headers, timeout=(10, 20))
             text = resp.text
             try:
@@ -423,6 +718,14 @@ class AfipInvoiceService:
         # Fallback: Consumidor Final
         return 'CF'
 
+    def _get_receptor_tax_condition_cached(self, token: str, sign: str, doc_tipo: int, doc_nro: str) -> str:
+        """Condición IVA del receptor memorizada por documento (un lote repite mucho Consumidor Final)"""
+        cache = self.__dict__.setdefault('_receptor_conditions', {})
+        key = (doc_tipo, doc_nro)
+        if key not in cache:
+            cache[key] = self._get_receptor_tax_condition(token, sign, doc_tipo, doc_nro)
+        return cache[key]
+
     def _log_available_optionals(self, token: str, sign: str) -> None:
         """
         Consulta FEParamGetTiposOpcional y loguea si el Id 2101 está habilitado.
@@ -445,7 +748,7 @@ class AfipInvoiceService:
     </wsfe:FEParamGetTiposOpcional>
   </soap:Body>
 </soap:Envelope>'''
-            session = requests.Session()
+            session = wsfe_session()
             resp = session.post(self.wsfev1_url, data=body, headers=headers, timeout=(10, 20))
             text = resp.text
             try:
@@ -476,7 +779,7 @@ class AfipInvoiceService:
         """Obtiene el Id del opcional correspondiente a 'Condición IVA del receptor' buscando por descripción."""
         # Reutilizar cache si existe
         found = getattr(self, '_available_optionals', None)
-        if not found:
+        if found is None:
             self._log_available_optionals(token, sign)
             found = getattr(self, '_available_optionals', None) or []
         # Buscar por keywords en la descripción
@@ -514,7 +817,7 @@ class AfipInvoiceService:
     </wsfe:FECompUltimoAutorizado>
   </soap:Body>
  </soap:Envelope>'''
-            session = requests.Session()
+            session = wsfe_session()
             resp = session.post(self.wsfev1_url, data=body, headers=headers, timeout=(10, 20))
             text = resp.text
             try:
@@ -530,6 +833,39 @@ class AfipInvoiceService:
             logger.error(f"Error consultando FECompUltimoAutorizado: {e}")
         return None
     
+    def _get_max_records_per_request(self, token: str, sign: str) -> int:
+        """
+        Tope de comprobantes por FECAESolicitar (FECompTotXRequest), acotado por AFIP_CAE_BATCH_SIZE.
+        """
+        limit = int(getattr(settings, 'AFIP_CAE_BATCH_SIZE', self.DEFAULT_MAX_RECORDS_PER_REQUEST))
+        try:
+            headers = {
+                'Content-Type': 'text/xml; charset=utf-8',
+                'SOAPAction': 'http://ar.gov.afip.dif.FEV1/FECompTotXRequest'
+            }
+            body = f'''<?xml version="1.0" encoding="UTF-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" xmlns:wsfe="http://ar.gov.afip.dif.FEV1/">
+  <soap:Header/>
+  <soap:Body>
+    <wsfe:FECompTotXRequest>
+      <wsfe:Auth>
+        <wsfe:Token>{token}</wsfe:Token>
+        <wsfe:Sign>{sign}</wsfe:Sign>
+        <wsfe:Cuit>{self.config.cuit}</wsfe:Cuit>
+      </wsfe:Auth>
+    </wsfe:FECompTotXRequest>
+  </soap:Body>
+</soap:Envelope>'''
+            session = wsfe_session()
+            resp = session.post(self.wsfev1_url, data=body, headers=headers, timeout=(10, 20))
+            root = ET.fromstring(resp.text)
+            reg_el = root.find(f'.//{WSFE_NS}RegXReq')
+            if reg_el is not None and reg_el.text and reg_el.text.strip().isdigit():
+                limit = min(limit, int(reg_el.text.strip()))
+        except Exception as e:
+            logger.error(f"Error consultando FECompTotXRequest: {e}")
+        return max(limit, 1)
+    
     def _format_amount(self, amount: Decimal) -> str:
         """
         Formatea un monto para AFIP
@@ -601,11 +937,8 @@ class AfipInvoiceService:
                 'SOAPAction': 'http://ar.gov.afip.dif.FEV1/FECAESolicitar'
             }
             
-            # Reintentos y timeouts controlados
-            session = requests.Session()
-            adapter = requests.adapters.HTTPAdapter(max_retries=2)
-            session.mount('http://', adapter)
-            session.mount('https://', adapter)
+            # Reintentos y timeouts controlados (sesión compartida con pool keep-alive)
+            session = wsfe_session()
             # Log de request saliente (XML enmascarado)
             try:
                 masked_xml = self._mask_sensitive_xml(xml_content)
@@ -750,6 +1083,49 @@ class AfipInvoiceService:
                 pass
             raise AfipInvoiceError(f"Error procesando respuesta de AFIP: {str(e)}")
     
+    def _parse_batch_response(self, response_xml: str) -> Tuple[Dict[int, Dict], List[str]]:
+        """
+        Interpreta la respuesta de un FECAESolicitar con varios comprobantes
+        
+        Returns:
+            Tuple: (resultado por número de comprobante, errores generales del request)
+        """
+        try:
+            root = ET.fromstring(response_xml)
+        except ET.ParseError:
+            import re
+            root = ET.fromstring(re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', response_xml).lstrip('\ufeff'))
+        
+        result_element = root.find(f'.//{WSFE_NS}FECAESolicitarResult')
+        if result_element is None:
+            fault = root.find('.//{http://schemas.xmlsoap.org/soap/envelope/}Fault')
+            if fault is not None:
+                raise AfipInvoiceError(f"SOAP Fault de AFIP: {fault.findtext('.//faultstring') or 'Fault desconocido'}")
+            raise AfipInvoiceError("Respuesta de AFIP no contiene FECAESolicitarResult")
+        
+        errors = []
+        errors_element = result_element.find(f'{WSFE_NS}Errors')
+        if errors_element is not None:
+            for err in errors_element.findall(f'{WSFE_NS}Err'):
+                errors.append(f"{err.findtext(f'{WSFE_NS}Code') or ''}: {err.findtext(f'{WSFE_NS}Msg') or ''}".strip(': '))
+        
+        items: Dict[int, Dict] = {}
+        for det in result_element.findall(f'.//{WSFE_NS}FECAEDetResponse'):
+            number = (det.findtext(f'{WSFE_NS}CbteDesde') or '').strip()
+            if not number.isdigit():
+                continue
+            observations = [
+                f"Obs {obs.findtext(f'{WSFE_NS}Code') or ''}: {obs.findtext(f'{WSFE_NS}Msg') or ''}".strip(': ')
+                for obs in det.findall(f'.//{WSFE_NS}Obs')
+            ]
+            items[int(number)] = {
+                'result': det.findtext(f'{WSFE_NS}Resultado'),
+                'cae': (det.findtext(f'{WSFE_NS}CAE') or '').strip(),
+                'cae_expiration': (det.findtext(f'{WSFE_NS}CAEFchVto') or '').strip(),
+                'errors': observations,
+            }
+        return items, errors
+    
     def _extract_result_data(self, result_element) -> Dict:
         """
         Extrae los datos del resultado de AFIP
@@ -804,13 +1180,14 @@ class AfipInvoiceService:
         
         return data
     
-    def _update_invoice_with_afip_data(self, invoice, cae_data: Dict):
+    def _update_invoice_with_afip_data(self, invoice, cae_data: Dict, update_config: bool = True):
         """
         Actualiza la factura con los datos de AFIP
         
         Args:
             invoice: Instancia de Invoice
             cae_data: Datos del CAE de AFIP
+            update_config: Actualizar el último número en AfipConfig (el lote lo hace una vez por grupo)
         """
         try:
             # Actualizar CAE
@@ -836,12 +1213,10 @@ class AfipInvoiceService:
             invoice.save()
             
             # Actualizar último número de factura en configuración
-            if cae_data.get('invoice_number'):
+            if update_config and cae_data.get('invoice_number'):
                 try:
-                    invoice_number = int(cae_data['invoice_number'])
-                    if invoice_number > self.config.last_invoice_number:
-                        self.config.last_invoice_number = invoice_number
-                        self.config.save()
+                    # UPDATE condicional: no pisa token/sign ni hace retroceder la serie con un config viejo
+                    self.config.update_invoice_number(int(cae_data['invoice_number']))
                 except (ValueError, TypeError):
                     pass
             
@@ -6,6 +6,7 @@ Facilita el uso de todos los servicios de AFIP desde un solo punto
 import logging
 from typing import Dict, Optional
 from django.conf import settings
+from django.db import transaction
 from .afip_auth_service import AfipAuthService, AfipAuthError
 from .afip_zeep_auth_service import AfipZeepAuthService, AfipZeepAuthError
 from .afip_invoice_service import AfipInvoiceService, AfipInvoiceError
@@ -83,6 +84,28 @@ class AfipService:
             logger.error(f"Error enviando factura {invoice.number}: {str(e)}")
             raise
     
+    def send_invoices_batch(self, invoices) -> Dict[str, Dict]:
+        """
+        Envía varias facturas a AFIP en requests por lotes (ver AfipInvoiceService.send_invoices_batch)
+        
+        Args:
+            invoices: Facturas a autorizar
+            
+        Returns:
+            Dict[str, Dict]: Resultado por id de factura
+        """
+        if self.use_mock and not self.is_production:
+            # El mock no implementa CantReg > 1: una llamada por factura
+            results = {}
+            for invoice in invoices:
+                try:
+                    results[str(invoice.id)] = self.invoice_service.send_invoice(invoice)
+                except Exception as e:
+                    results[str(invoice.id)] = {'success': False, 'error': str(e)}
+            return results
+        logger.info(f"Enviando lote de {len(invoices)} facturas a AFIP ({self.config.environment})")
+        return self.invoice_service.send_invoices_batch(invoices)
+    
     def test_connection(self) -> Dict:
         """
         Prueba la conexión con AFIP
@@ -266,4 +289,37 @@ class AfipServiceError(Exception):
     """
     Excepción personalizada para errores del servicio AFIP
     """
-    pass
\ No newline at end of file
+    pass
+
+
+def send_invoice_and_record(config, invoice) -> Dict:
+    """
+    Envía la factura a AFIP y deja el resultado en ella (aprobada con CAE o con error)
+    
+    Args:
+        config: Instancia de AfipConfig
+        invoice: Factura o nota de crédito a enviar
+        
+    Returns:
+        Dict: Resultado de AfipService.send_invoice
+    """
+    try:
+        result = AfipService(config).send_invoice(invoice)
+    except Exception as e:
+        result = {'success': False, 'error': str(e)}
+    
+    if result['success']:
+        invoice.mark_as_approved(result['cae'], result['cae_expiration'])
+        logger.info(f"Comprobante {invoice.number} enviado a AFIP")
+    else:
+        invoice.mark_as_error(result['error'])
+        logger.error(f"Error enviando comprobante {invoice.number} a AFIP: {result['error']}")
+    return result
+
+
+def send_invoice_on_commit(config, invoice):
+    """
+    Programa el envío a AFIP para después del commit de la transacción que creó la factura,
+    así el lock de la serie tomado por AfipConfig.allocate_invoice_number no espera a AFIP
+    """
+    transaction.on_commit(lambda: send_invoice_and_record(config, invoice))
@@ -0,0 +1,355 @@
+"""
+Ticket de acceso (TA) de WSAA compartido entre procesos.
+
+Antes, cuando el TA vencía, el worker que tomaba el lock lo pedía a WSAA y el resto
+esperaba haciendo `sleep` sobre cache/BD (hasta 90s): la emisión de facturas se frenaba
+en cada recambio del ticket. AfipTicketCache:
+
+- guarda el TA en una única entrada de cache (token, sign y vencimiento) y en AfipConfig
+- sirve el TA vigente sin bloquear; dentro de AFIP_TA_RENEW_BEFORE_SECONDS del vencimiento
+  encola una única renovación en segundo plano (single-flight) y sigue sirviendo el TA actual
+- si no hay TA vigente, un solo worker lo pide a WSAA y el resto espera una notificación
+  (pub/sub de Redis si la cache es Redis, Condition del proceso si no) en lugar de sondear
+
+Uso:
+    tickets = AfipTicketCache(config)
+    token, sign = tickets.get(generate)   # generate() -> (token, sign, generación, vencimiento)
+    tickets.renew(generate)               # desde la tarea de renovación
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TicketGenerator = Callable[[], Tuple[str, str, Optional[datetime], Optional[datetime]]]
+
+# WSAA emite TA de 12 horas; la cache nunca lo guarda más que eso
+MAX_TICKET_SECONDS = 12 * 60 * 60
+
+
+class TicketStillValid(Exception):
+    """WSAA rechazó el login (coe.alreadyAuthenticated): el TA emitido antes sigue vigente."""
+
+
+def is_already_authenticated(message: str) -> bool:
+    return any(text in (message or '') for text in ('alreadyAuthenticated', 'TA valido', 'TA válido'))
+
+
+@dataclass
+class AfipTicket:
+    token: str
+    sign: str
+    generation: Optional[datetime]
+    expiration: datetime
+
+    def remaining_seconds(self) -> float:
+        return (self.expiration - timezone.now()).total_seconds()
+
+    def as_cache(self) -> Dict:
+        return {
+            'token': self.token,
+            'sign': self.sign,
+            'generation': self.generation.isoformat() if self.generation else None,
+            'expiration': self.expiration.isoformat(),
+        }
+
+    @classmethod
+    def from_cache(cls, data: Dict) -> 'AfipTicket':
+        generation = data.get('generation')
+        return cls(
+            token=data['token'],
+            sign=data['sign'],
+            generation=datetime.fromisoformat(generation) if generation else None,
+            expiration=datetime.fromisoformat(data['expiration']),
+        )
+
+
+class _LocalWaiter:
+    def __init__(self, notifier: 'TicketNotifier', channel: str):
+        self._notifier = notifier
+        self._channel = channel
+        with notifier._cond:
+            self._version = notifier._versions[channel]
+
+    def wait(self, timeout: float) -> bool:
+        cond, versions = self._notifier._cond, self._notifier._versions
+        with cond:
+            notified = cond.wait_for(lambda: versions[self._channel] != self._version, timeout)
+            self._version = versions[self._channel]
+        return notified
+
+    def close(self):
+        pass
+
+
+class _RedisWaiter:
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining):
+                return True
+
+    def close(self):
+        try:
+            self._pubsub.close()
+        except Exception:
+            pass
+
+
+class TicketNotifier:
+    """Aviso de 'TA nuevo disponible' para los workers que esperan."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._versions: Dict[str, int] = defaultdict(int)
+
+    def _redis(self):
+        # Solo si la cache es django-redis: el TA vive ahí y los waiters están en otros procesos
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection('default')
+        except Exception:
+            return None
+
+    def subscribe(self, channel: str):
+        """
+        Suscribe antes de volver a mirar la cache, así no se pierde un aviso publicado
+        entre la lectura y la espera.
+        """
+        client = self._redis()
+        if client is not None:
+            try:
+                pubsub = client.pubsub()
+                pubsub.subscribe(channel)
+                return _RedisWaiter(pubsub)
+            except Exception as e:
+                logger.warning(f"No se pudo suscribir a {channel} en Redis ({e}); espera local")
+        return _LocalWaiter(self, channel)
+
+    def publish(self, channel: str) -> None:
+        with self._cond:
+            self._versions[channel] += 1
+            self._cond.notify_all()
+        client = self._redis()
+        if client is not None:
+            try:
+                client.publish(channel, '1')
+            except Exception as e:
+                logger.warning(f"No se pudo publicar aviso de TA en {channel}: {e}")
+
+
+notifier = TicketNotifier()
+
+
+class AfipTicketCache:
+    """TA de un AfipConfig: lectura sin bloqueo, generación single-flight y renovación anticipada."""
+
+    # Por debajo de este margen el TA ya no se sirve (latencia hasta WSFEv1)
+    EXPIRY_MARGIN_SECONDS = 60
+    # Vida del lock de generación y de la marca de renovación encolada
+    LOCK_SECONDS = 120
+
+    def __init__(self, config, activate_config: bool = False):
+        self.config = config
+        self.activate_config = activate_config
+        suffix = f"{config.hotel.id}_{config.environment}"
+        self.ticket_key = f"afip_ta_{suffix}"
+        # Claves históricas (las lee el comando clear_afip_token)
+        self.token_key = f"afip_token_{suffix}"
+        self.sign_key = f"afip_sign_{suffix}"
+        self.lock_key = f"afip_wsaa_lock_{suffix}"
+        self.renew_key = f"afip_wsaa_renew_{suffix}"
+        # Hasta el vencimiento del TA actual: WSAA no emite otro, no volver a pedirlo
+        self.still_valid_key = f"afip_wsaa_still_valid_{suffix}"
+        self.channel = f"afip:wsaa:ta:{suffix}"
+
+    @property
+    def renew_before_seconds(self) -> int:
+        return int(getattr(settings, 'AFIP_TA_RENEW_BEFORE_SECONDS', 900))
+
+    @property
+    def wait_timeout_seconds(self) -> int:
+        return int(getattr(settings, 'AFIP_TA_WAIT_TIMEOUT_SECONDS', 90))
+
+    # ---- lectura ----
+    def _usable(self, ticket: Optional[AfipTicket]) -> bool:
+        return ticket is not None and ticket.remaining_seconds() > self.EXPIRY_MARGIN_SECONDS
+
+    def _wsaa_refuses(self, ticket: Optional[AfipTicket]) -> bool:
+        """WSAA ya respondió alreadyAuthenticated para este TA: se sirve hasta su vencimiento."""
+        return ticket is not None and ticket.remaining_seconds() > 0 and bool(cache.get(self.still_valid_key))
+
+    def _servable(self, ticket: Optional[AfipTicket]) -> bool:
+        return self._usable(ticket) or self._wsaa_refuses(ticket)
+
+    def load(self) -> Optional[AfipTicket]:
+        """TA desde la cache o, si no está, desde la BD (re-leída: otro proceso pudo persistirlo)."""
+        data = cache.get(self.ticket_key)
+        if data:
+            try:
+                return AfipTicket.from_cache(data)
+            except (KeyError, TypeError, ValueError):
+                cache.delete(self.ticket_key)
+
+        if self.config.pk:
+            try:
+                row = type(self.config).objects.filter(pk=self.config.pk).values(
+                    'afip_token', 'afip_sign', 'afip_token_generation', 'afip_token_expiration',
+                ).first()
+            except Exception as e:
+                logger.warning(f"No se pudo reutilizar TA desde BD: {e}")
+                row = None
+            if row:
+                for field, value in row.items():
+                    setattr(self.config, field, value)
+        token = getattr(self.config, 'afip_token', None)
+        sign = getattr(self.config, 'afip_sign', None)
+        expiration = getattr(self.config, 'afip_token_expiration', None)
+        if not (token and sign and expiration):
+            return None
+        ticket = AfipTicket(token, sign, getattr(self.config, 'afip_token_generation', None), expiration)
+        if self._usable(ticket):
+            self._cache(ticket)
+        return ticket
+
+    def _cache(self, ticket: AfipTicket) -> None:
+        ttl = int(min(MAX_TICKET_SECONDS, ticket.remaining_seconds()))
+        if ttl <= 0:
+            return
+        cache.set(self.ticket_key, ticket.as_cache(), ttl)
+        cache.set(self.token_key, ticket.token, ttl)
+        cache.set(self.sign_key, ticket.sign, ttl)
+
+    def clear(self) -> None:
+        cache.delete_many([self.ticket_key, self.token_key, self.sign_key, self.still_valid_key])
+
+    # ---- acceso ----
+    def get(self, generate: TicketGenerator) -> Tuple[str, str]:
+        ticket = self.load()
+        if self._usable(ticket) or self._wsaa_refuses(ticket):
+            if ticket.remaining_seconds() < self.renew_before_seconds and not self._wsaa_refuses(ticket):
+                self.schedule_renewal()
+            return ticket.token, ticket.sign
+
+        deadline = time.monotonic() + self.wait_timeout_seconds
+        while True:
+            if cache.add(self.lock_key, True, timeout=self.LOCK_SECONDS):
+                ticket, _ = self._generate(generate, locked=True)
+                return ticket.token, ticket.sign
+            logger.info(f"Otro worker está pidiendo el TA del hotel {self.config.hotel.id}; esperando aviso")
+            ticket = self._wait(deadline)
+            if ticket is not None:
+                return ticket.token, ticket.sign
+            if time.monotonic() >= deadline:
+                # El generador no avisó a tiempo (proceso caído con el lock tomado)
+                logger.info("TA no apareció; intentando generar uno nuevo nosotros")
+                ticket, _ = self._generate(generate, locked=False)
+                return ticket.token, ticket.sign
+
+    def _wait(self, deadline: float) -> Optional[AfipTicket]:
+        """Espera el aviso del generador; None si terminó sin TA (hay que reintentar el lock)."""
+        waiter = notifier.subscribe(self.channel)
+        try:
+            while True:
+                ticket = self.load()
+                if self._servable(ticket):
+                    return ticket
+                if cache.get(self.lock_key) is None:
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                waiter.wait(remaining)
+        finally:
+            waiter.close()
+
+    # ---- generación ----
+    def _generate(self, generate: TicketGenerator, locked: bool) -> Tuple[AfipTicket, bool]:
+        """Pide el TA a WSAA; devuelve (ticket, True si es nuevo)."""
+        try:
+            try:
+                token, sign, gen_dt, exp_dt = generate()
+            except TicketStillValid:
+                return self._keep_current(), False
+            now = timezone.now()
+            ticket = AfipTicket(token, sign, gen_dt or now, exp_dt or (now + timedelta(hours=12)))
+            self._cache(ticket)
+            self._persist(ticket)
+            logger.info(f"Token AFIP generado exitosamente para hotel {self.config.hotel.id}")
+            return ticket, True
+        finally:
+            if locked:
+                cache.delete(self.lock_key)
+            # También ante error: los que esperan dejan de hacerlo y reintentan el lock
+            notifier.publish(self.channel)
+
+    def _keep_current(self) -> AfipTicket:
+        """
+        WSAA no emite un TA nuevo mientras el anterior siga vigente: se sigue sirviendo el actual
+        y no se vuelve a intentar el login hasta que venza.
+        """
+        ticket = self.load()
+        if ticket is None or ticket.remaining_seconds() <= 0:
+            raise TicketStillValid("WSAA indicó TA válido, pero no hay TA local disponible para reutilizar")
+        cache.set(self.still_valid_key, True, max(1, int(ticket.remaining_seconds())))
+        self._cache(ticket)
+        logger.info(f"WSAA indica TA vigente para hotel {self.config.hotel.id}; se reutiliza hasta su vencimiento")
+        return ticket
+
+    def _persist(self, ticket: AfipTicket) -> None:
+        try:
+            self.config.afip_token = ticket.token
+            self.config.afip_sign = ticket.sign
+            self.config.afip_token_generation = ticket.generation
+            self.config.afip_token_expiration = ticket.expiration
+            update_fields = ['afip_token', 'afip_sign', 'afip_token_generation', 'afip_token_expiration']
+            if self.activate_config and hasattr(self.config, 'is_active'):
+                self.config.is_active = True
+                update_fields.append('is_active')
+            self.config.save(update_fields=update_fields)
+        except Exception as e:
+            logger.warning(f"No se pudo persistir TA en BD: {e}")
+
+    # ---- renovación anticipada ----
+    def schedule_renewal(self) -> bool:
+        """Encola una única renovación por hotel/ambiente; la marca vence con LOCK_SECONDS."""
+        if not cache.add(self.renew_key, True, timeout=self.LOCK_SECONDS):
+            return False
+        try:
+            from ..tasks import renew_afip_ticket_task
+            renew_afip_ticket_task.delay(self.config.id)
+            logger.info(f"Renovación de TA encolada para hotel {self.config.hotel.id}")
+            return True
+        except Exception as e:
+            cache.delete(self.renew_key)
+            logger.warning(f"No se pudo encolar la renovación del TA: {e}")
+            return False
+
+    def renew(self, generate: TicketGenerator) -> bool:
+        """Renueva el TA si está por vencer; mientras tanto el resto sigue usando el actual."""
+        if not cache.add(self.lock_key, True, timeout=self.LOCK_SECONDS):
+            return False
+        ticket = self.load()
+        fresh = self._usable(ticket) and ticket.remaining_seconds() >= self.renew_before_seconds
+        if fresh or self._wsaa_refuses(ticket):
+            cache.delete(self.lock_key)
+            return False
+        _, renewed = self._generate(generate, locked=True)
+        return renewed
@@ -9,9 +9,6 @@ import logging
 from datetime import datetime, timedelta, timezone as dt_timezone
 from typing import Optional, Tuple
 
-from django.core.cache import cache
-from django.utils import timezone as dj_tz
-
 from cryptography import x509
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.serialization import pkcs7
@@ -19,6 +16,8 @@ from cryptography.hazmat.primitives.serialization import pkcs7
 import requests
 import xml.etree.ElementTree as ET
 
+from .afip_ticket_cache import AfipTicketCache, TicketStillValid, is_already_authenticated
+
 
 logger = logging.getLogger(__name__)
 
@@ -32,84 +31,33 @@ class AfipZeepAuthService:
         self.config = config
         self.is_production = config.environment == 'production'
         self.wsaa_wsdl = self.WSAA_WSDL_PROD if self.is_production else self.WSAA_WSDL_HOMO
-        self.token_cache_key = f"afip_token_{config.hotel.id}_{config.environment}"
-        self.sign_cache_key = f"afip_sign_{config.hotel.id}_{config.environment}"
+        # Mismo TA compartido que AfipAuthService (cache + BD, renovación en segundo plano)
+        self.tickets = AfipTicketCache(config, activate_config=True)
+        self.token_cache_key = self.tickets.token_key
+        self.sign_cache_key = self.tickets.sign_key
 
     def get_token_and_sign(self) -> Tuple[str, str]:
-        # Cache
-        cached_token = cache.get(self.token_cache_key)
-        cached_sign = cache.get(self.sign_cache_key)
-        if cached_token and cached_sign:
-            return cached_token, cached_sign
+        return self.tickets.get(self._generate_new_token)
 
-        # Persistencia si no venció
-        if getattr(self.config, 'afip_token', None) and getattr(self.config, 'afip_sign', None):
-            exp = getattr(self.config, 'afip_token_expiration', None)
-            if exp and exp > dj_tz.now():
-                ttl = max(60, min(11 * 60 * 60, int((exp - dj_tz.now()).total_seconds())))
-                cache.set(self.token_cache_key, self.config.afip_token, ttl)
-                cache.set(self.sign_cache_key, self.config.afip_sign, ttl)
-                return self.config.afip_token, self.config.afip_sign
+    def renew_ticket(self) -> bool:
+        return self.tickets.renew(self._generate_new_token)
 
-        # Lock sencillo para evitar tormenta de logins
-        lock_key = f"afip_wsaa_lock_{self.config.hotel.id}_{self.config.environment}"
-        got_lock = cache.add(lock_key, True, timeout=120)
+    def _generate_new_token(self) -> Tuple[str, str, Optional[datetime], Optional[datetime]]:
         try:
-            if not got_lock:
-                # Espera breve por si otro proceso persiste el TA
-                token_sign = self._wait_for_existing_ta(timeout_seconds=90, interval_seconds=5)
-                if token_sign is not None:
-                    return token_sign
-
-            try:
-                token, sign, gen_dt, exp_dt = self._request_ta_with_zeep()
-            except Exception as e:
-                # Fallback robusto: usar cliente por requests del servicio existente
-                logger.warning(f"Fallo WSAA Zeep ({e}); intentando fallback por requests")
-                try:
-                    from .afip_auth_service import AfipAuthService  # import local para evitar ciclos
-                    token, sign = AfipAuthService(self.config).get_token_and_sign()
-                    gen_dt = dj_tz.now()
-                    exp_dt = gen_dt + timedelta(hours=12)
-                except Exception as e2:
-                    raise AfipZeepAuthError(f"Fallback por requests también falló: {e2}")
-
-            # Cache y persistencia
-            now = dj_tz.now()
-            cache_timeout = int(min(11 * 60 * 60, max(60, (exp_dt - now).total_seconds()))) if exp_dt and exp_dt > now else 11 * 60 * 60
-            cache.set(self.token_cache_key, token, cache_timeout)
-            cache.set(self.sign_cache_key, sign, cache_timeout)
-
+            return self._request_ta_with_zeep()
+        except Exception as e:
+            if is_already_authenticated(str(e)):
+                # Mismo CEE/servicio: el fallback por requests recibiría la misma respuesta
+                raise TicketStillValid(str(e))
+            # Fallback robusto: pedir el TA por requests (ya dentro del lock de AfipTicketCache)
+            logger.warning(f"Fallo WSAA Zeep ({e}); intentando fallback por requests")
             try:
-                self.config.afip_token = token
-                self.config.afip_sign = sign
-                self.config.afip_token_generation = gen_dt or now
-                self.config.afip_token_expiration = exp_dt or (now + timedelta(hours=12))
-                if hasattr(self.config, 'is_active'):
-                    self.config.is_active = True
-                self.config.save(update_fields=['afip_token','afip_sign','afip_token_generation','afip_token_expiration','is_active'])
-            except Exception as e:
-                logger.warning(f"No se pudo persistir TA en BD: {e}")
-
-            return token, sign
-        finally:
-            if got_lock:
-                cache.delete(lock_key)
-
-    def _wait_for_existing_ta(self, timeout_seconds: int, interval_seconds: int) -> Optional[Tuple[str, str]]:
-        from time import sleep
-        deadline = dj_tz.now() + timedelta(seconds=timeout_seconds)
-        while dj_tz.now() < deadline:
-            cached_token = cache.get(self.token_cache_key)
-            cached_sign = cache.get(self.sign_cache_key)
-            if cached_token and cached_sign:
-                return cached_token, cached_sign
-            if getattr(self.config, 'afip_token', None) and getattr(self.config, 'afip_sign', None):
-                exp = getattr(self.config, 'afip_token_expiration', None)
-                if not exp or exp > dj_tz.now():
-                    return self.config.afip_token, self.config.afip_sign
-            sleep(interval_seconds)
-        return None
+                from .afip_auth_service import AfipAuthService  # import local para evitar ciclos
+                return AfipAuthService(self.config)._generate_new_token()
+            except TicketStillValid:
+                raise
+            except Exception as e2:
+                raise AfipZeepAuthError(f"Fallback por requests también falló: {e2}")
 
     def _request_ta_with_zeep(self) -> Tuple[str, str, Optional[datetime], Optional[datetime]]:
         # Import diferido: evita romper el arranque del proyecto si `zeep`
@@ -9,7 +9,7 @@ from django.utils import timezone
 from decimal import Decimal
 
 from .models import Invoice, InvoiceItem
-from .services import AfipService, InvoiceGeneratorService
+from .services import InvoiceGeneratorService, send_invoice_on_commit
 
 logger = logging.getLogger(__name__)
 
@@ -44,7 +44,7 @@ def generate_invoice_on_payment_approved(sender, instance, created, **kwargs):
             # Generar factura automáticamente
             with transaction.atomic():
                 # Generar número de factura
-                next_number = afip_config.get_next_invoice_number()
+                next_number = afip_config.allocate_invoice_number()
                 formatted_number = afip_config.format_invoice_number(next_number)
                 
                 # Determinar tipo de factura (por defecto Factura B)
@@ -98,26 +98,10 @@ def generate_invoice_on_payment_approved(sender, instance, created, **kwargs):
                 }
                 InvoiceItem.objects.create(**item_data)
                 
-                # Actualizar número en configuración
-                afip_config.update_invoice_number(next_number)
-                
                 logger.info(f"Factura {invoice.number} generada automáticamente para el pago {instance.id}")
                 
-                # Intentar enviar a AFIP automáticamente si está configurado
-                try:
-                    afip_service = AfipService(afip_config)
-                    result = afip_service.send_invoice(invoice)
-                    
-                    if result['success']:
-                        invoice.mark_as_approved(result['cae'], result['cae_expiration'])
-                        logger.info(f"Factura {invoice.number} enviada automáticamente a AFIP")
-                    else:
-                        invoice.mark_as_error(result['error'])
-                        logger.error(f"Error enviando factura {invoice.number} a AFIP: {result['error']}")
-                        
-                except Exception as e:
-                    logger.error(f"Error enviando factura {invoice.number} a AFIP: {str(e)}")
-                    invoice.mark_as_error(str(e))
+                # Enviar a AFIP después del commit, sin retener el lock de la serie durante la llamada
+                send_invoice_on_commit(afip_config, invoice)
                 
         except Exception as e:
             logger.error(f"Error generando factura automática para pago {instance.id}: {str(e)}")
@@ -163,7 +147,7 @@ def generate_credit_note_on_refund(sender, instance, created, **kwargs):
             # Generar nota de crédito automáticamente
             with transaction.atomic():
                 # Generar número de nota de crédito
-                next_number = afip_config.get_next_invoice_number()
+                next_number = afip_config.allocate_invoice_number()
                 formatted_number = afip_config.format_invoice_number(next_number)
                 
                 # Crear nota de crédito
@@ -203,26 +187,10 @@ def generate_credit_note_on_refund(sender, instance, created, **kwargs):
                 }
                 InvoiceItem.objects.create(**item_data)
                 
-                # Actualizar número en configuración
-                afip_config.update_invoice_number(next_number)
-                
                 logger.info(f"Nota de crédito {credit_note.number} generada automáticamente para el reembolso {instance.id}")
                 
-                # Intentar enviar a AFIP automáticamente si está configurado
-                try:
-                    afip_service = AfipService(afip_config)
-                    result = afip_service.send_invoice(credit_note)
-                    
-                    if result['success']:
-                        credit_note.mark_as_approved(result['cae'], result['cae_expiration'])
-                        logger.info(f"Nota de crédito {credit_note.number} enviada automáticamente a AFIP")
-                    else:
-                        credit_note.mark_as_error(result['error'])
-                        logger.error(f"Error enviando nota de crédito {credit_note.number} a AFIP: {result['error']}")
-                        
-                except Exception as e:
-                    logger.error(f"Error enviando nota de crédito {credit_note.number} a AFIP: {str(e)}")
-                    credit_note.mark_as_error(str(e))
+                # Enviar a AFIP después del commit, sin retener el lock de la serie durante la llamada
+                send_invoice_on_commit(afip_config, credit_note)
                 
         except Exception as e:
             logger.error(f"Error generando nota de crédito automática para reembolso {instance.id}: {str(e)}")
\ No newline at end of file
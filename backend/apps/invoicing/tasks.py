@@ -2,8 +2,9 @@
 Tareas de Celery para el módulo de facturación
 """
 from celery import shared_task
+from django.db import transaction
 from django.utils import timezone
-from datetime import datetime, timedelta
+from datetime import timedelta
 import logging
 from .services import AfipService, InvoiceGeneratorService
 from .models import AfipConfig
@@ -21,7 +22,6 @@ def send_invoice_to_afip_task(self, invoice_id):
     """
     try:
         from .models import Invoice
-        from .services.afip_service import AfipService
         
         # Obtener la factura
         try:
@@ -76,6 +76,131 @@ def send_invoice_to_afip_task(self, invoice_id):
         return {'success': False, 'error': str(e)}
 
 
+def _claim_invoices(hotel_id, invoice_ids):
+    """
+    Pasa a 'sent' las facturas todavía enviables (draft o error con reintentos) y las devuelve
+    ordenadas por creación. El lock evita que dos workers envíen la misma factura.
+    """
+    from .models import Invoice, InvoiceStatus
+    
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Invoice.objects.select_for_update()
+            .filter(
+                hotel_id=hotel_id,
+                id__in=invoice_ids,
+                status__in=[InvoiceStatus.DRAFT, InvoiceStatus.ERROR],
+                retry_count__lt=3,
+            )
+            .values_list('id', flat=True)
+        )
+        Invoice.objects.filter(id__in=ids).update(status=InvoiceStatus.SENT, sent_to_afip_at=now, updated_at=now)
+    return list(Invoice.objects.filter(id__in=ids).order_by('created_at'))
+
+
+@shared_task
+def send_invoices_batch_task(hotel_id, invoice_ids):
+    """
+    Autoriza un conjunto de facturas de un hotel con requests FECAESolicitar por lotes
+    
+    Args:
+        hotel_id: ID del hotel
+        invoice_ids: IDs de las facturas a enviar
+    """
+    try:
+        try:
+            afip_config = AfipConfig.objects.select_related('hotel').get(hotel_id=hotel_id, is_active=True)
+        except AfipConfig.DoesNotExist:
+            logger.error(f"Hotel {hotel_id} no tiene configuración AFIP activa")
+            return {'success': False, 'error': 'Hotel sin configuración AFIP'}
+        
+        invoices = _claim_invoices(hotel_id, invoice_ids)
+        if not invoices:
+            return {'success': True, 'approved_count': 0, 'error_count': 0}
+        
+        try:
+            results = AfipService(afip_config).send_invoices_batch(invoices)
+        except Exception as e:
+            results = {str(invoice.id): {'success': False, 'error': str(e)} for invoice in invoices}
+        
+        approved_count = 0
+        for invoice in invoices:
+            result = results.get(str(invoice.id)) or {'success': False, 'error': 'Sin respuesta de AFIP'}
+            if result['success']:
+                if result.get('persisted') is False:
+                    logger.warning(f"Guardando CAE {result['cae']} de la factura {invoice.id} desde la tarea de lote")
+                invoice.mark_as_approved(result['cae'], result['cae_expiration'])
+                approved_count += 1
+            else:
+                invoice.mark_as_error(result['error'])
+        
+        logger.info(
+            f"Lote de facturas del hotel {hotel_id}: {approved_count} aprobadas, "
+            f"{len(invoices) - approved_count} con error"
+        )
+        return {
+            'success': True,
+            'approved_count': approved_count,
+            'error_count': len(invoices) - approved_count,
+        }
+        
+    except Exception as e:
+        logger.error(f"Error en envío por lotes de facturas del hotel {hotel_id}: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+def _dispatch_batches(invoices_query):
+    """Programa un send_invoices_batch_task por hotel con sus facturas; devuelve (facturas, lotes)"""
+    by_hotel = {}
+    for hotel_id, invoice_id in invoices_query.order_by('created_at').values_list('hotel_id', 'id'):
+        by_hotel.setdefault(hotel_id, []).append(str(invoice_id))
+    
+    invoice_count = 0
+    for hotel_id, invoice_ids in by_hotel.items():
+        try:
+            send_invoices_batch_task.delay(hotel_id, invoice_ids)
+            invoice_count += len(invoice_ids)
+        except Exception as e:
+            logger.error(f"Error programando lote de facturas para hotel {hotel_id}: {e}")
+    return invoice_count, len(by_hotel)
+
+
+@shared_task
+def send_pending_invoices_task(hotel_id=None):
+    """
+    Facturación de fin de día: envía a AFIP las facturas en borrador, un lote por hotel
+    Se ejecuta diariamente
+    
+    Args:
+        hotel_id: ID del hotel (opcional, si no se especifica procesa todos)
+    """
+    try:
+        from .models import Invoice
+        
+        pending_invoices = Invoice.objects.filter(
+            status='draft',
+            retry_count__lt=3,
+            issue_date__lte=timezone.now().date(),
+            hotel__afip_config__is_active=True,
+        )
+        if hotel_id:
+            pending_invoices = pending_invoices.filter(hotel_id=hotel_id)
+        
+        invoice_count, batch_count = _dispatch_batches(pending_invoices)
+        
+        logger.info(f"Programados {batch_count} lotes con {invoice_count} facturas pendientes")
+        return {
+            'success': True,
+            'invoice_count': invoice_count,
+            'batch_count': batch_count
+        }
+        
+    except Exception as e:
+        logger.error(f"Error en tarea de facturación de fin de día: {e}")
+        return {'success': False, 'error': str(e)}
+
+
 @shared_task
 def generate_invoice_pdf_task(invoice_id):
     """
@@ -86,7 +211,6 @@ def generate_invoice_pdf_task(invoice_id):
     """
     try:
         from .models import Invoice
-        from .services.invoice_generator import InvoiceGeneratorService
         
         # Obtener la factura
         try:
@@ -111,6 +235,37 @@ def generate_invoice_pdf_task(invoice_id):
         return {'success': False, 'error': str(e)}
 
 
+def _reclaim_stale_sent_invoices():
+    """
+    Pasa a 'error' las facturas que quedaron en 'sent' sin CAE (worker caído entre el claim y
+    el resultado de AFIP) hace más de AFIP_SENT_STALE_MINUTES, para que vuelvan a reintentarse.
+    Las que ya tenían número enviado a AFIP no gastan un intento: el reintento consulta ese
+    número con FECompConsultar y recupera el CAE antes de renumerar.
+    """
+    from django.conf import settings
+    from django.db.models import F, Q
+    from .models import Invoice, InvoiceStatus
+    
+    now = timezone.now()
+    cutoff = now - timedelta(minutes=getattr(settings, 'AFIP_SENT_STALE_MINUTES', 30))
+    stale = Invoice.objects.filter(
+        Q(cae__isnull=True) | Q(cae=''),
+        status=InvoiceStatus.SENT,
+        sent_to_afip_at__lt=cutoff,
+    )
+    numbered = stale.filter(afip_number__isnull=False).update(
+        status=InvoiceStatus.ERROR,
+        last_error='Envío a AFIP interrumpido sin resultado; se consultará el comprobante',
+        updated_at=now,
+    )
+    return numbered + stale.filter(afip_number__isnull=True).update(
+        status=InvoiceStatus.ERROR,
+        last_error='Envío a AFIP interrumpido sin resultado',
+        retry_count=F('retry_count') + 1,
+        updated_at=now,
+    )
+
+
 @shared_task
 def retry_failed_invoices_task():
     """
@@ -120,6 +275,10 @@ def retry_failed_invoices_task():
     try:
         from .models import Invoice
         
+        reclaimed_count = _reclaim_stale_sent_invoices()
+        if reclaimed_count:
+            logger.warning(f"{reclaimed_count} facturas en 'sent' sin resultado de AFIP vuelven a reintentarse")
+        
         # Obtener facturas que pueden ser reintentadas
         failed_invoices = Invoice.objects.filter(
             status='error',
@@ -127,23 +286,15 @@ def retry_failed_invoices_task():
             created_at__gte=timezone.now() - timedelta(days=7)  # Solo las de los últimos 7 días
         )
         
-        retry_count = 0
-        success_count = 0
+        # Un lote por hotel (FECAESolicitar con varios comprobantes) en lugar de una tarea por factura
+        retry_count, batch_count = _dispatch_batches(failed_invoices)
         
-        for invoice in failed_invoices:
-            try:
-                # Enviar tarea de reintento
-                send_invoice_to_afip_task.delay(str(invoice.id))
-                retry_count += 1
-                
-            except Exception as e:
-                logger.error(f"Error programando reintento para factura {invoice.id}: {e}")
-        
-        logger.info(f"Programados {retry_count} reintentos de facturas fallidas")
+        logger.info(f"Programados {retry_count} reintentos de facturas fallidas en {batch_count} lotes")
         return {
             'success': True,
             'retry_count': retry_count,
-            'success_count': success_count
+            'batch_count': batch_count,
+            'reclaimed_count': reclaimed_count,
         }
         
     except Exception as e:
@@ -195,7 +346,6 @@ def generate_daily_invoice_report_task(hotel_id=None):
     """
     try:
         from .models import Invoice
-        from .services.invoice_generator import InvoiceGeneratorService
         
         # Filtrar facturas del día
         today = timezone.now().date()
@@ -242,7 +392,6 @@ def validate_afip_connection_task():
         
         for config in configs:
             try:
-                from .services.afip_service import AfipService
                 afip_service = AfipService(config)
                 is_available = afip_service.test_connection()
                 
@@ -271,3 +420,50 @@ def validate_afip_connection_task():
     except Exception as e:
         logger.error(f"Error en validación de conexión AFIP: {e}")
         return {'success': False, 'error': str(e)}
+
+
+@shared_task
+def renew_afip_ticket_task(config_id):
+    """
+    Renueva el TA de WSAA de un AfipConfig antes de su vencimiento
+    Mientras corre, el resto de los workers sigue usando el TA vigente
+    """
+    try:
+
+        config = AfipConfig.objects.select_related('hotel').get(id=config_id)
+        auth_service = AfipService(config).auth_service
+        if getattr(auth_service, 'is_mock', False):
+            return {'success': True, 'renewed': False, 'reason': 'mock'}
+
+        renewed = auth_service.renew_ticket()
+        logger.info(f"Renovación de TA para hotel {config.hotel.id}: {'nuevo TA' if renewed else 'sin cambios'}")
+        return {'success': True, 'renewed': renewed}
+
+    except AfipConfig.DoesNotExist:
+        return {'success': False, 'error': 'Configuración AFIP no encontrada'}
+    except Exception as e:
+        logger.error(f"Error renovando TA de AfipConfig {config_id}: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+@shared_task
+def renew_expiring_afip_tickets_task():
+    """
+    Encola la renovación de los TA que vencen dentro de AFIP_TA_RENEW_BEFORE_SECONDS
+    Cubre a los hoteles sin emisión en la ventana de renovación
+    """
+    try:
+        from django.conf import settings
+        from .services.afip_ticket_cache import AfipTicketCache
+
+        horizon = timezone.now() + timedelta(seconds=getattr(settings, 'AFIP_TA_RENEW_BEFORE_SECONDS', 900))
+        configs = AfipConfig.objects.select_related('hotel').filter(
+            is_active=True,
+            afip_token_expiration__lte=horizon,
+        )
+        scheduled = sum(1 for config in configs if AfipTicketCache(config).schedule_renewal())
+        return {'success': True, 'scheduled_count': scheduled}
+
+    except Exception as e:
+        logger.error(f"Error programando renovación de TA: {e}")
+        return {'success': False, 'error': str(e)}
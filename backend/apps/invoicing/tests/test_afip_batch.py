@@ -0,0 +1,301 @@
+"""
+Tests de autorización de CAE por lotes (FECAESolicitar con CantReg > 1) contra un stub SOAP local
+"""
+import threading
+import xml.etree.ElementTree as ET
+from datetime import date, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from apps.core.models import Currency, Hotel
+from apps.reservations.models import Reservation, ReservationStatus
+from apps.rooms.models import Room
+
+from ..models import AfipConfig, Invoice, InvoiceItem, InvoiceStatus, InvoiceType
+from ..services.afip_auth_service import AfipAuthService
+from ..services.afip_invoice_service import AfipInvoiceService
+from ..tasks import retry_failed_invoices_task, send_invoices_batch_task
+
+NS = '{http://ar.gov.afip.dif.FEV1/}'
+
+
+class WsfeStub:
+    """WSFEv1 mínimo: numeración correlativa, tope por request, rechazo por importe y respuestas perdidas"""
+
+    def __init__(self, limit, last=0, reject_totals=(), lose_responses=0):
+        self.limit = limit
+        self.last = last
+        self.reject_totals = set(reject_totals)
+        self.lose_responses = lose_responses
+        self.vouchers = {}
+        self.calls = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+                action = self.headers.get('SOAPAction', '').strip('"').rsplit('/', 1)[-1]
+                stub.calls.append((action, self.client_address[1]))
+                data = stub.respond(action, body).encode()
+                if action == 'FECAESolicitar' and stub.lose_responses:
+                    # AFIP autorizó pero la respuesta no llega
+                    stub.lose_responses -= 1
+                    data = b'Gateway Timeout'
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/xml; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/wsfev1/service.asmx'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def actions(self, name):
+        return [action for action, _ in self.calls if action == name]
+
+    def respond(self, action, body):
+        if action == 'FECompTotXRequest':
+            inner = f'<FECompTotXRequestResult><RegXReq>{self.limit}</RegXReq></FECompTotXRequestResult>'
+        elif action == 'FECompUltimoAutorizado':
+            inner = f'<FECompUltimoAutorizadoResult><CbteNro>{self.last}</CbteNro></FECompUltimoAutorizadoResult>'
+        elif action == 'FEParamGetCondicionIvaReceptor':
+            inner = '<CondicionIvaReceptor>CF</CondicionIvaReceptor>'
+        elif action == 'FECAESolicitar':
+            inner = self._authorize(body)
+        elif action == 'FECompConsultar':
+            inner = self._consult(body)
+        else:
+            inner = ''
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>'
+            f'<{action}Response xmlns="http://ar.gov.afip.dif.FEV1/">{inner}</{action}Response>'
+            '</soap:Body></soap:Envelope>'
+        )
+
+    def _authorize(self, body):
+        request = ET.fromstring(body)
+        details = request.findall(f'.//{NS}FECAEDetRequest')
+        assert int(request.findtext(f'.//{NS}CantReg')) == len(details) <= self.limit
+        items, results = [], set()
+        for det in details:
+            number = int(det.findtext(f'{NS}CbteDesde'))
+            total = Decimal(det.findtext(f'{NS}ImpTotal'))
+            if number != self.last + 1 or total in self.reject_totals:
+                results.add('R')
+                items.append(
+                    f'<FECAEDetResponse><CbteDesde>{number}</CbteDesde><CbteHasta>{number}</CbteHasta>'
+                    '<Resultado>R</Resultado><Observaciones><Obs><Code>10016</Code>'
+                    '<Msg>Comprobante rechazado</Msg></Obs></Observaciones><CAE></CAE></FECAEDetResponse>'
+                )
+                continue
+            self.last = number
+            self.vouchers[number] = total
+            results.add('A')
+            items.append(
+                f'<FECAEDetResponse><CbteDesde>{number}</CbteDesde><CbteHasta>{number}</CbteHasta>'
+                f'<Resultado>A</Resultado><CAE>7{number:013d}</CAE><CAEFchVto>20301231</CAEFchVto></FECAEDetResponse>'
+            )
+        header = results.pop() if len(results) == 1 else 'P'
+        return (
+            f'<FECAESolicitarResult><FeCabResp><Resultado>{header}</Resultado></FeCabResp>'
+            f'<FeDetResp>{"".join(items)}</FeDetResp></FECAESolicitarResult>'
+        )
+
+    def _consult(self, body):
+        number = int(ET.fromstring(body).findtext(f'.//{NS}CbteNro'))
+        if number not in self.vouchers:
+            return (
+                '<FECompConsultarResult><Errors><Err><Code>602</Code>'
+                '<Msg>No existen datos en nuestros registros</Msg></Err></Errors></FECompConsultarResult>'
+            )
+        return (
+            f'<FECompConsultarResult><ResultGet><CbteDesde>{number}</CbteDesde><CbteHasta>{number}</CbteHasta>'
+            f'<ImpTotal>{self.vouchers[number]}</ImpTotal><Resultado>A</Resultado>'
+            f'<CodAutorizacion>7{number:013d}</CodAutorizacion><FchVto>20301231</FchVto></ResultGet>'
+            '</FECompConsultarResult>'
+        )
+
+
+@override_settings(AFIP_USE_MOCK=False, AFIP_CAE_BATCH_SIZE=250)
+class AfipBatchAuthorizationTest(TestCase):
+    """FECAESolicitar por lotes: numeración local, tope por request y mapeo de resultados"""
+
+    def setUp(self):
+        currency = Currency.objects.create(code='ARS', name='Peso')
+        self.hotel = Hotel.objects.create(name='Hotel Lote', email='lote@hotel.com')
+        room = Room.objects.create(
+            name='L-1', hotel=self.hotel, floor='1', room_type='double', number=701,
+            base_price=Decimal('100.00'), base_currency=currency, capacity=2, max_capacity=2,
+        )
+        check_in = date.today() + timedelta(days=5)
+        self.reservation = Reservation.objects.create(
+            hotel=self.hotel, room=room, check_in=check_in, check_out=check_in + timedelta(days=2),
+            guests_data=[{'name': 'Cliente Lote', 'email': 'cliente@x.com', 'is_primary': True}],
+            status=ReservationStatus.CONFIRMED,
+        )
+        self.config = AfipConfig.objects.create(
+            hotel=self.hotel, cuit='20123456789', point_of_sale=3,
+            certificate_path='/tmp/cert.crt', private_key_path='/tmp/key.key', environment='test',
+        )
+        auth = patch.object(AfipAuthService, 'get_token_and_sign', return_value=('tok', 'sig'))
+        auth.start()
+        self.addCleanup(auth.stop)
+        email = patch('apps.invoicing.services.email_service.InvoiceEmailService.send_invoice_email')
+        email.start()
+        self.addCleanup(email.stop)
+        self._n = 0
+
+    def _stub(self, **kwargs):
+        stub = WsfeStub(**kwargs)
+        self.addCleanup(stub.stop)
+        return stub
+
+    def _invoice(self, total, **kwargs):
+        self._n += 1
+        total = Decimal(total)
+        net = (total / Decimal('1.21')).quantize(Decimal('0.01'))
+        invoice = Invoice.objects.create(
+            reservation=self.reservation, hotel=self.hotel, type=InvoiceType.FACTURA_B,
+            number=f'0003-{self._n:08d}', issue_date=date.today(), total=total, net_amount=net,
+            vat_amount=total - net, client_name='Cliente Lote', client_document_number='12345678', **kwargs
+        )
+        InvoiceItem.objects.create(invoice=invoice, description='Hospedaje', quantity=1, unit_price=net)
+        return invoice
+
+    def test_batches_share_session_and_track_numbering_locally(self):
+        stub = self._stub(limit=2, last=10)
+        invoices = [self._invoice(f'{100 * (i + 1)}.00') for i in range(5)]
+        service = AfipInvoiceService(self.config)
+        service.wsfev1_url = stub.url
+
+        results = service.send_invoices_batch(invoices)
+
+        # 5 comprobantes con tope 2 → 3 requests; el último número se consulta una sola vez
+        self.assertEqual(len(stub.actions('FECAESolicitar')), 3)
+        self.assertEqual(len(stub.actions('FECompUltimoAutorizado')), 1)
+        self.assertEqual(len(stub.actions('FECompTotXRequest')), 1)
+        self.assertEqual(len({port for _, port in stub.calls}), 1)  # una conexión keep-alive
+
+        for number, invoice in enumerate(invoices, 11):
+            result = results[str(invoice.id)]
+            self.assertEqual((result['success'], result['invoice_number'], result['cae']), (True, str(number), f'7{number:013d}'))
+            invoice.refresh_from_db()
+            self.assertEqual((invoice.status, invoice.cae), (InvoiceStatus.APPROVED, f'7{number:013d}'))
+        self.config.refresh_from_db()
+        self.assertEqual(self.config.last_invoice_number, 15)
+
+    def test_rejected_items_are_mapped_and_numbering_resumes(self):
+        stub = self._stub(limit=3, last=10, reject_totals={Decimal('666.00')})
+        first, rejected, after_rejected, next_batch = [
+            self._invoice(total) for total in ('100.00', '666.00', '300.00', '400.00')
+        ]
+        service = AfipInvoiceService(self.config)
+        service.wsfev1_url = stub.url
+
+        results = service.send_invoices_batch([first, rejected, after_rejected, next_batch])
+
+        self.assertEqual(results[str(first.id)]['invoice_number'], '11')
+        self.assertFalse(results[str(rejected.id)]['success'])
+        self.assertIn('10016', results[str(rejected.id)]['error'])
+        self.assertFalse(results[str(after_rejected.id)]['success'])
+        # El siguiente lote sigue desde el último número aprobado, sin volver a consultar a AFIP
+        self.assertEqual(results[str(next_batch.id)]['invoice_number'], '12')
+        self.assertEqual(len(stub.actions('FECompUltimoAutorizado')), 1)
+
+    def test_lost_response_recovers_cae_without_renumbering(self):
+        stub = self._stub(limit=250, last=10, lose_responses=1)
+        invoices = [self._invoice('100.00'), self._invoice('200.00')]
+        service = AfipInvoiceService(self.config)
+        service.wsfev1_url = stub.url
+
+        results = service.send_invoices_batch(invoices)
+
+        # AFIP autorizó 11 y 12 aunque la respuesta se perdió: se recuperan con FECompConsultar
+        self.assertEqual(len(stub.actions('FECAESolicitar')), 1)
+        self.assertEqual(len(stub.actions('FECompConsultar')), 2)
+        for number, invoice in enumerate(invoices, 11):
+            self.assertEqual(results[str(invoice.id)]['cae'], f'7{number:013d}')
+            invoice.refresh_from_db()
+            self.assertEqual((invoice.status, invoice.afip_number), (InvoiceStatus.APPROVED, number))
+
+    def test_pending_numbers_are_consulted_before_renumbering(self):
+        stub = self._stub(limit=250, last=11)
+        stub.vouchers[11] = Decimal('100.00')
+        authorized = self._invoice('100.00', status=InvoiceStatus.ERROR, afip_number=11)
+        unknown = self._invoice('200.00', status=InvoiceStatus.ERROR, afip_number=12)
+        service = AfipInvoiceService(self.config)
+        service.wsfev1_url = stub.url
+
+        results = service.send_invoices_batch([authorized, unknown])
+
+        # 11 ya estaba autorizado: no se vuelve a enviar; 12 no existe en AFIP y se numera de nuevo
+        self.assertEqual(results[str(authorized.id)]['cae'], f'7{11:013d}')
+        self.assertEqual(results[str(unknown.id)]['invoice_number'], '12')
+        self.assertEqual(len(stub.actions('FECAESolicitar')), 1)
+        self.assertEqual(stub.last, 12)
+        self.config.refresh_from_db()
+        self.assertEqual(self.config.last_invoice_number, 12)
+
+    def test_tasks_claim_group_and_apply_results(self):
+        stub = self._stub(limit=250, last=0)
+        draft = self._invoice('100.00')
+        failed = self._invoice('200.00', status=InvoiceStatus.ERROR, retry_count=1)
+        approved = self._invoice('300.00', status=InvoiceStatus.APPROVED, cae='1' * 14)
+
+        with patch('apps.invoicing.tasks.send_invoices_batch_task.delay') as delay:
+            result = retry_failed_invoices_task()
+        self.assertEqual((result['retry_count'], result['batch_count']), (1, 1))
+        delay.assert_called_once_with(self.hotel.id, [str(failed.id)])
+
+        with patch.object(AfipInvoiceService, 'WSFEv1_HOMOLOGATION_URL', stub.url):
+            result = send_invoices_batch_task(self.hotel.id, [str(draft.id), str(failed.id), str(approved.id)])
+        self.assertEqual((result['approved_count'], result['error_count']), (2, 0))
+        self.assertEqual(len(stub.actions('FECAESolicitar')), 1)
+
+        for invoice in (draft, failed):
+            invoice.refresh_from_db()
+            self.assertEqual(invoice.status, InvoiceStatus.APPROVED)
+            self.assertEqual(invoice.cae_expiration, date(2030, 12, 31))
+        approved.refresh_from_db()
+        self.assertEqual(approved.cae, '1' * 14)
+
+    @override_settings(AFIP_SENT_STALE_MINUTES=30)
+    def test_stale_sent_invoices_without_cae_are_retried(self):
+        now = timezone.now()
+        stale = self._invoice('100.00', status=InvoiceStatus.SENT, sent_to_afip_at=now - timedelta(hours=1))
+        in_flight = self._invoice('200.00', status=InvoiceStatus.SENT, sent_to_afip_at=now - timedelta(minutes=5))
+        authorized = self._invoice(
+            '300.00', status=InvoiceStatus.SENT, cae='1' * 14, sent_to_afip_at=now - timedelta(hours=1)
+        )
+        numbered = self._invoice(
+            '400.00', status=InvoiceStatus.SENT, afip_number=7, retry_count=2, sent_to_afip_at=now - timedelta(hours=1)
+        )
+
+        with patch('apps.invoicing.tasks.send_invoices_batch_task.delay') as delay:
+            result = retry_failed_invoices_task()
+        # Sólo las facturas abandonadas por un worker caído vuelven a la cola de reintentos
+        self.assertEqual((result['reclaimed_count'], result['retry_count']), (2, 2))
+        delay.assert_called_once_with(self.hotel.id, [str(stale.id), str(numbered.id)])
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.retry_count), (InvoiceStatus.ERROR, 1))
+        # Con número ya enviado no gasta intento: el reintento consulta el comprobante antes de renumerar
+        numbered.refresh_from_db()
+        self.assertEqual((numbered.status, numbered.retry_count), (InvoiceStatus.ERROR, 2))
+        for invoice in (in_flight, authorized):
+            invoice.refresh_from_db()
+            self.assertEqual(invoice.status, InvoiceStatus.SENT)
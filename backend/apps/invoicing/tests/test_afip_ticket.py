@@ -0,0 +1,117 @@
+"""
+Tests del TA de WSAA compartido: TA vigente sin bloqueo, renovación single-flight y espera por aviso
+"""
+import threading
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from apps.core.models import Hotel
+
+from ..models import AfipConfig
+from ..services.afip_auth_service import AfipAuthService
+from ..services.afip_ticket_cache import AfipTicketCache
+from ..services.afip_zeep_auth_service import AfipZeepAuthService
+from ..tasks import renew_afip_ticket_task, renew_expiring_afip_tickets_task
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'afip-ticket'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE, AFIP_USE_MOCK=False, AFIP_TA_RENEW_BEFORE_SECONDS=900, AFIP_TA_WAIT_TIMEOUT_SECONDS=30)
+class AfipTicketCacheTest(TransactionTestCase):
+    def setUp(self):
+        hotel = Hotel.objects.create(name='Hotel TA', email='ta@hotel.com')
+        self.config = AfipConfig.objects.create(
+            hotel=hotel, cuit='20123456789', point_of_sale=1, is_active=True,
+            certificate_path='/tmp/cert.crt', private_key_path='/tmp/key.key', environment='test',
+        )
+        self.tickets = AfipTicketCache(self.config)
+        self.addCleanup(self.tickets.clear)
+
+    def _ticket(self, token, seconds):
+        now = timezone.now()
+        return token, f'sign-{token}', now, now + timedelta(seconds=seconds)
+
+    def test_stale_ticket_is_served_while_a_single_renewal_runs(self):
+        AfipConfig.objects.filter(pk=self.config.pk).update(
+            afip_token='viejo', afip_sign='sign-viejo', afip_token_expiration=timezone.now() + timedelta(minutes=5),
+        )
+        service = AfipAuthService(AfipConfig.objects.get(pk=self.config.pk))
+        with patch.object(AfipAuthService, '_generate_new_token') as generate, \
+                patch('apps.invoicing.tasks.renew_afip_ticket_task.delay') as delay:
+            results = {service.get_token_and_sign() for _ in range(3)}
+            self.assertEqual(renew_expiring_afip_tickets_task()['scheduled_count'], 0)
+        # El TA por vencer se sigue sirviendo y la renovación se encola una sola vez
+        self.assertEqual(results, {('viejo', 'sign-viejo')})
+        generate.assert_not_called()
+        delay.assert_called_once_with(self.config.id)
+
+        with patch.object(AfipZeepAuthService, '_request_ta_with_zeep', return_value=self._ticket('nuevo', 12 * 3600)):
+            self.assertEqual(renew_afip_ticket_task(self.config.id), {'success': True, 'renewed': True})
+            # Ya renovado: una segunda ejecución no vuelve a pedir TA a WSAA
+            self.assertEqual(renew_afip_ticket_task(self.config.id), {'success': True, 'renewed': False})
+
+        self.assertEqual(service.get_token_and_sign(), ('nuevo', 'sign-nuevo'))
+        self.config.refresh_from_db()
+        self.assertEqual(self.config.afip_token, 'nuevo')
+        self.assertGreater(self.config.afip_token_expiration, timezone.now() + timedelta(hours=11))
+
+    def test_already_authenticated_keeps_serving_ticket_without_new_logins(self):
+        AfipConfig.objects.filter(pk=self.config.pk).update(
+            afip_token='vigente', afip_sign='sign-vigente', afip_token_expiration=timezone.now() + timedelta(seconds=30),
+        )
+        service = AfipZeepAuthService(AfipConfig.objects.get(pk=self.config.pk))
+        fault = Exception('coe.alreadyAuthenticated: El CEE ya posee un TA valido para el acceso al WSN solicitado')
+        with patch.object(AfipZeepAuthService, '_request_ta_with_zeep', side_effect=fault) as login, \
+                patch.object(AfipAuthService, '_generate_new_token') as fallback, \
+                patch('apps.invoicing.tasks.renew_afip_ticket_task.delay') as delay:
+            results = {service.get_token_and_sign() for _ in range(3)}
+            self.assertFalse(service.renew_ticket())
+        # Dentro del último minuto: un solo login, sin fallback por requests ni renovaciones encoladas
+        self.assertEqual(results, {('vigente', 'sign-vigente')})
+        self.assertEqual(login.call_count, 1)
+        fallback.assert_not_called()
+        delay.assert_not_called()
+
+    def test_waiters_are_notified_and_retry_after_a_failed_generation(self):
+        release = threading.Event()
+        calls = []
+
+        def generate():
+            calls.append(threading.current_thread().name)
+            release.wait(10)
+            if len(calls) == 1:
+                raise RuntimeError('WSAA no responde')
+            return self._ticket('concurrente', 12 * 3600)
+
+        results, errors = [], []
+
+        def worker():
+            try:
+                results.append(AfipTicketCache(AfipConfig.objects.get(pk=self.config.pk)).get(generate))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, name=f'w{i}') for i in range(6)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        time.sleep(0.3)
+        release.set()
+        for thread in threads:
+            thread.join(15)
+
+        # Un solo worker pidió el TA a la vez: el primero falló, los que esperaban se enteraron por
+        # el aviso, uno reintentó y el resto recibió su TA sin sondear
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(results, [('concurrente', 'sign-concurrente')] * 5)
+        self.assertLess(time.monotonic() - started, 5)
+        self.config.refresh_from_db()
+        self.assertEqual(self.config.afip_token, 'concurrente')
@@ -0,0 +1,147 @@
+"""
+Test de estrés de la numeración fiscal: facturas concurrentes sin números repetidos ni huecos
+"""
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.db import OperationalError, connection, transaction
+from django.test import TransactionTestCase
+
+from apps.core.models import Currency, Hotel
+from apps.reservations.models import Reservation, ReservationStatus
+from apps.rooms.models import Room
+
+from ..models import AfipConfig, Invoice, InvoiceType
+
+
+class InvoiceNumberAllocationTest(TransactionTestCase):
+    WORKERS = 8
+    PER_WORKER = 10
+
+    def setUp(self):
+        # Sin TestCase los on_commit corren de verdad: no encolar tareas de Celery sin broker
+        celery = patch('celery.app.task.Task.apply_async')
+        celery.start()
+        self.addCleanup(celery.stop)
+        currency = Currency.objects.create(code='ARS', name='Peso')
+        self.hotel = Hotel.objects.create(name='Hotel Serie', email='serie@hotel.com')
+        room = Room.objects.create(
+            name='N-1', hotel=self.hotel, floor='1', room_type='double', number=801,
+            base_price=Decimal('100.00'), base_currency=currency, capacity=2, max_capacity=2,
+        )
+        check_in = date.today() + timedelta(days=3)
+        self.reservation = Reservation.objects.create(
+            hotel=self.hotel, room=room, check_in=check_in, check_out=check_in + timedelta(days=1),
+            guests_data=[{'name': 'Cliente Serie', 'email': 'serie@x.com', 'is_primary': True}],
+            status=ReservationStatus.CONFIRMED,
+        )
+        self.config = AfipConfig.objects.create(
+            hotel=self.hotel, cuit='20123456789', point_of_sale=4,
+            certificate_path='/tmp/cert.crt', private_key_path='/tmp/key.key', environment='test',
+        )
+
+    def _issue(self, config, rollback):
+        """Como las vistas y señales: número y factura en la misma transacción."""
+        with transaction.atomic():
+            number = config.allocate_invoice_number()
+            Invoice.objects.create(
+                reservation=self.reservation, hotel=self.hotel, type=InvoiceType.FACTURA_B,
+                number=config.format_invoice_number(number), issue_date=date.today(), total=Decimal('121.00'),
+                net_amount=Decimal('100.00'), vat_amount=Decimal('21.00'), client_name='Cliente Serie',
+                client_document_number='12345678',
+            )
+            if rollback:
+                raise RuntimeError('pago revertido')
+
+    def test_concurrent_invoices_get_unique_gap_free_numbers(self):
+        barrier = threading.Barrier(self.WORKERS)
+        errors = []
+
+        def worker(index):
+            try:
+                config = AfipConfig.objects.get(pk=self.config.pk)
+                barrier.wait()
+                for i in range(self.PER_WORKER):
+                    while True:
+                        try:
+                            self._issue(config, rollback=(i % 5 == 4))
+                            break
+                        except RuntimeError:
+                            break
+                        except OperationalError as e:
+                            # La base SQLite de tests falla en lugar de esperar el lock de la fila
+                            if connection.vendor != 'sqlite' or 'locked' not in str(e):
+                                raise
+                            time.sleep(0.001)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        self.assertEqual(errors, [])
+
+        # Las facturas revertidas no consumen número: la serie queda 1..N sin huecos
+        issued = self.WORKERS * (self.PER_WORKER - self.PER_WORKER // 5)
+        numbers = sorted(Invoice.objects.filter(hotel=self.hotel).values_list('number', flat=True))
+        self.assertEqual(numbers, [f'0004-{n:08d}' for n in range(1, issued + 1)])
+        self.config.refresh_from_db()
+        self.assertEqual(self.config.last_invoice_number, issued)
+
+        # update_invoice_number con una instancia desactualizada no hace retroceder la serie
+        stale = AfipConfig.objects.get(pk=self.config.pk)
+        stale.last_invoice_number = 0
+        stale.update_invoice_number(5)
+        self.config.refresh_from_db()
+        self.assertEqual(self.config.last_invoice_number, issued)
+
+    def test_afip_send_runs_after_commit_without_series_lock(self):
+        from ..services import send_invoice_on_commit
+        from ..services.afip_service import AfipService
+
+        def send(invoice):
+            # El envío ya no corre dentro de la transacción que tomó el lock de AfipConfig
+            self.assertFalse(connection.in_atomic_block)
+            return {'success': True, 'cae': '7' * 14, 'cae_expiration': '20301231'}
+
+        with patch.object(AfipService, '__init__', return_value=None), \
+                patch.object(AfipService, 'send_invoice', side_effect=send) as send_invoice, \
+                patch('apps.invoicing.services.email_service.InvoiceEmailService.send_invoice_email'):
+            with transaction.atomic():
+                number = self.config.allocate_invoice_number()
+                invoice = Invoice.objects.create(
+                    reservation=self.reservation, hotel=self.hotel, type=InvoiceType.FACTURA_B,
+                    number=self.config.format_invoice_number(number), issue_date=date.today(),
+                    total=Decimal('121.00'), net_amount=Decimal('100.00'), vat_amount=Decimal('21.00'),
+                    client_name='Cliente Serie', client_document_number='12345678',
+                )
+                send_invoice_on_commit(self.config, invoice)
+                send_invoice.assert_not_called()
+        send_invoice.assert_called_once()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.cae, '7' * 14)
+
+    def test_cae_update_does_not_roll_back_config(self):
+        from ..services.afip_invoice_service import AfipInvoiceService
+
+        stale = AfipConfig.objects.get(pk=self.config.pk)
+        AfipConfig.objects.filter(pk=self.config.pk).update(last_invoice_number=20, afip_token='nuevo')
+        invoice = Invoice.objects.create(
+            reservation=self.reservation, hotel=self.hotel, type=InvoiceType.FACTURA_B, number='0004-00000005',
+            issue_date=date.today(), total=Decimal('121.00'), net_amount=Decimal('100.00'),
+            vat_amount=Decimal('21.00'), client_name='Cliente Serie', client_document_number='12345678',
+        )
+
+        AfipInvoiceService(stale)._update_invoice_with_afip_data(
+            invoice, {'cae': '7' * 14, 'cae_expiration': '20301231', 'invoice_number': '5'}
+        )
+
+        self.config.refresh_from_db()
+        self.assertEqual((self.config.last_invoice_number, self.config.afip_token), (20, 'nuevo'))
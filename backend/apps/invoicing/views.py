@@ -21,7 +21,7 @@ from .serializers import (
     InvoiceSummarySerializer, AfipStatusSerializer, InjectTASerializer,
     GenerateInvoiceFromPaymentSerializer, CreateCreditNoteSerializer
 )
-from .services import AfipService
+from .services import AfipService, send_invoice_on_commit
 from .services.invoice_pdf_service import InvoicePDFService
 
 logger = logging.getLogger(__name__)
@@ -371,7 +371,7 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                     }, status=status.HTTP_400_BAD_REQUEST)
                 
                 # Generar número de nota de crédito
-                next_number = afip_config.get_next_invoice_number()
+                next_number = afip_config.allocate_invoice_number()
                 formatted_number = afip_config.format_invoice_number(next_number)
                 
                 # Crear nota de crédito
@@ -406,9 +406,6 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                     item_data['invoice'] = credit_note
                     InvoiceItem.objects.create(**item_data)
                 
-                # Actualizar número en configuración
-                afip_config.update_invoice_number(next_number)
-                
                 # Serializar respuesta
                 credit_note_serializer = InvoiceSerializer(credit_note)
                 return Response(credit_note_serializer.data, status=status.HTTP_201_CREATED)
@@ -509,7 +506,7 @@ class GenerateInvoiceFromPaymentView(APIView):
                 total_amount = sum(p.amount for p in payments)
                 
                 # Generar número de factura
-                next_number = afip_config.get_next_invoice_number()
+                next_number = afip_config.allocate_invoice_number()
                 formatted_number = afip_config.format_invoice_number(next_number)
                 
                 # Determinar tipo de factura basado en el cliente
@@ -578,30 +575,17 @@ class GenerateInvoiceFromPaymentView(APIView):
                     item_data['invoice'] = invoice
                     InvoiceItem.objects.create(**item_data)
                 
-                # Actualizar número en configuración
-                afip_config.update_invoice_number(next_number)
-                
-                # Si se solicita envío automático a AFIP
+                # Si se solicita envío automático a AFIP: después del commit, sin retener el lock de la serie
                 if serializer.validated_data.get('send_to_afip', False):
-                    try:
-                        afip_service = AfipService(afip_config)
-                        result = afip_service.send_invoice(invoice)
-                        
-                        if result['success']:
-                            invoice.mark_as_approved(result['cae'], result['cae_expiration'])
-                        else:
-                            invoice.mark_as_error(result['error'])
-                    except Exception as e:
-                        logger.error(f"Error enviando factura a AFIP: {e}")
-                        invoice.mark_as_error(str(e))
-                
-                # Serializar respuesta
-                invoice_serializer = InvoiceSerializer(invoice)
-                response_data = invoice_serializer.data
-                response_data['payments_included'] = reference_payments
-                response_data['total_payments'] = len(reference_payments)
-                
-                return Response(response_data, status=status.HTTP_201_CREATED)
+                    send_invoice_on_commit(afip_config, invoice)
+            
+            # Serializar respuesta (ya con el resultado de AFIP si se envió)
+            invoice_serializer = InvoiceSerializer(invoice)
+            response_data = invoice_serializer.data
+            response_data['payments_included'] = reference_payments
+            response_data['total_payments'] = len(reference_payments)
+            
+            return Response(response_data, status=status.HTTP_201_CREATED)
                 
         except Exception as e:
             logger.error(f"Error generando factura desde pago: {e}")
@@ -699,11 +683,12 @@ class CreateInvoiceFromReservationView(APIView):
                     }, status=status.HTTP_400_BAD_REQUEST)
                 
                 # Generar número de factura evitando duplicados
-                next_number = afip_config.get_next_invoice_number()
+                next_number = afip_config.allocate_invoice_number()
                 formatted_number = afip_config.format_invoice_number(next_number)
                 attempts = 0
                 while Invoice.objects.filter(hotel=reservation.hotel, number=formatted_number).exists() and attempts < 20:
-                    next_number += 1
+                    # Número ya usado (p. ej. carga manual): reservar el siguiente para que la serie avance
+                    next_number = afip_config.allocate_invoice_number()
                     formatted_number = afip_config.format_invoice_number(next_number)
                     attempts += 1
                 
@@ -759,9 +744,6 @@ class CreateInvoiceFromReservationView(APIView):
                     item_data['invoice'] = invoice
                     InvoiceItem.objects.create(**item_data)
                 
-                # Actualizar número de factura en configuración al último usado
-                afip_config.update_invoice_number(next_number)
-                
                 # Si la factura se crea ya aprobada (caso raro), enviar email
                 if invoice.status == 'approved' and invoice.cae:
                     try:
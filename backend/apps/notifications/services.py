@@ -209,20 +209,17 @@ class NotificationService:
         )
     
     @staticmethod
-    def create_ota_reservation_notification(
+    def _ota_reservation_content(
         provider_name: str,
         reservation_code: str,
         room_name: str,
         check_in_date: str,
         check_out_date: str,
         guest_name: str = "",
-        hotel_id: Optional[int] = None,
-        reservation_id: Optional[int] = None,
-        user_id: Optional[int] = None,
         external_id: Optional[str] = None,
         overbooking: bool = False
-    ) -> Notification:
-        """Crea notificación cuando se recibe una nueva reserva desde una OTA"""
+    ) -> tuple:
+        """(título, mensaje, metadata) de la notificación de reserva OTA"""
         
         # Construir mensaje con información relevante
         message_parts = [
@@ -257,6 +254,27 @@ class NotificationService:
         if external_id:
             metadata['external_id'] = external_id
         
+        return title, message, metadata
+
+    @staticmethod
+    def create_ota_reservation_notification(
+        provider_name: str,
+        reservation_code: str,
+        room_name: str,
+        check_in_date: str,
+        check_out_date: str,
+        guest_name: str = "",
+        hotel_id: Optional[int] = None,
+        reservation_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+        external_id: Optional[str] = None,
+        overbooking: bool = False
+    ) -> Notification:
+        """Crea notificación cuando se recibe una nueva reserva desde una OTA"""
+        title, message, metadata = NotificationService._ota_reservation_content(
+            provider_name, reservation_code, room_name, check_in_date, check_out_date,
+            guest_name=guest_name, external_id=external_id, overbooking=overbooking,
+        )
         return NotificationService.create(
             notification_type=NotificationType.OTA_RESERVATION_RECEIVED,
             title=title,
@@ -267,6 +285,33 @@ class NotificationService:
             metadata=metadata
         )
 
+    @staticmethod
+    def create_ota_reservation_notifications(items: list) -> list:
+        """
+        Notificaciones de varias reservas OTA nuevas (broadcast) en un solo INSERT.
+        
+        Args:
+            items: Lista de dicts con los argumentos de create_ota_reservation_notification
+                   (sin user_id)
+        """
+        notifications = []
+        for item in items:
+            item = dict(item)
+            hotel_id = item.pop('hotel_id', None)
+            reservation_id = item.pop('reservation_id', None)
+            title, message, metadata = NotificationService._ota_reservation_content(**item)
+            notifications.append(Notification(
+                type=NotificationType.OTA_RESERVATION_RECEIVED,
+                title=title,
+                message=message,
+                hotel_id=hotel_id,
+                reservation_id=reservation_id,
+                metadata=metadata,
+            ))
+        if notifications:
+            Notification.objects.bulk_create(notifications)
+        return notifications
+
     @staticmethod
     def create_website_reservation_notification(
         reservation_code: str,
@@ -1,6 +1,9 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Optional
+import hashlib
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta, timezone
 
 # Imports opcionales - si no están instalados, las funciones fallarán con un error claro
@@ -16,17 +19,30 @@ except ImportError:
 
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 
+# Máximo de llamadas por request batch que acepta la API de Calendar
+BATCH_LIMIT = 50
+
+_local = threading.local()
+
 
 def _build_service(credentials_json: Dict[str, Any]):
     """Construye el cliente de Google Calendar desde un JSON de service account.
 
     Espera el JSON completo de la service account compartida con el calendario.
+    El cliente (y su token OAuth) se reutiliza por hilo: httplib2 no es thread-safe.
     """
     if not GOOGLE_AVAILABLE:
         raise ImportError("Google Calendar API no está instalada. Instala: pip install google-api-python-client google-auth")
     
-    creds = service_account.Credentials.from_service_account_info(credentials_json, scopes=SCOPES)
-    return build("calendar", "v3", credentials=creds, cache_discovery=False)
+    key = hashlib.sha256(json.dumps(credentials_json, sort_keys=True).encode()).hexdigest()
+    services = getattr(_local, "services", None)
+    if services is None:
+        services = _local.services = {}
+    service = services.get(key)
+    if service is None:
+        creds = service_account.Credentials.from_service_account_info(credentials_json, scopes=SCOPES)
+        service = services[key] = build("calendar", "v3", credentials=creds, cache_discovery=False)
+    return service
 
 
 def list_events(
@@ -54,7 +70,15 @@ def list_events(
             timeMax=time_max.isoformat(),
         )
 
-    return req.execute()
+    # Recorrer todas las páginas: nextSyncToken solo viene en la última
+    resp = req.execute()
+    items = list(resp.get("items", []))
+    while resp.get("nextPageToken"):
+        req = service.events().list_next(req, resp)
+        resp = req.execute()
+        items.extend(resp.get("items", []))
+    resp["items"] = items
+    return resp
 
 
 def get_calendar(credentials_json: Dict[str, Any], calendar_id: str) -> Dict[str, Any]:
@@ -95,3 +119,26 @@ def watch_calendar(credentials_json: Dict[str, Any], calendar_id: str, address:
     return service.events().watch(calendarId=calendar_id, body=body).execute()
 
 
+def execute_batch(
+    credentials_json: Dict[str, Any],
+    calls: List[Tuple[str, str, Dict[str, Any]]],
+) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Exception]]]:
+    """Ejecuta llamadas a events() agrupadas en requests batch de hasta BATCH_LIMIT.
+
+    calls: [(request_id, método de events() — "list", "insert", "update", "delete" —, kwargs)]
+    Devuelve {request_id: (respuesta, excepción)}; un error en una llamada no corta el resto.
+    """
+    results: Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Exception]]] = {}
+    if not calls:
+        return results
+    service = _build_service(credentials_json)
+
+    def _callback(request_id, response, exception):
+        results[request_id] = (response, exception)
+
+    for i in range(0, len(calls), BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=_callback)
+        for request_id, method, kwargs in calls[i:i + BATCH_LIMIT]:
+            batch.add(getattr(service.events(), method)(**kwargs), request_id=request_id)
+        batch.execute()
+    return results
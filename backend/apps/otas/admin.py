@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import OtaConfig, OtaRoomMapping, OtaSyncJob, OtaSyncLog, OtaImportedEvent, OtaRoomTypeMapping, OtaRatePlanMapping
+from .models import OtaConfig, OtaRoomMapping, OtaSyncJob, OtaSyncLog, OtaImportedEvent, OtaRoomTypeMapping, OtaRatePlanMapping, OtaAriState
 
 @admin.register(OtaConfig)
 class OtaConfigAdmin(admin.ModelAdmin):
@@ -47,4 +47,11 @@ class OtaRoomTypeMappingAdmin(admin.ModelAdmin):
 class OtaRatePlanMappingAdmin(admin.ModelAdmin):
     list_display = ("hotel", "provider", "rate_plan_code", "provider_code", "currency", "is_active")
     list_filter = ("provider", "currency", "is_active")
-    search_fields = ("rate_plan_code", "provider_code")
\ No newline at end of file
+    search_fields = ("rate_plan_code", "provider_code")
+
+
+@admin.register(OtaAriState)
+class OtaAriStateAdmin(admin.ModelAdmin):
+    list_display = ("hotel", "provider", "room_type_code", "rate_plan_code", "updated_at")
+    list_filter = ("provider",)
+    search_fields = ("room_type_code", "rate_plan_code")
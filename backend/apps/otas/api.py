@@ -7,9 +7,9 @@ from rest_framework import permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.request import Request
-from django.http import StreamingHttpResponse
-import json, time, os
-import redis
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseNotAllowed, StreamingHttpResponse
+import json, time
 
 from .models import (
     OtaConfig,
@@ -25,6 +25,8 @@ from .serializers import (
 )
 from .services.ical_sync_service import ICALSyncService
 from .services.smoobu_sync_service import SmoobuSyncService
+from .services.event_bus import publisher, redis_url
+from .services.event_fanout import get_hub
 from django.conf import settings
 from django.utils import timezone
 
@@ -317,42 +319,66 @@ def google_webhook_notify(request: Request) -> Response:
 
 
 @api_view(["GET"])
-@permission_classes([permissions.AllowAny])
-def events_stream(request: Request):
+def events_metrics(request: Request) -> Response:
+    """
+    Métricas del publicador de eventos de OTAs de todos los procesos (hash en Redis).
+
+    GET /api/otas/events/metrics/
+    """
+    return Response(publisher.metrics(), status=status.HTTP_200_OK)
+
+
+async def events_stream(request):
     """SSE: emite eventos de OTAs (reservations_updated) para refrescar UI sin F5.
 
-    Opcional: ?hotel=<id> para filtrar por hotel.
+    Opcional: ?hotel=<id> para filtrar por hotel. Soporta Last-Event-ID (header o
+    ?lastEventId=) para reponer eventos perdidos durante una reconexión.
+
+    Bajo ASGI el stream es una corrutina alimentada por la suscripción compartida del
+    proceso (ver services/event_fanout.py). Bajo WSGI (runserver) se mantiene el loop
+    sincrónico con una suscripción por cliente.
     """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
     hotel_id = request.GET.get("hotel")
-    redis_host = os.environ.get("REDIS_HOST", "redis")
-    r = redis.Redis(host=redis_host, port=6379, db=0, decode_responses=True)
+    if isinstance(request, ASGIRequest):
+        last_event_id = request.headers.get("Last-Event-ID") or request.GET.get("lastEventId")
+        stream = get_hub().stream(hotel_id=hotel_id, last_event_id=last_event_id)
+    else:
+        stream = _sync_event_stream(hotel_id)
+
+    resp = StreamingHttpResponse(stream, content_type='text/event-stream')
+    resp['Cache-Control'] = 'no-cache'
+    resp['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+def _sync_event_stream(hotel_id):
+    import redis
+
+    # Conexión dedicada: una pubsub retiene su conexión mientras dure el stream
+    r = redis.Redis.from_url(redis_url(), decode_responses=True)
     p = r.pubsub()
     channels = ["otas:events"]
     if hotel_id:
         channels.append(f"otas:events:{hotel_id}")
     p.subscribe(*channels)
 
-    def event_stream():
-        # Enviar cabecera inicial
-        yield "event: ping\ndata: {}\n\n"
-        last_heartbeat = time.time()
+    # Enviar cabecera inicial
+    yield "event: ping\ndata: {}\n\n"
+    last_heartbeat = time.time()
+    try:
+        while True:
+            message = p.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message and message.get("type") == "message":
+                data = message.get("data")
+                yield f"event: update\ndata: {data}\n\n"
+            # Heartbeat cada 15s
+            if time.time() - last_heartbeat > 15:
+                yield "event: ping\ndata: {}\n\n"
+                last_heartbeat = time.time()
+    finally:
         try:
-            while True:
-                message = p.get_message(ignore_subscribe_messages=True, timeout=1.0)
-                if message and message.get("type") == "message":
-                    data = message.get("data")
-                    yield f"event: update\ndata: {data}\n\n"
-                # Heartbeat cada 15s
-                if time.time() - last_heartbeat > 15:
-                    yield "event: ping\ndata: {}\n\n"
-                    last_heartbeat = time.time()
-        finally:
-            try:
-                p.close()
-            except Exception:
-                pass
-
-    resp = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
-    resp['Cache-Control'] = 'no-cache'
-    resp['X-Accel-Buffering'] = 'no'
-    return resp
+            p.close()
+        except Exception:
+            pass
@@ -7,7 +7,8 @@ from apps.rooms.models import Room
 from apps.reservations.models import Reservation, ReservationStatus
 from apps.otas.models import OtaConfig, OtaProvider, OtaRoomMapping, OtaSyncJob
 from apps.otas.services.ical_sync_service import ICALSyncService
-from apps.otas.services.ari_publisher import build_mock_ari_payload, push_ari_for_hotel
+from apps.otas.services.ari_engine import build_ari_delta
+from apps.otas.services.ari_publisher import push_ari_for_hotel
 
 import secrets
 
@@ -81,11 +82,11 @@ class Command(BaseCommand):
         job.save(update_fields=["status", "stats", "finished_at"])
         self.stdout.write(self.style.SUCCESS(f"IMPORT ICS OK: {stats}"))
 
-        # 5) ARI payload mock y push (usa mapeos si existen; si no, el payload saldrá vacío)
+        # 5) Delta de ARI y push (usa mapeos si existen; si no, no hay rangos a enviar)
         df = today + timedelta(days=1)
         dt = today + timedelta(days=7)
-        ari_payload = build_mock_ari_payload(hotel.id, OtaProvider.BOOKING, df, dt)
-        self.stdout.write(f"ARI items a enviar: {len(ari_payload.get('items', []))}")
+        delta = build_ari_delta(hotel.id, OtaProvider.BOOKING, df, dt)
+        self.stdout.write(f"ARI items a enviar: {len(delta.ranges)}")
 
         job2 = OtaSyncJob.objects.create(hotel=hotel, provider=OtaProvider.BOOKING, job_type=OtaSyncJob.JobType.PUSH_ARI, status=OtaSyncJob.JobStatus.RUNNING, stats={})
         push_stats = push_ari_for_hotel(job2, hotel.id, OtaProvider.BOOKING, df, dt)
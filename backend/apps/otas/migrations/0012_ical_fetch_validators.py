@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('otas', '0011_rename_otas_smoobu_hotel_room_kind_idx_otas_smoobu_hotel_i_2fc39c_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='otaroommapping',
+            name='ical_content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='otaroommapping',
+            name='ical_etag',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='otaroommapping',
+            name='ical_last_modified',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
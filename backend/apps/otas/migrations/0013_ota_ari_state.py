@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_remove_hotel_currency'),
+        ('otas', '0012_ical_fetch_validators'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OtaAriState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(choices=[('ical', 'iCal'), ('booking', 'Booking'), ('airbnb', 'Airbnb'), ('expedia', 'Expedia'), ('smoobu', 'Smoobu'), ('google', 'Google Calendar'), ('other', 'Otro')], max_length=20)),
+                ('room_type_code', models.CharField(max_length=60)),
+                ('rate_plan_code', models.CharField(max_length=60)),
+                ('values', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('hotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ota_ari_states', to='core.hotel')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hotel', 'provider'], name='otas_otaari_hotel_i_f3d64a_idx')],
+                'unique_together': {('hotel', 'provider', 'room_type_code', 'rate_plan_code')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('otas', '0013_ota_ari_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='otaroommapping',
+            name='rate_push_state',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -85,6 +85,15 @@ class OtaRoomMapping(models.Model):
     # Última sincronización exitosa
     last_synced = models.DateTimeField(null=True, blank=True)
 
+    # Validadores HTTP y hash del último feed iCal importado (fetch condicional)
+    ical_etag = models.CharField(max_length=255, blank=True, null=True)
+    ical_last_modified = models.CharField(max_length=64, blank=True, null=True)
+    ical_content_hash = models.CharField(max_length=64, blank=True, null=True)
+
+    # Huella del último push de tarifas (Smoobu): precio/min_stay por fecha y firma de las
+    # reglas que aplican a la habitación (ver SmoobuSyncService.push_rates_for_room)
+    rate_push_state = models.JSONField(default=dict, blank=True)
+
     # Google Calendar Webhooks (opcional)
     google_watch_channel_id = models.CharField(max_length=120, blank=True, null=True)
     google_resource_id = models.CharField(max_length=120, blank=True, null=True)
@@ -233,6 +242,31 @@ class OtaRatePlanMapping(models.Model):
         return f"{self.hotel_id}:{self.provider}:{self.rate_plan_code}->{self.provider_code}"
 
 
+class OtaAriState(models.Model):
+    """
+    Último ARI enviado con éxito a un canal por (tipo de habitación, plan de tarifa).
+
+    `values` guarda por fecha ISO la tupla enviada:
+    [disponibilidad, precio, cerrado, CTA, CTD, min_stay, max_stay].
+    Se usa para enviar solo las fechas que cambiaron (ver services/ari_engine.py).
+    """
+    hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name="ota_ari_states")
+    provider = models.CharField(max_length=20, choices=OtaProvider.choices)
+    room_type_code = models.CharField(max_length=60)
+    rate_plan_code = models.CharField(max_length=60)
+    values = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [("hotel", "provider", "room_type_code", "rate_plan_code")]
+        indexes = [
+            models.Index(fields=["hotel", "provider"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.hotel_id}:{self.provider}:{self.room_type_code}/{self.rate_plan_code}"
+
+
 class SmoobuExportedBooking(models.Model):
     """
     Tracking de bookings/bloqueos creados en Smoobu desde AlojaSys (fase 2, push).
@@ -0,0 +1,256 @@
+"""
+Cálculo de ARI (disponibilidad, tarifa y restricciones) y envío por deltas.
+
+Antes push_ari_for_hotel mandaba disponibilidad 1 y precio fijo para todo el rango en
+cada cambio. El motor:
+
+- calcula por (tipo de habitación, plan de tarifa, fecha) la disponibilidad real
+  (habitaciones del tipo sin reserva activa ni bloqueo, vía OccupancyGrid), la tarifa
+  base del plan (índice tarifario + precio de la habitación, igual que el motor de
+  pricing) y las restricciones de la regla ganadora (cerrado, CTA, CTD, estadía mín./máx.)
+- compara contra el último estado aceptado por el canal (OtaAriState)
+- emite solo las fechas que cambiaron, agrupadas en rangos contiguos con valores iguales
+- reparte los rangos en lotes de OTA_ARI_MAX_ITEMS_PER_PUSH; el estado se actualiza solo
+  con los lotes que el canal aceptó
+
+Uso:
+    delta = build_ari_delta(hotel_id, provider, date_from, date_to)
+    for payload, ranges in delta.batches():
+        result = adapter.push_ari(payload)
+        if result.success:
+            delta.commit(ranges)
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from apps.rooms.models import Room
+from apps.reservations.services.occupancy import OccupancyGrid
+
+from ..models import OtaAriState, OtaRatePlanMapping, OtaRoomTypeMapping
+
+# Orden de los valores por fecha (en OtaAriState.values y en los items del payload)
+ARI_FIELDS = (
+    "availability",
+    "price",
+    "closed",
+    "closed_to_arrival",
+    "closed_to_departure",
+    "min_stay",
+    "max_stay",
+)
+
+# (room_type_code, rate_plan_code) internos del PMS
+AriKey = Tuple[str, str]
+
+
+@dataclass
+class AriRange:
+    """Fechas contiguas [date_from, date_to] de una combinación con los mismos valores."""
+    key: AriKey
+    date_from: date
+    date_to: date
+    values: List[Any]
+
+    def dates(self) -> Iterator[date]:
+        d = self.date_from
+        while d <= self.date_to:
+            yield d
+            d += timedelta(days=1)
+
+
+def _rooms_by_type(hotel_id: int, room_type_codes) -> Dict[str, List[Room]]:
+    rooms = Room.objects.filter(hotel_id=hotel_id, is_active=True, room_type__in=list(room_type_codes)).order_by("id")
+    by_type: Dict[str, List[Room]] = defaultdict(list)
+    for room in rooms:
+        by_type[room.room_type].append(room)
+    return by_type
+
+
+def _plan_index(base_index, rate_plan_code: str):
+    from apps.rates.services.rule_index import HotelRateIndex
+
+    rules = [r for r in base_index.rules if r.plan.code == rate_plan_code]
+    return HotelRateIndex(base_index.hotel_id, rules, base_index.occupancy, base_index.taxes)
+
+
+def compute_ari(
+    hotel_id: int,
+    provider: str,
+    date_from: date,
+    date_to: date,
+    *,
+    room_types: Optional[List[OtaRoomTypeMapping]] = None,
+    rate_plans: Optional[List[OtaRatePlanMapping]] = None,
+) -> Dict[AriKey, Dict[date, List[Any]]]:
+    """
+    ARI por (room_type_code, rate_plan_code) y fecha en [date_from, date_to].
+
+    La tarifa y las restricciones se toman de una habitación representativa del tipo
+    (la de menor id) a su capacidad estándar, con las reglas del plan para el canal.
+    """
+    from apps.rates.services.engine import _price_night
+    from apps.rates.services.rule_index import get_hotel_rate_index
+
+    if room_types is None:
+        room_types = list(OtaRoomTypeMapping.objects.filter(hotel_id=hotel_id, provider=provider, is_active=True))
+    if rate_plans is None:
+        rate_plans = list(OtaRatePlanMapping.objects.filter(hotel_id=hotel_id, provider=provider, is_active=True))
+    if not room_types or not rate_plans or date_to < date_from:
+        return {}
+
+    end = date_to + timedelta(days=1)
+    dates = [date_from + timedelta(days=i) for i in range((end - date_from).days)]
+    by_type = _rooms_by_type(hotel_id, {m.room_type_code for m in room_types})
+    all_rooms = [r for rooms in by_type.values() for r in rooms]
+    grid = OccupancyGrid.load(hotel_id, date_from, end, rooms=all_rooms, include_blocks=True)
+
+    availability: Dict[str, List[int]] = {}
+    for m in room_types:
+        busy = [grid.unavailable_bits(r.id) for r in by_type.get(m.room_type_code, [])]
+        availability[m.room_type_code] = [sum(1 for bits in busy if not (bits >> i) & 1) for i in range(len(dates))]
+
+    base_index = get_hotel_rate_index(hotel_id)
+    result: Dict[AriKey, Dict[date, List[Any]]] = {}
+    for rp in rate_plans:
+        index = _plan_index(base_index, rp.rate_plan_code)
+        for rt in room_types:
+            rooms = by_type.get(rt.room_type_code)
+            series: Dict[date, List[Any]] = {}
+            for i, d in enumerate(dates):
+                if not rooms:
+                    # Tipo mapeado sin habitaciones activas: sin inventario para vender
+                    series[d] = [0, None, True, False, False, None, None]
+                    continue
+                room = rooms[0]
+                rule = index.rule_for(room, d, provider, include_closed=True)
+                night = _price_night(
+                    room, room.capacity or 1, d, provider, None, None,
+                    index=index, promos=[], voucher=None,
+                )
+                series[d] = [
+                    availability[rt.room_type_code][i],
+                    str(night["base_rate"]),
+                    bool(rule and rule.closed),
+                    bool(rule and rule.closed_to_arrival),
+                    bool(rule and rule.closed_to_departure),
+                    rule.min_stay if rule else None,
+                    rule.max_stay if rule else None,
+                ]
+            result[(rt.room_type_code, rp.rate_plan_code)] = series
+    return result
+
+
+def coalesce_changes(
+    computed: Dict[AriKey, Dict[date, List[Any]]],
+    stored: Dict[AriKey, Dict[str, List[Any]]],
+) -> List[AriRange]:
+    """Fechas cuyo valor difiere del último enviado, agrupadas en rangos contiguos iguales."""
+    ranges: List[AriRange] = []
+    for key, series in computed.items():
+        previous = stored.get(key, {})
+        run: Optional[AriRange] = None
+        for d in sorted(series):
+            values = series[d]
+            if previous.get(d.isoformat()) == values:
+                run = None
+                continue
+            if run is not None and run.values == values and run.date_to + timedelta(days=1) == d:
+                run.date_to = d
+                continue
+            run = AriRange(key=key, date_from=d, date_to=d, values=values)
+            ranges.append(run)
+    return ranges
+
+
+class AriDelta:
+    """Rangos a enviar a un canal y persistencia del estado aceptado."""
+
+    def __init__(
+        self,
+        hotel_id: int,
+        provider: str,
+        ranges: List[AriRange],
+        states: Dict[AriKey, OtaAriState],
+        room_types: List[OtaRoomTypeMapping],
+        rate_plans: List[OtaRatePlanMapping],
+        evaluated_dates: int = 0,
+    ):
+        self.hotel_id = hotel_id
+        self.provider = provider
+        self.ranges = ranges
+        self.states = states
+        self.evaluated_dates = evaluated_dates
+        self._room_types = {m.room_type_code: m for m in room_types}
+        self._rate_plans = {m.rate_plan_code: m for m in rate_plans}
+
+    @property
+    def changed_dates(self) -> int:
+        return sum((r.date_to - r.date_from).days + 1 for r in self.ranges)
+
+    def item(self, r: AriRange) -> Dict[str, Any]:
+        rt = self._room_types[r.key[0]]
+        rp = self._rate_plans[r.key[1]]
+        return {
+            "room_type": rt.provider_code,
+            "rate_plan": rp.provider_code,
+            "currency": rp.currency,
+            "date_from": r.date_from.isoformat(),
+            "date_to": r.date_to.isoformat(),
+            **dict(zip(ARI_FIELDS, r.values)),
+        }
+
+    def batches(self, size: Optional[int] = None) -> Iterator[Tuple[Dict[str, Any], List[AriRange]]]:
+        """(payload, rangos) en lotes de a lo sumo `size` items."""
+        size = max(int(size or getattr(settings, "OTA_ARI_MAX_ITEMS_PER_PUSH", 200)), 1)
+        for i in range(0, len(self.ranges), size):
+            chunk = self.ranges[i:i + size]
+            payload = {"hotel_id": self.hotel_id, "provider": self.provider, "items": [self.item(r) for r in chunk]}
+            yield payload, chunk
+
+    def commit(self, ranges: List[AriRange]) -> None:
+        """Registra los rangos como aceptados por el canal (descarta fechas pasadas)."""
+        touched: Dict[AriKey, OtaAriState] = {}
+        for r in ranges:
+            state = self.states.get(r.key)
+            if state is None:
+                state = OtaAriState(
+                    hotel_id=self.hotel_id,
+                    provider=self.provider,
+                    room_type_code=r.key[0],
+                    rate_plan_code=r.key[1],
+                    values={},
+                )
+                self.states[r.key] = state
+            for d in r.dates():
+                state.values[d.isoformat()] = r.values
+            touched[r.key] = state
+        if not touched:
+            return
+        today = date.today().isoformat()
+        for state in touched.values():
+            state.values = {k: v for k, v in state.values.items() if k >= today}
+        with transaction.atomic():
+            for state in touched.values():
+                state.save()
+
+
+def build_ari_delta(hotel_id: int, provider: str, date_from: date, date_to: date, *, force: bool = False) -> AriDelta:
+    """Calcula el ARI de [date_from, date_to] y lo compara con el estado del canal (force=True reenvía todo)."""
+    room_types = list(OtaRoomTypeMapping.objects.filter(hotel_id=hotel_id, provider=provider, is_active=True))
+    rate_plans = list(OtaRatePlanMapping.objects.filter(hotel_id=hotel_id, provider=provider, is_active=True))
+    computed = compute_ari(hotel_id, provider, date_from, date_to, room_types=room_types, rate_plans=rate_plans)
+    states = {
+        (s.room_type_code, s.rate_plan_code): s
+        for s in OtaAriState.objects.filter(hotel_id=hotel_id, provider=provider)
+    }
+    stored = {} if force else {key: s.values or {} for key, s in states.items()}
+    ranges = coalesce_changes(computed, stored)
+    evaluated = sum(len(series) for series in computed.values())
+    return AriDelta(hotel_id, provider, ranges, states, room_types, rate_plans, evaluated_dates=evaluated)
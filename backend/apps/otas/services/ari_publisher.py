@@ -4,12 +4,11 @@ from dataclasses import dataclass
 from datetime import date, datetime, timedelta
 from typing import Iterable, Dict, Any
 
+from django.conf import settings
 from django.db import transaction
 
 from apps.otas.models import (
     OtaProvider,
-    OtaRoomTypeMapping,
-    OtaRatePlanMapping,
     OtaSyncJob,
     OtaSyncLog,
     OtaConfig,
@@ -17,10 +16,12 @@ from apps.otas.models import (
 )
 
 import json
-import time
 import requests
 import os
 
+from .http_client import ChannelHttpError, http_client
+from .sync_log import SyncLogBuffer
+
 
 @dataclass
 class AriPushResult:
@@ -45,6 +46,33 @@ class OtaAdapterBase:
         # En mock simplemente retorna éxito con conteo
         return AriPushResult(success=True, pushed=len(payload.get("items", [])), details={"mock": True})
 
+    def _post_ari(self, url: str, headers: Dict[str, str], body: Dict[str, Any], count: int) -> AriPushResult:
+        # Sesión keep-alive compartida; 429/5xx/red lanzan RetryableChannelError y la task
+        # se reprograma (sin dormir en el worker)
+        resp = http_client.post(self.provider, url, data=json.dumps(body), headers=headers)
+        details = {"mock": False, "status": resp.status_code, "endpoint": url}
+        if 200 <= resp.status_code < 300:
+            return AriPushResult(success=True, pushed=count, errors=0, details=details)
+        return AriPushResult(success=False, pushed=0, errors=count, details=details)
+
+    def check_availability(self, external_id: str, check_in: date, check_out: date, timeout: float | None = None) -> bool | None:
+        """
+        Consulta la disponibilidad de una habitación en el canal.
+        None = el canal no expone la consulta (o modo mock): vale solo la verificación local.
+        """
+        return None
+
+    def _get_availability(self, base_url: str, external_id: str, check_in: date, check_out: date, timeout: float | None) -> bool | None:
+        # Mismo pool / breaker que el push ARI; ante error o breaker abierto lanza ChannelHttpError
+        url = f"{base_url.rstrip('/')}/availability"
+        params = {"room_id": external_id, "check_in": check_in.isoformat(), "check_out": check_out.isoformat()}
+        kwargs = {"timeout": (http_client.timeout()[0], timeout)} if timeout else {}
+        resp = http_client.get(self.provider, url, params=params, headers={"X-Provider": str(self.provider)}, **kwargs)
+        if not (200 <= resp.status_code < 300):
+            raise ChannelHttpError(f"HTTP {resp.status_code} desde {self.provider}")
+        available = resp.json().get("available")
+        return None if available is None else bool(available)
+
     # Pull de reservas (interfaz)
     def pull_reservations(self, since: datetime) -> Dict[str, Any]:
         # En mock, generamos 1 reserva sintética para demo
@@ -93,31 +121,12 @@ class BookingAdapter(OtaAdapterBase):
             "items": payload.get("items", []),
         }
 
-        # Backoff simple (2 intentos)
-        for attempt in range(2):
-            try:
-                resp = requests.post(url, data=json.dumps(body), headers=headers, timeout=10)
-                ok = 200 <= resp.status_code < 300
-                details = {
-                    "mock": False,
-                    "status": resp.status_code,
-                    "endpoint": url,
-                }
-                if ok:
-                    return AriPushResult(success=True, pushed=len(payload.get("items", [])), errors=0, details=details)
-                # si 429/5xx, reintentar una vez
-                if resp.status_code in (429, 500, 502, 503, 504) and attempt == 0:
-                    time.sleep(1.0)
-                    continue
-                return AriPushResult(success=False, pushed=0, errors=len(payload.get("items", [])), details=details)
-            except Exception:
-                if attempt == 0:
-                    time.sleep(1.0)
-                    continue
-                break
-
-        # Fallback
-        return AriPushResult(success=True, pushed=len(payload.get("items", [])), details={"mock": True, "fallback": True})
+        return self._post_ari(url, headers, body, len(payload.get("items", [])))
+
+    def check_availability(self, external_id: str, check_in: date, check_out: date, timeout: float | None = None) -> bool | None:
+        if self.is_mock or not self.is_available():
+            return super().check_availability(external_id, check_in, check_out, timeout)
+        return self._get_availability(self.config.booking_base_url, external_id, check_in, check_out, timeout)
 
     def pull_reservations(self, since: datetime) -> Dict[str, Any]:
         if self.is_mock or not self.is_available():
@@ -128,7 +137,7 @@ class BookingAdapter(OtaAdapterBase):
         params = {"since": since.isoformat()}
         headers = {"X-Provider": "booking"}
         try:
-            resp = requests.get(url, params=params, headers=headers, timeout=10)
+            resp = http_client.get(self.provider, url, params=params, headers=headers)
             if 200 <= resp.status_code < 300:
                 return {"items": []}  # echo sin formato real
         except Exception:
@@ -164,24 +173,12 @@ class AirbnbAdapter(OtaAdapterBase):
             "items": payload.get("items", []),
         }
 
-        for attempt in range(2):
-            try:
-                resp = requests.post(url, data=json.dumps(body), headers=headers, timeout=10)
-                ok = 200 <= resp.status_code < 300
-                details = {"mock": False, "status": resp.status_code, "endpoint": url}
-                if ok:
-                    return AriPushResult(success=True, pushed=len(payload.get("items", [])), errors=0, details=details)
-                if resp.status_code in (429, 500, 502, 503, 504) and attempt == 0:
-                    time.sleep(1.0)
-                    continue
-                return AriPushResult(success=False, pushed=0, errors=len(payload.get("items", [])), details=details)
-            except Exception:
-                if attempt == 0:
-                    time.sleep(1.0)
-                    continue
-                break
-
-        return AriPushResult(success=True, pushed=len(payload.get("items", [])), details={"mock": True, "fallback": True})
+        return self._post_ari(url, headers, body, len(payload.get("items", [])))
+
+    def check_availability(self, external_id: str, check_in: date, check_out: date, timeout: float | None = None) -> bool | None:
+        if self.is_mock or not self.is_available():
+            return super().check_availability(external_id, check_in, check_out, timeout)
+        return self._get_availability(self.config.airbnb_base_url, external_id, check_in, check_out, timeout)
 
     def pull_reservations(self, since: datetime) -> Dict[str, Any]:
         if self.is_mock or not self.is_available():
@@ -192,7 +189,7 @@ class AirbnbAdapter(OtaAdapterBase):
         params = {"since": since.isoformat()}
         headers = {"X-Provider": "airbnb"}
         try:
-            resp = requests.get(url, params=params, headers=headers, timeout=10)
+            resp = http_client.get(self.provider, url, params=params, headers=headers)
             if 200 <= resp.status_code < 300:
                 return {"items": []}
         except Exception:
@@ -322,78 +319,66 @@ class SmoobuAdapter(OtaAdapterBase):
 
 
 @transaction.atomic
-def build_mock_ari_payload(
+def push_ari_for_hotel(
+    job: OtaSyncJob,
     hotel_id: int,
     provider: str,
     date_from: date,
     date_to: date,
+    force: bool = False,
 ) -> Dict[str, Any]:
-    # Construimos un payload minimal con mapeos activos
-    room_types = list(
-        OtaRoomTypeMapping.objects.filter(hotel_id=hotel_id, provider=provider, is_active=True)
-        .values("room_type_code", "provider_code")
-    )
-    rate_plans = list(
-        OtaRatePlanMapping.objects.filter(hotel_id=hotel_id, provider=provider, is_active=True)
-        .values("rate_plan_code", "provider_code", "currency")
-    )
-
-    items: list[Dict[str, Any]] = []
-    for rt in room_types:
-        for rp in rate_plans:
-            items.append({
-                "room_type": rt["provider_code"],
-                "rate_plan": rp["provider_code"],
-                "currency": rp["currency"],
-                "date_from": date_from.isoformat(),
-                "date_to": date_to.isoformat(),
-                # En real: disponibilidad diaria y precio por noche
-                "availability": 1,
-                "price": 10000,
-            })
-
-    return {"hotel_id": hotel_id, "provider": provider, "items": items}
-
-
-def push_ari_for_hotel(job: OtaSyncJob, hotel_id: int, provider: str, date_from: date, date_to: date) -> Dict[str, Any]:
+    """
+    Envía al canal solo el ARI que cambió desde el último push aceptado (ver ari_engine).
+    force=True reenvía el rango completo.
+    """
     from django.utils import timezone
     import traceback
-    
+    from .ari_engine import build_ari_delta
+
+    log = SyncLogBuffer(job)
     try:
         adapter = get_adapter(provider, hotel_id)
-        payload = build_mock_ari_payload(hotel_id, provider, date_from, date_to)
-
-        # Log de request
-        OtaSyncLog.objects.create(
-            job=job,
-            level=OtaSyncLog.Level.INFO,
-            message="PUSH_ARI_REQUEST",
-            payload={"provider": provider, "items": len(payload.get("items", []))},
-        )
+        delta = build_ari_delta(hotel_id, provider, date_from, date_to, force=force)
 
-        result = adapter.push_ari(payload)
+        pushed = 0
+        errors = 0
+        batches = 0
+        if not delta.ranges:
+            log.add(OtaSyncLog.Level.INFO, "PUSH_ARI_SKIPPED", {"provider": provider, "reason": "no_changes", "dates": delta.evaluated_dates})
 
-        # Log de response
-        OtaSyncLog.objects.create(
-            job=job,
-            level=OtaSyncLog.Level.INFO,
-            message="PUSH_ARI_RESPONSE",
-            payload={"pushed": result.pushed, "errors": result.errors, **(result.details or {})},
-        )
+        for payload, ranges in delta.batches():
+            batches += 1
+            # Log de request
+            log.add(OtaSyncLog.Level.INFO, "PUSH_ARI_REQUEST", {"provider": provider, "items": len(payload.get("items", [])), "batch": batches})
+
+            result = adapter.push_ari(payload)
+
+            # Log de response
+            log.add(OtaSyncLog.Level.INFO, "PUSH_ARI_RESPONSE", {"pushed": result.pushed, "errors": result.errors, "batch": batches, **(result.details or {})})
+
+            if result.success:
+                # Solo lo aceptado por el canal pasa a ser el estado conocido
+                delta.commit(ranges)
+                pushed += result.pushed
+            else:
+                errors += result.errors or len(ranges)
 
         job.stats = {
             **(job.stats or {}),
-            "pushed": result.pushed,
-            "errors": result.errors,
+            "pushed": pushed,
+            "errors": errors,
+            "batches": batches,
+            "ranges": len(delta.ranges),
+            "changed_dates": delta.changed_dates,
+            "evaluated_dates": delta.evaluated_dates,
         }
         return job.stats
     except Exception as e:
         # Registrar error en log con detalles completos
-        OtaSyncLog.objects.create(
-            job=job,
-            level=OtaSyncLog.Level.ERROR,
-            message="PUSH_ARI_SERVICE_ERROR",
-            payload={
+        log.add(
+            OtaSyncLog.Level.ERROR,
+            "PUSH_ARI_SERVICE_ERROR",
+            {
                 "hotel_id": hotel_id,
                 "provider": provider,
                 "error": str(e),
@@ -403,59 +388,63 @@ def push_ari_for_hotel(job: OtaSyncJob, hotel_id: int, provider: str, date_from:
             },
         )
         raise  # Re-lanzar para que el task lo maneje
+    finally:
+        log.flush()
 
 
 def pull_reservations_for_hotel(job: OtaSyncJob, hotel_id: int, provider: str, since: datetime) -> Dict[str, Any]:
     from django.utils import timezone
     import traceback
-    from apps.otas.services.ota_reservation_service import OtaReservationService
-    from apps.reservations.models import ReservationChannel, ReservationStatus, Reservation
-    
+    from apps.otas.services.ota_reservation_service import OtaBookingData, OtaReservationService
+    from apps.reservations.models import ReservationChannel
+
+    log = SyncLogBuffer(job)
     try:
         adapter = get_adapter(provider, hotel_id)
 
-        OtaSyncLog.objects.create(
-            job=job,
-            level=OtaSyncLog.Level.INFO,
-            message="PULL_RES_REQUEST",
-            payload={"provider": provider, "since": since.isoformat()},
-        )
+        log.add(OtaSyncLog.Level.INFO, "PULL_RES_REQUEST", {"provider": provider, "since": since.isoformat()})
 
         data = adapter.pull_reservations(since)
         items = data.get("items", [])
 
-        OtaSyncLog.objects.create(
-            job=job,
-            level=OtaSyncLog.Level.INFO,
-            message="PULL_RES_RESPONSE",
-            payload={"count": len(items)},
-        )
+        log.add(OtaSyncLog.Level.INFO, "PULL_RES_RESPONSE", {"count": len(items)})
 
         created = 0
         updated = 0
+        unchanged = 0
         skipped = 0
         errors = 0
 
         # Solo procesamos (upsert/cancel) en Smoobu por ahora. No afectamos comportamiento actual de Booking/Airbnb.
         if provider == OtaProvider.SMOOBU:
-            for it in items:
+            complete = [
+                it for it in items
+                if it.get("smoobu_id") and it.get("arrival") and it.get("departure") and it.get("apartment_id")
+            ]
+            skipped += len(items) - len(complete)
+
+            # Todos los mappings del lote en una consulta
+            mappings = {
+                m.external_id: m
+                for m in OtaRoomMapping.objects.select_related("hotel", "room").filter(
+                    hotel_id=hotel_id,
+                    provider=OtaProvider.SMOOBU,
+                    external_id__in={str(it.get("apartment_id")) for it in complete},
+                    is_active=True,
+                )
+            }
+
+            hotel = None
+            bookings = []
+            internal_block_ids = []
+            for it in complete:
                 try:
                     smoobu_id = it.get("smoobu_id")
-                    arrival = it.get("arrival")
-                    departure = it.get("departure")
-                    apartment_id = it.get("apartment_id")
-                    if not (smoobu_id and arrival and departure and apartment_id):
-                        skipped += 1
-                        continue
-
-                    mapping = (
-                        OtaRoomMapping.objects.select_related("hotel", "room")
-                        .filter(hotel_id=hotel_id, provider=OtaProvider.SMOOBU, external_id=str(apartment_id), is_active=True)
-                        .first()
-                    )
+                    mapping = mappings.get(str(it.get("apartment_id")))
                     if not mapping:
                         skipped += 1
                         continue
+                    hotel = mapping.hotel
 
                     # Evitar loop: bloqueos creados por AlojaSys en Smoobu vuelven por webhook/pull.
                     # No debemos crearlos como "reservas" en AlojaSys.
@@ -467,14 +456,7 @@ def pull_reservations_for_hotel(job: OtaSyncJob, hotel_id: int, provider: str, s
                         or (str(it.get("guest_name") or "").strip().lower() in ("bloqueo", "bloqueo alojasys"))
                     )
                     if is_internal_block:
-                        # Si alguna corrida anterior ya lo creó como reserva, la cancelamos para que no moleste.
-                        try:
-                            Reservation.objects.filter(
-                                hotel=mapping.hotel,
-                                external_id=f"smoobu:{smoobu_id}",
-                            ).exclude(status=ReservationStatus.CANCELLED).update(status=ReservationStatus.CANCELLED)
-                        except Exception:
-                            pass
+                        internal_block_ids.append(f"smoobu:{smoobu_id}")
                         skipped += 1
                         continue
 
@@ -489,11 +471,6 @@ def pull_reservations_for_hotel(job: OtaSyncJob, hotel_id: int, provider: str, s
                     else:
                         channel = ReservationChannel.OTHER
 
-                    external_id = f"smoobu:{smoobu_id}"
-
-                    # Si es un bloqueo, lo tratamos igual como reserva OTA para bloquear inventario en AlojaSys
-                    # (y para tener trazabilidad). En el futuro podríamos mapear a RoomBlock si preferís.
-
                     adults = it.get("adults") or 0
                     children = it.get("children") or 0
                     guests = max(int(adults) + int(children), 1)
@@ -513,27 +490,48 @@ def pull_reservations_for_hotel(job: OtaSyncJob, hotel_id: int, provider: str, s
                         }
                     ]
 
-                    # Upsert: si ya existe, cuenta como updated; si no, created.
-                    result = OtaReservationService.upsert_reservation(
-                        hotel=mapping.hotel,
+                    bookings.append(OtaBookingData(
                         room=mapping.room,
-                        external_id=external_id,
+                        external_id=f"smoobu:{smoobu_id}",
                         channel=channel,
-                        check_in=date.fromisoformat(arrival[:10]),
-                        check_out=date.fromisoformat(departure[:10]),
+                        check_in=date.fromisoformat(it.get("arrival")[:10]),
+                        check_out=date.fromisoformat(it.get("departure")[:10]),
                         guests=guests,
                         guests_data=guests_data,
                         notes=f"Importado desde Smoobu (canal: {it.get('channel_name')})",
                         ota_total_price=it.get("price"),
-                        provider_name=OtaProvider.SMOOBU.label,
-                    )
-                    if result.get("created"):
-                        created += 1
-                    else:
-                        updated += 1
+                    ))
                 except Exception:
                     errors += 1
 
+            # Si alguna corrida anterior ya creó un bloqueo propio como reserva, lo cancelamos.
+            if internal_block_ids:
+                try:
+                    OtaReservationService.cancel_internal_blocks(hotel_id, internal_block_ids)
+                except Exception:
+                    pass
+
+            # Upsert por lotes: una lectura con lock, escrituras bulk y trabajo derivado por lote
+            size = max(int(getattr(settings, "OTA_PULL_BATCH_SIZE", 200)), 1)
+            for i in range(0, len(bookings), size):
+                chunk = bookings[i:i + size]
+                try:
+                    result = OtaReservationService.upsert_reservations_batch(
+                        hotel=hotel,
+                        bookings=chunk,
+                        provider_name=OtaProvider.SMOOBU.label,
+                    )
+                    created += result["created"]
+                    updated += result["updated"]
+                    unchanged += result["unchanged"]
+                except Exception as e:
+                    errors += len(chunk)
+                    log.add(
+                        OtaSyncLog.Level.ERROR,
+                        "PULL_RES_BATCH_ERROR",
+                        {"hotel_id": hotel_id, "batch": i // size + 1, "count": len(chunk), "error": str(e)},
+                    )
+
         else:
             skipped = len(items)  # comportamiento anterior
 
@@ -542,17 +540,17 @@ def pull_reservations_for_hotel(job: OtaSyncJob, hotel_id: int, provider: str, s
             "fetched": len(items),
             "created": created,
             "updated": updated,
+            "unchanged": unchanged,
             "skipped": skipped,
             "errors": errors,
         }
         return job.stats
     except Exception as e:
         # Registrar error en log con detalles completos
-        OtaSyncLog.objects.create(
-            job=job,
-            level=OtaSyncLog.Level.ERROR,
-            message="PULL_RES_SERVICE_ERROR",
-            payload={
+        log.add(
+            OtaSyncLog.Level.ERROR,
+            "PULL_RES_SERVICE_ERROR",
+            {
                 "hotel_id": hotel_id,
                 "provider": provider,
                 "error": str(e),
@@ -562,5 +560,7 @@ def pull_reservations_for_hotel(job: OtaSyncJob, hotel_id: int, provider: str, s
             },
         )
         raise  # Re-lanzar para que el task lo maneje
+    finally:
+        log.flush()
 
 
@@ -2,31 +2,46 @@
 Servicio para verificar disponibilidad en tiempo real en las OTAs antes de confirmar reservas.
 Evita overbooking consultando las OTAs directamente antes de confirmar una reserva en AlojaSys.
 """
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import date, datetime
 from typing import Dict, List, Optional, Tuple
+from django.conf import settings
 from django.utils import timezone
 from django.core.cache import cache
 
 from apps.core.models import Hotel
 from apps.rooms.models import Room
-from apps.reservations.models import Reservation, ReservationStatus
+from apps.reservations.models import Reservation, ReservationStatus, RoomInventoryDay
 from apps.otas.models import OtaConfig, OtaRoomMapping, OtaProvider
 from apps.otas.services.ari_publisher import get_adapter
 
 
 class AvailabilityCheckResult:
     """Resultado de la verificación de disponibilidad en OTAs"""
+
+    # Origen del dato remoto: consultado ahora / de caché vigente / de caché vencida
+    # (el canal no respondió a tiempo) / desconocido (sin respuesta ni dato previo)
+    FRESH = "fresh"
+    CACHED = "cached"
+    STALE = "stale"
+    UNKNOWN = "unknown"
+
     def __init__(
         self,
         is_available: bool,
         provider: str = None,
         error: str = None,
-        details: Dict = None
+        details: Dict = None,
+        status: str = FRESH,
     ):
         self.is_available = is_available
         self.provider = provider
         self.error = error
         self.details = details or {}
+        self.status = status
 
     def __repr__(self):
         status = "✅ Disponible" if self.is_available else "❌ No disponible"
@@ -35,8 +50,38 @@ class AvailabilityCheckResult:
         return f"{status} ({self.provider})"
 
 
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # Pool compartido por proceso (los hilos no sobreviven a un fork del worker)
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "OTA_AVAILABILITY_MAX_WORKERS", 8),
+                thread_name_prefix="ota-availability",
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _cache_key(room: Room, check_in: date, check_out: date) -> str:
+    return f"otas:availability:{room.id}:{check_in.isoformat()}:{check_out.isoformat()}"
+
+
 class OtaAvailabilityChecker:
-    """Servicio para verificar disponibilidad en OTAs en tiempo real"""
+    """
+    Servicio para verificar disponibilidad en OTAs en tiempo real.
+
+    La verificación local (mapeos y reservas importadas) corre en el hilo del request;
+    las consultas a los canales salen en paralelo con un deadline global
+    (OTA_AVAILABILITY_DEADLINE_SECONDS) y un timeout por canal. Las respuestas remotas se
+    cachean por habitación y rango (OTA_AVAILABILITY_CACHE_SECONDS); si un canal no
+    responde a tiempo se usa la última respuesta conocida (stale) o se informa unknown.
+    """
 
     @staticmethod
     def check_availability_for_room(
@@ -57,31 +102,63 @@ class OtaAvailabilityChecker:
         Returns:
             Lista de AvailabilityCheckResult, uno por cada OTA configurada
         """
-        results = []
-        
         # Obtener todas las configuraciones OTA activas para este hotel
-        ota_configs = OtaConfig.objects.filter(
+        ota_configs = list(OtaConfig.objects.filter(
             hotel=room.hotel,
             is_active=True,
             provider__in=[OtaProvider.BOOKING, OtaProvider.AIRBNB]
-        )
+        ))
         
-        if not ota_configs.exists():
+        if not ota_configs:
             # Si no hay OTAs configuradas, retornar disponible
             return [AvailabilityCheckResult(is_available=True, provider="none", details={"message": "No hay OTAs configuradas"})]
-        
-        # Verificar disponibilidad en cada OTA
-        for ota_config in ota_configs:
-            result = OtaAvailabilityChecker._check_ota_availability(
-                ota_config,
-                room,
-                check_in,
-                check_out,
-                exclude_reservation_id
+
+        mappings = {
+            m.provider: m
+            for m in OtaRoomMapping.objects.filter(
+                hotel=room.hotel,
+                room=room,
+                provider__in=[c.provider for c in ota_configs],
+                is_active=True,
             )
-            results.append(result)
-        
-        return results
+        }
+
+        # Verificación local en este hilo; lo que requiere consultar al canal queda pendiente
+        results: Dict[str, AvailabilityCheckResult] = {}
+        remote: Dict[str, Tuple[object, OtaRoomMapping]] = {}
+        for ota_config in ota_configs:
+            try:
+                adapter = get_adapter(ota_config.provider, ota_config.hotel_id)
+                result = OtaAvailabilityChecker._check_ota_availability(
+                    ota_config,
+                    room,
+                    check_in,
+                    check_out,
+                    exclude_reservation_id,
+                    adapter=adapter,
+                    mapping=mappings.get(ota_config.provider),
+                )
+            except Exception as e:
+                result = OtaAvailabilityChecker._error_result(ota_config.provider, e)
+            if result is None:
+                remote[ota_config.provider] = (adapter, mappings[ota_config.provider])
+            else:
+                results[ota_config.provider] = result
+
+        if remote:
+            results.update(OtaAvailabilityChecker._check_remote(room, check_in, check_out, remote))
+
+        return [results[c.provider] for c in ota_configs]
+
+    @staticmethod
+    def _error_result(provider: str, e: Exception) -> AvailabilityCheckResult:
+        # Si hay error al verificar, no bloquear la reserva pero loggear
+        return AvailabilityCheckResult(
+            is_available=True,  # Permitir por defecto si hay error
+            provider=provider,
+            error=str(e),
+            details={"warning": "Error al verificar disponibilidad, se permitió la reserva"}
+        )
 
     @staticmethod
     def _check_ota_availability(
@@ -89,10 +166,13 @@ class OtaAvailabilityChecker:
         room: Room,
         check_in: date,
         check_out: date,
-        exclude_reservation_id: Optional[int] = None
-    ) -> AvailabilityCheckResult:
+        exclude_reservation_id: Optional[int] = None,
+        *,
+        adapter=None,
+        mapping: Optional[OtaRoomMapping] = None,
+    ) -> Optional[AvailabilityCheckResult]:
         """
-        Verifica disponibilidad en una OTA específica.
+        Verificación local de disponibilidad para una OTA específica.
         
         Args:
             ota_config: Configuración de la OTA
@@ -100,103 +180,154 @@ class OtaAvailabilityChecker:
             check_in: Fecha de check-in
             check_out: Fecha de check-out
             exclude_reservation_id: ID de reserva a excluir
+            adapter / mapping: ya resueltos por check_availability_for_room
         
         Returns:
-            AvailabilityCheckResult con el resultado de la verificación
+            AvailabilityCheckResult, o None si localmente está disponible y hay que
+            consultar al canal
         """
-        try:
-            # Obtener adapter para la OTA
-            adapter = get_adapter(ota_config.provider, ota_config.hotel_id)
-            
-            if not adapter or not adapter.is_available():
-                # Si el adapter no está disponible (sin credenciales, modo mock, etc.)
-                # No podemos verificar, asumimos disponible pero loggear
-                return AvailabilityCheckResult(
-                    is_available=True,
-                    provider=ota_config.provider,
-                    details={"warning": "Adapter no disponible, no se pudo verificar"}
-                )
-            
-            # Intentar consultar disponibilidad en la OTA
-            # Por ahora, verificamos si hay reservas en el PMS con external_id de esa OTA
-            # En el futuro, esto podría hacer una llamada real a la API de la OTA
-            
-            # Verificar mapeo de la habitación
-            mapping = OtaRoomMapping.objects.filter(
-                hotel=room.hotel,
-                room=room,
+        if adapter is None or not adapter.is_available():
+            # Si el adapter no está disponible (sin credenciales, modo mock, etc.)
+            # No podemos verificar, asumimos disponible pero loggear
+            return AvailabilityCheckResult(
+                is_available=True,
                 provider=ota_config.provider,
-                is_active=True
-            ).first()
-            
-            if not mapping:
-                # Si no hay mapeo, no podemos verificar en la OTA
-                return AvailabilityCheckResult(
-                    is_available=True,
-                    provider=ota_config.provider,
-                    details={"warning": "No hay mapeo configurado para esta habitación en la OTA"}
-                )
-            
-            # Verificar si hay reservas en el PMS que vengan de esta OTA en el rango de fechas
-            # (Esto es una verificación local, no una consulta real a la OTA)
-            # Para una verificación real, necesitaríamos llamar a la API de la OTA
-            
-            # Por ahora, verificamos reservas existentes en el PMS con external_id de esa OTA
-            channel_map = {
-                OtaProvider.BOOKING: "booking",
-                OtaProvider.AIRBNB: "other",
-                OtaProvider.EXPEDIA: "expedia",
-            }
-            channel = channel_map.get(ota_config.provider, "other")
-            
-            conflicting_reservations = Reservation.objects.filter(
-                hotel=room.hotel,
-                room=room,
-                channel=channel,
-                external_id__isnull=False,  # Solo reservas importadas desde OTAs
-                status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN],
-                check_in__lt=check_out,
-                check_out__gt=check_in,
+                details={"warning": "Adapter no disponible, no se pudo verificar"}
             )
-            
-            if exclude_reservation_id:
-                conflicting_reservations = conflicting_reservations.exclude(id=exclude_reservation_id)
-            
-            if conflicting_reservations.exists():
-                # Hay conflicto con reservas importadas desde la OTA
-                return AvailabilityCheckResult(
-                    is_available=False,
-                    provider=ota_config.provider,
-                    error="Habitación ocupada en la OTA (reservas existentes en el PMS)",
-                    details={
-                        "conflicting_reservations": list(
-                            conflicting_reservations.values_list("id", "external_id", "check_in", "check_out")
-                        )
-                    }
-                )
-            
-            # TODO: En el futuro, aquí se podría hacer una llamada real a la API de la OTA
-            # para verificar disponibilidad en tiempo real
-            # Por ejemplo:
-            # availability = adapter.check_availability(mapping.external_id, check_in, check_out)
-            # if not availability.is_available:
-            #     return AvailabilityCheckResult(is_available=False, provider=ota_config.provider, ...)
-            
-            # Por ahora, si no hay conflictos locales, asumimos disponible
+
+        if not mapping:
+            # Si no hay mapeo, no podemos verificar en la OTA
             return AvailabilityCheckResult(
                 is_available=True,
                 provider=ota_config.provider,
-                details={"message": "Disponible según reservas locales (no se consultó la OTA directamente)"}
+                details={"warning": "No hay mapeo configurado para esta habitación en la OTA"}
             )
-            
-        except Exception as e:
-            # Si hay error al verificar, no bloquear la reserva pero loggear
+
+        # Verificamos reservas existentes en el PMS con external_id de esa OTA
+        channel_map = {
+            OtaProvider.BOOKING: "booking",
+            OtaProvider.AIRBNB: "other",
+            OtaProvider.EXPEDIA: "expedia",
+        }
+        channel = channel_map.get(ota_config.provider, "other")
+
+        # Atajo: si el inventario diario no tiene días ocupados en el rango (fuera de la
+        # reserva excluida), no puede haber conflictos y evitamos el join de solapamiento
+        occupied_days = RoomInventoryDay.objects.filter(
+            room=room,
+            occupied=True,
+            date__gte=check_in,
+            date__lt=check_out,
+        )
+        if exclude_reservation_id:
+            occupied_days = occupied_days.exclude(reservation_id=exclude_reservation_id)
+        if not occupied_days.exists():
+            return None
+
+        conflicting_reservations = Reservation.objects.filter(
+            hotel=room.hotel,
+            room=room,
+            channel=channel,
+            external_id__isnull=False,  # Solo reservas importadas desde OTAs
+            status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN],
+            check_in__lt=check_out,
+            check_out__gt=check_in,
+        )
+
+        if exclude_reservation_id:
+            conflicting_reservations = conflicting_reservations.exclude(id=exclude_reservation_id)
+
+        if conflicting_reservations.exists():
+            # Hay conflicto con reservas importadas desde la OTA
             return AvailabilityCheckResult(
-                is_available=True,  # Permitir por defecto si hay error
+                is_available=False,
                 provider=ota_config.provider,
-                error=str(e),
-                details={"warning": "Error al verificar disponibilidad, se permitió la reserva"}
+                error="Habitación ocupada en la OTA (reservas existentes en el PMS)",
+                details={
+                    "conflicting_reservations": list(
+                        conflicting_reservations.values_list("id", "external_id", "check_in", "check_out")
+                    )
+                }
+            )
+
+        return None
+
+    @staticmethod
+    def _check_remote(
+        room: Room,
+        check_in: date,
+        check_out: date,
+        remote: Dict[str, Tuple[object, OtaRoomMapping]],
+    ) -> Dict[str, AvailabilityCheckResult]:
+        """Consulta los canales en paralelo; el costo total lo acota el deadline global."""
+        key = _cache_key(room, check_in, check_out)
+        fresh_for = getattr(settings, "OTA_AVAILABILITY_CACHE_SECONDS", 30)
+        try:
+            cached = cache.get(key) or {}
+        except Exception:
+            cached = {}
+        now = time.time()
+
+        answers: Dict[str, Dict] = {}
+        results: Dict[str, AvailabilityCheckResult] = {}
+        futures = {}
+        provider_timeout = getattr(settings, "OTA_AVAILABILITY_PROVIDER_TIMEOUT", 2.0)
+        for provider, (adapter, mapping) in remote.items():
+            entry = cached.get(provider)
+            if entry and now - entry["at"] < fresh_for:
+                results[provider] = OtaAvailabilityChecker._remote_result(provider, entry, AvailabilityCheckResult.CACHED)
+                continue
+            futures[_get_executor().submit(
+                adapter.check_availability, mapping.external_id, check_in, check_out, provider_timeout
+            )] = provider
+
+        if futures:
+            done, _ = wait(futures, timeout=getattr(settings, "OTA_AVAILABILITY_DEADLINE_SECONDS", 2.5))
+            for future, provider in futures.items():
+                if future in done and future.exception() is None:
+                    answers[provider] = {"available": future.result(), "at": now}
+                    results[provider] = OtaAvailabilityChecker._remote_result(provider, answers[provider], AvailabilityCheckResult.FRESH)
+                    continue
+                reason = "deadline" if future not in done else str(future.exception())
+                entry = cached.get(provider)
+                if entry:
+                    result = OtaAvailabilityChecker._remote_result(provider, entry, AvailabilityCheckResult.STALE)
+                else:
+                    # Sin respuesta ni dato previo: no bloqueamos, pero queda marcado
+                    result = AvailabilityCheckResult(
+                        is_available=True,
+                        provider=provider,
+                        status=AvailabilityCheckResult.UNKNOWN,
+                        details={"warning": "La OTA no respondió a tiempo; disponible según reservas locales"},
+                    )
+                result.details["reason"] = reason
+                results[provider] = result
+
+        if answers:
+            try:
+                cache.set(key, {**cached, **answers}, timeout=getattr(settings, "OTA_AVAILABILITY_STALE_SECONDS", 600))
+            except Exception:
+                pass
+        return results
+
+    @staticmethod
+    def _remote_result(provider: str, entry: Dict, status: str) -> AvailabilityCheckResult:
+        details = {"checked_at": entry["at"]}
+        if status == AvailabilityCheckResult.STALE:
+            details["stale"] = True
+        if entry["available"] is False:
+            return AvailabilityCheckResult(
+                is_available=False,
+                provider=provider,
+                error="Habitación no disponible en la OTA",
+                details=details,
+                status=status,
             )
+        if entry["available"] is None:
+            details["message"] = "Disponible según reservas locales (la OTA no expone consulta de disponibilidad)"
+        else:
+            details["message"] = "Disponible en la OTA"
+        return AvailabilityCheckResult(is_available=True, provider=provider, details=details, status=status)
 
     @staticmethod
     def validate_before_confirmation(
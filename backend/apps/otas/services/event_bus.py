@@ -0,0 +1,210 @@
+"""
+Publicador de eventos de OTAs (pub/sub de Redis) compartido por todo el proceso.
+
+Antes cada evento creaba su propio cliente `redis.Redis` (un connect TCP por publish).
+EventPublisher usa un único ConnectionPool por proceso y:
+
+- envía los publish en pipeline (canal global + canal del hotel en un solo round-trip)
+- dentro de `batch()` acumula los eventos de un ciclo de sync y los envía juntos al
+  salir, deduplicando eventos idénticos
+- usa timeouts cortos de socket y, ante un fallo, deja de intentar durante
+  OTA_EVENTS_BACKOFF_SECONDS (los eventos se descartan y se cuentan): un Redis lento
+  no frena los jobs de sincronización
+- lleva las métricas (enviados / fallidos / descartados, latencia de publish) en un hash
+  de Redis compartido por todos los procesos, dentro del mismo pipeline de los publish;
+  `metrics()` las lee desde cualquier proceso (la API web no publica eventos)
+
+Uso:
+    from apps.otas.services.event_bus import publish_event, publisher
+
+    publish_event(hotel_id, {"type": "reservations_updated", "provider": "ical"})
+
+    with publisher.batch():
+        for m in mappings:
+            ...
+            publish_event(m.hotel_id, {...})
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+GLOBAL_CHANNEL = "otas:events"
+METRICS_KEY = "otas:events:metrics"
+
+
+def hotel_channel(hotel_id: int) -> str:
+    return f"{GLOBAL_CHANNEL}:{hotel_id}"
+
+
+def redis_url() -> str:
+    # Misma resolución que antes del publicador compartido: variable REDIS_HOST o "redis"
+    return f"redis://{os.environ.get('REDIS_HOST', 'redis')}:6379/0"
+
+
+def _default_client_factory():
+    import redis
+
+    timeout = getattr(settings, "OTA_EVENTS_REDIS_TIMEOUT", 0.5)
+    pool = redis.ConnectionPool.from_url(
+        redis_url(),
+        max_connections=getattr(settings, "OTA_EVENTS_REDIS_MAX_CONNECTIONS", 10),
+        socket_timeout=timeout,
+        socket_connect_timeout=timeout,
+        health_check_interval=30,
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+class EventPublisher:
+    """Publicador con pool de conexiones, pipeline, lotes y degradación ante fallos."""
+
+    # Tope de eventos pendientes en un lote (se envía antes si se alcanza)
+    MAX_PENDING = 200
+
+    def __init__(self, client_factory: Optional[Callable[[], Any]] = None):
+        self._client_factory = client_factory or _default_client_factory
+        self._client = None
+        self._pid = None
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._disabled_until = 0.0
+        # Métricas todavía no enviadas al hash compartido (fallos, descartes y latencias
+        # se conocen después del pipeline y viajan con el siguiente)
+        self._unsynced: Dict[str, float] = {}
+        self._last_latency_ms: Optional[float] = None
+
+    # ---- conexión ----
+    def _get_client(self):
+        # ConnectionPool no se comparte entre procesos: recrearlo tras un fork (prefork de Celery)
+        pid = os.getpid()
+        with self._lock:
+            if self._client is None or self._pid != pid:
+                self._client = self._client_factory()
+                self._pid = pid
+            return self._client
+
+    def client(self):
+        """Cliente Redis del pool compartido del proceso."""
+        return self._get_client()
+
+    # ---- cola / lotes ----
+    def _pending(self) -> Optional[List[Tuple[str, str]]]:
+        return getattr(self._local, "pending", None)
+
+    @contextmanager
+    def batch(self):
+        """Acumula los publish del bloque y los envía en un único pipeline al salir."""
+        outer = self._pending() is None
+        if outer:
+            self._local.pending = []
+        try:
+            yield self
+        finally:
+            if outer:
+                pending = self._local.pending
+                self._local.pending = None
+                self._send(pending)
+
+    def publish(self, hotel_id: Optional[int], event: Dict[str, Any]) -> None:
+        """Publica el evento en el canal global y, si hay hotel, en el canal del hotel."""
+        payload = json.dumps(event)
+        messages = [(GLOBAL_CHANNEL, payload)]
+        if hotel_id is not None:
+            messages.append((hotel_channel(hotel_id), payload))
+        pending = self._pending()
+        if pending is None:
+            self._send(messages)
+            return
+        for message in messages:
+            if message not in pending:
+                pending.append(message)
+        if len(pending) >= self.MAX_PENDING:
+            self._local.pending = []
+            self._send(pending)
+
+    def _send(self, messages: List[Tuple[str, str]]) -> None:
+        if not messages:
+            return
+        now = time.monotonic()
+        if now < self._disabled_until:
+            self._count("dropped", len(messages))
+            return
+        with self._lock:
+            unsynced, self._unsynced = self._unsynced, {}
+            last_latency = self._last_latency_ms
+        started = time.perf_counter()
+        try:
+            pipe = self._get_client().pipeline(transaction=False)
+            for channel, payload in messages:
+                pipe.publish(channel, payload)
+            pipe.hincrby(METRICS_KEY, "published", len(messages))
+            pipe.hincrby(METRICS_KEY, "flushes", 1)
+            for field, value in unsynced.items():
+                if isinstance(value, float):
+                    pipe.hincrbyfloat(METRICS_KEY, field, value)
+                else:
+                    pipe.hincrby(METRICS_KEY, field, value)
+            if last_latency is not None:
+                pipe.hset(METRICS_KEY, "last_latency_ms", last_latency)
+            pipe.execute()
+        except Exception:
+            with self._lock:
+                for field, value in unsynced.items():
+                    self._unsynced[field] = self._unsynced.get(field, 0) + value
+                self._disabled_until = time.monotonic() + getattr(settings, "OTA_EVENTS_BACKOFF_SECONDS", 30)
+            self._count("failed", len(messages))
+            return
+        latency_ms = round((time.perf_counter() - started) * 1000.0, 3)
+        self._count("latency_ms_total", latency_ms)
+        self._count("latency_samples", 1)
+        with self._lock:
+            self._last_latency_ms = latency_ms
+
+    # ---- métricas ----
+    def _count(self, key: str, n: float) -> None:
+        with self._lock:
+            self._unsynced[key] = self._unsynced.get(key, 0) + n
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Métricas de todos los procesos (hash de Redis) más lo que este proceso todavía no
+        envió. `degraded` y `shared` describen la conexión de este proceso con Redis.
+        """
+        data: Dict[str, Any] = {"published": 0, "failed": 0, "dropped": 0, "flushes": 0}
+        shared = True
+        try:
+            stored = self._get_client().hgetall(METRICS_KEY) or {}
+        except Exception:
+            stored, shared = {}, False
+        totals: Dict[str, float] = {}
+        for field, value in stored.items():
+            field = field.decode() if isinstance(field, bytes) else field
+            totals[field] = float(value.decode() if isinstance(value, bytes) else value)
+        with self._lock:
+            for field, value in self._unsynced.items():
+                totals[field] = totals.get(field, 0) + value
+            data["degraded"] = time.monotonic() < self._disabled_until
+        for field in ("published", "failed", "dropped", "flushes"):
+            data[field] = int(totals.get(field, 0))
+        samples = totals.get("latency_samples", 0)
+        data["avg_latency_ms"] = round(totals["latency_ms_total"] / samples, 3) if samples else None
+        data["last_latency_ms"] = totals.get("last_latency_ms", self._last_latency_ms)
+        data["shared"] = shared
+        return data
+
+
+publisher = EventPublisher()
+
+
+def publish_event(hotel_id: Optional[int], event: Dict[str, Any]) -> None:
+    """Publica un evento de OTAs con el publicador compartido del proceso."""
+    if hotel_id is not None and "hotel_id" not in event:
+        event = {**event, "hotel_id": hotel_id}
+    publisher.publish(hotel_id, event)
@@ -0,0 +1,186 @@
+"""
+Fan-out de eventos de OTAs para el stream SSE (servido bajo ASGI).
+
+Antes cada cliente SSE abría su propia suscripción pub/sub y un loop de polling de 1s
+en un hilo del worker WSGI. EventHub mantiene UNA suscripción por proceso (redis.asyncio)
+y reparte cada mensaje a las colas asyncio de los clientes conectados:
+
+- un stream abierto es una corrutina con una cola acotada (sin hilos)
+- cada mensaje recibe un id "<boot>-<seq>" y se guarda en un buffer circular; con
+  Last-Event-ID el cliente recibe lo que se perdió mientras reconectaba
+- los heartbeats salen del timeout de espera de la cola (no hay polling)
+- un cliente lento que llena su cola se desconecta; el navegador reconecta y repone
+  lo pendiente desde el buffer
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Deque, Optional, Set, Tuple
+
+from django.conf import settings
+
+from .event_bus import GLOBAL_CHANNEL, redis_url
+
+# Fin de stream para un cliente (desconexión forzada)
+_CLOSE = object()
+
+
+@dataclass(eq=False)
+class Subscriber:
+    hotel_id: Optional[str]
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=settings.OTA_EVENTS_CLIENT_QUEUE))
+
+    def wants(self, hotel_id: Optional[str]) -> bool:
+        return self.hotel_id is None or hotel_id is None or self.hotel_id == hotel_id
+
+
+def _default_pubsub_factory():
+    import redis.asyncio as aioredis
+
+    client = aioredis.Redis.from_url(redis_url(), decode_responses=True)
+    return client.pubsub(ignore_subscribe_messages=True)
+
+
+class EventHub:
+    """Suscripción pub/sub compartida y reparto de eventos a los streams del proceso."""
+
+    def __init__(self, pubsub_factory: Optional[Callable[[], Any]] = None, buffer_size: Optional[int] = None):
+        self._pubsub_factory = pubsub_factory or _default_pubsub_factory
+        self._boot = format(int(time.time() * 1000), "x")
+        self._seq = itertools.count(1)
+        self._buffer: Deque[Tuple[int, Optional[str], str]] = deque(
+            maxlen=buffer_size or settings.OTA_EVENTS_REPLAY_BUFFER
+        )
+        self._subscribers: Set[Subscriber] = set()
+        self._reader: Optional[asyncio.Task] = None
+
+    # ---- ids ----
+    def event_id(self, seq: int) -> str:
+        return f"{self._boot}-{seq}"
+
+    def _parse_last_id(self, last_event_id: Optional[str]) -> Optional[int]:
+        # Ids de otro proceso / arranque no sirven para reponer
+        if not last_event_id or "-" not in last_event_id:
+            return None
+        boot, _, seq = last_event_id.rpartition("-")
+        if boot != self._boot or not seq.isdigit():
+            return None
+        return int(seq)
+
+    # ---- reparto ----
+    def dispatch(self, data: str) -> int:
+        """Registra el mensaje en el buffer y lo encola para cada suscriptor interesado."""
+        try:
+            hotel_id = json.loads(data).get("hotel_id")
+        except (ValueError, AttributeError):
+            hotel_id = None
+        hotel_id = str(hotel_id) if hotel_id is not None else None
+        seq = next(self._seq)
+        self._buffer.append((seq, hotel_id, data))
+        for sub in list(self._subscribers):
+            if not sub.wants(hotel_id):
+                continue
+            try:
+                sub.queue.put_nowait((seq, data))
+            except asyncio.QueueFull:
+                self._kick(sub)
+        return seq
+
+    def _kick(self, sub: Subscriber) -> None:
+        self._subscribers.discard(sub)
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(_CLOSE)
+
+    async def _read_forever(self) -> None:
+        backoff = 1
+        while self._subscribers:
+            pubsub = None
+            try:
+                pubsub = self._pubsub_factory()
+                await pubsub.subscribe(GLOBAL_CHANNEL)
+                backoff = 1
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.dispatch(message.get("data"))
+                    if not self._subscribers:
+                        break
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose() if hasattr(pubsub, "aclose") else await pubsub.close()
+                    except Exception:
+                        pass
+        self._reader = None
+
+    def _ensure_reader(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._reader is None or self._reader.done() or self._reader.get_loop() is not loop:
+            self._reader = loop.create_task(self._read_forever())
+
+    # ---- clientes ----
+    async def stream(
+        self,
+        hotel_id: Optional[str] = None,
+        last_event_id: Optional[str] = None,
+        heartbeat: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        """Generador SSE para un cliente: repone desde Last-Event-ID y luego sigue en vivo."""
+        heartbeat = heartbeat or settings.OTA_EVENTS_HEARTBEAT_SECONDS
+        sub = Subscriber(hotel_id=str(hotel_id) if hotel_id else None)
+        self._subscribers.add(sub)
+        self._ensure_reader()
+        try:
+            yield "event: ping\ndata: {}\n\n"
+            last_seq = self._parse_last_id(last_event_id)
+            if last_seq is not None:
+                for seq, event_hotel, data in list(self._buffer):
+                    if seq > last_seq and sub.wants(event_hotel):
+                        yield self._format(seq, data)
+                        last_seq = seq
+            while True:
+                try:
+                    item = await asyncio.wait_for(sub.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield "event: ping\ndata: {}\n\n"
+                    continue
+                if item is _CLOSE:
+                    return
+                seq, data = item
+                if last_seq is not None and seq <= last_seq:
+                    continue  # ya enviado en la reposición
+                yield self._format(seq, data)
+        finally:
+            self._subscribers.discard(sub)
+            # Sin clientes no hace falta mantener la suscripción abierta
+            if not self._subscribers and self._reader is not None:
+                self._reader.cancel()
+                self._reader = None
+
+    def _format(self, seq: int, data: str) -> str:
+        return f"id: {self.event_id(seq)}\nevent: update\ndata: {data}\n\n"
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+
+_hub: Optional[EventHub] = None
+
+
+def get_hub() -> EventHub:
+    """Hub del proceso (uno por worker ASGI)."""
+    global _hub
+    if _hub is None:
+        _hub = EventHub()
+    return _hub
@@ -1,23 +1,39 @@
+"""
+Sincronización con Google Calendar.
+
+- import: lista eventos (incremental con syncToken) y los concilia contra OtaImportedEvent y
+  Reservation con consultas por conjunto; las altas/cambios pasan por
+  OtaReservationService.upsert_reservations_batch
+- export / delete: las llamadas a la API se agrupan en requests batch (búsqueda del evento
+  por extendedProperty y escritura), varias reservas y calendarios por request
+- import_all_google reparte los mapeos en shards (tasks) y dentro de cada shard los listados
+  corren en paralelo (solo HTTP); la escritura en la base queda en serie
+"""
 from __future__ import annotations
 
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
+from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
 
 from apps.reservations.models import Reservation, ReservationStatus, ReservationChannel
 from apps.otas.models import OtaRoomMapping, OtaSyncJob, OtaSyncLog, OtaProvider, OtaImportedEvent
 from apps.notifications.services import NotificationService
-from .ota_reservation_service import OtaReservationService
+from .ota_reservation_service import OtaBookingData, OtaReservationService
+from .sync_log import SyncLogBuffer
 
 # Lazy import para evitar errores si no están instaladas las dependencias de Google
 try:
-    from ..adapters.google_calendar_adapter import list_events, watch_calendar, insert_event, update_event, delete_event, get_calendar
+    from ..adapters.google_calendar_adapter import list_events, watch_calendar, insert_event, update_event, delete_event, get_calendar, execute_batch
     GOOGLE_AVAILABLE = True
 except ImportError:
     GOOGLE_AVAILABLE = False
     list_events = None
+    execute_batch = None
     watch_calendar = None
     insert_event = None
     update_event = None
@@ -33,8 +49,6 @@ def _event_dates(google_event: Dict[str, Any]) -> tuple[date, date]:
     será check-in=25 y check-out=26 (1 noche). Google envía end exclusivo
     para all‑day, por lo que restamos 1 día.
     """
-    from datetime import timedelta
-
     def _to_date(d: Dict[str, str]) -> date:
         if 'date' in d:  # all-day event
             return date.fromisoformat(d['date'])
@@ -54,23 +68,11 @@ def _event_dates(google_event: Dict[str, Any]) -> tuple[date, date]:
     return start, end
 
 
-@transaction.atomic
-def import_events_for_mapping(mapping: OtaRoomMapping, job: Optional[OtaSyncJob] = None) -> Dict[str, Any]:
-    """Importa eventos de Google Calendar como reservas del PMS.
-
-    mapping.external_id debe contener el Calendar ID.
-    OtaConfig.credentials debe contener `service_account_json` con las credenciales.
-    """
-    if not GOOGLE_AVAILABLE:
-        return {"processed": 0, "created": 0, "updated": 0, "errors": 1, "reason": "google_api_not_installed"}
-    
-    stats: Dict[str, Any] = {"processed": 0, "created": 0, "updated": 0, "errors": 0}
-
-    # Obtener credenciales desde OtaConfig del hotel/proveedor
-    ota_config = mapping.hotel.ota_configs.filter(provider=OtaProvider.GOOGLE, is_active=True).first()
+def _credentials_for_hotel(hotel) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """(JSON de la service account, None) o (None, motivo) según el OtaConfig de Google del hotel."""
+    ota_config = hotel.ota_configs.filter(provider=OtaProvider.GOOGLE, is_active=True).first()
     if not ota_config:
-        return {**stats, "reason": "no_active_google_config"}
-
+        return None, "no_active_google_config"
     creds_container = ota_config.credentials or {}
     # Aceptar dos formatos: {"service_account_json": {...}} o el JSON de SA plano
     if isinstance(creds_container, dict) and "service_account_json" in creds_container:
@@ -79,261 +81,307 @@ def import_events_for_mapping(mapping: OtaRoomMapping, job: Optional[OtaSyncJob]
         creds = creds_container  # asumir que ya es el JSON de la service account
     # Validación mínima
     if not isinstance(creds, dict) or creds.get("type") != "service_account":
-        return {**stats, "reason": "missing_or_invalid_service_account_json"}
+        return None, "missing_or_invalid_service_account_json"
+    return creds, None
 
-    calendar_id = mapping.external_id
-    if not calendar_id:
-        return {**stats, "reason": "missing_calendar_id_in_mapping"}
 
-    # Listar eventos (full o incremental con syncToken)
-    try:
-        if mapping.google_sync_token:
-            events = list_events(creds, calendar_id, sync_token=mapping.google_sync_token)
+def _list_mapping_events(creds: Dict[str, Any], mapping: OtaRoomMapping) -> Tuple[Dict[str, Any], bool]:
+    """(respuesta de events.list, es_incremental). Solo HTTP, no toca la base."""
+    if mapping.google_sync_token:
+        try:
+            return list_events(creds, mapping.external_id, sync_token=mapping.google_sync_token), True
+        except Exception as e:
+            # 410 Gone: el syncToken expiró y hay que volver a un listado completo
+            if "410" not in str(e):
+                raise
+    return list_events(creds, mapping.external_id), False
+
+
+def fetch_events_for_mappings(mappings: Iterable[OtaRoomMapping], max_workers: Optional[int] = None) -> Dict[int, Any]:
+    """
+    Lista en paralelo (concurrencia acotada) los eventos de cada mapeo.
+
+    Devuelve {mapping_id: (eventos, es_incremental)} o {mapping_id: excepción}. Las
+    credenciales se resuelven antes (base) y los hilos solo hacen HTTP.
+    """
+    jobs = []
+    creds_by_hotel: Dict[int, Tuple[Optional[Dict[str, Any]], Optional[str]]] = {}
+    for m in mappings:
+        if m.hotel_id not in creds_by_hotel:
+            creds_by_hotel[m.hotel_id] = _credentials_for_hotel(m.hotel)
+        creds, reason = creds_by_hotel[m.hotel_id]
+        if creds and m.external_id:
+            jobs.append((m, creds))
+    if not jobs:
+        return {}
+
+    def _fetch(job):
+        m, creds = job
+        try:
+            return m.id, _list_mapping_events(creds, m)
+        except Exception as e:
+            return m.id, e
+
+    workers = max(1, min(max_workers or settings.OTA_GOOGLE_FETCH_CONCURRENCY, len(jobs)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="google-fetch") as pool:
+        return dict(pool.map(_fetch, jobs))
+
+
+def _guest_name_from_summary(summary: str) -> str:
+    """Nombre del huésped a partir del summary (similar a iCal)."""
+    guest_name = summary or "Google Guest"
+    if summary:
+        # Si tiene formato "Reserva - Nombre" o "Reserva- Nombre", extraer el nombre
+        if ' - ' in summary:
+            parts = summary.split(' - ', 1)
+            if len(parts) > 1 and parts[0].strip().lower().startswith('reserva'):
+                guest_name = parts[1].strip()  # Tomar la parte después de "Reserva - "
+            else:
+                guest_name = parts[0].strip()  # Si no empieza con "Reserva", tomar la primera parte
+        elif '-' in summary and not summary.startswith('-'):
+            # Formato "Reserva-Nombre" (sin espacio)
+            parts = summary.split('-', 1)
+            if len(parts) > 1 and parts[0].strip().lower().startswith('reserva'):
+                guest_name = parts[1].strip()  # Tomar la parte después de "Reserva-"
+            else:
+                guest_name = summary  # Si no empieza con "Reserva", usar el summary completo
         else:
-            events = list_events(creds, calendar_id)
-    except Exception as e:
-        stats["errors"] += 1
-        if job:
-            OtaSyncLog.objects.create(job=job, level=OtaSyncLog.Level.ERROR, message="GOOGLE_IMPORT_ERROR", payload={"error": str(e)})
-        return stats
+            guest_name = summary  # Si no tiene separador, usar el summary completo
+    return guest_name
 
-    seen_uids: set[str] = set()
 
-    for ev in events.get('items', []):
-        # Manejar eventos cancelados (Google envía status=cancelled y sin start/end)
-        if ev.get('status') == 'cancelled':
-            uid = ev.get('id')
-            if uid:
-                seen_uids.add(uid)
-                try:
-                    res = Reservation.objects.filter(hotel=mapping.hotel, room=mapping.room, external_id=uid).first()
-                    if res and res.status != ReservationStatus.CANCELLED:
-                        res.status = ReservationStatus.CANCELLED
-                        res.notes = (res.notes or "") + "\nCancelada por Google Calendar (evento eliminado)."
-                        res.save(update_fields=["status", "notes"], skip_clean=True)
-                        if job:
-                            OtaSyncLog.objects.create(
-                                job=job,
-                                level=OtaSyncLog.Level.INFO,
-                                message="GOOGLE_EVENT_DELETED_CANCELLED",
-                                payload={"external_id": uid, "reservation_id": res.id},
-                            )
-                    # Borrar tracking si existe
-                    OtaImportedEvent.objects.filter(hotel=mapping.hotel, room=mapping.room, provider=OtaProvider.GOOGLE, uid=uid).delete()
-                except Exception as e:
-                    if job:
-                        OtaSyncLog.objects.create(job=job, level=OtaSyncLog.Level.ERROR, message="GOOGLE_EVENT_DELETE_ERROR", payload={"uid": uid, "error": str(e)})
+def _cancel_reservations(reservations: Iterable[Reservation], note: str, event: str, log: SyncLogBuffer) -> int:
+    """Cancela (save por reserva, con sus señales) las reservas activas; suelen ser pocas por ciclo."""
+    cancelled = 0
+    for res in reservations:
+        if res.status == ReservationStatus.CANCELLED:
             continue
-        # Si el evento fue creado por AlojaSys (extendedProperties.private.alojasys_reservation_id), no importar para evitar duplicados
         try:
-            ext_priv = ev.get('extendedProperties', {}).get('private', {})
+            with transaction.atomic():
+                res.status = ReservationStatus.CANCELLED
+                res.notes = (res.notes or "") + note
+                res.save(update_fields=["status", "notes"], skip_clean=True)
+            cancelled += 1
+            log.add(OtaSyncLog.Level.INFO, event, {"external_id": res.external_id, "reservation_id": res.id})
+        except Exception as e:
+            log.add(OtaSyncLog.Level.ERROR, "GOOGLE_EVENT_DELETE_ERROR", {"uid": res.external_id, "error": str(e)})
+    return cancelled
+
+
+@transaction.atomic
+def import_events_for_mapping(
+    mapping: OtaRoomMapping,
+    job: Optional[OtaSyncJob] = None,
+    prefetched: Any = None,
+) -> Dict[str, Any]:
+    """Importa eventos de Google Calendar como reservas del PMS.
+
+    mapping.external_id debe contener el Calendar ID.
+    OtaConfig.credentials debe contener `service_account_json` con las credenciales.
+    prefetched: resultado de fetch_events_for_mappings para este mapeo (si ya se listó).
+    """
+    if not GOOGLE_AVAILABLE:
+        return {"processed": 0, "created": 0, "updated": 0, "errors": 1, "reason": "google_api_not_installed"}
+    
+    stats: Dict[str, Any] = {"processed": 0, "created": 0, "updated": 0, "unchanged": 0, "cancelled": 0, "errors": 0}
+    with SyncLogBuffer(job) as log:
+        creds, reason = _credentials_for_hotel(mapping.hotel)
+        if reason:
+            return {**stats, "reason": reason}
+
+        calendar_id = mapping.external_id
+        if not calendar_id:
+            return {**stats, "reason": "missing_calendar_id_in_mapping"}
+
+        # Listar eventos (full o incremental con syncToken)
+        try:
+            if isinstance(prefetched, Exception):
+                raise prefetched
+            events, incremental = prefetched if prefetched is not None else _list_mapping_events(creds, mapping)
+        except Exception as e:
+            stats["errors"] += 1
+            log.add(OtaSyncLog.Level.ERROR, "GOOGLE_IMPORT_ERROR", {"error": str(e)})
+            return stats
+
+        hotel, room = mapping.hotel, mapping.room
+        seen_uids: set[str] = set()
+        cancelled_uids: set[str] = set()
+        parsed: Dict[str, Dict[str, Any]] = {}
+
+        for ev in events.get('items', []):
+            uid = ev.get('id')
+            # Manejar eventos cancelados (Google envía status=cancelled y sin start/end)
+            if ev.get('status') == 'cancelled':
+                if uid:
+                    seen_uids.add(uid)
+                    cancelled_uids.add(uid)
+                    parsed.pop(uid, None)
+                continue
+            # Si el evento fue creado por AlojaSys (extendedProperties.private.alojasys_reservation_id), no importar para evitar duplicados
+            ext_priv = (ev.get('extendedProperties') or {}).get('private') or {}
             if ext_priv.get('alojasys_reservation_id'):
-                # Skip: evento originado en el PMS
-                seen_uids.add(ev.get('id') or '')
+                seen_uids.add(uid or '')
                 continue
-        except Exception:
-            pass
-
-        # Solo eventos con fechas
-        if 'start' not in ev or 'end' not in ev:
-            continue
 
-        stats['processed'] += 1
-        uid = ev.get('id')
-        if not uid:
-            continue
-        seen_uids.add(uid)
-        summary = ev.get('summary') or ''
+            # Solo eventos con fechas
+            if 'start' not in ev or 'end' not in ev:
+                continue
 
-        # Si la descripción indica una reserva creada por AlojaSys, no importar
-        desc = ev.get('description') or ''
-        if 'AlojaSys Reservation #' in desc:
+            stats['processed'] += 1
+            if not uid:
+                continue
             seen_uids.add(uid)
-            continue
-        check_in, check_out = _event_dates(ev)
-
-        # Extraer nombre del huésped del summary (similar a iCal)
-        guest_name = summary or "Google Guest"
-        if summary:
-            # Si tiene formato "Reserva - Nombre" o "Reserva- Nombre", extraer el nombre
-            if ' - ' in summary:
-                parts = summary.split(' - ', 1)
-                if len(parts) > 1 and parts[0].strip().lower().startswith('reserva'):
-                    guest_name = parts[1].strip()  # Tomar la parte después de "Reserva - "
-                else:
-                    guest_name = parts[0].strip()  # Si no empieza con "Reserva", tomar la primera parte
-            elif '-' in summary and not summary.startswith('-'):
-                # Formato "Reserva-Nombre" (sin espacio)
-                parts = summary.split('-', 1)
-                if len(parts) > 1 and parts[0].strip().lower().startswith('reserva'):
-                    guest_name = parts[1].strip()  # Tomar la parte después de "Reserva-"
-                else:
-                    guest_name = summary  # Si no empieza con "Reserva", usar el summary completo
-            else:
-                guest_name = summary  # Si no tiene separador, usar el summary completo
 
-        # Upsert de reserva (reutiliza canal OTHER para Google)
-        try:
-            result = OtaReservationService.upsert_reservation(
-                hotel=mapping.hotel,
-                room=mapping.room,
-                external_id=uid,
-                channel=ReservationChannel.OTHER,
-                check_in=check_in,
-                check_out=check_out,
-                guests=1,
-                guests_data=[{"name": guest_name, "email": "", "is_primary": True}],
-                notes=f"Importado desde Google Calendar: {summary}",
-                payment_info=None,
-                auto_confirm=False,
-                provider_name=OtaProvider.GOOGLE.label,  # "Google Calendar"
-            )
-            # Registrar/actualizar evento importado para detectar eliminaciones futuras
-            imported, created = OtaImportedEvent.objects.get_or_create(
-                hotel=mapping.hotel,
-                room=mapping.room,
-                provider=OtaProvider.GOOGLE,
-                uid=uid,
-                defaults={
-                    "dtstart": check_in,
-                    "dtend": check_out,
-                    "source_url": f"google://{mapping.external_id}",
-                    "summary": summary,
-                },
+            # Si la descripción indica una reserva creada por AlojaSys, no importar
+            if 'AlojaSys Reservation #' in (ev.get('description') or ''):
+                continue
+            try:
+                check_in, check_out = _event_dates(ev)
+            except Exception as e:
+                stats['errors'] += 1
+                log.add(OtaSyncLog.Level.ERROR, "GOOGLE_EVENT_IMPORT_ERROR", {"event_id": uid, "error": str(e)})
+                continue
+            summary = ev.get('summary') or ''
+            cancelled_uids.discard(uid)
+            parsed[uid] = {
+                "check_in": check_in,
+                "check_out": check_out,
+                "summary": summary,
+                "guest_name": _guest_name_from_summary(summary),
+            }
+
+        # Tracking del calendario: en full sync se necesitan todos para detectar eliminados
+        tracked_qs = OtaImportedEvent.objects.filter(room=room, provider=OtaProvider.GOOGLE)
+        if incremental:
+            tracked_qs = tracked_qs.filter(uid__in=set(parsed) | cancelled_uids)
+        tracked = {imp.uid: imp for imp in tracked_qs}
+
+        # Altas / cambios de reservas en un lote (canal OTHER para Google)
+        results: Dict[str, Dict[str, Any]] = {}
+        if parsed:
+            bookings = [
+                OtaBookingData(
+                    room=room,
+                    external_id=uid,
+                    channel=ReservationChannel.OTHER,
+                    check_in=ev["check_in"],
+                    check_out=ev["check_out"],
+                    guests=1,
+                    guests_data=[{"name": ev["guest_name"], "email": "", "is_primary": True}],
+                    notes=f"Importado desde Google Calendar: {ev['summary']}",
+                )
+                for uid, ev in parsed.items()
+            ]
+            try:
+                batch = OtaReservationService.upsert_reservations_batch(
+                    hotel=hotel,
+                    bookings=bookings,
+                    auto_confirm=False,
+                    provider_name=OtaProvider.GOOGLE.label,  # "Google Calendar"
+                )
+                stats['created'] += batch["created"]
+                stats['updated'] += batch["updated"]
+                stats['unchanged'] += batch["unchanged"]
+                results = {r["external_id"]: r for r in batch["results"]}
+            except Exception as e:
+                stats['errors'] += len(bookings)
+                log.add(OtaSyncLog.Level.ERROR, "GOOGLE_EVENT_IMPORT_ERROR", {"event_ids": list(parsed)[:50], "error": str(e)})
+
+        # Registrar/actualizar eventos importados para detectar eliminaciones futuras
+        source_url = f"google://{calendar_id}"
+        now = timezone.now()
+        to_create, to_update, notifications = [], [], []
+        for uid, ev in parsed.items():
+            result = results.get(uid)
+            if result is None:
+                continue
+            imported = tracked.get(uid)
+            if imported is None:
+                to_create.append(OtaImportedEvent(
+                    hotel=hotel,
+                    room=room,
+                    provider=OtaProvider.GOOGLE,
+                    uid=uid,
+                    dtstart=ev["check_in"],
+                    dtend=ev["check_out"],
+                    source_url=source_url,
+                    summary=ev["summary"],
+                ))
+                # Notificación: si no fue "created" pero el evento importado sí es nuevo, notificar
+                # (caso: ya existía una reserva con ese external_id pero es la primera vez que vemos este UID de Google)
+                if not result["created"]:
+                    notifications.append({
+                        "provider_name": OtaProvider.GOOGLE.label,
+                        "reservation_code": f"RES-{result['reservation_id']}",
+                        "room_name": room.name or f"Habitación {room.number}",
+                        "check_in_date": ev["check_in"].strftime("%d/%m/%Y"),
+                        "check_out_date": ev["check_out"].strftime("%d/%m/%Y"),
+                        "guest_name": ev["guest_name"],
+                        "hotel_id": hotel.id,
+                        "reservation_id": result["reservation_id"],
+                        "external_id": uid,
+                        "overbooking": False,
+                    })
+            elif (imported.dtstart, imported.dtend, imported.summary, imported.source_url) != (ev["check_in"], ev["check_out"], ev["summary"], source_url):
+                imported.dtstart, imported.dtend = ev["check_in"], ev["check_out"]
+                imported.summary, imported.source_url = ev["summary"], source_url
+                imported.last_seen = now
+                to_update.append(imported)
+        if to_create:
+            OtaImportedEvent.objects.bulk_create(to_create, ignore_conflicts=True)
+        if to_update:
+            OtaImportedEvent.objects.bulk_update(to_update, ["dtstart", "dtend", "summary", "source_url", "last_seen"])
+        if notifications:
+            try:
+                NotificationService.create_ota_reservation_notifications(notifications)
+            except Exception:
+                pass
+
+        # Eventos eliminados en Google: cancelar la reserva asociada y borrar el tracking.
+        # Los "desaparecidos" solo se pueden inferir de un listado completo: en incremental
+        # Google informa las bajas como status=cancelled.
+        gone = set(cancelled_uids)
+        if not incremental:
+            gone |= {uid for uid in tracked if uid not in seen_uids}
+        if gone:
+            stats['cancelled'] += _cancel_reservations(
+                Reservation.objects.filter(hotel=hotel, room=room, external_id__in=gone),
+                "\nCancelada por Google Calendar (evento eliminado).",
+                "GOOGLE_EVENT_DELETED_CANCELLED",
+                log,
             )
-            if not created:
-                changed = False
-                if imported.dtstart != check_in or imported.dtend != check_out or imported.summary != summary:
-                    imported.dtstart = check_in
-                    imported.dtend = check_out
-                    imported.summary = summary
-                    changed = True
-                if imported.source_url != f"google://{mapping.external_id}":
-                    imported.source_url = f"google://{mapping.external_id}"
-                    changed = True
-                if changed:
-                    imported.save(update_fields=["dtstart", "dtend", "summary", "source_url", "last_seen"])
-            if result.get("created"):
-                stats['created'] += 1
-            else:
-                stats['updated'] += 1
-
-            # Notificación: si no fue "created" pero el evento importado sí es nuevo, notificar
-            # (caso: ya existía una reserva con ese external_id pero es la primera vez que vemos este UID de Google)
-            if (not result.get("created")) and created:
-                try:
-                    NotificationService.create_ota_reservation_notification(
-                        provider_name=OtaProvider.GOOGLE.label,
-                        reservation_code=f"RES-{{}}".format(
-                            Reservation.objects.filter(
-                                hotel=mapping.hotel, room=mapping.room, external_id=uid
-                            ).values_list('id', flat=True).first() or "?"
-                        ),
-                        room_name=mapping.room.name or f"Habitación {mapping.room.number}",
-                        check_in_date=check_in.strftime("%d/%m/%Y"),
-                        check_out_date=check_out.strftime("%d/%m/%Y"),
-                        guest_name=guest_name,
-                        hotel_id=mapping.hotel.id,
-                        reservation_id=Reservation.objects.filter(
-                            hotel=mapping.hotel, room=mapping.room, external_id=uid
-                        ).values_list('id', flat=True).first(),
-                        external_id=uid,
-                        overbooking=False,
-                    )
-                except Exception:
-                    pass
-        except Exception as e:
-            stats['errors'] += 1
-            if job:
-                OtaSyncLog.objects.create(
-                    job=job,
-                    level=OtaSyncLog.Level.ERROR,
-                    message="GOOGLE_EVENT_IMPORT_ERROR",
-                    payload={"event_id": uid, "error": str(e)},
+            OtaImportedEvent.objects.filter(room=room, provider=OtaProvider.GOOGLE, uid__in=gone).delete()
+
+        if not incremental:
+            # Salvaguarda adicional: cancelar reservas importadas desde Google cuyo external_id ya no aparece
+            try:
+                missing_reservations = Reservation.objects.filter(
+                    hotel=hotel,
+                    room=room,
+                    channel=ReservationChannel.OTHER,
+                    external_id__isnull=False,
+                    notes__icontains="Google Calendar",
+                ).exclude(external_id__in=list(seen_uids)).exclude(status=ReservationStatus.CANCELLED)
+                stats['cancelled'] += _cancel_reservations(
+                    missing_reservations,
+                    "\nCancelada por Google Calendar (evento eliminado - fallback).",
+                    "GOOGLE_EVENT_DELETED_CANCELLED_FALLBACK",
+                    log,
                 )
+            except Exception as e:
+                log.add(OtaSyncLog.Level.ERROR, "GOOGLE_DELETE_FALLBACK_ERROR", {"error": str(e)})
 
-    # Detectar eventos eliminados en Google y cancelar la reserva asociada (para modo full sync)
-    try:
-        existing = OtaImportedEvent.objects.filter(
-            hotel=mapping.hotel,
-            room=mapping.room,
-            provider=OtaProvider.GOOGLE,
-        )
-        for imp in existing:
-            if imp.uid not in seen_uids:
-                try:
-                    res = Reservation.objects.filter(
-                        hotel=mapping.hotel,
-                        room=mapping.room,
-                        external_id=imp.uid,
-                    ).first()
-                    if res and res.status != ReservationStatus.CANCELLED:
-                        res.status = ReservationStatus.CANCELLED
-                        res.notes = (res.notes or "") + "\nCancelada por Google Calendar (evento eliminado)."
-                        res.save(update_fields=["status", "notes"], skip_clean=True)
-                        if job:
-                            OtaSyncLog.objects.create(
-                                job=job,
-                                level=OtaSyncLog.Level.INFO,
-                                message="GOOGLE_EVENT_DELETED_CANCELLED",
-                                payload={"external_id": imp.uid, "reservation_id": res.id},
-                            )
-                    imp.delete()
-                except Exception as e:
-                    if job:
-                        OtaSyncLog.objects.create(
-                            job=job,
-                            level=OtaSyncLog.Level.ERROR,
-                            message="GOOGLE_EVENT_DELETE_ERROR",
-                            payload={"uid": imp.uid, "error": str(e)},
-                        )
-    except Exception as e:
-        if job:
-            OtaSyncLog.objects.create(job=job, level=OtaSyncLog.Level.ERROR, message="GOOGLE_DELETE_SCAN_ERROR", payload={"error": str(e)})
-
-    # Salvaguarda adicional: cancelar reservas importadas desde Google cuyo external_id ya no aparece
-    try:
-        missing_reservations = Reservation.objects.filter(
-            hotel=mapping.hotel,
-            room=mapping.room,
-            channel=ReservationChannel.OTHER,
-            external_id__isnull=False,
-            notes__icontains="Google Calendar",
-        ).exclude(external_id__in=list(seen_uids))
-
-        for res in missing_reservations:
-            if res.status != ReservationStatus.CANCELLED:
-                res.status = ReservationStatus.CANCELLED
-                res.notes = (res.notes or "") + "\nCancelada por Google Calendar (evento eliminado - fallback)."
-                res.save(update_fields=["status", "notes"], skip_clean=True)
-                if job:
-                    OtaSyncLog.objects.create(
-                        job=job,
-                        level=OtaSyncLog.Level.INFO,
-                        message="GOOGLE_EVENT_DELETED_CANCELLED_FALLBACK",
-                        payload={"external_id": res.external_id, "reservation_id": res.id},
-                    )
-    except Exception as e:
-        if job:
-            OtaSyncLog.objects.create(job=job, level=OtaSyncLog.Level.ERROR, message="GOOGLE_DELETE_FALLBACK_ERROR", payload={"error": str(e)})
-
-    # Actualizar last_synced
-    mapping.last_synced = timezone.now()
-    mapping.save(update_fields=["last_synced"])
-
-    if job:
-        OtaSyncLog.objects.create(job=job, level=OtaSyncLog.Level.INFO, message="GOOGLE_IMPORT_COMPLETED", payload={**stats})
-
-    # Guardar nextSyncToken si existe (para incremental en siguientes corridas)
-    try:
+        # Actualizar last_synced y guardar nextSyncToken (para incremental en siguientes corridas)
+        mapping.last_synced = timezone.now()
+        update_fields = ["last_synced"]
         next_token = events.get('nextSyncToken')
         if next_token:
             mapping.google_sync_token = next_token
-            mapping.save(update_fields=["google_sync_token"])
-    except Exception:
-        pass
+            update_fields.append("google_sync_token")
+        mapping.save(update_fields=update_fields)
 
-    return stats
+        log.add(OtaSyncLog.Level.INFO, "GOOGLE_IMPORT_COMPLETED", {**stats, "incremental": incremental})
+        return stats
 
 
 def enable_webhook_watch(mapping: OtaRoomMapping, base_callback_url: str) -> Dict[str, Any]:
@@ -387,208 +435,208 @@ def enable_webhook_watch(mapping: OtaRoomMapping, base_callback_url: str) -> Dic
     return {"status": "ok", "channel_id": channel_id, "resource_id": resource_id, "expiration": expiration_ms}
 
 
-def export_reservation_to_google(reservation: Reservation) -> Dict[str, Any]:
-    """Exporta una reserva a Google Calendar (crea/actualiza evento).
-    
-    Busca mapeos activos de Google para la habitación y exporta la reserva.
+# Google Calendar (all-day) usa end EXCLUSIVO y la zona del hotel para el evento
+_EVENT_TIMEZONE = "America/Argentina/Buenos_Aires"
+
+
+def _event_body(reservation: Reservation) -> Dict[str, Any]:
+    # Nombre del huésped
+    guest_name = "Huésped"
+    if reservation.guests_data:
+        primary = next((g for g in reservation.guests_data if g.get("is_primary")), reservation.guests_data[0])
+        guest_name = primary.get("name", "Huésped")
+    return {
+        "summary": f"Reserva - {guest_name}",
+        "description": f"AlojaSys Reservation #{reservation.id}\nHabitación: {reservation.room.name}\nHotel: {reservation.hotel.name}",
+        "start": {
+            "date": reservation.check_in.isoformat(),
+            "timeZone": _EVENT_TIMEZONE,
+        },
+        "end": {
+            # En hotelería, nuestro rango ya es [check_in, check_out) → el día de check_out NO ocupa noche.
+            # Por lo tanto, el end.date correcto es exactamente check_out (sin +1),
+            # para permitir back-to-back (salida 24, entrada 24).
+            "date": reservation.check_out.isoformat(),
+            "timeZone": _EVENT_TIMEZONE,
+        },
+        "extendedProperties": {
+            "private": {
+                "alojasys_reservation_id": str(reservation.id),
+            }
+        },
+    }
+
+
+def _google_error_message(error: Exception, calendar_id: str) -> str:
+    error_msg = str(error)
+    # Mensaje más claro para errores comunes
+    if "404" in error_msg or "notFound" in error_msg or "Not Found" in error_msg:
+        return f"Calendar not found or Service Account lacks write permissions. Calendar ID: {calendar_id}. Make sure the Service Account email has 'Make changes to events' permission."
+    if "403" in error_msg or "Forbidden" in error_msg:
+        return f"Access denied. Service Account needs 'Make changes to events' permission on calendar {calendar_id}."
+    return error_msg
+
+
+def _imported_event_id(reservation: Reservation) -> Optional[str]:
+    ext = reservation.external_id or ""
+    return ext.replace("google_", "", 1) if ext.startswith("google_") else None
+
+
+def sync_reservations_to_google(reservations: Iterable[Reservation]) -> Dict[int, Dict[str, Any]]:
+    """Exporta las reservas confirmadas y borra los eventos de las canceladas con requests batch.
+
+    Por hotel: una consulta de mapeos y dos rondas batch (búsqueda del evento por
+    extendedProperty y escritura), en lugar de get_calendar + list + insert/update por
+    reserva y calendario. Devuelve {reservation_id: {"status", "results"}}.
     """
     import logging
     logger = logging.getLogger(__name__)
-    
-    if not GOOGLE_AVAILABLE:
-        logger.warning(f"Reservation {reservation.id}: Google API not installed")
-        return {"status": "error", "reason": "google_api_not_installed"}
-    
-    # Solo exportar reservas confirmadas
-    if reservation.status != ReservationStatus.CONFIRMED:
-        logger.debug(f"Reservation {reservation.id}: Status is {reservation.status}, skipping export")
-        return {"status": "skipped", "reason": "reservation_not_confirmed"}
-    
-    # Buscar mapeos Google activos para esta habitación con export habilitado
-    mappings = OtaRoomMapping.objects.filter(
-        hotel=reservation.hotel,
-        room=reservation.room,
-        provider=OtaProvider.GOOGLE,
-        is_active=True,
-        sync_direction__in=[OtaRoomMapping.SyncDirection.EXPORT, OtaRoomMapping.SyncDirection.BOTH],
-    ).exclude(external_id__isnull=True).exclude(external_id="")
-    
-    if not mappings.exists():
-        logger.warning(f"Reservation {reservation.id}: No Google mappings found for room {reservation.room_id} with EXPORT/BOTH direction")
-        return {"status": "skipped", "reason": "no_google_mappings"}
-    
-    # Obtener credenciales desde OtaConfig
-    ota_config = reservation.hotel.ota_configs.filter(provider=OtaProvider.GOOGLE, is_active=True).first()
-    if not ota_config:
-        return {"status": "error", "reason": "no_active_google_config"}
-    
-    creds_container = ota_config.credentials or {}
-    if isinstance(creds_container, dict) and "service_account_json" in creds_container:
-        creds = creds_container.get("service_account_json")
-    else:
-        creds = creds_container
-    if not isinstance(creds, dict) or creds.get("type") != "service_account":
-        return {"status": "error", "reason": "missing_or_invalid_service_account_json"}
-    
-    results = []
 
-    def _find_existing_event_id(calendar_id: str) -> str | None:
-        """Busca si ya existe un evento en el calendario para esta reserva.
-        Criterio: extendedProperties.private.alojasys_reservation_id == reservation.id
-        Fallback: description contiene "AlojaSys Reservation #<id>".
-        """
-        try:
-            time_min = reservation.check_in - timedelta(days=2)
-            time_max = reservation.check_out + timedelta(days=2)
-            evs = list_events(creds, calendar_id, time_min=time_min, time_max=time_max)
-            for ev in evs.get('items', []):
-                ext_priv = (ev.get('extendedProperties') or {}).get('private') or {}
-                if str(ext_priv.get('alojasys_reservation_id')) == str(reservation.id):
-                    return ev.get('id')
-                if ('description' in ev) and (f"AlojaSys Reservation #{reservation.id}" in (ev.get('description') or '')):
-                    return ev.get('id')
-        except Exception:
-            return None
-        return None
-    for mapping in mappings:
-        calendar_id = mapping.external_id
-        if not calendar_id:
+    out: Dict[int, Dict[str, Any]] = {}
+    by_hotel: Dict[int, List[Reservation]] = defaultdict(list)
+    for r in reservations:
+        if not GOOGLE_AVAILABLE:
+            out[r.id] = {"status": "error", "reason": "google_api_not_installed"}
+        elif r.status in (ReservationStatus.CONFIRMED, ReservationStatus.CANCELLED):
+            by_hotel[r.hotel_id].append(r)
+        else:
+            out[r.id] = {"status": "skipped", "reason": "reservation_not_confirmed"}
+
+    export_directions = (OtaRoomMapping.SyncDirection.EXPORT, OtaRoomMapping.SyncDirection.BOTH)
+    for hotel_id, items in by_hotel.items():
+        mappings_by_room: Dict[int, List[OtaRoomMapping]] = defaultdict(list)
+        mappings = (
+            OtaRoomMapping.objects.filter(
+                hotel_id=hotel_id,
+                room_id__in={r.room_id for r in items},
+                provider=OtaProvider.GOOGLE,
+                is_active=True,
+            )
+            .exclude(external_id__isnull=True)
+            .exclude(external_id="")
+        )
+        for m in mappings:
+            mappings_by_room[m.room_id].append(m)
+
+        # (reserva, mapeo) a sincronizar; las exportaciones solo van a mapeos EXPORT/BOTH
+        pairs: List[Tuple[Reservation, OtaRoomMapping]] = []
+        for r in items:
+            targets = mappings_by_room.get(r.room_id, [])
+            if r.status == ReservationStatus.CONFIRMED:
+                targets = [m for m in targets if m.sync_direction in export_directions]
+            if not targets:
+                logger.debug(f"Reservation {r.id}: No Google mappings found for room {r.room_id}")
+                out[r.id] = {"status": "skipped", "reason": "no_google_mappings"}
+                continue
+            out[r.id] = {"status": "ok", "results": []}
+            pairs.extend((r, m) for m in targets)
+        if not pairs:
             continue
-        
-        # Verificar acceso al calendario antes de intentar crear eventos
+
+        creds, reason = _credentials_for_hotel(items[0].hotel)
+        if reason:
+            for r, _ in pairs:
+                out[r.id] = {"status": "error", "reason": reason}
+            continue
+
+        # Ronda 1: buscar el evento de cada reserva en cada calendario (idempotencia)
+        lookups = []
+        for idx, (r, m) in enumerate(pairs):
+            if r.status == ReservationStatus.CANCELLED and _imported_event_id(r):
+                continue
+            lookups.append((str(idx), "list", {
+                "calendarId": m.external_id,
+                "privateExtendedProperty": f"alojasys_reservation_id={r.id}",
+                "singleEvents": True,
+                "maxResults": 10,
+            }))
         try:
-            get_calendar(creds, calendar_id)
-            logger.debug(f"Reservation {reservation.id}: Calendar {calendar_id} is accessible")
-        except Exception as cal_error:
-            error_msg = str(cal_error)
-            if "404" in error_msg or "notFound" in error_msg:
-                logger.error(f"Reservation {reservation.id}: Calendar {calendar_id} not found or Service Account lacks access. Make sure the calendar is shared with the Service Account email.")
-                results.append({"mapping_id": mapping.id, "action": "error", "error": f"Calendar not accessible: {error_msg}"})
+            found = execute_batch(creds, lookups)
+        except Exception as e:
+            logger.error(f"Hotel {hotel_id}: Error buscando eventos de Google Calendar: {e}", exc_info=True)
+            for r, m in pairs:
+                out[r.id]["results"].append({"mapping_id": m.id, "action": "error", "error": str(e)})
+            continue
+
+        # Ronda 2: crear / actualizar / borrar
+        writes = []
+        for idx, (r, m) in enumerate(pairs):
+            results = out[r.id]["results"]
+            response, error = found.get(str(idx), (None, None))
+            if error is not None:
+                results.append({"mapping_id": m.id, "action": "error", "error": _google_error_message(error, m.external_id)})
                 continue
+            existing_ids = [ev.get("id") for ev in (response or {}).get("items", []) if ev.get("id")]
+            if r.status == ReservationStatus.CANCELLED:
+                event_ids = [_imported_event_id(r)] if _imported_event_id(r) else existing_ids
+                if not event_ids:
+                    results.append({"mapping_id": m.id, "action": "already_deleted"})
+                for event_id in event_ids:
+                    writes.append((r, m, "deleted", event_id, "delete", {"calendarId": m.external_id, "eventId": event_id}))
+            elif existing_ids:
+                writes.append((r, m, "updated", existing_ids[0], "update", {
+                    "calendarId": m.external_id, "eventId": existing_ids[0], "body": _event_body(r),
+                }))
             else:
-                logger.warning(f"Reservation {reservation.id}: Could not verify calendar access: {error_msg}, proceeding anyway")
-        
-        # Nombre del huésped
-        guest_name = "Huésped"
-        if reservation.guests_data:
-            primary = next((g for g in reservation.guests_data if g.get("is_primary")), reservation.guests_data[0])
-            guest_name = primary.get("name", "Huésped")
-        
-        # Crear cuerpo del evento
-        event_body = {
-            "summary": f"Reserva - {guest_name}",
-            "description": f"AlojaSys Reservation #{reservation.id}\nHabitación: {reservation.room.name}\nHotel: {reservation.hotel.name}",
-            "start": {
-                "date": reservation.check_in.isoformat(),
-                "timeZone": "America/Argentina/Buenos_Aires",
-            },
-            "end": {
-                # Google Calendar (all-day) usa end EXCLUSIVO.
-                # En hotelería, nuestro rango ya es [check_in, check_out) → el día de check_out NO ocupa noche.
-                # Por lo tanto, el end.date correcto es exactamente check_out (sin +1),
-                # para permitir back-to-back (salida 24, entrada 24).
-                "date": reservation.check_out.isoformat(),
-                "timeZone": "America/Argentina/Buenos_Aires",
-            },
-            "extendedProperties": {
-                "private": {
-                    "alojasys_reservation_id": str(reservation.id),
-                }
-            },
-        }
-        
-        # Buscar si ya existe un evento para esta reserva (idempotencia)
-        google_event_id = _find_existing_event_id(calendar_id)
-        
+                writes.append((r, m, "created", None, "insert", {"calendarId": m.external_id, "body": _event_body(r)}))
         try:
-            if google_event_id:
-                # Actualizar evento existente
-                event_id = google_event_id.replace('google_', '')
-                logger.info(f"Reservation {reservation.id}: Updating Google Calendar event {event_id} in calendar {calendar_id}")
-                update_event(creds, calendar_id, event_id, event_body)
-                results.append({"mapping_id": mapping.id, "action": "updated", "event_id": event_id})
-            else:
-                # Crear nuevo evento
-                logger.info(f"Reservation {reservation.id}: Creating Google Calendar event in calendar {calendar_id}")
-                created_event = insert_event(creds, calendar_id, event_body)
-                event_id = created_event.get('id')
-                logger.info(f"Reservation {reservation.id}: Created Google Calendar event {event_id}")
+            written = execute_batch(creds, [(str(i), w[4], w[5]) for i, w in enumerate(writes)])
+        except Exception as e:
+            logger.error(f"Hotel {hotel_id}: Error escribiendo eventos de Google Calendar: {e}", exc_info=True)
+            written = {str(i): (None, e) for i in range(len(writes))}
+
+        tracking = []
+        for i, (r, m, action, event_id, _, kwargs) in enumerate(writes):
+            response, error = written.get(str(i), (None, None))
+            results = out[r.id]["results"]
+            if error is not None:
+                if action == "deleted" and ("not found" in str(error).lower() or "404" in str(error) or "410" in str(error)):
+                    # Si el evento ya no existe, está bien
+                    results.append({"mapping_id": m.id, "action": "already_deleted"})
+                    continue
+                logger.error(f"Reservation {r.id}: Error syncing Google Calendar event: {error}")
+                results.append({"mapping_id": m.id, "action": "error", "error": _google_error_message(error, m.external_id)})
+                continue
+            if action == "created":
+                event_id = (response or {}).get("id")
                 # Registrar en OtaImportedEvent para seguimiento (sin tocar external_id para no violar validación de canal DIRECT)
-                try:
-                    OtaImportedEvent.objects.update_or_create(
-                        hotel=reservation.hotel,
-                        room=reservation.room,
+                if event_id:
+                    tracking.append(OtaImportedEvent(
+                        hotel_id=r.hotel_id,
+                        room_id=r.room_id,
                         provider=OtaProvider.GOOGLE,
                         uid=event_id,
-                        defaults={
-                            "dtstart": reservation.check_in,
-                            "dtend": reservation.check_out,
-                            "summary": event_body.get("summary"),
-                            "source_url": f"google://{calendar_id}",
-                        },
-                    )
-                except Exception:
-                    pass
-                results.append({"mapping_id": mapping.id, "action": "created", "event_id": event_id})
-        except Exception as e:
-            error_msg = str(e)
-            # Mensaje más claro para errores comunes
-            if "404" in error_msg or "notFound" in error_msg or "Not Found" in error_msg:
-                error_msg = f"Calendar not found or Service Account lacks write permissions. Calendar ID: {calendar_id}. Make sure the Service Account email has 'Make changes to events' permission."
-            elif "403" in error_msg or "Forbidden" in error_msg:
-                error_msg = f"Access denied. Service Account needs 'Make changes to events' permission on calendar {calendar_id}."
-            logger.error(f"Reservation {reservation.id}: Error creating/updating Google Calendar event: {error_msg}", exc_info=True)
-            results.append({"mapping_id": mapping.id, "action": "error", "error": error_msg})
+                        dtstart=r.check_in,
+                        dtend=r.check_out,
+                        summary=kwargs["body"].get("summary"),
+                        source_url=f"google://{m.external_id}",
+                    ))
+            results.append({"mapping_id": m.id, "action": action, "event_id": event_id})
+        if tracking:
+            try:
+                OtaImportedEvent.objects.bulk_create(tracking, ignore_conflicts=True)
+            except Exception:
+                pass
+    return out
+
+
+def export_reservation_to_google(reservation: Reservation) -> Dict[str, Any]:
+    """Exporta una reserva a Google Calendar (crea/actualiza evento).
     
-    return {"status": "ok", "results": results}
+    Busca mapeos activos de Google para la habitación y exporta la reserva.
+    """
+    if not GOOGLE_AVAILABLE:
+        return {"status": "error", "reason": "google_api_not_installed"}
+    # Solo exportar reservas confirmadas
+    if reservation.status != ReservationStatus.CONFIRMED:
+        return {"status": "skipped", "reason": "reservation_not_confirmed"}
+    return sync_reservations_to_google([reservation])[reservation.id]
 
 
 def delete_reservation_from_google(reservation: Reservation) -> Dict[str, Any]:
     """Elimina un evento de Google Calendar cuando se cancela una reserva."""
     if not GOOGLE_AVAILABLE:
         return {"status": "error", "reason": "google_api_not_installed"}
-    
-    # Buscar event_id en external_id
-    if not reservation.external_id or not reservation.external_id.startswith('google_'):
-        return {"status": "skipped", "reason": "no_google_event_id"}
-    
-    event_id = reservation.external_id.replace('google_', '')
-    
-    # Buscar mapeos Google activos
-    mappings = OtaRoomMapping.objects.filter(
-        hotel=reservation.hotel,
-        room=reservation.room,
-        provider=OtaProvider.GOOGLE,
-        is_active=True,
-    ).exclude(external_id__isnull=True).exclude(external_id="")
-    
-    if not mappings.exists():
-        return {"status": "skipped", "reason": "no_google_mappings"}
-    
-    ota_config = reservation.hotel.ota_configs.filter(provider=OtaProvider.GOOGLE, is_active=True).first()
-    if not ota_config:
-        return {"status": "error", "reason": "no_active_google_config"}
-    
-    creds_container = ota_config.credentials or {}
-    if isinstance(creds_container, dict) and "service_account_json" in creds_container:
-        creds = creds_container.get("service_account_json")
-    else:
-        creds = creds_container
-    if not isinstance(creds, dict) or creds.get("type") != "service_account":
-        return {"status": "error", "reason": "missing_or_invalid_service_account_json"}
-    
-    results = []
-    for mapping in mappings:
-        calendar_id = mapping.external_id
-        try:
-            delete_event(creds, calendar_id, event_id)
-            results.append({"mapping_id": mapping.id, "action": "deleted"})
-        except Exception as e:
-            # Si el evento ya no existe, está bien
-            if "not found" in str(e).lower() or "404" in str(e):
-                results.append({"mapping_id": mapping.id, "action": "already_deleted"})
-            else:
-                results.append({"mapping_id": mapping.id, "action": "error", "error": str(e)})
-    
-    return {"status": "ok", "results": results}
-
+    if reservation.status != ReservationStatus.CANCELLED:
+        return {"status": "skipped", "reason": "reservation_not_cancelled"}
+    return sync_reservations_to_google([reservation])[reservation.id]
@@ -0,0 +1,229 @@
+"""
+Cliente HTTP saliente compartido por los adapters de canales (Booking, Airbnb).
+
+Antes cada llamada hacía un `requests.post` suelto (conexión y handshake TLS nuevos) y
+los reintentos dormían con `time.sleep` dentro del worker de Celery. ChannelHttpClient:
+
+- mantiene una `requests.Session` por host con pool keep-alive, recreada tras un fork
+- aplica timeouts de conexión / lectura configurables
+- no reintenta en proceso: ante 429/5xx o error de red lanza RetryableChannelError y la
+  task se reprograma con `self.retry(countdown=...)` (backoff exponencial con jitter,
+  respetando Retry-After)
+- lleva un circuit breaker por proveedor: tras OTA_HTTP_BREAKER_THRESHOLD fallos seguidos
+  deja de llamar durante OTA_HTTP_BREAKER_COOLDOWN_SECONDS y después deja pasar una
+  llamada de prueba
+
+El breaker es por proceso (cada worker aprende el estado del canal por su cuenta).
+"""
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+# Respuestas que indican un problema transitorio del canal
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+
+class ChannelHttpError(Exception):
+    """Error de comunicación con un canal."""
+
+
+class RetryableChannelError(ChannelHttpError):
+    """Fallo transitorio: la operación debe reprogramarse (retry_after en segundos, si el canal lo indicó)."""
+
+    def __init__(self, message: str, *, provider: str = "", status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.provider = provider
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(RetryableChannelError):
+    """El breaker del proveedor está abierto: no se llamó al canal."""
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def backoff_countdown(retries: int, retry_after: Optional[float] = None) -> int:
+    """Segundos hasta el próximo intento: exponencial con jitter, nunca menos que Retry-After."""
+    base = float(_setting("OTA_HTTP_RETRY_BASE_SECONDS", 5))
+    cap = float(_setting("OTA_HTTP_RETRY_MAX_SECONDS", 300))
+    ceiling = min(cap, base * (2 ** max(retries, 0)))
+    # "Equal jitter": la mitad fija y la otra mitad aleatoria, para no sincronizar reintentos
+    countdown = ceiling / 2 + random.uniform(0, ceiling / 2)
+    if retry_after:
+        countdown = max(countdown, min(float(retry_after), cap))
+    return max(int(round(countdown)), 1)
+
+
+def _parse_retry_after(resp: requests.Response) -> Optional[float]:
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
+
+class CircuitBreaker:
+    """Breaker cerrado / abierto / semiabierto de un proveedor."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = max(int(threshold), 1)
+        self.cooldown = float(cooldown)
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(self.cooldown - (time.monotonic() - self.opened_at), 0.0)
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial:
+                # Una sola llamada de prueba mientras está semiabierto
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class ChannelHttpClient:
+    """Sesiones keep-alive por host y breaker por proveedor para las llamadas a canales."""
+
+    def __init__(self):
+        self._sessions: Dict[Tuple[str, str], requests.Session] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._pid = None
+        self._lock = threading.RLock()
+
+    def _check_fork(self) -> None:
+        # Los sockets del pool no se comparten entre procesos (prefork de Celery)
+        pid = os.getpid()
+        if self._pid != pid:
+            self._sessions = {}
+            self._breakers = {}
+            self._pid = pid
+
+    def session_for(self, url: str) -> requests.Session:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        with self._lock:
+            self._check_fork()
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                size = int(_setting("OTA_HTTP_POOL_MAXSIZE", 10))
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=0)
+                session.mount(f"{parts.scheme}://", adapter)
+                self._sessions[key] = session
+            return session
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        with self._lock:
+            self._check_fork()
+            breaker = self._breakers.get(provider)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    _setting("OTA_HTTP_BREAKER_THRESHOLD", 5),
+                    _setting("OTA_HTTP_BREAKER_COOLDOWN_SECONDS", 60),
+                )
+                self._breakers[provider] = breaker
+            return breaker
+
+    @staticmethod
+    def timeout() -> Tuple[float, float]:
+        return (
+            float(_setting("OTA_HTTP_CONNECT_TIMEOUT", 3.05)),
+            float(_setting("OTA_HTTP_READ_TIMEOUT", 10)),
+        )
+
+    def request(self, provider: str, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Ejecuta la llamada con la sesión del host. Devuelve la respuesta (incluye 4xx no
+        transitorios) o lanza RetryableChannelError / CircuitOpenError.
+        """
+        breaker = self.breaker(provider)
+        if not breaker.allow():
+            raise CircuitOpenError(
+                f"Circuit breaker abierto para {provider}",
+                provider=provider,
+                retry_after=breaker.retry_after(),
+            )
+        kwargs.setdefault("timeout", self.timeout())
+        # Toda salida registra el resultado: una excepción inesperada no deja la llamada de
+        # prueba tomada y el breaker trabado en semiabierto
+        succeeded = False
+        try:
+            try:
+                resp = self.session_for(url).request(method, url, **kwargs)
+            except requests.RequestException as e:
+                raise RetryableChannelError(f"{type(e).__name__}: {e}", provider=provider) from e
+            if resp.status_code in RETRYABLE_STATUSES:
+                raise RetryableChannelError(
+                    f"HTTP {resp.status_code} desde {provider}",
+                    provider=provider,
+                    status=resp.status_code,
+                    retry_after=_parse_retry_after(resp),
+                )
+            succeeded = True
+            return resp
+        finally:
+            if succeeded:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+
+    def get(self, provider: str, url: str, **kwargs) -> requests.Response:
+        return self.request(provider, "GET", url, **kwargs)
+
+    def post(self, provider: str, url: str, **kwargs) -> requests.Response:
+        return self.request(provider, "POST", url, **kwargs)
+
+    def reset(self) -> None:
+        """Cierra las sesiones y reinicia los breakers (tests / cambio de configuración)."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+            self._breakers = {}
+
+
+http_client = ChannelHttpClient()
@@ -0,0 +1,237 @@
+"""
+Feeds iCal de salida (por hotel y por habitación) con caché y respuestas condicionales.
+
+Las OTAs consultan estos .ics cada pocos minutos por cada habitación. Antes cada poll
+armaba el documento completo desde la base. Ahora:
+
+- el feed renderizado se guarda en caché (por habitación y por hotel) junto con su ETag
+  fuerte (sha256 del cuerpo), la fecha de render y los datos para validar el token
+- los signals de reservas, bloqueos, habitaciones, hoteles y configuración iCal invalidan
+  las entradas afectadas al confirmar la transacción; las escrituras bulk llaman a
+  invalidate_ical_feeds directamente
+- cada hotel y habitación tiene un contador de generación que la invalidación incrementa y
+  que forma parte de la clave: un render que empezó antes de invalidar se guarda bajo la
+  generación vieja y nadie lo vuelve a leer
+- la vista responde 304 ante If-None-Match / If-Modified-Since vigentes
+
+Un poll repetido es un hit de caché (sin consultas) o un 304.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from icalendar import Calendar, Event
+
+from apps.core.models import Hotel
+from apps.rooms.models import Room
+from apps.reservations.models import Reservation, ReservationStatus
+
+from ..models import OtaConfig, OtaProvider, OtaRoomMapping
+
+logger = logging.getLogger(__name__)
+
+# Reservas que bloquean inventario y se exportan
+EXPORT_STATUSES = (ReservationStatus.CONFIRMED, ReservationStatus.PENDING)
+
+
+def _room_key(room_id: int) -> str:
+    return f"otas:ical:room:{room_id}"
+
+
+def _hotel_key(hotel_id: int) -> str:
+    return f"otas:ical:hotel:{hotel_id}"
+
+
+def _generation_key(key: str) -> str:
+    return f"{key}:gen"
+
+
+def _generation(key: str) -> int:
+    """
+    Generación vigente del feed. Si el contador no existe (o se desalojó) arranca en el
+    reloj actual, así nunca se reutiliza una generación con entradas viejas en caché.
+    """
+    gen_key = _generation_key(key)
+    try:
+        gen = cache.get(gen_key)
+        if gen is None:
+            cache.add(gen_key, time.time_ns(), timeout=None)
+            gen = cache.get(gen_key)
+        return int(gen or 0)
+    except Exception:
+        return 0
+
+
+def _bump_generation(key: str) -> None:
+    gen_key = _generation_key(key)
+    try:
+        cache.incr(gen_key)
+    except ValueError:
+        # Sin contador: cualquier valor nuevo deja atrás las entradas existentes
+        cache.add(gen_key, time.time_ns(), timeout=None)
+
+
+def _versioned(key: str, gen: int) -> str:
+    return f"{key}:{gen}"
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "OTA_ICAL_EXPORT_CACHE_SECONDS", 3600))
+
+
+def build_calendar(name: str) -> Calendar:
+    cal = Calendar()
+    cal.add("prodid", "-//AlojaSys//ICS Export//ES")
+    cal.add("version", "2.0")
+    cal.add("X-WR-CALNAME", name)
+    return cal
+
+
+def add_reservation_event(cal: Calendar, reservation: Reservation) -> None:
+    event = Event()
+    # All-day event (iCal estándar): DTEND es no-inclusivo.
+    # Para reservas hoteleras, el evento cubre [check_in, check_out) → DTEND = check_out.
+    dt_start = datetime.combine(reservation.check_in, datetime.min.time())
+    dt_end = datetime.combine(reservation.check_out, datetime.min.time())
+
+    event.add("uid", f"alojasys-reservation-{reservation.id}@alojasys")
+    event.add("summary", f"RES-{reservation.id} | {reservation.room.name}")
+    event.add("dtstart", dt_start.date())
+    event.add("dtend", dt_end.date())
+    event.add("description", f"Hotel: {reservation.hotel.name}")
+    cal.add_component(event)
+
+
+def _ical_tokens(hotel_id: int) -> list:
+    return list(
+        OtaConfig.objects.filter(hotel_id=hotel_id, provider=OtaProvider.ICAL, is_active=True)
+        .exclude(ical_out_token__isnull=True)
+        .exclude(ical_out_token="")
+        .values_list("ical_out_token", flat=True)
+    )
+
+
+def _entry(body: bytes, hotel_id: int, **extra) -> Dict[str, Any]:
+    return {
+        "body": body,
+        "etag": f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+        "last_modified": int(timezone.now().timestamp()),
+        "hotel_id": hotel_id,
+        "tokens": _ical_tokens(hotel_id),
+        **extra,
+    }
+
+
+def _cache_get(key: str, gen: int) -> Optional[Dict[str, Any]]:
+    try:
+        return cache.get(_versioned(key, gen))
+    except Exception:
+        return None
+
+
+def _cache_add(key: str, gen: int, entry: Dict[str, Any]) -> None:
+    """Guarda el render bajo la generación leída antes de consultar la base."""
+    try:
+        cache.add(_versioned(key, gen), entry, timeout=_ttl())
+    except Exception:
+        pass
+
+
+def cached_hotel_feed(hotel_id: int) -> Optional[Dict[str, Any]]:
+    """Entrada del feed del hotel sólo si está en caché (no renderiza)."""
+    key = _hotel_key(hotel_id)
+    return _cache_get(key, _generation(key))
+
+
+def cached_room_feed(room_id: int) -> Optional[Dict[str, Any]]:
+    """Entrada del feed de la habitación sólo si está en caché (no renderiza)."""
+    key = _room_key(room_id)
+    return _cache_get(key, _generation(key))
+
+
+def render_hotel_feed(hotel_id: int) -> Optional[Dict[str, Any]]:
+    """Entrada del feed del hotel (desde caché o renderizada). None si el hotel no existe."""
+    key = _hotel_key(hotel_id)
+    gen = _generation(key)
+    entry = _cache_get(key, gen)
+    if entry is not None:
+        return entry
+    hotel = Hotel.objects.filter(id=hotel_id).first()
+    if hotel is None:
+        return None
+    cal = build_calendar(f"AlojaSys - {hotel.name}")
+    qs = Reservation.objects.filter(hotel=hotel, status__in=EXPORT_STATUSES).select_related("room")
+    for r in qs:
+        r.hotel = hotel
+        add_reservation_event(cal, r)
+    entry = _entry(cal.to_ical(), hotel.id)
+    _cache_add(key, gen, entry)
+    return entry
+
+
+def render_room_feed(room_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Entrada del feed de la habitación. None si la habitación no existe.
+
+    `export_allowed` es False cuando hay mapeos iCal activos y ninguno permite export;
+    `export_mapping_ids` son los mapeos cuyo last_synced se actualiza al servir.
+    """
+    key = _room_key(room_id)
+    gen = _generation(key)
+    entry = _cache_get(key, gen)
+    if entry is not None:
+        return entry
+    room = Room.objects.select_related("hotel").filter(id=room_id).first()
+    if room is None:
+        return None
+    mappings = list(
+        OtaRoomMapping.objects.filter(room=room, provider=OtaProvider.ICAL, is_active=True)
+        .values_list("id", "sync_direction")
+    )
+    export_ids = [
+        mid for mid, direction in mappings
+        if direction in (OtaRoomMapping.SyncDirection.EXPORT, OtaRoomMapping.SyncDirection.BOTH)
+    ]
+    cal = build_calendar(f"AlojaSys - {room.hotel.name} - {room.name}")
+    qs = Reservation.objects.filter(room=room, status__in=EXPORT_STATUSES)
+    for r in qs:
+        r.room = room
+        r.hotel = room.hotel
+        add_reservation_event(cal, r)
+    entry = _entry(
+        cal.to_ical(),
+        room.hotel_id,
+        export_allowed=not mappings or bool(export_ids),
+        export_mapping_ids=export_ids,
+    )
+    _cache_add(key, gen, entry)
+    return entry
+
+
+def invalidate_ical_feeds(hotel_id: int, room_ids: Optional[Iterable[int]] = None) -> None:
+    """
+    Descarta el feed del hotel y el de las habitaciones indicadas (todas si room_ids es None)
+    pasando a la generación siguiente.
+    """
+    if room_ids is None:
+        room_ids = Room.objects.filter(hotel_id=hotel_id).values_list("id", flat=True)
+    keys = [_hotel_key(hotel_id)] + [_room_key(rid) for rid in set(room_ids) if rid]
+    try:
+        for key in keys:
+            _bump_generation(key)
+    except Exception as e:
+        logger.debug(f"No se pudo invalidar la caché iCal del hotel {hotel_id}: {e}")
+
+
+def invalidate_ical_feeds_on_commit(hotel_id: int, room_ids: Optional[Iterable[int]] = None) -> None:
+    """Invalida al confirmar la transacción (evita que un poll concurrente re-cachee datos viejos)."""
+    room_ids = None if room_ids is None else list(room_ids)
+    transaction.on_commit(lambda: invalidate_ical_feeds(hotel_id, room_ids))
@@ -0,0 +1,151 @@
+"""
+Descarga concurrente y condicional de feeds iCal.
+
+Cada OtaRoomMapping guarda los validadores HTTP (ETag / Last-Modified) y el hash SHA-256
+del último feed importado. En cada ciclo:
+
+- se envía If-None-Match / If-Modified-Since; un 304 no descarga ni parsea nada
+- si el servidor ignora los validadores, el hash del body detecta un feed idéntico
+- solo los feeds que cambiaron se entregan al importador
+
+Las descargas corren en un pool de hilos acotado (solo HTTP, sin acceso a la base), así
+la duración del ciclo depende de la latencia del feed más lento y no de la cantidad
+de mapeos.
+"""
+from __future__ import annotations
+
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+import requests
+from django.conf import settings
+
+from ..models import OtaRoomMapping
+
+
+class FetchStatus:
+    CHANGED = "changed"
+    NOT_MODIFIED = "not_modified"  # 304
+    UNCHANGED = "unchanged"  # 200 con el mismo hash
+    ERROR = "error"
+
+
+@dataclass
+class FetchResult:
+    mapping_id: int
+    status: str
+    content: Optional[bytes] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    http_status: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def changed(self) -> bool:
+        return self.status == FetchStatus.CHANGED
+
+
+_local = threading.local()
+
+
+def _session() -> requests.Session:
+    # requests.Session no es thread-safe: una por hilo del pool (reutiliza conexiones keep-alive)
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def content_hash(content: bytes, url: str = "") -> str:
+    # La URL entra en el hash: si el mapeo cambia de feed, se reimporta aunque el body coincida
+    return hashlib.sha256(url.encode() + b"\n" + (content or b"")).hexdigest()
+
+
+def fetch_feed(
+    mapping_id: int,
+    url: str,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+    previous_hash: Optional[str] = None,
+    timeout: Optional[int] = None,
+) -> FetchResult:
+    """Descarga un feed con validadores condicionales. No toca la base de datos."""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        resp = _session().get(url, headers=headers, timeout=timeout or settings.OTA_ICAL_FETCH_TIMEOUT)
+        if resp.status_code == 304:
+            return FetchResult(
+                mapping_id=mapping_id,
+                status=FetchStatus.NOT_MODIFIED,
+                etag=resp.headers.get("ETag") or etag,
+                last_modified=resp.headers.get("Last-Modified") or last_modified,
+                content_hash=previous_hash,
+                http_status=304,
+            )
+        resp.raise_for_status()
+    except Exception as e:
+        return FetchResult(mapping_id=mapping_id, status=FetchStatus.ERROR, error=str(e))
+
+    digest = content_hash(resp.content, url)
+    return FetchResult(
+        mapping_id=mapping_id,
+        status=FetchStatus.UNCHANGED if previous_hash and digest == previous_hash else FetchStatus.CHANGED,
+        content=resp.content,
+        etag=resp.headers.get("ETag"),
+        last_modified=resp.headers.get("Last-Modified"),
+        content_hash=digest,
+        http_status=resp.status_code,
+    )
+
+
+def fetch_feeds(
+    mappings: Iterable[OtaRoomMapping],
+    max_workers: Optional[int] = None,
+    force: bool = False,
+) -> Dict[int, FetchResult]:
+    """
+    Descarga en paralelo (concurrencia acotada) los feeds de los mapeos dados.
+
+    Con force=True no se envían validadores ni se compara el hash (import completo).
+    Devuelve {mapping_id: FetchResult}.
+    """
+    jobs = [
+        (
+            m.id,
+            m.ical_in_url,
+            None if force else m.ical_etag,
+            None if force else m.ical_last_modified,
+            None if force else m.ical_content_hash,
+        )
+        for m in mappings
+        if m.ical_in_url
+    ]
+    if not jobs:
+        return {}
+    workers = max(1, min(max_workers or settings.OTA_ICAL_FETCH_CONCURRENCY, len(jobs)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ical-fetch") as pool:
+        results = list(pool.map(lambda args: fetch_feed(*args), jobs))
+    return {result.mapping_id: result for result in results}
+
+
+def save_validators(mapping: OtaRoomMapping, result: Optional[FetchResult]) -> None:
+    """
+    Persiste ETag / Last-Modified / hash del feed (o los limpia con result=None para que el
+    próximo ciclo vuelva a descargar e importar completo).
+    """
+    values = {
+        "ical_etag": result.etag if result else None,
+        "ical_last_modified": result.last_modified if result else None,
+        "ical_content_hash": result.content_hash if result else None,
+    }
+    OtaRoomMapping.objects.filter(pk=mapping.pk).update(**values)
+    for field, value in values.items():
+        setattr(mapping, field, value)
@@ -14,7 +14,8 @@ from django.utils import timezone
 from django.conf import settings
 
 from apps.reservations.models import Reservation, ReservationStatus, ReservationChannel, RoomBlock, RoomBlockType
-from apps.notifications.services import NotificationService
+from .ota_reservation_service import OtaBookingData, OtaReservationService
+from .sync_log import SyncLogBuffer
 from ..models import (
     OtaRoomMapping,
     OtaImportedEvent,
@@ -43,91 +44,29 @@ class ICALSyncService:
             end = start + timedelta(days=1)
         return start, end
 
+    # Mapeo provider -> channel de Reservation y "source" para logging
+    CHANNEL_MAP = {
+        OtaProvider.ICAL: ReservationChannel.OTHER,
+        OtaProvider.BOOKING: ReservationChannel.BOOKING,
+        OtaProvider.AIRBNB: ReservationChannel.AIRBNB,
+        OtaProvider.EXPEDIA: ReservationChannel.EXPEDIA,
+    }
+    SOURCE_MAP = {
+        OtaProvider.ICAL: "ical",
+        OtaProvider.BOOKING: "booking",
+        OtaProvider.AIRBNB: "airbnb",
+        OtaProvider.EXPEDIA: "expedia",
+    }
+
     @staticmethod
-    @transaction.atomic
-    def import_reservations(ota_room_mapping: OtaRoomMapping, job: Optional[OtaSyncJob] = None) -> Dict[str, Any]:
+    def _parse_events(cal: Calendar, stats: Dict[str, Any], log: SyncLogBuffer) -> Dict[str, dict]:
         """
-        Importa reservas desde un feed iCal.
-
-        Args:
-            ota_room_mapping: Mapeo de habitación OTA con URL iCal configurada
-            job: Job de sincronización opcional para registrar logs
+        Recorre los VEVENT del feed y devuelve {uid: evento normalizado}.
 
-        Returns:
-            Dict con estadísticas: {processed, created, updated, skipped, errors}
+        Si un UID aparece repetido prevalece la última ocurrencia (como en el procesamiento
+        secuencial, donde la última escritura era la que quedaba).
         """
-        stats = {"processed": 0, "created": 0, "updated": 0, "skipped": 0, "errors": 0, "cancelled": 0}
-        run_started_at = timezone.now()
-
-        # Verificar condiciones previas
-        if not ota_room_mapping.is_active or not ota_room_mapping.ical_in_url:
-            reason = "mapping not active or no ical_in_url"
-            if job:
-                OtaSyncLog.objects.create(
-                    job=job,
-                    level=OtaSyncLog.Level.WARNING,
-                    message="IMPORT_SKIPPED",
-                    payload={"mapping_id": ota_room_mapping.id, "reason": reason},
-                )
-            return {**stats, "reason": reason}
-
-        # Verificar sync_direction
-        if ota_room_mapping.sync_direction not in [
-            OtaRoomMapping.SyncDirection.IMPORT,
-            OtaRoomMapping.SyncDirection.BOTH,
-        ]:
-            reason = f"sync_direction is {ota_room_mapping.sync_direction}, not allowing import"
-            if job:
-                OtaSyncLog.objects.create(
-                    job=job,
-                    level=OtaSyncLog.Level.INFO,
-                    message="IMPORT_SKIPPED",
-                    payload={"mapping_id": ota_room_mapping.id, "reason": reason},
-                )
-            return {**stats, "reason": reason}
-
-        # Registrar inicio
-        if job:
-            OtaSyncLog.objects.create(
-                job=job,
-                level=OtaSyncLog.Level.INFO,
-                message="IMPORT_STARTED",
-                payload={"mapping_id": ota_room_mapping.id, "url": ota_room_mapping.ical_in_url},
-            )
-
-        # Descargar archivo iCal
-        try:
-            resp = requests.get(ota_room_mapping.ical_in_url, timeout=20)
-            resp.raise_for_status()
-        except Exception as e:
-            error_msg = f"Error descargando ICS: {str(e)}"
-            stats["errors"] += 1
-            if job:
-                OtaSyncLog.objects.create(
-                    job=job,
-                    level=OtaSyncLog.Level.ERROR,
-                    message="IMPORT_ERROR",
-                    payload={"error": str(e), "url": ota_room_mapping.ical_in_url},
-                )
-            return stats
-
-        # Parsear calendario
-        try:
-            cal = Calendar.from_ical(resp.content)
-        except Exception as e:
-            error_msg = f"Error parseando ICS: {str(e)}"
-            stats["errors"] += 1
-            if job:
-                OtaSyncLog.objects.create(
-                    job=job,
-                    level=OtaSyncLog.Level.ERROR,
-                    message="IMPORT_ERROR",
-                    payload={"error": str(e)},
-                )
-            return stats
-
-        # Procesar eventos VEVENT
-        seen_uids: set[str] = set()
+        events: Dict[str, dict] = {}
         for component in cal.walk("VEVENT"):
             stats["processed"] += 1
 
@@ -139,520 +78,519 @@ class ICALSyncService:
 
             if not uid or not dtstart or not dtend:
                 stats["skipped"] += 1
-                if job:
-                    OtaSyncLog.objects.create(
-                        job=job,
-                        level=OtaSyncLog.Level.WARNING,
-                        message="EVENT_SKIPPED",
-                        payload={
-                            "reason": "missing uid, dtstart or dtend",
-                            "uid": uid,
-                            "has_dtstart": bool(dtstart),
-                            "has_dtend": bool(dtend),
-                        },
-                    )
+                log.add(OtaSyncLog.Level.WARNING, "EVENT_SKIPPED", {
+                    "reason": "missing uid, dtstart or dtend",
+                    "uid": uid,
+                    "has_dtstart": bool(dtstart),
+                    "has_dtend": bool(dtend),
+                })
                 continue
 
-            seen_uids.add(uid)
-
             # Normalizar fechas
-            start_date = ICALSyncService._to_date(dtstart.dt) if dtstart else None
-            end_date = ICALSyncService._to_date(dtend.dt) if dtend else None
-
+            start_date = ICALSyncService._to_date(dtstart.dt)
+            end_date = ICALSyncService._to_date(dtend.dt)
             if not start_date or not end_date:
                 stats["skipped"] += 1
                 continue
-
             start_date, end_date = ICALSyncService._normalize_range(start_date, end_date)
 
-            # Persistir / refrescar tracking del evento importado (por provider real, no siempre "ical")
-            try:
-                imported_event, created_ie = OtaImportedEvent.objects.get_or_create(
+            if uid in events:
+                # La ocurrencia previa cuenta como procesada sin efecto
+                stats["skipped"] += 1
+            events[uid] = {
+                "uid": uid,
+                "start": start_date,
+                "end": end_date,
+                "summary": summary,
+                "cancelled": ical_status in ("cancelled", "canceled"),
+            }
+        return events
+
+    @staticmethod
+    def _reconcile_tracking(ota_room_mapping: OtaRoomMapping, events: Dict[str, dict], stored: Dict[str, OtaImportedEvent]) -> None:
+        """
+        Sincroniza OtaImportedEvent con el feed usando operaciones bulk:
+        altas con bulk_create, cambios con bulk_update y un único UPDATE de last_seen
+        para los eventos sin cambios.
+        """
+        now = timezone.now()
+        url = ota_room_mapping.ical_in_url
+        to_create, to_update, seen_ids = [], [], []
+        for uid, ev in events.items():
+            current = stored.get(uid)
+            if current is None:
+                to_create.append(OtaImportedEvent(
                     hotel=ota_room_mapping.hotel,
                     room=ota_room_mapping.room,
                     provider=ota_room_mapping.provider,
                     uid=uid,
-                    defaults={
-                        "dtstart": start_date,
-                        "dtend": end_date,
-                        "source_url": ota_room_mapping.ical_in_url,
-                        "summary": summary,
-                    },
+                    dtstart=ev["start"],
+                    dtend=ev["end"],
+                    source_url=url,
+                    summary=ev["summary"],
+                ))
+            elif (current.dtstart, current.dtend, current.source_url, current.summary) != (ev["start"], ev["end"], url, ev["summary"]):
+                current.dtstart, current.dtend = ev["start"], ev["end"]
+                current.source_url, current.summary = url, ev["summary"]
+                current.last_seen = now
+                to_update.append(current)
+            else:
+                # Aunque no cambie nada, refrescar last_seen para poder detectar "desaparecidos"
+                seen_ids.append(current.id)
+
+        with transaction.atomic():
+            if to_create:
+                OtaImportedEvent.objects.bulk_create(to_create, batch_size=500, ignore_conflicts=True)
+            if to_update:
+                OtaImportedEvent.objects.bulk_update(
+                    to_update, ["dtstart", "dtend", "source_url", "summary", "last_seen"], batch_size=500
                 )
-                if not created_ie:
-                    changed_ie = False
-                    if imported_event.dtstart != start_date or imported_event.dtend != end_date:
-                        imported_event.dtstart = start_date
-                        imported_event.dtend = end_date
-                        changed_ie = True
-                    if imported_event.source_url != ota_room_mapping.ical_in_url:
-                        imported_event.source_url = ota_room_mapping.ical_in_url
-                        changed_ie = True
-                    if imported_event.summary != summary:
-                        imported_event.summary = summary
-                        changed_ie = True
-                    if changed_ie:
-                        imported_event.save(update_fields=["dtstart", "dtend", "source_url", "summary", "last_seen"])
-                    else:
-                        # Aunque no cambie nada, refrescar last_seen para poder detectar "desaparecidos"
-                        OtaImportedEvent.objects.filter(pk=imported_event.pk).update(last_seen=run_started_at)
-                # created_ie ya tiene last_seen set por auto_now=True
+            if seen_ids:
+                OtaImportedEvent.objects.filter(id__in=seen_ids).update(last_seen=now)
+
+    @staticmethod
+    def _guest_name_from_summary(summary: Optional[str], provider: str) -> str:
+        guest_name = summary or f"Huésped {provider}"
+        # Intentar extraer nombre del summary si tiene formato "Reserva - Nombre" o "Reserva- Nombre"
+        if summary:
+            # Si tiene formato "Reserva - Nombre" o "Reserva- Nombre", extraer el nombre
+            if ' - ' in summary:
+                parts = summary.split(' - ', 1)
+                if len(parts) > 1 and parts[0].strip().lower().startswith('reserva'):
+                    guest_name = parts[1].strip()  # Tomar la parte después de "Reserva - "
+                else:
+                    guest_name = parts[0].strip()  # Si no empieza con "Reserva", tomar la primera parte
+            elif '-' in summary and not summary.startswith('-'):
+                # Formato "Reserva-Nombre" (sin espacio)
+                parts = summary.split('-', 1)
+                if len(parts) > 1 and parts[0].strip().lower().startswith('reserva'):
+                    guest_name = parts[1].strip()  # Tomar la parte después de "Reserva-"
+                else:
+                    guest_name = summary  # Si no empieza con "Reserva", usar el summary completo
+            else:
+                guest_name = summary  # Si no tiene separador, usar el summary completo
+        return guest_name
+
+    @staticmethod
+    def _booking_for_event(ota_room_mapping: OtaRoomMapping, ev: dict, channel: str, source: str, existing: bool) -> OtaBookingData:
+        """Evento del feed como OtaBookingData; a una reserva existente no se le pisan los huéspedes."""
+        summary = ev["summary"]
+        guests_data = []
+        if not existing:
+            guest_name = ICALSyncService._guest_name_from_summary(summary, ota_room_mapping.provider)
+            guests_data = [{
+                "name": guest_name,
+                "email": f"{guest_name.lower().replace(' ', '.')}@example.com",
+                "is_primary": True,
+                "source": source,  # "ical", "booking", "airbnb", etc.
+            }]
+        # iCal no modela “pendiente/confirmada” como un PMS, pero el evento representa una
+        # ocupación real (bloquea inventario): el upsert la deja CONFIRMED
+        return OtaBookingData(
+            room=ota_room_mapping.room,
+            external_id=ev["uid"],  # UID del evento iCal como external_id
+            channel=channel,
+            check_in=ev["start"],
+            check_out=ev["end"],
+            guests=None if existing else 1,
+            guests_data=guests_data,
+            notes=f"Importado desde {ota_room_mapping.provider} iCal: {summary or ''}",
+        )
+
+    @staticmethod
+    def import_reservations(
+        ota_room_mapping: OtaRoomMapping,
+        job: Optional[OtaSyncJob] = None,
+        content: Optional[bytes] = None,
+    ) -> Dict[str, Any]:
+        """
+        Importa reservas desde un feed iCal.
+
+        Reconciliación por lotes: parsea el feed completo, lee de una vez los
+        OtaImportedEvent y reservas existentes, calcula el diff en memoria y aplica
+        altas y cambios por lote con upsert_reservations_batch y las cancelaciones en
+        transacciones cortas. Los eventos sin cambios no escriben nada salvo un UPDATE de last_seen.
+
+        Args:
+            ota_room_mapping: Mapeo de habitación OTA con URL iCal configurada
+            job: Job de sincronización opcional para registrar logs
+            content: Body del feed ya descargado (ver ical_fetcher); si no se pasa, se descarga
+
+        Returns:
+            Dict con estadísticas: {processed, created, updated, skipped, errors}
+        """
+        stats = {"processed": 0, "created": 0, "updated": 0, "skipped": 0, "errors": 0, "cancelled": 0}
+        run_started_at = timezone.now()
+        # Logs del job: buffer con colapso de no-ops, se insertan con bulk_create al salir del
+        # bloque (también si se escapa una excepción)
+        with SyncLogBuffer(job) as log:
+            # Verificar condiciones previas
+            if not ota_room_mapping.is_active or not ota_room_mapping.ical_in_url:
+                reason = "mapping not active or no ical_in_url"
+                log.add(OtaSyncLog.Level.WARNING, "IMPORT_SKIPPED", {"mapping_id": ota_room_mapping.id, "reason": reason})
+                return {**stats, "reason": reason}
+
+            # Verificar sync_direction
+            if ota_room_mapping.sync_direction not in [
+                OtaRoomMapping.SyncDirection.IMPORT,
+                OtaRoomMapping.SyncDirection.BOTH,
+            ]:
+                reason = f"sync_direction is {ota_room_mapping.sync_direction}, not allowing import"
+                log.add(OtaSyncLog.Level.INFO, "IMPORT_SKIPPED", {"mapping_id": ota_room_mapping.id, "reason": reason})
+                return {**stats, "reason": reason}
+
+            # Registrar inicio
+            log.add(OtaSyncLog.Level.INFO, "IMPORT_STARTED", {"mapping_id": ota_room_mapping.id, "url": ota_room_mapping.ical_in_url})
+
+            # Descargar archivo iCal (salvo que el fetcher ya lo haya traído)
+            try:
+                if content is None:
+                    resp = requests.get(ota_room_mapping.ical_in_url, timeout=20)
+                    resp.raise_for_status()
+                    content = resp.content
+            except Exception as e:
+                stats["errors"] += 1
+                log.add(OtaSyncLog.Level.ERROR, "IMPORT_ERROR", {"error": str(e), "url": ota_room_mapping.ical_in_url})
+                return stats
+
+            # Parsear calendario
+            try:
+                cal = Calendar.from_ical(content)
+            except Exception as e:
+                stats["errors"] += 1
+                log.add(OtaSyncLog.Level.ERROR, "IMPORT_ERROR", {"error": str(e)})
+                return stats
+
+            events = ICALSyncService._parse_events(cal, stats, log)
+            seen_uids = set(events)
+
+            # Estado actual: una query para los eventos importados de esta habitación/provider
+            stored = {
+                ev.uid: ev
+                for ev in OtaImportedEvent.objects.filter(
+                    hotel=ota_room_mapping.hotel,
+                    room=ota_room_mapping.room,
+                    provider=ota_room_mapping.provider,
+                )
+            }
+            # Persistir / refrescar tracking del evento importado (por provider real, no siempre "ical")
+            try:
+                ICALSyncService._reconcile_tracking(ota_room_mapping, events, stored)
             except Exception:
                 # No romper import por fallas de tracking
                 pass
 
             # Determinar si se debe crear Reservation o RoomBlock
             # Por defecto: Booking/Airbnb/Expedia crean Reservation, ICAL genérico puede crear RoomBlock
-            # Para ICAL, podemos crear RoomBlock si no necesitamos rastrear como reserva visible
             create_reservation = ota_room_mapping.provider in [
                 OtaProvider.BOOKING,
                 OtaProvider.AIRBNB,
                 OtaProvider.EXPEDIA,
             ]
-            
             # Si es ICAL, por defecto también creamos Reservation (comportamiento actual)
             # Pero se puede cambiar para crear RoomBlock si es necesario
             if ota_room_mapping.provider == OtaProvider.ICAL:
                 create_reservation = True  # Cambiar a False si se quiere usar RoomBlock para ICAL genérico
-            
-            # Mapear provider a channel para Reservations
-            channel_map = {
-                OtaProvider.ICAL: ReservationChannel.OTHER,
-                OtaProvider.BOOKING: ReservationChannel.BOOKING,
-                OtaProvider.AIRBNB: ReservationChannel.AIRBNB,
-                OtaProvider.EXPEDIA: ReservationChannel.EXPEDIA,
-            }
-            channel = channel_map.get(ota_room_mapping.provider, ReservationChannel.OTHER)
-            
-            # Mapear provider a "source" para logging (equivalente al provider)
-            source_map = {
-                OtaProvider.ICAL: "ical",
-                OtaProvider.BOOKING: "booking",
-                OtaProvider.AIRBNB: "airbnb",
-                OtaProvider.EXPEDIA: "expedia",
-            }
-            source = source_map.get(ota_room_mapping.provider, "unknown")
 
-            # Procesar según tipo: Reservation o RoomBlock
+            channel = ICALSyncService.CHANNEL_MAP.get(ota_room_mapping.provider, ReservationChannel.OTHER)
+            source = ICALSyncService.SOURCE_MAP.get(ota_room_mapping.provider, "unknown")
+
+            # Eventos que ya no están en el feed (misma fuente, no vencidos)
+            today = timezone.localdate()
+            disappeared = [
+                ev for uid, ev in stored.items()
+                if uid not in seen_uids
+                and ev.source_url == ota_room_mapping.ical_in_url
+                and ev.last_seen < run_started_at
+                and not (ev.dtend and ev.dtend < today)
+            ]
+
+            if create_reservation:
+                ICALSyncService._apply_reservation_diff(
+                    ota_room_mapping, events, disappeared, channel, source, stats, log
+                )
+            else:
+                ICALSyncService._apply_block_diff(ota_room_mapping, events, source, stats, log)
+
+            # Actualizar last_synced si hubo procesamiento exitoso
+            if stats["processed"] > 0 or stats["created"] > 0 or stats["updated"] > 0:
+                ota_room_mapping.last_synced = timezone.now()
+                ota_room_mapping.save(update_fields=["last_synced"])
+
+            # Registrar finalización
+            if job:
+                job.stats = {**(job.stats or {}), **stats}
+                job.save(update_fields=["stats"])
+                log.add(OtaSyncLog.Level.INFO, "IMPORT_COMPLETED", {"mapping_id": ota_room_mapping.id, **stats})
+
+            return stats
+
+    @staticmethod
+    def _apply_reservation_diff(
+        ota_room_mapping: OtaRoomMapping,
+        events: Dict[str, dict],
+        disappeared: list,
+        channel: str,
+        source: str,
+        stats: Dict[str, Any],
+        log: SyncLogBuffer,
+    ) -> None:
+        """Aplica altas, cambios y cancelaciones de reservas a partir del diff del feed."""
+        uids = set(events) | {ev.uid for ev in disappeared}
+        # Una sola query para todas las reservas de los UIDs involucrados (la más reciente gana,
+        # igual que el .first() por evento con el ordering de Reservation)
+        reservations: Dict[str, Reservation] = {}
+        if uids:
+            for r in Reservation.objects.filter(
+                hotel=ota_room_mapping.hotel,
+                external_id__in=uids,
+                channel=channel,
+            ).select_related("room"):
+                reservations.setdefault(r.external_id, r)
+
+        bookings = []
+        for uid, ev in events.items():
+            start_date, end_date, summary = ev["start"], ev["end"], ev["summary"]
+            reservation = reservations.get(uid)
             try:
-                if create_reservation:
-                    # ===== LÓGICA PARA RESERVATION =====
-                    # Buscar si existe una reserva con el mismo external_id y channel en el hotel
-                    reservation = Reservation.objects.filter(
-                        hotel=ota_room_mapping.hotel,
-                        external_id=uid,
-                        channel=channel,
-                    ).first()
-
-                    # Si el VEVENT viene CANCELLED, cancelar la reserva si existe y no está cerrada.
-                    if ical_status in ("cancelled", "canceled"):
-                        if reservation and reservation.status in [ReservationStatus.PENDING, ReservationStatus.CONFIRMED]:
+                # Si el VEVENT viene CANCELLED, cancelar la reserva si existe y no está cerrada.
+                if ev["cancelled"]:
+                    if reservation and reservation.status in [ReservationStatus.PENDING, ReservationStatus.CONFIRMED]:
+                        with transaction.atomic():
                             reservation.status = ReservationStatus.CANCELLED
                             reservation.notes = (reservation.notes or "") + f"\nCancelada desde {ota_room_mapping.provider} iCal (STATUS:CANCELLED)."
                             reservation.save(skip_clean=True)
-                            stats["cancelled"] += 1
-                            if job:
-                                OtaSyncLog.objects.create(
-                                    job=job,
-                                    level=OtaSyncLog.Level.INFO,
-                                    message="RESERVATION_CANCELLED",
-                                    payload={
-                                        "reservation_id": reservation.id,
-                                        "external_id": uid,
-                                        "source": source,
-                                        "channel": channel,
-                                        "provider": ota_room_mapping.provider,
-                                        "reason": "ical_status_cancelled",
-                                        "status": "success",
-                                    },
-                                )
-                        else:
-                            stats["skipped"] += 1
-                        continue
-
-                    if reservation:
-                        # Actualizar reserva existente
-                        changed = False
-                        if reservation.check_in != start_date or reservation.check_out != end_date:
-                            reservation.check_in = start_date
-                            reservation.check_out = end_date
-                            changed = True
-                        if reservation.room_id != ota_room_mapping.room_id:
-                            reservation.room = ota_room_mapping.room
-                            changed = True
-                        if reservation.status != ReservationStatus.CONFIRMED and reservation.status != ReservationStatus.CANCELLED:
-                            reservation.status = ReservationStatus.CONFIRMED
-                            changed = True
-                        if summary and (not reservation.notes or summary not in reservation.notes):
-                            reservation.notes = f"Importado desde {ota_room_mapping.provider} iCal: {summary or ''}"
-                            changed = True
-
-                        if changed:
-                            # Saltar validación de solapamiento para reservas importadas desde OTA
-                            # porque pueden tener fechas que se solapan con otras reservas del PMS
-                            reservation.save(skip_clean=True)
-                            stats["updated"] += 1
-                            if job:
-                                OtaSyncLog.objects.create(
-                                    job=job,
-                                    level=OtaSyncLog.Level.INFO,
-                                    message="RESERVATION_UPDATED",
-                                    payload={
-                                        "reservation_id": reservation.id,
-                                        "external_id": uid,
-                                        "source": source,
-                                        "channel": channel,
-                                        "check_in": start_date.isoformat(),
-                                        "check_out": end_date.isoformat(),
-                                        "room_id": ota_room_mapping.room_id,
-                                        "provider": ota_room_mapping.provider,
-                                        "status": "success",
-                                    },
-                                )
-                        else:
-                            stats["skipped"] += 1
-                            if job:
-                                OtaSyncLog.objects.create(
-                                    job=job,
-                                    level=OtaSyncLog.Level.INFO,
-                                    message="RESERVATION_NO_CHANGES",
-                                    payload={
-                                        "reservation_id": reservation.id,
-                                        "external_id": uid,
-                                        "source": source,
-                                        "status": "skipped",
-                                    },
-                                )
-                    else:
-                        # Crear nueva reserva
-                        # Nota: Al crear, puede haber conflictos de solapamiento con otras reservas
-                        # En ese caso, registramos el error pero continuamos
-                        try:
-                            # Obtener política de cancelación para el hotel
-                            from apps.payments.models import CancellationPolicy
-                            cancellation_policy = CancellationPolicy.resolve_for_hotel(ota_room_mapping.hotel)
-                            
-                            # Extraer nombre del huésped del summary si es posible
-                            guest_name = summary or f"Huésped {ota_room_mapping.provider}"
-                            # Intentar extraer nombre del summary si tiene formato "Reserva - Nombre" o "Reserva- Nombre"
-                            if summary:
-                                # Si tiene formato "Reserva - Nombre" o "Reserva- Nombre", extraer el nombre
-                                if ' - ' in summary:
-                                    parts = summary.split(' - ', 1)
-                                    if len(parts) > 1 and parts[0].strip().lower().startswith('reserva'):
-                                        guest_name = parts[1].strip()  # Tomar la parte después de "Reserva - "
-                                    else:
-                                        guest_name = parts[0].strip()  # Si no empieza con "Reserva", tomar la primera parte
-                                elif '-' in summary and not summary.startswith('-'):
-                                    # Formato "Reserva-Nombre" (sin espacio)
-                                    parts = summary.split('-', 1)
-                                    if len(parts) > 1 and parts[0].strip().lower().startswith('reserva'):
-                                        guest_name = parts[1].strip()  # Tomar la parte después de "Reserva-"
-                                    else:
-                                        guest_name = summary  # Si no empieza con "Reserva", usar el summary completo
-                                else:
-                                    guest_name = summary  # Si no tiene separador, usar el summary completo
-                            
-                            # Preparar guests_data completo
-                            guests_data = [{
-                                "name": guest_name,
-                                "email": f"{guest_name.lower().replace(' ', '.')}@example.com",
-                                "is_primary": True,
-                                "source": source,  # "ical", "booking", "airbnb", etc.
-                            }]
-                            
-                            # Proveer valores mínimos para pasar validaciones y guardar con skip_clean
-                            reservation = Reservation(
-                                hotel=ota_room_mapping.hotel,
-                                room=ota_room_mapping.room,
-                                external_id=uid,  # UID del evento iCal como external_id
-                                channel=channel,  # Channel según provider (booking, expedia, other)
-                                check_in=start_date,
-                                check_out=end_date,
-                                # iCal no modela “pendiente/confirmada” como un PMS, pero el evento representa
-                                # una ocupación real (bloquea inventario). Para evitar confusión operativa y
-                                # efectos colaterales (tareas automáticas sobre PENDING), la marcamos CONFIRMED.
-                                status=ReservationStatus.CONFIRMED,
-                                guests=1,
-                                guests_data=guests_data,
-                                notes=f"Importado desde {ota_room_mapping.provider} iCal: {summary or ''}",
-                                applied_cancellation_policy=cancellation_policy,  # Aplicar política si existe
-                                # Campos agregados para compatibilidad con columnas NOT NULL
-                                overbooking_flag=False,
-                            )
-                            reservation.save(skip_clean=True)
-                            
-                            # Generar noches y calcular totales para que la reserva esté completa
-                            from apps.reservations.services.pricing import generate_nights_for_reservation, recalc_reservation_totals
-                            generate_nights_for_reservation(reservation)
-                            recalc_reservation_totals(reservation)
-                            
-                            # Verificar si hay overbooking
-                            active_status = [
-                                ReservationStatus.PENDING,
-                                ReservationStatus.CONFIRMED,
-                                ReservationStatus.CHECK_IN,
-                            ]
-                            has_overlap = Reservation.objects.filter(
-                                hotel=reservation.hotel,
-                                room=reservation.room,
-                                status__in=active_status,
-                                check_in__lt=reservation.check_out,
-                                check_out__gt=reservation.check_in,
-                            ).exclude(pk=reservation.pk).exists()
-                            
-                            if has_overlap and not reservation.overbooking_flag:
-                                reservation.overbooking_flag = True
-                                reservation.save(update_fields=["overbooking_flag"])
-                            
-                            # Crear notificación para nueva reserva OTA
-                            try:
-                                provider_name = OtaProvider(ota_room_mapping.provider).label
-                                NotificationService.create_ota_reservation_notification(
-                                    provider_name=provider_name,
-                                    reservation_code=f"RES-{reservation.id}",
-                                    room_name=ota_room_mapping.room.name or f"Habitación {ota_room_mapping.room.number}",
-                                    check_in_date=start_date.strftime("%d/%m/%Y"),
-                                    check_out_date=end_date.strftime("%d/%m/%Y"),
-                                    guest_name=guest_name,
-                                    hotel_id=ota_room_mapping.hotel.id,
-                                    reservation_id=reservation.id,
-                                    external_id=uid,
-                                    overbooking=has_overlap
-                                )
-                            except Exception as notif_error:
-                                import logging
-                                logger = logging.getLogger(__name__)
-                                logger.warning(f"Error al crear notificación para reserva OTA {reservation.id}: {notif_error}")
-                            
-                            stats["created"] += 1
-                            if job:
-                                OtaSyncLog.objects.create(
-                                    job=job,
-                                    level=OtaSyncLog.Level.INFO,
-                                    message="RESERVATION_CREATED",
-                                    payload={
-                                        "reservation_id": reservation.id,
-                                        "external_id": uid,
-                                        "source": source,
-                                        "channel": channel,
-                                        "check_in": start_date.isoformat(),
-                                        "check_out": end_date.isoformat(),
-                                        "room_id": ota_room_mapping.room_id,
-                                        "provider": ota_room_mapping.provider,
-                                        "status": "success",
-                                    },
-                                )
-                        except Exception as create_error:
-                            # Si falla por validación de solapamiento, registrar pero continuar
-                            stats["errors"] += 1
-                            if job:
-                                OtaSyncLog.objects.create(
-                                    job=job,
-                                    level=OtaSyncLog.Level.WARNING,
-                                    message="RESERVATION_CONFLICT",
-                                    payload={
-                                        "external_id": uid,
-                                        "source": source,
-                                        "error": str(create_error),
-                                        "check_in": start_date.isoformat(),
-                                        "check_out": end_date.isoformat(),
-                                        "room_id": ota_room_mapping.room_id,
-                                        "provider": ota_room_mapping.provider,
-                                        "status": "error",
-                                    },
-                                )
-                else:
-                    # ===== LÓGICA PARA ROOMBLOCK (cuando no se requiere reserva visible) =====
-                    # Buscar si existe un bloqueo con el mismo external_id almacenado en reason
-                    # (usamos reason para almacenar el external_id ya que RoomBlock no tiene external_id)
-                    existing_block = RoomBlock.objects.filter(
-                        hotel=ota_room_mapping.hotel,
-                        room=ota_room_mapping.room,
-                        reason__icontains=f"external_id:{uid}",
-                        is_active=True,
-                    ).first()
-                    
-                    if existing_block:
-                        # Actualizar bloqueo existente
-                        changed = False
-                        if existing_block.start_date != start_date or existing_block.end_date != end_date:
-                            existing_block.start_date = start_date
-                            existing_block.end_date = end_date
-                            changed = True
-                        if summary and (not existing_block.reason or summary not in existing_block.reason):
-                            existing_block.reason = f"external_id:{uid} - {summary or 'Importado desde OTA'}"
-                            changed = True
-                        
-                        if changed:
-                            existing_block.save()
-                            stats["updated"] += 1
-                            if job:
-                                OtaSyncLog.objects.create(
-                                    job=job,
-                                    level=OtaSyncLog.Level.INFO,
-                                    message="ROOMBLOCK_UPDATED",
-                                    payload={
-                                        "block_id": existing_block.id,
-                                        "external_id": uid,
-                                        "source": source,
-                                        "start_date": start_date.isoformat(),
-                                        "end_date": end_date.isoformat(),
-                                        "room_id": ota_room_mapping.room_id,
-                                        "provider": ota_room_mapping.provider,
-                                        "status": "success",
-                                    },
-                                )
-                        else:
-                            stats["skipped"] += 1
-                            if job:
-                                OtaSyncLog.objects.create(
-                                    job=job,
-                                    level=OtaSyncLog.Level.INFO,
-                                    message="ROOMBLOCK_NO_CHANGES",
-                                    payload={
-                                        "block_id": existing_block.id,
-                                        "external_id": uid,
-                                        "source": source,
-                                        "status": "skipped",
-                                    },
-                                )
-                    else:
-                        # Crear nuevo bloqueo
-                        try:
-                            room_block = RoomBlock.objects.create(
-                                hotel=ota_room_mapping.hotel,
-                                room=ota_room_mapping.room,
-                                start_date=start_date,
-                                end_date=end_date,
-                                block_type=RoomBlockType.HOLD,
-                                reason=f"external_id:{uid} - {summary or 'Importado desde OTA iCal'}",  # Almacenar UID en reason
-                                is_active=True,
-                            )
-                            stats["created"] += 1
-                            if job:
-                                OtaSyncLog.objects.create(
-                                    job=job,
-                                    level=OtaSyncLog.Level.INFO,
-                                    message="ROOMBLOCK_CREATED",
-                                    payload={
-                                        "block_id": room_block.id,
-                                        "external_id": uid,
-                                        "source": source,
-                                        "start_date": start_date.isoformat(),
-                                        "end_date": end_date.isoformat(),
-                                        "room_id": ota_room_mapping.room_id,
-                                        "provider": ota_room_mapping.provider,
-                                        "status": "success",
-                                    },
-                                )
-                        except Exception as create_error:
-                            stats["errors"] += 1
-                            if job:
-                                OtaSyncLog.objects.create(
-                                    job=job,
-                                    level=OtaSyncLog.Level.ERROR,
-                                    message="ROOMBLOCK_ERROR",
-                                    payload={
-                                        "external_id": uid,
-                                        "source": source,
-                                        "error": str(create_error),
-                                        "check_in": start_date.isoformat(),
-                                        "check_out": end_date.isoformat(),
-                                        "room_id": ota_room_mapping.room_id,
-                                        "provider": ota_room_mapping.provider,
-                                        "status": "error",
-                                    },
-                                )
-
-            except Exception as e:
-                stats["errors"] += 1
-                if job:
-                    OtaSyncLog.objects.create(
-                        job=job,
-                        level=OtaSyncLog.Level.ERROR,
-                        message="IMPORT_ERROR",
-                        payload={
+                        stats["cancelled"] += 1
+                        log.add(OtaSyncLog.Level.INFO, "RESERVATION_CANCELLED", {
+                            "reservation_id": reservation.id,
                             "external_id": uid,
                             "source": source,
-                            "error": str(e),
-                            "check_in": start_date.isoformat() if start_date else None,
-                            "check_out": end_date.isoformat() if end_date else None,
-                            "room_id": ota_room_mapping.room_id,
+                            "channel": channel,
                             "provider": ota_room_mapping.provider,
-                            "create_reservation": create_reservation,
-                            "status": "error",
-                        },
-                    )
+                            "reason": "ical_status_cancelled",
+                            "status": "success",
+                        })
+                    else:
+                        stats["skipped"] += 1
+                    continue
+
+                # Diff en memoria: sólo las altas y las reservas que cambian van al upsert por lote
+                if reservation and not (
+                    reservation.check_in != start_date
+                    or reservation.check_out != end_date
+                    or reservation.room_id != ota_room_mapping.room_id
+                    or reservation.status == ReservationStatus.PENDING
+                    or (summary and (not reservation.notes or summary not in reservation.notes))
+                ):
+                    stats["skipped"] += 1
+                    log.add(OtaSyncLog.Level.INFO, "RESERVATION_NO_CHANGES", {
+                        "reservation_id": reservation.id,
+                        "external_id": uid,
+                        "source": source,
+                        "status": "skipped",
+                    })
+                    continue
+                bookings.append(
+                    ICALSyncService._booking_for_event(ota_room_mapping, ev, channel, source, existing=reservation is not None)
+                )
+            except Exception as e:
+                stats["errors"] += 1
+                log.add(OtaSyncLog.Level.ERROR, "IMPORT_ERROR", {
+                    "external_id": uid,
+                    "source": source,
+                    "error": str(e),
+                    "check_in": start_date.isoformat() if start_date else None,
+                    "check_out": end_date.isoformat() if end_date else None,
+                    "room_id": ota_room_mapping.room_id,
+                    "provider": ota_room_mapping.provider,
+                    "create_reservation": True,
+                    "status": "error",
+                })
+
+        # Altas y cambios con upsert_reservations_batch: escrituras bulk y noches, totales,
+        # overbooking, auditoría, notificaciones e inventario una vez por lote
+        provider_name = OtaProvider(ota_room_mapping.provider).label
+        size = max(int(getattr(settings, "OTA_PULL_BATCH_SIZE", 200)), 1)
+        chunks = [bookings[i:i + size] for i in range(0, len(bookings), size)]
+        while chunks:
+            chunk = chunks.pop(0)
+            try:
+                result = OtaReservationService.upsert_reservations_batch(
+                    hotel=ota_room_mapping.hotel,
+                    bookings=chunk,
+                    provider_name=provider_name,
+                )
+            except Exception as e:
+                if len(chunk) > 1:
+                    # El lote se revierte entero: reintentar por mitades hasta aislar la reserva que falla
+                    half = len(chunk) // 2
+                    chunks[:0] = [chunk[:half], chunk[half:]]
+                    continue
+                stats["errors"] += 1
+                log.add(OtaSyncLog.Level.WARNING, "RESERVATION_CONFLICT", {
+                    "external_id": chunk[0].external_id,
+                    "source": source,
+                    "error": str(e),
+                    "room_id": ota_room_mapping.room_id,
+                    "provider": ota_room_mapping.provider,
+                    "status": "error",
+                })
+                continue
+            stats["created"] += result["created"]
+            stats["updated"] += result["updated"]
+            stats["skipped"] += result["unchanged"]
+            by_uid = {b.external_id: b for b in chunk}
+            for item in result["results"]:
+                if not (item["created"] or item["updated"]):
+                    continue
+                booking = by_uid[item["external_id"]]
+                log.add(OtaSyncLog.Level.INFO, "RESERVATION_CREATED" if item["created"] else "RESERVATION_UPDATED", {
+                    "reservation_id": item["reservation_id"],
+                    "external_id": item["external_id"],
+                    "source": source,
+                    "channel": channel,
+                    "check_in": booking.check_in.isoformat(),
+                    "check_out": booking.check_out.isoformat(),
+                    "room_id": ota_room_mapping.room_id,
+                    "provider": ota_room_mapping.provider,
+                    "status": "success",
+                })
 
         # Cancelaciones por "evento desaparecido del feed":
         # Si un UID ya existía para esta fuente (source_url) y no apareció en esta corrida,
         # lo marcamos como cancelado (solo reservas futuras/activas).
-        try:
-            if ota_room_mapping.ical_in_url:
-                disappeared = (
-                    OtaImportedEvent.objects.filter(
-                        hotel=ota_room_mapping.hotel,
-                        room=ota_room_mapping.room,
-                        provider=ota_room_mapping.provider,
-                        source_url=ota_room_mapping.ical_in_url,
-                        last_seen__lt=run_started_at,
-                    )
-                )
-                today = timezone.localdate()
-                for ev in disappeared.iterator():
-                    if ev.uid in seen_uids:
-                        continue
-                    # Cancelar solo si la reserva está activa y aún no pasó (ev.dtend >= hoy)
-                    if ev.dtend and ev.dtend < today:
-                        continue
-                    r = Reservation.objects.filter(
-                        hotel=ota_room_mapping.hotel,
-                        external_id=ev.uid,
-                        channel=channel_map.get(ota_room_mapping.provider, ReservationChannel.OTHER),
-                    ).first()
-                    if not r:
-                        continue
-                    if r.status not in [ReservationStatus.PENDING, ReservationStatus.CONFIRMED]:
-                        continue
+        for ev in disappeared:
+            r = reservations.get(ev.uid)
+            if not r or r.status not in [ReservationStatus.PENDING, ReservationStatus.CONFIRMED]:
+                continue
+            try:
+                with transaction.atomic():
                     r.status = ReservationStatus.CANCELLED
                     r.notes = (r.notes or "") + f"\nCancelada desde {ota_room_mapping.provider} iCal (evento ya no está en el feed)."
                     r.save(skip_clean=True)
-                    stats["cancelled"] += 1
-                    if job:
-                        OtaSyncLog.objects.create(
-                            job=job,
-                            level=OtaSyncLog.Level.INFO,
-                            message="RESERVATION_CANCELLED",
-                            payload={
-                                "reservation_id": r.id,
-                                "external_id": ev.uid,
-                                "provider": ota_room_mapping.provider,
-                                "reason": "event_disappeared",
-                                "status": "success",
-                            },
-                        )
-        except Exception:
-            # No romper import por fallas al detectar desaparecidos
-            pass
-
-        # Actualizar last_synced si hubo procesamiento exitoso
-        if stats["processed"] > 0 or stats["created"] > 0 or stats["updated"] > 0:
-            ota_room_mapping.last_synced = timezone.now()
-            ota_room_mapping.save(update_fields=["last_synced"])
+            except Exception:
+                # No romper import por fallas al cancelar desaparecidos
+                continue
+            stats["cancelled"] += 1
+            log.add(OtaSyncLog.Level.INFO, "RESERVATION_CANCELLED", {
+                "reservation_id": r.id,
+                "external_id": ev.uid,
+                "provider": ota_room_mapping.provider,
+                "reason": "event_disappeared",
+                "status": "success",
+            })
 
-        # Registrar finalización
-        if job:
-            job.stats = {**(job.stats or {}), **stats}
-            job.save(update_fields=["stats"])
-            OtaSyncLog.objects.create(
-                job=job,
-                level=OtaSyncLog.Level.INFO,
-                message="IMPORT_COMPLETED",
-                payload={"mapping_id": ota_room_mapping.id, **stats},
-            )
+    @staticmethod
+    def _apply_block_diff(
+        ota_room_mapping: OtaRoomMapping,
+        events: Dict[str, dict],
+        source: str,
+        stats: Dict[str, Any],
+        log: SyncLogBuffer,
+    ) -> None:
+        """
+        Variante RoomBlock (cuando no se requiere reserva visible). El UID se guarda en
+        reason como "external_id:<uid>"; los bloqueos activos de la habitación se leen una vez.
+        """
+        blocks: Dict[str, RoomBlock] = {}
+        for block in RoomBlock.objects.filter(
+            hotel=ota_room_mapping.hotel,
+            room=ota_room_mapping.room,
+            reason__icontains="external_id:",
+            is_active=True,
+        ):
+            reason = (block.reason or "").lower()
+            for uid in events:
+                if f"external_id:{uid}".lower() in reason:
+                    blocks.setdefault(uid, block)
+
+        for uid, ev in events.items():
+            start_date, end_date, summary = ev["start"], ev["end"], ev["summary"]
+            existing_block = blocks.get(uid)
+            try:
+                if existing_block:
+                    # Actualizar bloqueo existente
+                    changed = False
+                    if existing_block.start_date != start_date or existing_block.end_date != end_date:
+                        existing_block.start_date = start_date
+                        existing_block.end_date = end_date
+                        changed = True
+                    if summary and (not existing_block.reason or summary not in existing_block.reason):
+                        existing_block.reason = f"external_id:{uid} - {summary or 'Importado desde OTA'}"
+                        changed = True
+
+                    if changed:
+                        with transaction.atomic():
+                            existing_block.save()
+                        stats["updated"] += 1
+                        log.add(OtaSyncLog.Level.INFO, "ROOMBLOCK_UPDATED", {
+                            "block_id": existing_block.id,
+                            "external_id": uid,
+                            "source": source,
+                            "start_date": start_date.isoformat(),
+                            "end_date": end_date.isoformat(),
+                            "room_id": ota_room_mapping.room_id,
+                            "provider": ota_room_mapping.provider,
+                            "status": "success",
+                        })
+                    else:
+                        stats["skipped"] += 1
+                        log.add(OtaSyncLog.Level.INFO, "ROOMBLOCK_NO_CHANGES", {
+                            "block_id": existing_block.id,
+                            "external_id": uid,
+                            "source": source,
+                            "status": "skipped",
+                        })
+                    continue
 
-        return stats
+                # Crear nuevo bloqueo
+                try:
+                    with transaction.atomic():
+                        room_block = RoomBlock.objects.create(
+                            hotel=ota_room_mapping.hotel,
+                            room=ota_room_mapping.room,
+                            start_date=start_date,
+                            end_date=end_date,
+                            block_type=RoomBlockType.HOLD,
+                            reason=f"external_id:{uid} - {summary or 'Importado desde OTA iCal'}",  # Almacenar UID en reason
+                            is_active=True,
+                        )
+                    stats["created"] += 1
+                    log.add(OtaSyncLog.Level.INFO, "ROOMBLOCK_CREATED", {
+                        "block_id": room_block.id,
+                        "external_id": uid,
+                        "source": source,
+                        "start_date": start_date.isoformat(),
+                        "end_date": end_date.isoformat(),
+                        "room_id": ota_room_mapping.room_id,
+                        "provider": ota_room_mapping.provider,
+                        "status": "success",
+                    })
+                except Exception as create_error:
+                    stats["errors"] += 1
+                    log.add(OtaSyncLog.Level.ERROR, "ROOMBLOCK_ERROR", {
+                        "external_id": uid,
+                        "source": source,
+                        "error": str(create_error),
+                        "check_in": start_date.isoformat(),
+                        "check_out": end_date.isoformat(),
+                        "room_id": ota_room_mapping.room_id,
+                        "provider": ota_room_mapping.provider,
+                        "status": "error",
+                    })
+            except Exception as e:
+                stats["errors"] += 1
+                log.add(OtaSyncLog.Level.ERROR, "IMPORT_ERROR", {
+                    "external_id": uid,
+                    "source": source,
+                    "error": str(e),
+                    "check_in": start_date.isoformat() if start_date else None,
+                    "check_out": end_date.isoformat() if end_date else None,
+                    "room_id": ota_room_mapping.room_id,
+                    "provider": ota_room_mapping.provider,
+                    "create_reservation": False,
+                    "status": "error",
+                })
 
     @staticmethod
     @transaction.atomic
@@ -1,11 +1,15 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import copy
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
 from datetime import date, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 from decimal import Decimal
 
+from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
 
@@ -15,10 +19,14 @@ from apps.reservations.models import (
     ReservationChannel,
     Payment,
     ChannelCommission,
-    ReservationNight,
+    ReservationChangeLog,
+    ReservationChangeEvent,
+    ReservationStatusChange,
 )
 from apps.notifications.services import NotificationService
 
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class PaymentInfo:
@@ -34,6 +42,20 @@ class PaymentInfo:
     payout_date: Optional[date] = None
 
 
+@dataclass
+class OtaBookingData:
+    """Reserva de un canal ya normalizada, para upsert_reservations_batch."""
+    room: Any
+    external_id: str
+    channel: str
+    check_in: date
+    check_out: date
+    guests: Optional[int]  # None: no tocar los huéspedes de una reserva existente
+    guests_data: list = field(default_factory=list)
+    notes: Optional[str] = None
+    ota_total_price: Any = None
+
+
 class OtaReservationService:
     @staticmethod
     def _to_decimal(val: Any) -> Decimal | None:
@@ -52,6 +74,30 @@ class OtaReservationService:
         except Exception:
             return None
 
+    @staticmethod
+    def _flat_night_rows(check_in: date, nights_count: int, ota_total_price: Decimal) -> list:
+        """Prorrateo del total OTA en noches iguales (la última absorbe el redondeo)."""
+        base = (ota_total_price / Decimal(nights_count)).quantize(Decimal("0.01"))
+        # Ajuste en la última noche para que la suma dé exacta (por redondeo)
+        running = Decimal("0.00")
+        current = check_in
+        rows = []
+        for idx in range(nights_count):
+            amount = base
+            if idx == nights_count - 1:
+                amount = (ota_total_price - running).quantize(Decimal("0.01"))
+            rows.append({
+                "date": current,
+                "base_rate": amount,
+                "extra_guest_fee": Decimal("0.00"),
+                "discount": Decimal("0.00"),
+                "tax": Decimal("0.00"),
+                "total_night": amount,
+            })
+            running += amount
+            current = current + timedelta(days=1)
+        return rows
+
     @staticmethod
     def _apply_ota_total_price(reservation: Reservation, ota_total_price: Decimal) -> None:
         """
@@ -67,30 +113,13 @@ class OtaReservationService:
         if nights_count <= 0:
             return
 
-        # Reemplazar noches existentes por un prorrateo simple
-        ReservationNight.objects.filter(reservation=reservation).delete()
+        # Reemplazar noches existentes por un prorrateo simple (upsert por diferencias)
+        from apps.reservations.services.pricing import sync_reservation_nights
 
-        base = (ota_total_price / Decimal(nights_count)).quantize(Decimal("0.01"))
-        # Ajuste en la última noche para que la suma dé exacta (por redondeo)
-        running = Decimal("0.00")
-        current = reservation.check_in
-        for idx in range(nights_count):
-            amount = base
-            if idx == nights_count - 1:
-                amount = (ota_total_price - running).quantize(Decimal("0.01"))
-            ReservationNight.objects.create(
-                reservation=reservation,
-                hotel=reservation.hotel,
-                room=reservation.room,
-                date=current,
-                base_rate=amount,
-                extra_guest_fee=Decimal("0.00"),
-                discount=Decimal("0.00"),
-                tax=Decimal("0.00"),
-                total_night=amount,
-            )
-            running += amount
-            current = current + timedelta(days=1)
+        sync_reservation_nights(
+            reservation,
+            OtaReservationService._flat_night_rows(reservation.check_in, nights_count, ota_total_price),
+        )
 
         # Setear total_price sin disparar save() (evitar recalcular por base_price)
         type(reservation).objects.filter(pk=reservation.pk).update(total_price=ota_total_price)
@@ -336,4 +365,381 @@ class OtaReservationService:
             "paid_by": reservation.paid_by,
         }
 
+    @staticmethod
+    @transaction.atomic
+    def upsert_reservations_batch(
+        *,
+        hotel,
+        bookings: List[OtaBookingData],
+        auto_confirm: bool = True,
+        provider_name: str | None = None,
+    ) -> Dict[str, Any]:
+        """
+        upsert_reservation para un lote de reservas del mismo hotel (pull de canales).
+
+        Bloquea y lee las reservas existentes del lote en una sola consulta, escribe altas y
+        cambios con bulk_create / bulk_update y hace el trabajo derivado una vez por lote:
+        noches y totales OTA, comisión, política de cancelación, overbooking, auditoría,
+        notificaciones, inventario, export a Google y encolado de ARI / dashboard. bulk_* no
+        dispara post_save, así que acá se cubre lo que esas señales hacen para una reserva OTA.
 
+        Las reservas sin cambios no se reescriben y las notas se agregan solo si no estaban.
+        Devuelve {"created", "updated", "unchanged", "overbooking", "results": [...]}; guests=None
+        conserva los huéspedes de una reserva existente (feeds sin datos del huésped, como iCal).
+        """
+        from apps.reservations.middleware import get_current_user
+        from apps.reservations.services.audit import build_diff, build_snapshots
+        from apps.reservations.services.pricing import (
+            generate_nights_for_reservation,
+            recalc_reservation_totals,
+            sync_nights_bulk,
+        )
+        from apps.reservations.signals import AUDIT_FIELDS
+
+        by_key: Dict[tuple, OtaBookingData] = {}
+        for b in bookings:
+            assert b.external_id, "external_id es requerido para reservas OTA"
+            by_key[(str(b.external_id), b.channel or ReservationChannel.OTHER)] = b
+        stats: Dict[str, Any] = {"created": 0, "updated": 0, "unchanged": 0, "overbooking": 0, "results": []}
+        if not by_key:
+            return stats
+
+        existing: Dict[tuple, Reservation] = {}
+        locked = Reservation.objects.select_for_update().filter(
+            hotel=hotel, external_id__in={key[0] for key in by_key}
+        )
+        for r in locked:
+            # Igual que .first() en upsert_reservation: ante duplicados gana la más reciente
+            existing.setdefault((r.external_id, r.channel), r)
+
+        entries = []  # (booking, reservation, created, ota_total)
+        to_create: List[Reservation] = []
+        dirty: Dict[int, Reservation] = {}
+        update_fields = set()
+        prev_by_id: Dict[int, Reservation] = {}
+        for key, b in by_key.items():
+            ota_total = OtaReservationService._to_decimal(b.ota_total_price)
+            reservation = existing.get(key)
+            if reservation is None:
+                reservation = Reservation(
+                    hotel=hotel,
+                    room=b.room,
+                    external_id=key[0],
+                    channel=key[1],
+                    check_in=b.check_in,
+                    check_out=b.check_out,
+                    status=ReservationStatus.CONFIRMED if auto_confirm else ReservationStatus.PENDING,
+                    guests=b.guests or 1,
+                    guests_data=b.guests_data or [],
+                    notes=b.notes or "",
+                )
+                if ota_total is not None:
+                    reservation.total_price = ota_total
+                reservation.pricing_currency_id = b.room.base_currency_id
+                reservation.apply_pricing_defaults()
+                reservation.search_text = reservation.build_search_text()
+                to_create.append(reservation)
+                entries.append((b, reservation, True, ota_total))
+                continue
+
+            prev = copy.copy(reservation)
+            changed = set()
+            if reservation.room_id == b.room.id:
+                reservation.room = b.room  # instancia ya cargada, evita otra consulta
+            else:
+                reservation.room = b.room
+                changed.add("room")
+            if reservation.check_in != b.check_in or reservation.check_out != b.check_out:
+                reservation.check_in = b.check_in
+                reservation.check_out = b.check_out
+                changed.update({"check_in", "check_out"})
+            if b.guests is not None and reservation.guests != b.guests:
+                reservation.guests = b.guests
+                changed.add("guests")
+            if b.guests_data and reservation.guests_data != b.guests_data:
+                reservation.guests_data = b.guests_data
+                changed.add("guests_data")
+            if b.notes and b.notes not in (reservation.notes or ""):
+                reservation.notes = (reservation.notes or "") + f"\n{b.notes}"
+                changed.add("notes")
+            if ota_total is not None and reservation.total_price != ota_total:
+                reservation.total_price = ota_total
+                changed.add("total_price")
+            if reservation.status == ReservationStatus.PENDING and auto_confirm:
+                reservation.status = ReservationStatus.CONFIRMED
+                changed.add("status")
+            if changed:
+                reservation.apply_pricing_defaults()
+                reservation.search_text = reservation.build_search_text()
+                changed.update({"total_price", "pricing_currency", "search_text"})
+                prev_by_id[reservation.pk] = prev
+                dirty[reservation.pk] = reservation
+                update_fields |= changed
+            entries.append((b, reservation, False, ota_total))
+
+        # Política de cancelación (necesaria para la UI de cancelación): se resuelve una vez
+        missing_policy = [r for _, r, _, _ in entries if not r.applied_cancellation_policy_id]
+        if missing_policy:
+            try:
+                from apps.payments.models import CancellationPolicy
+                policy = CancellationPolicy.resolve_for_hotel(hotel)
+            except Exception:
+                policy = None
+            if policy:
+                for r in missing_policy:
+                    r.applied_cancellation_policy = policy
+                    if r.pk:
+                        dirty[r.pk] = r
+                        update_fields.add("applied_cancellation_policy")
+
+        if to_create:
+            Reservation.objects.bulk_create(to_create)
+        if dirty:
+            now = timezone.now()
+            for r in dirty.values():
+                r.updated_at = now
+            Reservation.objects.bulk_update(list(dirty.values()), sorted(update_fields | {"updated_at"}))
+
+        touched = to_create + [r for _, r, _, _ in entries if r.pk in prev_by_id]
+
+        # Noches y totales: prorrateo del total OTA en bloque; sin total OTA, lo que haría la señal
+        night_pairs = []
+        for _, r, created, ota_total in entries:
+            if not (created or r.pk in prev_by_id):
+                continue
+            nights_count = (r.check_out - r.check_in).days
+            if ota_total is not None:
+                if nights_count > 0:
+                    night_pairs.append((r, OtaReservationService._flat_night_rows(r.check_in, nights_count, ota_total)))
+            elif not str(r.external_id).startswith("smoobu:"):
+                generate_nights_for_reservation(r)
+                recalc_reservation_totals(r)
+        if night_pairs:
+            try:
+                sync_nights_bulk(night_pairs)
+            except Exception as e:
+                # No romper el import OTA por falla en nights; el total ya quedó guardado
+                logger.warning(f"Error al materializar noches OTA del hotel {hotel.id}: {e}")
+
+        # Comisión del canal según tasa configurada (solo si la reserva todavía no tiene)
+        rates = getattr(settings, "CHANNEL_COMMISSION_RATES", {})
+        commission_candidates = [r for r in touched if Decimal(str(rates.get(r.channel, 0))) != 0]
+        if commission_candidates:
+            with_commission = set(
+                ChannelCommission.objects.filter(reservation__in=commission_candidates)
+                .values_list("reservation_id", flat=True)
+            )
+            commissions = []
+            for r in commission_candidates:
+                if r.pk in with_commission:
+                    continue
+                rate = Decimal(str(rates.get(r.channel, 0)))
+                amount = (r.total_price or Decimal("0.00")) * (rate / Decimal("100"))
+                if amount > 0:
+                    commissions.append(ChannelCommission(reservation=r, channel=r.channel, rate_percent=rate, amount=amount))
+            if commissions:
+                ChannelCommission.objects.bulk_create(commissions)
+
+        # Overbooking: una consulta con las reservas activas de las habitaciones del lote
+        batch = [r for _, r, _, _ in entries]
+        lo = min(r.check_in for r in batch)
+        hi = max(r.check_out for r in batch)
+        occupied = defaultdict(list)
+        active_rows = Reservation.objects.filter(
+            hotel=hotel,
+            room_id__in={r.room_id for r in batch},
+            status__in=[ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN],
+            check_in__lt=hi,
+            check_out__gt=lo,
+        ).values_list("id", "room_id", "check_in", "check_out")
+        for rid, room_id, ci, co in active_rows:
+            occupied[room_id].append((rid, ci, co))
+        overlapping = {
+            r.pk
+            for r in batch
+            if any(rid != r.pk and ci < r.check_out and co > r.check_in for rid, ci, co in occupied[r.room_id])
+        }
+        flag_ids = [r.pk for r in batch if r.pk in overlapping and not r.overbooking_flag]
+        if flag_ids:
+            Reservation.objects.filter(pk__in=flag_ids).update(overbooking_flag=True)
+            for r in batch:
+                if r.pk in overlapping:
+                    r.overbooking_flag = True
+
+        # Auditoría (lo que registra reservation_post_save_log por save)
+        user = get_current_user()
+        snapshots = build_snapshots(touched)
+        change_logs = []
+        status_changes = []
+        for r in to_create:
+            room_name = getattr(r.room, "name", None) or "Habitación"
+            change_logs.append(ReservationChangeLog(
+                reservation=r,
+                event_type=ReservationChangeEvent.CREATED,
+                changed_by=user,
+                fields_changed={},
+                snapshot=snapshots.get(r.pk),
+                message=(
+                    f"Reserva #{r.id} creada: {r.guest_name or 'Sin nombre'} • {room_name} • "
+                    f"{r.check_in} → {r.check_out}"
+                )[:300],
+            ))
+        for r in touched:
+            prev = prev_by_id.get(r.pk)
+            if prev is None:
+                continue
+            diff = build_diff(prev, r, AUDIT_FIELDS)
+            if diff:
+                change_logs.append(ReservationChangeLog(
+                    reservation=r,
+                    event_type=ReservationChangeEvent.UPDATED,
+                    changed_by=user,
+                    fields_changed=diff,
+                    snapshot=snapshots.get(r.pk),
+                    message=f"Reserva actualizada: {r.id}",
+                ))
+            if prev.status != r.status:
+                status_changes.append(ReservationStatusChange(
+                    reservation=r,
+                    from_status=prev.status,
+                    to_status=r.status,
+                    changed_by=user,
+                    notes=f"Estado actualizado: {r.status}",
+                ))
+                change_logs.append(ReservationChangeLog(
+                    reservation=r,
+                    event_type=ReservationChangeEvent.STATUS_CHANGED,
+                    changed_by=user,
+                    fields_changed={"status": {"old": prev.status, "new": r.status}},
+                    snapshot=snapshots.get(r.pk),
+                ))
+        if change_logs:
+            ReservationChangeLog.objects.bulk_create(change_logs)
+        if status_changes:
+            ReservationStatusChange.objects.bulk_create(status_changes)
+
+        # Notificaciones de reservas nuevas en un solo INSERT
+        notifications = []
+        for b, r, created, _ in entries:
+            display_name = OtaReservationService._provider_display_name(provider_name, r.external_id, r.channel)
+            if not (created and display_name):
+                continue
+            notifications.append({
+                "provider_name": display_name,
+                "reservation_code": f"RES-{r.id}",
+                "room_name": b.room.name or f"Habitación {b.room.number}",
+                "check_in_date": r.check_in.strftime("%d/%m/%Y"),
+                "check_out_date": r.check_out.strftime("%d/%m/%Y"),
+                "guest_name": r.guest_name,
+                "hotel_id": hotel.id,
+                "reservation_id": r.id,
+                "external_id": r.external_id,
+                "overbooking": r.pk in overlapping,
+            })
+        if notifications:
+            try:
+                NotificationService.create_ota_reservation_notifications(notifications)
+            except Exception as e:
+                # No fallar el import si las notificaciones fallan
+                logger.warning(f"Error al crear notificaciones de reservas OTA del hotel {hotel.id}: {e}")
+
+        if touched:
+            OtaReservationService._after_batch_write(hotel, touched, prev_by_id)
+
+        for b, r, created, _ in entries:
+            if created:
+                stats["created"] += 1
+            elif r.pk in prev_by_id:
+                stats["updated"] += 1
+            else:
+                stats["unchanged"] += 1
+            if r.pk in overlapping:
+                stats["overbooking"] += 1
+            stats["results"].append({
+                "external_id": r.external_id,
+                "reservation_id": r.id,
+                "created": created,
+                "updated": r.pk in prev_by_id,
+                "overbooking": r.pk in overlapping,
+            })
+        return stats
+
+    @staticmethod
+    def _after_batch_write(hotel, touched: List[Reservation], prev_by_id: Dict[int, Reservation]) -> None:
+        """Inventario, export a Google y encolado de ARI / dashboard, una vez por lote."""
+        from apps.dashboard.signals import queue_metrics_refresh
+        from apps.otas.services.ical_export import invalidate_ical_feeds_on_commit
+        from apps.otas.signals import _enqueue_for_active_providers, _queue_sync_smoobu_for_hotel
+        from apps.reservations.services.inventory import refresh_room_inventory
+
+        spans = [(r.room_id, r.check_in, r.check_out) for r in touched]
+        spans += [(p.room_id, p.check_in, p.check_out) for p in prev_by_id.values()]
+        start = min(s[1] for s in spans)
+        end = max(s[2] for s in spans)
+        refresh_room_inventory(hotel.id, start, end, {s[0] for s in spans})
+        queue_metrics_refresh(hotel.id, start, end)
+        invalidate_ical_feeds_on_commit(hotel.id, {s[0] for s in spans})
+
+        to_google = [
+            r for r in touched
+            if r.status in (ReservationStatus.CONFIRMED, ReservationStatus.CANCELLED)
+            and not (r.channel == ReservationChannel.OTHER and r.notes and "google calendar" in r.notes.lower())
+        ]
+        if to_google:
+            transaction.on_commit(lambda: OtaReservationService._export_to_google(to_google))
+
+        trigger_info = {
+            "action": "reservations_batch_upserted",
+            "reservation_ids": [r.id for r in touched][:50],
+            "count": len(touched),
+            "check_in": start.isoformat(),
+            "check_out": end.isoformat(),
+        }
+        _enqueue_for_active_providers(hotel.id, trigger_info=trigger_info)
+        _queue_sync_smoobu_for_hotel(hotel.id, trigger_info=trigger_info)
+
+    @staticmethod
+    def cancel_internal_blocks(hotel_id: int, external_ids: List[str]) -> int:
+        """
+        Cancela las reservas que son bloqueos propios de AlojaSys reimportados desde la OTA.
+
+        Es un UPDATE sin señales, así que refresca acá el inventario de las habitaciones y fechas
+        afectadas, el dashboard y los feeds iCal. Devuelve la cantidad de reservas canceladas.
+        """
+        from apps.dashboard.signals import queue_metrics_refresh
+        from apps.otas.services.ical_export import invalidate_ical_feeds_on_commit
+        from apps.reservations.services.inventory import refresh_room_inventory
+
+        if not hotel_id or not external_ids:
+            return 0
+        with transaction.atomic():
+            qs = Reservation.objects.filter(hotel_id=hotel_id, external_id__in=external_ids).exclude(
+                status=ReservationStatus.CANCELLED
+            )
+            spans = list(qs.select_for_update().values_list("id", "room_id", "check_in", "check_out"))
+            if not spans:
+                return 0
+            Reservation.objects.filter(id__in=[s[0] for s in spans]).update(
+                status=ReservationStatus.CANCELLED, updated_at=timezone.now()
+            )
+            start = min(s[2] for s in spans)
+            end = max(s[3] for s in spans)
+            room_ids = {s[1] for s in spans}
+            refresh_room_inventory(hotel_id, start, end, room_ids)
+            queue_metrics_refresh(hotel_id, start, end)
+            invalidate_ical_feeds_on_commit(hotel_id, room_ids)
+        return len(spans)
+
+    @staticmethod
+    def _export_to_google(reservations: List[Reservation]) -> None:
+        from apps.otas.services.google_sync_service import sync_reservations_to_google
+
+        try:
+            outcome = sync_reservations_to_google(reservations)
+        except Exception as e:
+            logger.error(f"Error exporting {len(reservations)} reservations to Google Calendar: {e}", exc_info=True)
+            return
+        for reservation_id, result in outcome.items():
+            errors = [r for r in result.get("results", []) if r.get("action") == "error"]
+            if result.get("status") == "error" or errors:
+                logger.warning(f"Reservation {reservation_id}: Google Calendar export failed: {result}")
@@ -15,6 +15,7 @@ from django.db.models import Q
 from apps.otas.models import OtaConfig, OtaProvider, OtaRoomMapping, SmoobuExportedBooking
 from apps.reservations.models import Reservation, ReservationStatus, RoomBlock
 from apps.rates.services.engine import get_applicable_rule, compute_rate_for_date
+from apps.rates.services.rule_index import get_hotel_rate_index
 from apps.rooms.models import Room
 
 logger = logging.getLogger(__name__)
@@ -318,12 +319,69 @@ class SmoobuSyncService:
         return {"status": "ok", "action": "deleted", "smoobu_booking_id": exported.smoobu_booking_id}
 
     @staticmethod
-    def push_rates_for_room(room_id: int, days_ahead: int = 90) -> Dict[str, Any]:
+    def _rule_signatures(room: Room) -> Dict[str, list]:
+        """Firma por regla que aplica a la habitación (sin canal): {rule_id: [hash, inicio, fin]}."""
+        index = get_hotel_rate_index(room.hotel_id)
+        signatures: Dict[str, list] = {}
+        for rule in index.rules:
+            if rule.target_room_id and rule.target_room_id != room.id:
+                continue
+            if rule.target_room_type and rule.target_room_type != room.room_type:
+                continue
+            if rule.channel:
+                continue
+            values = [getattr(rule, f.attname) for f in rule._meta.concrete_fields]
+            values += [rule.plan.priority, sorted((index.occupancy.get(rule.id) or {}).items())]
+            signatures[str(rule.id)] = [
+                SmoobuSyncService._checksum(*values)[:16],
+                rule.start_date.isoformat(),
+                rule.end_date.isoformat(),
+            ]
+        return signatures
+
+    @staticmethod
+    def _dirty_dates(state: Dict[str, Any], room_signature: str, rules: Dict[str, list], dates: list[date]) -> list[date]:
+        """
+        Fechas de la ventana que hay que recalcular: las que no tienen huella, y las que
+        cubren las reglas nuevas, borradas o modificadas (rango viejo y nuevo). Si cambió
+        la habitación (precio base, capacidad, etc.) se recalcula todo.
+        """
+        pushed = state.get("dates") or {}
+        if not pushed or state.get("room") != room_signature:
+            return dates
+        previous = state.get("rules") or {}
+        spans = []
+        for rule_id in set(previous) | set(rules):
+            old, new = previous.get(rule_id), rules.get(rule_id)
+            if old == new:
+                continue
+            for sig in (old, new):
+                if sig:
+                    spans.append((date.fromisoformat(sig[1]), date.fromisoformat(sig[2])))
+        return [
+            d for d in dates
+            if d.isoformat() not in pushed or any(a <= d <= b for a, b in spans)
+        ]
+
+    @staticmethod
+    def push_rates_for_room(room_id: int, days_ahead: int = 90, force: bool = False) -> Dict[str, Any]:
+        """
+        Empuja precio/min_stay de la habitación a Smoobu de forma incremental.
+
+        El mapeo guarda la huella por fecha de lo último enviado y la firma de las reglas
+        que aplican; solo se recalculan las fechas afectadas por cambios de reglas (o que
+        entraron a la ventana) y solo se envían los tramos cuya huella cambió.
+        force=True recalcula y reenvía toda la ventana.
+        """
         room = Room.objects.select_related("hotel").filter(id=room_id, is_active=True).first()
         if not room:
             return {"status": "skipped", "reason": "room_not_found"}
         hotel_id = room.hotel_id
-        apartment_id = SmoobuSyncService._apartment_id_for_room(room_id)
+        mapping = OtaRoomMapping.objects.filter(provider=OtaProvider.SMOOBU, room_id=room_id, is_active=True).first()
+        try:
+            apartment_id = int(str(mapping.external_id)) if mapping and mapping.external_id else None
+        except Exception:
+            apartment_id = None
         if not apartment_id:
             return {"status": "skipped", "reason": "no_smoobu_mapping"}
         client = SmoobuSyncService._client_for_hotel(hotel_id)
@@ -332,50 +390,70 @@ class SmoobuSyncService:
 
         start = timezone.now().date()
         end = start + timedelta(days=days_ahead)
-
-        ops: list[Dict[str, Any]] = []
-        current = start
-        # Agrupar fechas con mismo precio/min_stay
-        run_start = None
-        run_price = None
-        run_min = None
-
-        while current < end:
+        dates = [start + timedelta(days=i) for i in range(days_ahead)]
+
+        state = {} if force else (mapping.rate_push_state or {})
+        room_signature = SmoobuSyncService._checksum(
+            room.base_price, room.capacity, room.extra_guest_fee, room.room_type
+        )[:16]
+        rules = SmoobuSyncService._rule_signatures(room)
+        dirty = SmoobuSyncService._dirty_dates(state, room_signature, rules, dates)
+        pushed = dict(state.get("dates") or {})
+
+        # Huella actual de las fechas afectadas; solo las que cambiaron se envían
+        changed: Dict[date, tuple] = {}
+        for current in dirty:
             parts = compute_rate_for_date(room, 1, current, channel=None, promotion_code=None, voucher_code=None)
             price = float(parts["base_rate"])
             rule = get_applicable_rule(room, current, channel=None, include_closed=True)
             min_stay = int(rule.min_stay) if (rule and rule.min_stay) else 1
+            if pushed.get(current.isoformat()) != [price, min_stay]:
+                changed[current] = (price, min_stay)
 
-            if run_start is None:
-                run_start = current
-                run_price = price
-                run_min = min_stay
-            elif price != run_price or min_stay != run_min:
-                # cerrar run anterior
-                ops.append(
-                    {
-                        "dates": [f"{run_start.isoformat()}:{current.isoformat()}"],
-                        "daily_price": run_price,
-                        "min_length_of_stay": run_min,
-                    }
-                )
-                run_start = current
-                run_price = price
-                run_min = min_stay
-
-            current += timedelta(days=1)
-
+        # Agrupar fechas contiguas con mismo precio/min_stay (rango inclusivo)
+        ops: list[Dict[str, Any]] = []
+        run_start = run_end = None
+        run_values = None
+        for current in sorted(changed):
+            values = changed[current]
+            if run_start is not None and values == run_values and run_end + timedelta(days=1) == current:
+                run_end = current
+                continue
+            if run_start is not None:
+                ops.append({
+                    "dates": [f"{run_start.isoformat()}:{run_end.isoformat()}"],
+                    "daily_price": run_values[0],
+                    "min_length_of_stay": run_values[1],
+                })
+            run_start = run_end = current
+            run_values = values
         if run_start is not None:
-            ops.append(
-                {
-                    "dates": [f"{run_start.isoformat()}:{end.isoformat()}"],
-                    "daily_price": run_price,
-                    "min_length_of_stay": run_min,
-                }
-            )
-
-        client.push_rates([apartment_id], ops)
-        return {"status": "ok", "apartment_id": apartment_id, "operations": len(ops)}
+            ops.append({
+                "dates": [f"{run_start.isoformat()}:{run_end.isoformat()}"],
+                "daily_price": run_values[0],
+                "min_length_of_stay": run_values[1],
+            })
+
+        if ops:
+            client.push_rates([apartment_id], ops)
+
+        # Guardar la huella solo tras un push exitoso (push_rates lanza si falla)
+        for current, values in changed.items():
+            pushed[current.isoformat()] = list(values)
+        today = start.isoformat()
+        mapping.rate_push_state = {
+            "room": room_signature,
+            "rules": rules,
+            "dates": {k: v for k, v in pushed.items() if today <= k < end.isoformat()},
+        }
+        mapping.save(update_fields=["rate_push_state", "updated_at"])
+        return {
+            "status": "ok",
+            "apartment_id": apartment_id,
+            "operations": len(ops),
+            "dates_evaluated": len(dirty),
+            "dates_changed": len(changed),
+        }
 
     @staticmethod
     def sync_hotel(hotel_id: int, days_ahead: int = 90) -> Dict[str, Any]:
@@ -0,0 +1,153 @@
+"""
+Sink de OtaSyncLog con buffer por job, colapso de no-ops y muestreo por hotel.
+
+Los jobs de sincronización (iCal, Google, ARI, Smoobu) corren cada minuto y antes
+escribían una fila por evento, casi siempre "sin cambios". SyncLogBuffer:
+
+- acumula las entradas del job en memoria y las inserta con bulk_create al flush
+- colapsa los mensajes no-op (p. ej. RESERVATION_NO_CHANGES) en contadores
+- aplica la política del hotel: nivel mínimo y tasa de muestreo de entradas INFO
+- los eventos de ciclo de vida del job (*_STARTED, *_COMPLETED, ...) y los WARNING/ERROR
+  que superan el nivel se escriben siempre
+
+Lo colapsado o descartado queda resumido en una única entrada LOG_SUMMARY por flush.
+
+Política (settings):
+    OTA_SYNC_LOG_LEVEL = "info"            # info | warning | error
+    OTA_SYNC_LOG_SAMPLE_RATE = 1.0         # fracción de entradas INFO por evento que se guardan
+    OTA_SYNC_LOG_HOTEL_POLICIES = {"12": {"level": "warning", "sample_rate": 0.1}}
+"""
+from __future__ import annotations
+
+import random
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+from ..models import OtaSyncJob, OtaSyncLog
+
+LEVEL_ORDER = {
+    OtaSyncLog.Level.INFO: 0,
+    OtaSyncLog.Level.WARNING: 1,
+    OtaSyncLog.Level.ERROR: 2,
+}
+
+# Mensajes "sin efecto" que se guardan solo como contador
+NOOP_MESSAGES = frozenset({
+    "RESERVATION_NO_CHANGES",
+    "ROOMBLOCK_NO_CHANGES",
+    "GOOGLE_EVENT_NO_CHANGES",
+})
+
+# Ciclo de vida del job: siempre se escriben (pocas filas por job)
+LIFECYCLE_SUFFIXES = ("_STARTED", "_COMPLETED", "_REQUEST", "_RESPONSE", "_SKIPPED")
+
+# Tope del buffer en memoria antes de un flush intermedio
+MAX_BUFFERED = 500
+
+
+@dataclass(frozen=True)
+class SyncLogPolicy:
+    level: str = OtaSyncLog.Level.INFO
+    sample_rate: float = 1.0
+
+
+def policy_for_hotel(hotel_id: Optional[int]) -> SyncLogPolicy:
+    """Política de logging del hotel (override de OTA_SYNC_LOG_HOTEL_POLICIES sobre el default)."""
+    values = {
+        "level": getattr(settings, "OTA_SYNC_LOG_LEVEL", OtaSyncLog.Level.INFO),
+        "sample_rate": getattr(settings, "OTA_SYNC_LOG_SAMPLE_RATE", 1.0),
+    }
+    overrides = getattr(settings, "OTA_SYNC_LOG_HOTEL_POLICIES", None) or {}
+    if hotel_id is not None:
+        values.update(overrides.get(str(hotel_id)) or overrides.get(hotel_id) or {})
+    level = str(values["level"]).lower()
+    if level not in LEVEL_ORDER:
+        level = OtaSyncLog.Level.INFO
+    try:
+        sample_rate = min(max(float(values["sample_rate"]), 0.0), 1.0)
+    except (TypeError, ValueError):
+        sample_rate = 1.0
+    return SyncLogPolicy(level=level, sample_rate=sample_rate)
+
+
+class SyncLogBuffer:
+    """
+    Buffer de logs de un OtaSyncJob. Con job=None todas las operaciones son no-op.
+
+    Uso:
+        log = SyncLogBuffer(job)
+        log.add(OtaSyncLog.Level.INFO, "RESERVATION_UPDATED", {...})
+        ...
+        log.flush()   # o `with SyncLogBuffer(job) as log: ...`
+    """
+
+    def __init__(self, job: Optional[OtaSyncJob], policy: Optional[SyncLogPolicy] = None):
+        self.job = job
+        self.policy = policy or policy_for_hotel(getattr(job, "hotel_id", None))
+        self._entries: List[OtaSyncLog] = []
+        self.collapsed: Counter = Counter()
+        self.dropped: Counter = Counter()
+
+    def __enter__(self) -> "SyncLogBuffer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.flush()
+
+    def _keep(self, level: str, message: str) -> bool:
+        if any(message.endswith(suffix) for suffix in LIFECYCLE_SUFFIXES):
+            return True
+        if LEVEL_ORDER.get(level, 0) < LEVEL_ORDER[self.policy.level]:
+            return False
+        if level == OtaSyncLog.Level.INFO and self.policy.sample_rate < 1.0:
+            return random.random() < self.policy.sample_rate
+        return True
+
+    def add(self, level: str, message: str, payload: Optional[Dict[str, Any]] = None) -> None:
+        if self.job is None:
+            return
+        if message in NOOP_MESSAGES:
+            self.collapsed[message] += 1
+            return
+        if not self._keep(level, message):
+            self.dropped[message] += 1
+            return
+        self._entries.append(OtaSyncLog(job=self.job, level=level, message=message, payload=payload or {}))
+        if len(self._entries) >= MAX_BUFFERED:
+            self._write()
+
+    def info(self, message: str, payload: Optional[Dict[str, Any]] = None) -> None:
+        self.add(OtaSyncLog.Level.INFO, message, payload)
+
+    def warning(self, message: str, payload: Optional[Dict[str, Any]] = None) -> None:
+        self.add(OtaSyncLog.Level.WARNING, message, payload)
+
+    def error(self, message: str, payload: Optional[Dict[str, Any]] = None) -> None:
+        self.add(OtaSyncLog.Level.ERROR, message, payload)
+
+    def _write(self) -> None:
+        if self._entries:
+            OtaSyncLog.objects.bulk_create(self._entries, batch_size=MAX_BUFFERED)
+            self._entries = []
+
+    def flush(self) -> None:
+        """Inserta lo pendiente más el resumen de contadores (si hubo colapsos o descartes)."""
+        if self.job is None:
+            return
+        if self.collapsed or self.dropped:
+            self._entries.append(OtaSyncLog(
+                job=self.job,
+                level=OtaSyncLog.Level.INFO,
+                message="LOG_SUMMARY",
+                payload={
+                    "collapsed": dict(self.collapsed),
+                    "dropped": dict(self.dropped),
+                    "policy": {"level": self.policy.level, "sample_rate": self.policy.sample_rate},
+                },
+            ))
+            self.collapsed.clear()
+            self.dropped.clear()
+        self._write()
@@ -7,20 +7,31 @@ from django.db import transaction
 from django.dispatch import receiver
 from django.core.cache import cache
 from django.utils import timezone
+from django.conf import settings
 
+import logging
 import os
 
+from apps.core.models import Hotel
+from apps.rooms.models import Room
 from apps.reservations.models import Reservation, RoomBlock
-from .models import OtaConfig, OtaProvider, OtaSyncJob, OtaSyncLog
+from .models import OtaConfig, OtaProvider, OtaRoomMapping, OtaSyncJob, OtaSyncLog
+from .services.ical_export import invalidate_ical_feeds_on_commit
 from .tasks import push_ari_for_hotel_task, sync_smoobu_for_hotel_task
 
+logger = logging.getLogger(__name__)
+
 
 def _queue_push_ari_for_hotel(hotel_id: int, provider: str, days_ahead: int = 30, trigger_info: dict = None) -> None:
-    # Evitar tormenta de eventos: coalescer por 60s
+    # Evitar tormenta de eventos: el primer cambio abre una ventana y la task corre al
+    # cerrarla, así el delta calculado incluye todos los cambios que la ventana absorbió
+    window = getattr(settings, "OTA_ARI_DEBOUNCE_SECONDS", 10)
     throttle_key = f"otas:ari:throttle:{hotel_id}:{provider}"
-    if cache.get(throttle_key):
-        return
-    cache.set(throttle_key, True, timeout=60)
+    try:
+        if not cache.add(throttle_key, True, timeout=window):
+            return
+    except Exception as e:
+        logger.debug(f"No se pudo coalescer el push ARI (hotel {hotel_id}, {provider}): {e}")
 
     today = date.today()
     df = today
@@ -59,8 +70,10 @@ def _queue_push_ari_for_hotel(hotel_id: int, provider: str, days_ahead: int = 30
     )
     
     # Enviar job_id a la task solo tras el commit para evitar race conditions
-    transaction.on_commit(lambda: push_ari_for_hotel_task.delay(
-        hotel_id, provider, df.isoformat(), dt.isoformat(), job_id=job.id
+    transaction.on_commit(lambda: push_ari_for_hotel_task.apply_async(
+        args=[hotel_id, provider, df.isoformat(), dt.isoformat()],
+        kwargs={"job_id": job.id},
+        countdown=window,
     ))
 
 
@@ -172,6 +185,7 @@ def room_block_saved(sender, instance: RoomBlock, **kwargs):
         "end_date": instance.end_date.isoformat() if instance.end_date else None,
         "created": kwargs.get("created", False),
     }
+    _enqueue_for_active_providers(instance.hotel_id, trigger_info=trigger_info)
     _queue_sync_smoobu_for_hotel(instance.hotel_id, trigger_info=trigger_info)
 
 
@@ -187,6 +201,55 @@ def room_block_deleted(sender, instance: RoomBlock, **kwargs):
         "start_date": instance.start_date.isoformat() if instance.start_date else None,
         "end_date": instance.end_date.isoformat() if instance.end_date else None,
     }
+    _enqueue_for_active_providers(instance.hotel_id, trigger_info=trigger_info)
     _queue_sync_smoobu_for_hotel(instance.hotel_id, trigger_info=trigger_info)
 
 
+# ---- caché de feeds iCal de salida ----
+
+@receiver(post_save, sender=Reservation)
+@receiver(post_delete, sender=Reservation)
+def reservation_ical_invalidate(sender, instance: Reservation, **kwargs):
+    if not instance.hotel_id:
+        return
+    prev = getattr(instance, "_prev", None)
+    room_ids = {instance.room_id, getattr(prev, "room_id", None)}
+    invalidate_ical_feeds_on_commit(instance.hotel_id, room_ids)
+
+
+@receiver(post_save, sender=RoomBlock)
+@receiver(post_delete, sender=RoomBlock)
+def room_block_ical_invalidate(sender, instance: RoomBlock, **kwargs):
+    if instance.hotel_id:
+        invalidate_ical_feeds_on_commit(instance.hotel_id, [instance.room_id])
+
+
+# Campos que cambian el feed exportado; un save con update_fields fuera de estos (last_synced,
+# rate_push_state, tokens de Google, estado de la habitación) no lo invalida
+ICAL_EXPORT_FIELDS = {
+    Room: {"name", "hotel", "hotel_id"},
+    OtaRoomMapping: {"hotel", "hotel_id", "room", "room_id", "provider", "sync_direction", "is_active"},
+}
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+@receiver(post_save, sender=OtaRoomMapping)
+@receiver(post_delete, sender=OtaRoomMapping)
+def room_ical_invalidate(sender, instance, update_fields=None, **kwargs):
+    # Nombre de la habitación en el feed / mapeos que habilitan el export
+    if update_fields is not None and not ICAL_EXPORT_FIELDS[sender].intersection(update_fields):
+        return
+    room_id = instance.id if sender is Room else instance.room_id
+    if instance.hotel_id:
+        invalidate_ical_feeds_on_commit(instance.hotel_id, [room_id])
+
+
+@receiver(post_save, sender=Hotel)
+@receiver(post_save, sender=OtaConfig)
+@receiver(post_delete, sender=OtaConfig)
+def hotel_ical_invalidate(sender, instance, **kwargs):
+    # Nombre del hotel en todos los feeds / tokens de export
+    hotel_id = instance.id if sender is Hotel else instance.hotel_id
+    if hotel_id:
+        invalidate_ical_feeds_on_commit(hotel_id)
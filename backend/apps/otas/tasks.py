@@ -1,23 +1,29 @@
 from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
 
 from .models import OtaRoomMapping, OtaSyncJob, OtaProvider, OtaSyncLog
 from .services.ical_importer import import_ics_for_room_mapping  # Mantener para compatibilidad
 from .services.ical_sync_service import ICALSyncService
+from .services.ical_fetcher import FetchStatus, fetch_feeds, save_validators
 from .services.ari_publisher import push_ari_for_hotel, pull_reservations_for_hotel
+from .services.sync_log import SyncLogBuffer
+from .services.event_bus import publish_event, publisher
+from .services.http_client import RetryableChannelError, backoff_countdown
 
 # Lazy import para Google Calendar (opcional)
 try:
     from .services.google_sync_service import import_events_for_mapping as google_import_events
+    from .services.google_sync_service import fetch_events_for_mappings as fetch_google_events
     GOOGLE_AVAILABLE = True
 except ImportError:
     GOOGLE_AVAILABLE = False
     google_import_events = None
+    fetch_google_events = None
 from .models import OtaConfig
 from django.utils import timezone
 from datetime import date, timedelta
-import os, json
-import redis
 from .services.smoobu_sync_service import SmoobuSyncService
 import logging
 
@@ -25,35 +31,74 @@ logger = logging.getLogger(__name__)
 
 
 @shared_task(bind=True)
-def import_all_ics(self):
-    """Importa ICS para todos los mapeos activos con URL configurada usando ICALSyncService."""
-    mappings = OtaRoomMapping.objects.select_related("hotel", "room").filter(
+def import_all_ics(self, force: bool = False):
+    """Importa ICS para todos los mapeos activos con URL configurada usando ICALSyncService.
+
+    Los feeds se descargan en paralelo con fetch condicional (ETag / If-Modified-Since /
+    hash del body); solo los que cambiaron se parsean e importan. force=True ignora los
+    validadores y reimporta todo.
+    """
+    mappings = list(OtaRoomMapping.objects.select_related("hotel", "room").filter(
         provider=OtaProvider.ICAL,
         is_active=True,
-    ).exclude(ical_in_url__isnull=True).exclude(ical_in_url="")
+    ).exclude(ical_in_url__isnull=True).exclude(ical_in_url=""))
 
-    total = 0
+    results = fetch_feeds(mappings, force=force)
+    summary = {"processed_mappings": len(mappings), "imported": 0, "not_modified": 0, "unchanged": 0, "fetch_errors": 0}
+    now = timezone.now()
+    unchanged_ids = []
     for m in mappings:
+        result = results.get(m.id)
+        if result is None:
+            continue
+        if result.status in (FetchStatus.NOT_MODIFIED, FetchStatus.UNCHANGED):
+            summary[result.status] += 1
+            unchanged_ids.append(m.id)
+            if result.etag != m.ical_etag or result.last_modified != m.ical_last_modified:
+                save_validators(m, result)
+            continue
+
         job = OtaSyncJob.objects.create(
             hotel=m.hotel,
             provider=OtaProvider.ICAL,
             job_type=OtaSyncJob.JobType.IMPORT_ICS,
             status=OtaSyncJob.JobStatus.RUNNING,
-            stats={"mapping_id": m.id},
+            stats={"mapping_id": m.id, "fetch": result.status, "http_status": result.http_status},
         )
+        if result.status == FetchStatus.ERROR:
+            summary["fetch_errors"] += 1
+            OtaSyncLog.objects.create(
+                job=job,
+                level=OtaSyncLog.Level.ERROR,
+                message="IMPORT_ERROR",
+                payload={"error": result.error, "url": m.ical_in_url},
+            )
+            job.status = OtaSyncJob.JobStatus.FAILED
+            job.error_message = result.error
+            job.finished_at = timezone.now()
+            job.save(update_fields=["status", "error_message", "finished_at"])
+            continue
+
         try:
-            stats = ICALSyncService.import_reservations(m, job=job)
+            stats = ICALSyncService.import_reservations(m, job=job, content=result.content)
             job.status = OtaSyncJob.JobStatus.SUCCESS if stats.get("errors", 0) == 0 else OtaSyncJob.JobStatus.FAILED
             job.finished_at = timezone.now()
             job.save(update_fields=["status", "stats", "finished_at"])
+            # Con errores (p.ej. conflictos) no se guarda el hash: el próximo ciclo reintenta
+            save_validators(m, result if job.status == OtaSyncJob.JobStatus.SUCCESS else None)
+            summary["imported"] += 1
         except Exception as e:
             job.status = OtaSyncJob.JobStatus.FAILED
             job.error_message = str(e)
             job.finished_at = timezone.now()
             job.save(update_fields=["status", "error_message", "finished_at"])
-        total += 1
+            save_validators(m, None)
+
+    # Un feed sin cambios también es una sincronización exitosa
+    if unchanged_ids:
+        OtaRoomMapping.objects.filter(id__in=unchanged_ids).update(last_synced=now)
 
-    return {"processed_mappings": total}
+    return summary
 
 
 @shared_task(bind=True)
@@ -65,63 +110,47 @@ def schedule_ical_sync(self):
 
 @shared_task(bind=True)
 def import_all_google(self):
-    """Importa eventos para todos los mapeos con provider=GOOGLE."""
+    """Reparte los mapeos con provider=GOOGLE en shards que se importan en paralelo (un task por shard)."""
     if not GOOGLE_AVAILABLE:
         return {"processed_mappings": 0, "error": "google_api_not_installed"}
     
-    mappings = OtaRoomMapping.objects.select_related("hotel", "room").filter(
-        provider=OtaProvider.GOOGLE,
-        is_active=True,
-    ).exclude(external_id__isnull=True).exclude(external_id="")
+    mapping_ids = list(
+        OtaRoomMapping.objects.filter(provider=OtaProvider.GOOGLE, is_active=True)
+        .exclude(external_id__isnull=True).exclude(external_id="")
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    size = max(int(settings.OTA_GOOGLE_SHARD_SIZE), 1)
+    shards = [mapping_ids[i:i + size] for i in range(0, len(mapping_ids), size)]
+    for shard in shards:
+        import_google_shard_task.apply_async(args=[shard])
+    return {"scheduled_mappings": len(mapping_ids), "shards": len(shards)}
 
-    total = 0
-    for m in mappings:
-        job = OtaSyncJob.objects.create(
-            hotel=m.hotel,
-            provider=OtaProvider.GOOGLE,
-            job_type=OtaSyncJob.JobType.IMPORT_ICS,
-            status=OtaSyncJob.JobStatus.RUNNING,
-            stats={"mapping_id": m.id},
-        )
-        try:
-            stats = google_import_events(m, job=job)
-            job.status = OtaSyncJob.JobStatus.SUCCESS if stats.get("errors", 0) == 0 else OtaSyncJob.JobStatus.FAILED
-            job.finished_at = timezone.now()
-            job.save(update_fields=["status", "stats", "finished_at"])
-            # Publicar evento para refrescar UI si éxito
-            if job.status == OtaSyncJob.JobStatus.SUCCESS:
-                try:
-                    redis_host = os.environ.get("REDIS_HOST", "redis")
-                    r = redis.Redis(host=redis_host, port=6379, db=0)
-                    payload = json.dumps({"type": "reservations_updated", "hotel_id": m.hotel_id, "provider": "google"})
-                    r.publish("otas:events", payload)
-                    r.publish(f"otas:events:{m.hotel_id}", payload)
-                except Exception:
-                    pass
-        except Exception as e:
-            job.status = OtaSyncJob.JobStatus.FAILED
-            job.error_message = str(e)
-            job.finished_at = timezone.now()
-            job.save(update_fields=["status", "error_message", "finished_at"])
-        total += 1
 
-    return {"processed_mappings": total}
+def _google_import_lock(mapping_id: int) -> str:
+    return f"otas:google:import:{mapping_id}"
 
-@shared_task(bind=True)
-def import_google_for_mapping_task(self, mapping_id: int):
-    """Importa eventos para un mapeo específico (usado por webhooks)."""
-    if not GOOGLE_AVAILABLE:
-        return {}
-    mapping = OtaRoomMapping.objects.select_related("hotel", "room").get(id=mapping_id)
-    job = OtaSyncJob.objects.create(
-        hotel=mapping.hotel,
-        provider=OtaProvider.GOOGLE,
-        job_type=OtaSyncJob.JobType.IMPORT_ICS,
-        status=OtaSyncJob.JobStatus.RUNNING,
-        stats={"mapping_id": mapping_id, "trigger": "webhook"},
-    )
+
+def _acquire_google_import(mapping_id: int) -> bool:
+    # Un mapeo no se importa dos veces a la vez (ciclo anterior lento o webhook en curso)
     try:
-        stats = google_import_events(mapping, job=job)
+        return bool(cache.add(_google_import_lock(mapping_id), True, timeout=settings.OTA_GOOGLE_IMPORT_LOCK_SECONDS))
+    except Exception as e:
+        logger.debug(f"No se pudo tomar el lock de import Google (mapping {mapping_id}): {e}")
+        return True
+
+
+def _release_google_import(mapping_id: int) -> None:
+    try:
+        cache.delete(_google_import_lock(mapping_id))
+    except Exception:
+        pass
+
+
+def _run_google_import(mapping: OtaRoomMapping, job: OtaSyncJob, prefetched=None) -> None:
+    try:
+        stats = google_import_events(mapping, job=job, prefetched=prefetched)
+        job.stats = {**(job.stats or {}), **stats}
         job.status = OtaSyncJob.JobStatus.SUCCESS if stats.get("errors", 0) == 0 else OtaSyncJob.JobStatus.FAILED
         job.finished_at = timezone.now()
         job.save(update_fields=["status", "stats", "finished_at"])
@@ -130,6 +159,62 @@ def import_google_for_mapping_task(self, mapping_id: int):
         job.error_message = str(e)
         job.finished_at = timezone.now()
         job.save(update_fields=["status", "error_message", "finished_at"])
+
+
+@shared_task(bind=True)
+def import_google_shard_task(self, mapping_ids: list):
+    """Importa un shard de mapeos de Google: listados en paralelo (HTTP) y escritura en serie."""
+    if not GOOGLE_AVAILABLE:
+        return {"processed_mappings": 0, "error": "google_api_not_installed"}
+    acquired = [mid for mid in mapping_ids if _acquire_google_import(mid)]
+    summary = {"processed_mappings": 0, "skipped_locked": len(mapping_ids) - len(acquired)}
+    try:
+        mappings = list(
+            OtaRoomMapping.objects.select_related("hotel", "room")
+            .filter(id__in=acquired, provider=OtaProvider.GOOGLE, is_active=True)
+            .order_by("id")
+        )
+        fetched = fetch_google_events(mappings)
+        # Los eventos del shard se publican juntos (un pipeline) al cerrar el lote
+        with publisher.batch():
+            for m in mappings:
+                job = OtaSyncJob.objects.create(
+                    hotel=m.hotel,
+                    provider=OtaProvider.GOOGLE,
+                    job_type=OtaSyncJob.JobType.IMPORT_ICS,
+                    status=OtaSyncJob.JobStatus.RUNNING,
+                    stats={"mapping_id": m.id},
+                )
+                _run_google_import(m, job, prefetched=fetched.get(m.id))
+                # Publicar evento para refrescar UI si éxito
+                if job.status == OtaSyncJob.JobStatus.SUCCESS:
+                    publish_event(m.hotel_id, {"type": "reservations_updated", "hotel_id": m.hotel_id, "provider": "google"})
+                summary["processed_mappings"] += 1
+    finally:
+        for mid in acquired:
+            _release_google_import(mid)
+    return summary
+
+@shared_task(bind=True)
+def import_google_for_mapping_task(self, mapping_id: int):
+    """Importa eventos para un mapeo específico (usado por webhooks)."""
+    if not GOOGLE_AVAILABLE:
+        return {}
+    if not _acquire_google_import(mapping_id):
+        # Hay un import en curso del mismo calendario: reintentar cuando termine
+        raise self.retry(countdown=10, max_retries=3)
+    try:
+        mapping = OtaRoomMapping.objects.select_related("hotel", "room").get(id=mapping_id)
+        job = OtaSyncJob.objects.create(
+            hotel=mapping.hotel,
+            provider=OtaProvider.GOOGLE,
+            job_type=OtaSyncJob.JobType.IMPORT_ICS,
+            status=OtaSyncJob.JobStatus.RUNNING,
+            stats={"mapping_id": mapping_id, "trigger": "webhook"},
+        )
+        _run_google_import(mapping, job)
+    finally:
+        _release_google_import(mapping_id)
     return job.stats or {}
 
 @shared_task(bind=True)
@@ -165,14 +250,7 @@ def import_ics_for_mapping_task(self, mapping_id: int, job_id: int | None = None
         job.finished_at = timezone.now()
         job.save(update_fields=["status", "stats", "finished_at"])
         if job.status == OtaSyncJob.JobStatus.SUCCESS:
-            try:
-                redis_host = os.environ.get("REDIS_HOST", "redis")
-                r = redis.Redis(host=redis_host, port=6379, db=0)
-                payload = json.dumps({"type": "reservations_updated", "hotel_id": mapping.hotel_id, "provider": "ical"})
-                r.publish("otas:events", payload)
-                r.publish(f"otas:events:{mapping.hotel_id}", payload)
-            except Exception:
-                pass
+            publish_event(mapping.hotel_id, {"type": "reservations_updated", "hotel_id": mapping.hotel_id, "provider": "ical"})
         
         # Registrar finalización (el ICALSyncService ya registra IMPORT_COMPLETED, pero agregamos uno adicional aquí para consistencia)
         if stats.get("errors", 0) == 0:
@@ -209,8 +287,13 @@ def import_ics_for_mapping_task(self, mapping_id: int, job_id: int | None = None
     return job.stats or {}
 
 
-@shared_task(bind=True)
-def push_ari_for_hotel_task(self, hotel_id: int, provider: str, date_from_str: str, date_to_str: str, job_id: int | None = None):
+@shared_task(bind=True, max_retries=None)
+def push_ari_for_hotel_task(self, hotel_id: int, provider: str, date_from_str: str, date_to_str: str, job_id: int | None = None, force: bool = False):
+    """
+    Push ARI de un hotel a un canal. Ante fallos transitorios del canal (429/5xx, red,
+    breaker abierto) la task se reprograma con backoff en lugar de dormir en el worker;
+    los lotes ya aceptados no se reenvían (ver ari_engine).
+    """
     df = date.fromisoformat(date_from_str)
     dt = date.fromisoformat(date_to_str)
     
@@ -269,7 +352,7 @@ def push_ari_for_hotel_task(self, hotel_id: int, provider: str, date_from_str: s
         )
     
     try:
-        stats = push_ari_for_hotel(job, hotel_id, provider, df, dt)
+        stats = push_ari_for_hotel(job, hotel_id, provider, df, dt, force=force)
         job.status = OtaSyncJob.JobStatus.SUCCESS
         job.stats = stats
         job.finished_at = timezone.now()
@@ -286,6 +369,47 @@ def push_ari_for_hotel_task(self, hotel_id: int, provider: str, date_from_str: s
                 "status": "success",
             },
         )
+    except RetryableChannelError as e:
+        retries = self.request.retries or 0
+        if retries >= settings.OTA_HTTP_MAX_RETRIES:
+            job.status = OtaSyncJob.JobStatus.FAILED
+            job.error_message = str(e)
+            job.finished_at = timezone.now()
+            OtaSyncLog.objects.create(
+                job=job,
+                level=OtaSyncLog.Level.ERROR,
+                message="PUSH_ARI_ERROR",
+                payload={
+                    "hotel_id": hotel_id,
+                    "provider": provider,
+                    "error": str(e),
+                    "error_type": type(e).__name__,
+                    "retries": retries,
+                    "timestamp": timezone.now().isoformat(),
+                },
+            )
+        else:
+            countdown = backoff_countdown(retries, e.retry_after)
+            job.error_message = str(e)
+            OtaSyncLog.objects.create(
+                job=job,
+                level=OtaSyncLog.Level.WARNING,
+                message="PUSH_ARI_RETRY_SCHEDULED",
+                payload={
+                    "hotel_id": hotel_id,
+                    "provider": provider,
+                    "error": str(e),
+                    "status": e.status,
+                    "attempt": retries + 1,
+                    "countdown": countdown,
+                },
+            )
+            raise self.retry(
+                args=[hotel_id, provider, date_from_str, date_to_str],
+                kwargs={"job_id": job.id, "force": force},
+                countdown=countdown,
+                exc=e,
+            )
     except Exception as e:
         import traceback
         job.status = OtaSyncJob.JobStatus.FAILED
@@ -415,12 +539,8 @@ def sync_smoobu_for_hotel_task(self, hotel_id: int, days_ahead: int = 90, job_id
             stats={"hotel_id": hotel_id, "provider": OtaProvider.SMOOBU, "days_ahead": days_ahead},
         )
 
-    OtaSyncLog.objects.create(
-        job=job,
-        level=OtaSyncLog.Level.INFO,
-        message="SMOOBU_SYNC_STARTED",
-        payload={"hotel_id": hotel_id, "days_ahead": days_ahead, "trigger": "task"},
-    )
+    log = SyncLogBuffer(job)
+    log.add(OtaSyncLog.Level.INFO, "SMOOBU_SYNC_STARTED", {"hotel_id": hotel_id, "days_ahead": days_ahead, "trigger": "task"})
     logger.info("SMOOBU_TASK_START hotel_id=%s days_ahead=%s job_id=%s", hotel_id, days_ahead, job.id)
 
     try:
@@ -428,11 +548,10 @@ def sync_smoobu_for_hotel_task(self, hotel_id: int, days_ahead: int = 90, job_id
         job.status = OtaSyncJob.JobStatus.SUCCESS if result.get("status") == "ok" else OtaSyncJob.JobStatus.FAILED
         job.stats = {**(job.stats or {}), **result}
         job.finished_at = timezone.now()
-        OtaSyncLog.objects.create(
-            job=job,
-            level=OtaSyncLog.Level.INFO if job.status == OtaSyncJob.JobStatus.SUCCESS else OtaSyncLog.Level.WARNING,
-            message="SMOOBU_SYNC_COMPLETED",
-            payload={"hotel_id": hotel_id, "result": result},
+        log.add(
+            OtaSyncLog.Level.INFO if job.status == OtaSyncJob.JobStatus.SUCCESS else OtaSyncLog.Level.WARNING,
+            "SMOOBU_SYNC_COMPLETED",
+            {"hotel_id": hotel_id, "result": result},
         )
         logger.info("SMOOBU_TASK_DONE hotel_id=%s job_id=%s status=%s result=%s", hotel_id, job.id, job.status, result)
     except Exception as e:
@@ -440,14 +559,10 @@ def sync_smoobu_for_hotel_task(self, hotel_id: int, days_ahead: int = 90, job_id
         job.status = OtaSyncJob.JobStatus.FAILED
         job.error_message = str(e)
         job.finished_at = timezone.now()
-        OtaSyncLog.objects.create(
-            job=job,
-            level=OtaSyncLog.Level.ERROR,
-            message="SMOOBU_SYNC_ERROR",
-            payload={"hotel_id": hotel_id, "error": str(e), "traceback": traceback.format_exc()},
-        )
+        log.add(OtaSyncLog.Level.ERROR, "SMOOBU_SYNC_ERROR", {"hotel_id": hotel_id, "error": str(e), "traceback": traceback.format_exc()})
         logger.exception("SMOOBU_TASK_ERROR hotel_id=%s job_id=%s error=%s", hotel_id, job.id, str(e))
     finally:
         job.save(update_fields=["status", "stats", "error_message", "finished_at"])
+        log.flush()
     return job.stats or {}
 
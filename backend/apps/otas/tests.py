@@ -0,0 +1,1260 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from celery.exceptions import Retry
+from django.core.cache import cache
+from django.db import connection
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.core.models import Currency, Hotel
+from apps.rooms.models import Room
+from apps.rates.models import RatePlan, RateRule
+from apps.rates.services.rule_index import clear_local_rate_indexes
+from apps.reservations.models import (
+    Reservation,
+    ReservationChangeEvent,
+    ReservationChangeLog,
+    ReservationNight,
+    ReservationStatus,
+    RoomBlock,
+    RoomBlockType,
+    RoomInventoryDay,
+)
+from apps.notifications.models import Notification
+from apps.otas.models import (
+    OtaAriState,
+    OtaConfig,
+    OtaImportedEvent,
+    OtaProvider,
+    OtaRatePlanMapping,
+    OtaRoomMapping,
+    OtaRoomTypeMapping,
+    OtaSyncJob,
+    OtaSyncLog,
+)
+from apps.otas.services.ari_engine import build_ari_delta
+from apps.otas.services.ari_publisher import AriPushResult, BookingAdapter, pull_reservations_for_hotel, push_ari_for_hotel
+from apps.otas.services.availability_checker import AvailabilityCheckResult, OtaAvailabilityChecker
+from apps.otas.services.smoobu_sync_service import SmoobuClient, SmoobuSyncService
+from apps.otas.services.ical_fetcher import FetchStatus, fetch_feeds
+from apps.otas.services.event_bus import EventPublisher
+from apps.otas.services.event_fanout import EventHub
+from apps.otas.services import google_sync_service, ical_export
+from apps.otas.services.ical_sync_service import ICALSyncService
+from apps.otas.services.ota_reservation_service import OtaReservationService
+from apps.otas.services.sync_log import SyncLogBuffer, policy_for_hotel
+from apps.otas.services.http_client import (
+    ChannelHttpClient,
+    CircuitOpenError,
+    RetryableChannelError,
+    backoff_countdown,
+    http_client,
+)
+from apps.otas.tasks import import_all_google, import_all_ics, import_google_shard_task, push_ari_for_hotel_task
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def build_ics(*events):
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//test//EN"]
+    for uid, start, end in events:
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{uid}",
+            f"DTSTART;VALUE=DATE:{start:%Y%m%d}",
+            f"DTEND;VALUE=DATE:{end:%Y%m%d}",
+            "SUMMARY:Reserva - Ana",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(lines) + "\r\n").encode()
+
+
+class FeedServer:
+    """Servidor HTTP local que sirve feeds iCal por path, con o sin soporte de ETag."""
+
+    def __init__(self):
+        self.feeds = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body, etag = server.feeds.get(self.path, (None, None))
+                server.requests.append((self.path, dict(self.headers)))
+                if body is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                if etag and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/calendar")
+                self.send_header("Content-Length", str(len(body)))
+                if etag:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_port}{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class IcalConditionalFetchTest(TestCase):
+    def setUp(self):
+        self.currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel iCal", email="ical@hotel.com")
+        self.rooms = [
+            Room.objects.create(
+                name=f"I-{n}", hotel=self.hotel, floor="1", room_type="double", number=n,
+                base_price=Decimal("100.00"), base_currency=self.currency, capacity=2, max_capacity=2,
+            )
+            for n in (101, 102)
+        ]
+        self.start = date.today() + timedelta(days=5)
+
+    def _mapping(self, room, url):
+        return OtaRoomMapping.objects.create(
+            hotel=self.hotel, room=room, provider=OtaProvider.ICAL, ical_in_url=url,
+        )
+
+    def test_unchanged_feeds_are_not_reimported(self):
+        with FeedServer() as server:
+            server.feeds["/etag.ics"] = (build_ics(("uid-1", self.start, self.start + timedelta(days=2))), '"v1"')
+            server.feeds["/plain.ics"] = (build_ics(("uid-2", self.start, self.start + timedelta(days=3))), None)
+            with_etag = self._mapping(self.rooms[0], server.url("/etag.ics"))
+            plain = self._mapping(self.rooms[1], server.url("/plain.ics"))
+
+            first = import_all_ics.apply().get()
+            self.assertEqual(first["imported"], 2)
+            self.assertEqual(Reservation.objects.filter(external_id__in=["uid-1", "uid-2"]).count(), 2)
+            with_etag.refresh_from_db()
+            self.assertEqual(with_etag.ical_etag, '"v1"')
+            self.assertTrue(with_etag.ical_content_hash)
+
+            jobs = OtaSyncJob.objects.count()
+            second = import_all_ics.apply().get()
+            self.assertEqual((second["imported"], second["not_modified"], second["unchanged"]), (0, 1, 1))
+            self.assertEqual(OtaSyncJob.objects.count(), jobs)
+            etag_requests = [headers for path, headers in server.requests if path == "/etag.ics"]
+            self.assertEqual(etag_requests[-1].get("If-None-Match"), '"v1"')
+
+            server.feeds["/plain.ics"] = (build_ics(("uid-3", self.start, self.start + timedelta(days=1))), None)
+            third = import_all_ics.apply().get()
+            self.assertEqual((third["imported"], third["not_modified"]), (1, 1))
+            self.assertTrue(Reservation.objects.filter(external_id="uid-3").exists())
+            plain.refresh_from_db()
+            self.assertIsNotNone(plain.last_synced)
+
+    def test_fetch_errors_and_force(self):
+        with FeedServer() as server:
+            server.feeds["/etag.ics"] = (build_ics(("uid-1", self.start, self.start + timedelta(days=2))), '"v1"')
+            ok = self._mapping(self.rooms[0], server.url("/etag.ics"))
+            missing = self._mapping(self.rooms[1], server.url("/missing.ics"))
+            import_all_ics.apply().get()
+            ok.refresh_from_db()
+            missing.refresh_from_db()
+
+            results = fetch_feeds([ok, missing])
+            self.assertEqual(results[ok.id].status, FetchStatus.NOT_MODIFIED)
+            self.assertEqual(results[missing.id].status, FetchStatus.ERROR)
+            self.assertIsNone(missing.ical_content_hash)
+
+            forced = fetch_feeds([ok], force=True)
+            self.assertEqual(forced[ok.id].status, FetchStatus.CHANGED)
+            self.assertEqual(
+                OtaImportedEvent.objects.filter(room=self.rooms[0], uid="uid-1").count(), 1
+            )
+            self.assertEqual(
+                Reservation.objects.get(external_id="uid-1").status, ReservationStatus.CONFIRMED
+            )
+
+
+def build_feed(events):
+    """Feed iCal con eventos (uid, inicio, fin, status opcional)."""
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//test//EN"]
+    for uid, start, end, *status in events:
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{uid}",
+            f"DTSTART;VALUE=DATE:{start:%Y%m%d}",
+            f"DTEND;VALUE=DATE:{end:%Y%m%d}",
+            f"SUMMARY:Reserva - {uid}",
+        ]
+        if status:
+            lines.append(f"STATUS:{status[0]}")
+        lines.append("END:VEVENT")
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(lines) + "\r\n").encode()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class IcalBatchedReconciliationTest(TestCase):
+    def setUp(self):
+        self.currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel Batch", email="batch@hotel.com")
+        self.room = Room.objects.create(
+            name="B-1", hotel=self.hotel, floor="1", room_type="double", number=301,
+            base_price=Decimal("100.00"), base_currency=self.currency, capacity=2, max_capacity=2,
+        )
+        self.mapping = OtaRoomMapping.objects.create(
+            hotel=self.hotel, room=self.room, provider=OtaProvider.ICAL, ical_in_url="http://feed.test/b.ics",
+        )
+        self.start = date.today() + timedelta(days=10)
+
+    def _events(self, n):
+        # Estadías de una noche sin solaparse
+        return [(f"evt-{i}", self.start + timedelta(days=2 * i), self.start + timedelta(days=2 * i + 1)) for i in range(n)]
+
+    def _import(self, events):
+        job = OtaSyncJob.objects.create(hotel=self.hotel, provider=OtaProvider.ICAL, job_type=OtaSyncJob.JobType.IMPORT_ICS)
+        return ICALSyncService.import_reservations(self.mapping, job=job, content=build_feed(events)), job
+
+    def test_unchanged_feed_cost_does_not_grow_with_events(self):
+        events = self._events(30)
+        stats, _ = self._import(events)
+        self.assertEqual(stats["created"], 30)
+        self.assertEqual(OtaImportedEvent.objects.filter(room=self.room).count(), 30)
+
+        with CaptureQueriesContext(connection) as small:
+            self._import(events[:5])
+        with CaptureQueriesContext(connection) as large:
+            stats, job = self._import(events)
+        self.assertEqual((stats["created"], stats["updated"], stats["skipped"]), (0, 0, 30))
+        # Un feed sin cambios no hace lecturas/escrituras por evento
+        self.assertLessEqual(len(large), len(small))
+        self.assertLess(len(large), 20)
+        self.assertFalse(job.logs.filter(message="RESERVATION_NO_CHANGES").exists())
+        summary = job.logs.get(message="LOG_SUMMARY")
+        self.assertEqual(summary.payload["collapsed"], {"RESERVATION_NO_CHANGES": 30})
+
+    def test_update_cancel_and_disappeared(self):
+        events = self._events(3)
+        self._import(events)
+        self.assertEqual(ReservationNight.objects.filter(reservation__hotel=self.hotel).count(), 3)
+        # Dato cargado en el PMS que el feed iCal no trae: el upsert no lo pisa
+        Reservation.objects.filter(external_id="evt-0").update(guests=3)
+        moved = ("evt-0", self.start + timedelta(days=20), self.start + timedelta(days=22))
+        cancelled = ("evt-1", events[1][1], events[1][2], "CANCELLED")
+        stats, job = self._import([moved, cancelled])
+
+        self.assertEqual((stats["updated"], stats["cancelled"]), (1, 2))
+        res = {r.external_id: r for r in Reservation.objects.filter(hotel=self.hotel)}
+        self.assertEqual(res["evt-0"].check_in, moved[1])
+        self.assertEqual(res["evt-0"].guests, 3)
+        self.assertEqual(
+            sorted(ReservationNight.objects.filter(reservation=res["evt-0"]).values_list("date", flat=True)),
+            [moved[1], moved[1] + timedelta(days=1)],
+        )
+        self.assertTrue(ReservationChangeLog.objects.filter(reservation=res["evt-0"], event_type=ReservationChangeEvent.UPDATED).exists())
+        self.assertEqual(res["evt-1"].status, ReservationStatus.CANCELLED)
+        self.assertEqual(res["evt-2"].status, ReservationStatus.CANCELLED)
+        self.assertEqual(OtaImportedEvent.objects.get(room=self.room, uid="evt-0").dtstart, moved[1])
+        reasons = sorted(job.logs.filter(message="RESERVATION_CANCELLED").values_list("payload__reason", flat=True))
+        self.assertEqual(reasons, ["event_disappeared", "ical_status_cancelled"])
+
+    def test_failed_chunk_is_split_to_isolate_bad_booking(self):
+        upsert = OtaReservationService.upsert_reservations_batch
+
+        def failing_upsert(**kwargs):
+            if any(b.external_id == "evt-2" for b in kwargs["bookings"]):
+                raise ValueError("conflicto")
+            return upsert(**kwargs)
+
+        with mock.patch.object(OtaReservationService, "upsert_reservations_batch", side_effect=failing_upsert):
+            stats, job = self._import(self._events(5))
+        self.assertEqual((stats["created"], stats["errors"]), (4, 1))
+        conflicts = job.logs.filter(message="RESERVATION_CONFLICT")
+        self.assertEqual([log.payload["external_id"] for log in conflicts], ["evt-2"])
+        self.assertFalse(Reservation.objects.filter(hotel=self.hotel, external_id="evt-2").exists())
+
+    def test_logs_are_flushed_when_import_raises(self):
+        job = OtaSyncJob.objects.create(hotel=self.hotel, provider=OtaProvider.ICAL, job_type=OtaSyncJob.JobType.IMPORT_ICS)
+        with mock.patch.object(ICALSyncService, "_apply_reservation_diff", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                ICALSyncService.import_reservations(self.mapping, job=job, content=build_feed(self._events(2)))
+        self.assertTrue(job.logs.filter(message="IMPORT_STARTED").exists())
+
+
+class SyncLogBufferTest(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name="Hotel Logs", email="logs@hotel.com")
+        self.job = OtaSyncJob.objects.create(hotel=self.hotel, provider=OtaProvider.ICAL, job_type=OtaSyncJob.JobType.IMPORT_ICS)
+
+    def test_buffers_and_collapses_noops(self):
+        log = SyncLogBuffer(self.job)
+        log.info("IMPORT_STARTED", {"mapping_id": 1})
+        for i in range(50):
+            log.info("RESERVATION_NO_CHANGES", {"external_id": f"uid-{i}"})
+        log.info("RESERVATION_UPDATED", {"external_id": "uid-x"})
+        self.assertFalse(self.job.logs.exists())
+
+        with self.assertNumQueries(1):
+            log.flush()
+        messages = sorted(self.job.logs.values_list("message", flat=True))
+        self.assertEqual(messages, ["IMPORT_STARTED", "LOG_SUMMARY", "RESERVATION_UPDATED"])
+        self.assertEqual(self.job.logs.get(message="LOG_SUMMARY").payload["collapsed"], {"RESERVATION_NO_CHANGES": 50})
+
+    def test_hotel_policy_level_and_sampling(self):
+        policies = {str(self.hotel.id): {"level": "warning", "sample_rate": 0}}
+        with self.settings(OTA_SYNC_LOG_HOTEL_POLICIES=policies):
+            policy = policy_for_hotel(self.hotel.id)
+            self.assertEqual((policy.level, policy.sample_rate), ("warning", 0.0))
+            with SyncLogBuffer(self.job) as log:
+                log.info("IMPORT_STARTED")
+                log.info("RESERVATION_CREATED", {"external_id": "a"})
+                log.warning("RESERVATION_CONFLICT", {"external_id": "b"})
+                log.error("IMPORT_ERROR", {"error": "boom"})
+        levels = dict(self.job.logs.values_list("message", "level"))
+        self.assertEqual(set(levels), {"IMPORT_STARTED", "RESERVATION_CONFLICT", "IMPORT_ERROR", "LOG_SUMMARY"})
+        self.assertEqual(levels["IMPORT_ERROR"], OtaSyncLog.Level.ERROR)
+        self.assertEqual(self.job.logs.get(message="LOG_SUMMARY").payload["dropped"], {"RESERVATION_CREATED": 1})
+        self.assertEqual(policy_for_hotel(None).level, "info")
+
+    def test_without_job_is_noop(self):
+        with self.assertNumQueries(0):
+            with SyncLogBuffer(None) as log:
+                log.error("IMPORT_ERROR")
+
+
+class RecordingRedis:
+    """Cliente Redis de prueba: registra los pipelines ejecutados."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.executed = []
+        self.hashes = {}
+
+    def hgetall(self, key):
+        if self.fail:
+            raise ConnectionError("redis down")
+        return {k.encode(): str(v).encode() for k, v in self.hashes.get(key, {}).items()}
+
+    def pipeline(self, transaction=True):
+        client = self
+
+        class Pipeline:
+            def __init__(self):
+                self.commands = []
+                self.writes = []
+
+            def publish(self, channel, payload):
+                self.commands.append((channel, json.loads(payload)))
+
+            def hincrby(self, key, field, amount):
+                self.writes.append((key, field, amount, True))
+
+            hincrbyfloat = hincrby
+
+            def hset(self, key, field, value):
+                self.writes.append((key, field, value, False))
+
+            def execute(self):
+                if client.fail:
+                    raise ConnectionError("redis down")
+                client.executed.append(self.commands)
+                for key, field, value, incr in self.writes:
+                    fields = client.hashes.setdefault(key, {})
+                    fields[field] = fields.get(field, 0) + value if incr else value
+
+        return Pipeline()
+
+
+class EventPublisherTest(TestCase):
+    def test_single_client_and_batched_pipeline(self):
+        clients = []
+
+        def factory():
+            clients.append(RecordingRedis())
+            return clients[-1]
+
+        pub = EventPublisher(client_factory=factory)
+        pub.publish(1, {"type": "reservations_updated"})
+        with pub.batch():
+            for hotel_id in (1, 2, 1):
+                pub.publish(hotel_id, {"type": "reservations_updated", "hotel_id": hotel_id})
+        self.assertEqual(len(clients), 1)
+        executed = clients[0].executed
+        self.assertEqual(len(executed), 2)
+        self.assertEqual([c for c, _ in executed[0]], ["otas:events", "otas:events:1"])
+        # El lote deduplica eventos idénticos: 2 hoteles x (global + hotel)
+        self.assertEqual(
+            [c for c, _ in executed[1]],
+            ["otas:events", "otas:events:1", "otas:events", "otas:events:2"],
+        )
+        metrics = pub.metrics()
+        self.assertEqual((metrics["published"], metrics["flushes"], metrics["shared"]), (6, 2, True))
+        self.assertIsNotNone(metrics["avg_latency_ms"])
+        # Otro proceso (la API web) ve los contadores desde el hash de Redis
+        web = EventPublisher(client_factory=lambda: clients[0]).metrics()
+        self.assertEqual((web["published"], web["flushes"]), (6, 2))
+        self.assertIsNotNone(web["avg_latency_ms"])
+
+    def test_failure_backs_off_without_raising(self):
+        client = RecordingRedis(fail=True)
+        pub = EventPublisher(client_factory=lambda: client)
+        with self.settings(OTA_EVENTS_BACKOFF_SECONDS=60):
+            pub.publish(1, {"type": "reservations_updated"})
+            client.fail = False
+            pub.publish(1, {"type": "reservations_updated"})
+        metrics = pub.metrics()
+        self.assertEqual((metrics["failed"], metrics["dropped"], metrics["published"]), (2, 2, 0))
+        self.assertTrue(metrics["degraded"])
+        self.assertEqual(client.executed, [])
+
+
+class FakePubSub:
+    """PubSub asíncrono de prueba alimentado por una cola."""
+
+    def __init__(self):
+        self.messages = asyncio.Queue()
+        self.channels = []
+
+    async def subscribe(self, *channels):
+        self.channels.extend(channels)
+
+    async def listen(self):
+        while True:
+            data = await self.messages.get()
+            yield {"type": "message", "channel": "otas:events", "data": data}
+
+    async def aclose(self):
+        pass
+
+
+class EventHubTest(TestCase):
+    def setUp(self):
+        self.pubsubs = []
+
+        def factory():
+            self.pubsubs.append(FakePubSub())
+            return self.pubsubs[-1]
+
+        self.hub = EventHub(pubsub_factory=factory, buffer_size=10)
+
+    async def _next(self, stream):
+        return await asyncio.wait_for(stream.__anext__(), timeout=1)
+
+    async def test_one_subscription_fans_out_by_hotel(self):
+        all_events = self.hub.stream()
+        hotel_1 = self.hub.stream(hotel_id="1")
+        self.assertIn("ping", await self._next(all_events))
+        self.assertIn("ping", await self._next(hotel_1))
+        await asyncio.sleep(0)
+        self.assertEqual(len(self.pubsubs), 1)
+        self.assertEqual(self.pubsubs[0].channels, ["otas:events"])
+
+        for hotel_id in (2, 1):
+            await self.pubsubs[0].messages.put(json.dumps({"type": "reservations_updated", "hotel_id": hotel_id}))
+        first = await self._next(all_events)
+        second = await self._next(all_events)
+        only = await self._next(hotel_1)
+        self.assertIn('"hotel_id": 2', first)
+        self.assertIn('"hotel_id": 1', second)
+        self.assertIn('"hotel_id": 1', only)
+        self.assertEqual(only.split("\n")[0], second.split("\n")[0])  # mismo id de evento
+        self.assertEqual(self.hub.subscriber_count, 2)
+        await all_events.aclose()
+        await hotel_1.aclose()
+        self.assertEqual(self.hub.subscriber_count, 0)
+
+    async def test_last_event_id_replay_and_heartbeat(self):
+        first_id = self.hub.dispatch(json.dumps({"hotel_id": 1, "n": 1}))
+        self.hub.dispatch(json.dumps({"hotel_id": 2, "n": 2}))
+        self.hub.dispatch(json.dumps({"hotel_id": 1, "n": 3}))
+
+        stream = self.hub.stream(hotel_id="1", last_event_id=self.hub.event_id(first_id), heartbeat=0.05)
+        await self._next(stream)  # ping inicial
+        replayed = await self._next(stream)
+        self.assertIn('"n": 3', replayed)
+        self.assertTrue(replayed.startswith(f"id: {self.hub.event_id(first_id + 2)}\n"))
+        self.assertIn("event: ping", await self._next(stream))
+        await stream.aclose()
+
+        # Un id de otro arranque no repone nada
+        stream = self.hub.stream(last_event_id="otro-1", heartbeat=0.05)
+        await self._next(stream)
+        self.assertIn("event: ping", await self._next(stream))
+        await stream.aclose()
+
+    async def test_asgi_view_streams_from_hub(self):
+        self.hub.dispatch(json.dumps({"hotel_id": 7, "n": 1}))
+        with mock.patch("apps.otas.api.get_hub", return_value=self.hub):
+            response = await AsyncClient().get(
+                "/api/otas/events/stream/?hotel=7", headers={"Last-Event-ID": self.hub.event_id(0)}
+            )
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            chunks = response.streaming_content
+            self.assertIn(b"ping", await self._next(chunks))
+            self.assertIn(b'"n": 1', await self._next(chunks))
+            await chunks.aclose()
+
+
+class RecordingAdapter(BookingAdapter):
+    """Adapter mock que guarda los payloads enviados (y puede rechazarlos)."""
+
+    def __init__(self, accept=True):
+        super().__init__(is_mock=True)
+        self.accept = accept
+        self.payloads = []
+
+    def push_ari(self, payload):
+        self.payloads.append(payload)
+        if not self.accept:
+            return AriPushResult(success=False, errors=len(payload["items"]))
+        return super().push_ari(payload)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, OTA_ARI_DEBOUNCE_SECONDS=10)
+class AriDeltaEngineTest(TestCase):
+    def setUp(self):
+        clear_local_rate_indexes()
+        self.currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel ARI", email="ari@hotel.com")
+        self.rooms = [
+            Room.objects.create(
+                name=f"D-{i}", hotel=self.hotel, floor="1", room_type="double", number=400 + i,
+                base_price=Decimal("100.00"), base_currency=self.currency, capacity=2, max_capacity=2,
+            )
+            for i in range(2)
+        ]
+        OtaRoomTypeMapping.objects.create(hotel=self.hotel, provider=OtaProvider.BOOKING, room_type_code="double", provider_code="BK-DBL")
+        OtaRatePlanMapping.objects.create(hotel=self.hotel, provider=OtaProvider.BOOKING, rate_plan_code="BAR", provider_code="BK-BAR")
+        self.start = date.today() + timedelta(days=5)
+        self.end = self.start + timedelta(days=9)
+        plan = RatePlan.objects.create(hotel=self.hotel, name="BAR", code="BAR", priority=100)
+        RateRule.objects.create(plan=plan, name="General", start_date=self.start, end_date=self.end, base_amount=Decimal("120.00"))
+        RateRule.objects.create(
+            plan=plan, name="Fin de semana largo", start_date=self.start + timedelta(days=3), end_date=self.start + timedelta(days=4),
+            priority=200, base_amount=Decimal("150.00"), min_stay=2, closed_to_arrival=True,
+        )
+
+    def _push(self, adapter, force=False):
+        job = OtaSyncJob.objects.create(hotel=self.hotel, provider=OtaProvider.BOOKING, job_type=OtaSyncJob.JobType.PUSH_ARI)
+        with mock.patch("apps.otas.services.ari_publisher.get_adapter", return_value=adapter):
+            return push_ari_for_hotel(job, self.hotel.id, OtaProvider.BOOKING, self.start, self.end, force=force), job
+
+    def test_first_push_coalesces_runs_with_real_values(self):
+        adapter = RecordingAdapter()
+        stats, _ = self._push(adapter)
+
+        items = adapter.payloads[0]["items"]
+        ranges = [(i["date_from"], i["date_to"], i["price"], i["min_stay"], i["closed_to_arrival"]) for i in items]
+        self.assertEqual(ranges, [
+            (self.start.isoformat(), (self.start + timedelta(days=2)).isoformat(), "120.00", 1, False),
+            ((self.start + timedelta(days=3)).isoformat(), (self.start + timedelta(days=4)).isoformat(), "150.00", 2, True),
+            ((self.start + timedelta(days=5)).isoformat(), self.end.isoformat(), "120.00", 1, False),
+        ])
+        self.assertTrue(all(i["availability"] == 2 and i["room_type"] == "BK-DBL" and i["rate_plan"] == "BK-BAR" for i in items))
+        self.assertEqual((stats["pushed"], stats["ranges"], stats["changed_dates"]), (3, 3, 10))
+        state = OtaAriState.objects.get(hotel=self.hotel, provider=OtaProvider.BOOKING, room_type_code="double", rate_plan_code="BAR")
+        self.assertEqual(len(state.values), 10)
+
+    def test_only_changed_dates_are_pushed(self):
+        self._push(RecordingAdapter())
+
+        adapter = RecordingAdapter()
+        stats, job = self._push(adapter)
+        self.assertEqual(adapter.payloads, [])
+        self.assertEqual(stats["pushed"], 0)
+        self.assertTrue(job.logs.filter(message="PUSH_ARI_SKIPPED").exists())
+
+        RoomBlock.objects.create(
+            hotel=self.hotel, room=self.rooms[0], block_type=RoomBlockType.MAINTENANCE,
+            start_date=self.start + timedelta(days=6), end_date=self.start + timedelta(days=8),
+        )
+        adapter = RecordingAdapter()
+        self._push(adapter)
+        items = adapter.payloads[0]["items"]
+        self.assertEqual(len(items), 1)
+        self.assertEqual(
+            (items[0]["date_from"], items[0]["date_to"], items[0]["availability"]),
+            ((self.start + timedelta(days=6)).isoformat(), (self.start + timedelta(days=7)).isoformat(), 1),
+        )
+
+    def test_rejected_batch_is_retried_next_time(self):
+        with self.settings(OTA_ARI_MAX_ITEMS_PER_PUSH=2):
+            stats, _ = self._push(RecordingAdapter(accept=False))
+            self.assertEqual((stats["batches"], stats["pushed"], stats["errors"]), (2, 0, 3))
+            self.assertFalse(OtaAriState.objects.exists())
+
+            adapter = RecordingAdapter()
+            stats, _ = self._push(adapter)
+            self.assertEqual([len(p["items"]) for p in adapter.payloads], [2, 1])
+            self.assertEqual(build_ari_delta(self.hotel.id, OtaProvider.BOOKING, self.start, self.end).ranges, [])
+
+    def test_burst_of_changes_enqueues_one_delayed_push(self):
+        OtaConfig.objects.create(hotel=self.hotel, provider=OtaProvider.BOOKING, is_active=True)
+        with mock.patch.object(push_ari_for_hotel_task, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(3):
+                    RoomBlock.objects.create(
+                        hotel=self.hotel, room=self.rooms[1], block_type=RoomBlockType.HOLD,
+                        start_date=self.start + timedelta(days=i), end_date=self.start + timedelta(days=i + 1),
+                    )
+        apply_async.assert_called_once()
+        self.assertEqual(apply_async.call_args.kwargs["countdown"], 10)
+        self.assertEqual(OtaSyncJob.objects.filter(hotel=self.hotel, job_type=OtaSyncJob.JobType.PUSH_ARI).count(), 1)
+
+
+class ChannelStub:
+    """Servidor HTTP/1.1 local de un canal: POST con la secuencia de status configurada, GET con un JSON fijo."""
+
+    def __init__(self, statuses=(200,), headers=None, get_body=None, delay=0.0):
+        self.statuses = list(statuses)
+        self.headers = headers or {}
+        self.get_body = get_body or {}
+        self.delay = delay
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub.requests.append((self.path, self.client_address[1], None))
+                time.sleep(stub.delay)
+                body = json.dumps(stub.get_body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                stub.requests.append((self.path, self.client_address[1], json.loads(body or b"{}")))
+                status = stub.statuses.pop(0) if len(stub.statuses) > 1 else stub.statuses[0]
+                self.send_response(status)
+                for name, value in stub.headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@override_settings(OTA_HTTP_BREAKER_THRESHOLD=2, OTA_HTTP_BREAKER_COOLDOWN_SECONDS=60)
+class ChannelHttpClientTest(TestCase):
+    def setUp(self):
+        self.client_http = ChannelHttpClient()
+        self.addCleanup(self.client_http.reset)
+
+    def test_requests_reuse_pooled_connection(self):
+        with ChannelStub() as stub:
+            for _ in range(3):
+                resp = self.client_http.post("booking", stub.base_url + "/ari/push", json={"items": []})
+                self.assertEqual(resp.status_code, 200)
+        ports = {port for _, port, _ in stub.requests}
+        self.assertEqual(len(stub.requests), 3)
+        self.assertEqual(len(ports), 1)
+
+    def test_transient_errors_raise_and_open_breaker(self):
+        with ChannelStub(statuses=[503], headers={"Retry-After": "7"}) as stub:
+            with self.assertRaises(RetryableChannelError) as ctx:
+                self.client_http.post("booking", stub.base_url + "/ari/push", json={})
+            self.assertEqual((ctx.exception.status, ctx.exception.retry_after), (503, 7.0))
+            with self.assertRaises(RetryableChannelError):
+                self.client_http.post("booking", stub.base_url + "/ari/push", json={})
+            with self.assertRaises(CircuitOpenError):
+                self.client_http.post("booking", stub.base_url + "/ari/push", json={})
+            # Otro proveedor no se ve afectado por el breaker de booking
+            with self.assertRaises(RetryableChannelError) as other:
+                self.client_http.post("airbnb", stub.base_url + "/ari/push", json={})
+            self.assertNotIsInstance(other.exception, CircuitOpenError)
+        self.assertEqual(len(stub.requests), 3)
+
+    def test_breaker_half_open_trial_closes_on_success(self):
+        breaker = self.client_http.breaker("booking")
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        breaker.opened_at -= 61
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_unexpected_error_in_half_open_trial_reopens_breaker(self):
+        breaker = self.client_http.breaker("booking")
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.opened_at -= 61
+        with mock.patch.object(self.client_http, "session_for", side_effect=ValueError("URL inválida")):
+            with self.assertRaises(ValueError):
+                self.client_http.post("booking", "http://127.0.0.1:1/ari/push", json={})
+        # La prueba fallida reabre el breaker en lugar de dejarlo semiabierto sin prueba disponible
+        self.assertEqual(breaker.state, "open")
+        breaker.opened_at -= 61
+        self.assertTrue(breaker.allow())
+
+    @override_settings(OTA_HTTP_RETRY_BASE_SECONDS=4, OTA_HTTP_RETRY_MAX_SECONDS=60)
+    def test_backoff_countdown_is_jittered_and_capped(self):
+        for retries in range(8):
+            ceiling = min(60, 4 * 2 ** retries)
+            self.assertTrue(ceiling / 2 - 1 <= backoff_countdown(retries) <= ceiling)
+        self.assertEqual(backoff_countdown(0, retry_after=30), 30)
+        self.assertEqual(backoff_countdown(0, retry_after=3600), 60)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class PushAriRetryTest(TestCase):
+    def setUp(self):
+        clear_local_rate_indexes()
+        self.addCleanup(http_client.reset)
+        currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel Retry", email="retry@hotel.com")
+        Room.objects.create(
+            name="R-1", hotel=self.hotel, floor="1", room_type="double", number=501,
+            base_price=Decimal("90.00"), base_currency=currency, capacity=2, max_capacity=2,
+        )
+        OtaRoomTypeMapping.objects.create(hotel=self.hotel, provider=OtaProvider.BOOKING, room_type_code="double", provider_code="BK-DBL")
+        OtaRatePlanMapping.objects.create(hotel=self.hotel, provider=OtaProvider.BOOKING, rate_plan_code="BAR", provider_code="BK-BAR")
+        self.start = date.today() + timedelta(days=1)
+
+    def _run(self, stub):
+        OtaConfig.objects.update_or_create(
+            hotel=self.hotel, provider=OtaProvider.BOOKING,
+            defaults={"is_active": True, "booking_base_url": stub.base_url},
+        )
+        return push_ari_for_hotel_task(
+            self.hotel.id, OtaProvider.BOOKING, self.start.isoformat(), (self.start + timedelta(days=3)).isoformat(),
+        )
+
+    def test_transient_failure_reschedules_task_without_sleeping(self):
+        with ChannelStub(statuses=[503]) as stub, \
+                mock.patch.object(push_ari_for_hotel_task, "retry", return_value=Retry()) as retry, \
+                mock.patch("time.sleep") as sleep:
+            with self.assertRaises(Retry):
+                self._run(stub)
+        sleep.assert_not_called()
+        self.assertEqual(len(stub.requests), 1)
+        job = OtaSyncJob.objects.get(hotel=self.hotel, job_type=OtaSyncJob.JobType.PUSH_ARI)
+        self.assertEqual(job.status, OtaSyncJob.JobStatus.RUNNING)
+        self.assertEqual(retry.call_args.kwargs["kwargs"]["job_id"], job.id)
+        self.assertGreaterEqual(retry.call_args.kwargs["countdown"], 1)
+        self.assertTrue(job.logs.filter(message="PUSH_ARI_RETRY_SCHEDULED").exists())
+        self.assertFalse(OtaAriState.objects.exists())
+
+    def test_successful_push_records_state(self):
+        with ChannelStub(statuses=[200]) as stub:
+            stats = self._run(stub)
+        self.assertEqual(stats["pushed"], 1)
+        self.assertEqual(stub.requests[0][0], "/ari/push")
+        self.assertEqual(stub.requests[0][2]["items"][0]["price"], "90.00")
+        self.assertTrue(OtaAriState.objects.filter(hotel=self.hotel).exists())
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHE,
+    OTA_AVAILABILITY_DEADLINE_SECONDS=0.6,
+    OTA_AVAILABILITY_PROVIDER_TIMEOUT=2,
+    OTA_AVAILABILITY_CACHE_SECONDS=30,
+)
+class OtaAvailabilityFanOutTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(http_client.reset)
+        currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel Check", email="check@hotel.com")
+        self.room = Room.objects.create(
+            name="C-1", hotel=self.hotel, floor="1", room_type="double", number=601,
+            base_price=Decimal("90.00"), base_currency=currency, capacity=2, max_capacity=2,
+        )
+        for provider in (OtaProvider.BOOKING, OtaProvider.AIRBNB):
+            OtaRoomMapping.objects.create(hotel=self.hotel, room=self.room, provider=provider, external_id=f"{provider}-601")
+        self.check_in = date.today() + timedelta(days=20)
+        self.check_out = self.check_in + timedelta(days=2)
+
+    def _configure(self, booking, airbnb):
+        OtaConfig.objects.update_or_create(
+            hotel=self.hotel, provider=OtaProvider.BOOKING, defaults={"is_active": True, "booking_base_url": booking.base_url},
+        )
+        OtaConfig.objects.update_or_create(
+            hotel=self.hotel, provider=OtaProvider.AIRBNB, defaults={"is_active": True, "airbnb_base_url": airbnb.base_url},
+        )
+
+    def _check(self):
+        started = time.monotonic()
+        results = OtaAvailabilityChecker.check_availability_for_room(self.room, self.check_in, self.check_out)
+        return {r.provider: r for r in results}, time.monotonic() - started
+
+    def test_providers_are_queried_concurrently(self):
+        with ChannelStub(get_body={"available": True}, delay=0.4) as booking, \
+                ChannelStub(get_body={"available": False}, delay=0.4) as airbnb:
+            self._configure(booking, airbnb)
+            results, elapsed = self._check()
+        self.assertLess(elapsed, 0.75)
+        self.assertEqual(results[OtaProvider.BOOKING].status, AvailabilityCheckResult.FRESH)
+        self.assertTrue(results[OtaProvider.BOOKING].is_available)
+        self.assertFalse(results[OtaProvider.AIRBNB].is_available)
+        self.assertIn("room_id=booking-601", booking.requests[0][0])
+
+    def test_deadline_returns_partial_results(self):
+        with ChannelStub(get_body={"available": True}, delay=1.5) as booking, \
+                ChannelStub(get_body={"available": True}) as airbnb:
+            self._configure(booking, airbnb)
+            results, elapsed = self._check()
+        self.assertLess(elapsed, 1.2)
+        self.assertEqual(results[OtaProvider.BOOKING].status, AvailabilityCheckResult.UNKNOWN)
+        self.assertTrue(results[OtaProvider.BOOKING].is_available)
+        self.assertEqual(results[OtaProvider.BOOKING].details["reason"], "deadline")
+        self.assertEqual(results[OtaProvider.AIRBNB].status, AvailabilityCheckResult.FRESH)
+
+    def test_cached_answers_and_stale_fallback(self):
+        with ChannelStub(get_body={"available": False}) as booking, \
+                ChannelStub(get_body={"available": True}) as airbnb:
+            self._configure(booking, airbnb)
+            self._check()
+            results, _ = self._check()
+            self.assertEqual(len(booking.requests), 1)
+            self.assertEqual(results[OtaProvider.BOOKING].status, AvailabilityCheckResult.CACHED)
+            self.assertFalse(results[OtaProvider.BOOKING].is_available)
+
+            # Vencida la caché corta, un canal lento responde con el último dato conocido
+            booking.delay = 1.5
+            with self.settings(OTA_AVAILABILITY_CACHE_SECONDS=0):
+                results, _ = self._check()
+        self.assertEqual(results[OtaProvider.BOOKING].status, AvailabilityCheckResult.STALE)
+        self.assertFalse(results[OtaProvider.BOOKING].is_available)
+        self.assertEqual(results[OtaProvider.AIRBNB].status, AvailabilityCheckResult.FRESH)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SmoobuIncrementalRatePushTest(TestCase):
+    def setUp(self):
+        clear_local_rate_indexes()
+        currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel Smoobu", email="smoobu@hotel.com")
+        self.room = Room.objects.create(
+            name="S-1", hotel=self.hotel, floor="1", room_type="double", number=701,
+            base_price=Decimal("100.00"), base_currency=currency, capacity=2, max_capacity=2,
+        )
+        OtaConfig.objects.create(hotel=self.hotel, provider=OtaProvider.SMOOBU, is_active=True, credentials={"api_key": "k", "dry_run": True})
+        self.mapping = OtaRoomMapping.objects.create(hotel=self.hotel, room=self.room, provider=OtaProvider.SMOOBU, external_id="123")
+        self.plan = RatePlan.objects.create(hotel=self.hotel, name="Base", code="BASE", priority=100)
+        self.today = timezone.now().date()
+
+    def _push(self, **kwargs):
+        with mock.patch.object(SmoobuClient, "push_rates", autospec=True, **kwargs) as push:
+            out = SmoobuSyncService.push_rates_for_room(self.room.id, days_ahead=10)
+        return out, [c.args[2] for c in push.call_args_list]
+
+    def _day(self, n):
+        return (self.today + timedelta(days=n)).isoformat()
+
+    def test_unchanged_inventory_sends_nothing(self):
+        out, calls = self._push()
+        self.assertEqual(calls, [[{"dates": [f"{self._day(0)}:{self._day(9)}"], "daily_price": 100.0, "min_length_of_stay": 1}]])
+        self.assertEqual(out["dates_evaluated"], 10)
+
+        with mock.patch("apps.otas.services.smoobu_sync_service.compute_rate_for_date") as compute:
+            out, calls = self._push()
+        compute.assert_not_called()
+        self.assertEqual(calls, [])
+        self.assertEqual((out["operations"], out["dates_evaluated"]), (0, 0))
+
+    def test_rule_change_recomputes_only_its_dates(self):
+        self._push()
+        rule = RateRule.objects.create(
+            plan=self.plan, name="Promo", start_date=self.today + timedelta(days=3), end_date=self.today + timedelta(days=4),
+            base_amount=Decimal("150.00"), min_stay=2,
+        )
+        out, calls = self._push()
+        self.assertEqual(out["dates_evaluated"], 2)
+        self.assertEqual(calls, [[{"dates": [f"{self._day(3)}:{self._day(4)}"], "daily_price": 150.0, "min_length_of_stay": 2}]])
+
+        rule.delete()
+        out, calls = self._push()
+        self.assertEqual(out["dates_evaluated"], 2)
+        self.assertEqual(calls, [[{"dates": [f"{self._day(3)}:{self._day(4)}"], "daily_price": 100.0, "min_length_of_stay": 1}]])
+
+    def test_failed_push_keeps_previous_fingerprint(self):
+        self._push()
+        RateRule.objects.create(
+            plan=self.plan, name="Alta", start_date=self.today + timedelta(days=8), end_date=self.today + timedelta(days=20),
+            base_amount=Decimal("180.00"),
+        )
+        with self.assertRaises(RuntimeError):
+            self._push(side_effect=RuntimeError("HTTP 503"))
+        out, calls = self._push()
+        self.assertEqual(calls, [[{"dates": [f"{self._day(8)}:{self._day(9)}"], "daily_price": 180.0, "min_length_of_stay": 1}]])
+        self.mapping.refresh_from_db()
+        self.assertEqual(self.mapping.rate_push_state["dates"][self._day(9)], [180.0, 1])
+
+
+class SmoobuBatchPullTest(TestCase):
+    def setUp(self):
+        currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel Pull", email="pull@hotel.com")
+        OtaConfig.objects.create(hotel=self.hotel, provider=OtaProvider.SMOOBU, is_active=True, credentials={"api_key": "k"})
+        self.rooms = []
+        for i in range(3):
+            room = Room.objects.create(
+                name=f"P-{i}", hotel=self.hotel, floor="1", room_type="double", number=800 + i,
+                base_price=Decimal("100.00"), base_currency=currency, capacity=2, max_capacity=2,
+            )
+            OtaRoomMapping.objects.create(hotel=self.hotel, room=room, provider=OtaProvider.SMOOBU, external_id=f"apt-{i}")
+            self.rooms.append(room)
+        self.start = date.today() + timedelta(days=30)
+
+    def _items(self, first_id, count, price="300.00", offset=0):
+        items = []
+        for n in range(count):
+            arrival = self.start + timedelta(days=offset + 3 * (n // 3))
+            items.append({
+                "smoobu_id": first_id + n,
+                "apartment_id": f"apt-{n % 3}",
+                "arrival": arrival.isoformat(),
+                "departure": (arrival + timedelta(days=3)).isoformat(),
+                "guest_name": f"Huésped {first_id + n}",
+                "channel_name": "Booking.com",
+                "adults": 2,
+                "price": price,
+            })
+        return items
+
+    def _pull(self, items):
+        job = OtaSyncJob.objects.create(
+            hotel=self.hotel, provider=OtaProvider.SMOOBU, job_type=OtaSyncJob.JobType.PULL_RESERVATIONS,
+        )
+        adapter = mock.Mock()
+        adapter.pull_reservations.return_value = {"items": items}
+        with mock.patch("apps.otas.services.ari_publisher.get_adapter", return_value=adapter):
+            with CaptureQueriesContext(connection) as ctx:
+                stats = pull_reservations_for_hotel(job, self.hotel.id, OtaProvider.SMOOBU, timezone.now())
+        return stats, len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        stats_small, small = self._pull(self._items(1000, 3))
+        stats_large, large = self._pull(self._items(2000, 15, offset=30))
+        self.assertEqual((stats_small["created"], stats_large["created"]), (3, 15))
+        self.assertEqual(stats_large["errors"], 0)
+        self.assertEqual(small, large)
+
+        res = Reservation.objects.get(external_id="smoobu:2007")
+        self.assertEqual(res.total_price, Decimal("300.00"))
+        self.assertEqual(res.status, ReservationStatus.CONFIRMED)
+        nights = list(ReservationNight.objects.filter(reservation=res).order_by("date").values_list("total_night", flat=True))
+        self.assertEqual(nights, [Decimal("100.00")] * 3)
+        self.assertTrue(ReservationChangeLog.objects.filter(reservation=res, event_type=ReservationChangeEvent.CREATED).exists())
+        self.assertEqual(Notification.objects.filter(hotel_id=self.hotel.id).count(), 18)
+
+    def test_repull_writes_only_changes(self):
+        items = self._items(3000, 6)
+        self._pull(items)
+        items[2]["price"] = "450.00"
+        stats, _ = self._pull(items)
+        self.assertEqual((stats["created"], stats["updated"], stats["unchanged"]), (0, 1, 5))
+
+        res = Reservation.objects.get(external_id="smoobu:3002")
+        self.assertEqual(res.total_price, Decimal("450.00"))
+        self.assertEqual(res.notes.count("Importado desde Smoobu"), 1)
+        self.assertEqual(sum(ReservationNight.objects.filter(reservation=res).values_list("total_night", flat=True)), Decimal("450.00"))
+        self.assertEqual(ReservationChangeLog.objects.filter(event_type=ReservationChangeEvent.UPDATED).count(), 0)
+        self.assertEqual(Notification.objects.filter(hotel_id=self.hotel.id).count(), 6)
+
+    def test_overlaps_are_flagged_and_internal_blocks_cancelled(self):
+        items = self._items(4000, 2)
+        items[1]["apartment_id"] = "apt-0"  # misma habitación y fechas que el primero
+        blocked = self._items(4100, 1)[0]
+        blocked["apartment_id"] = "apt-1"
+        self._pull(items + [dict(blocked)])
+        self.assertTrue(all(Reservation.objects.filter(external_id__in=["smoobu:4000", "smoobu:4001"]).values_list("overbooking_flag", flat=True)))
+
+        block_res = Reservation.objects.get(external_id="smoobu:4100")
+        self.assertTrue(RoomInventoryDay.objects.filter(reservation=block_res).exists())
+
+        blocked["guest_name"] = "Bloqueo AlojaSys"
+        stats, _ = self._pull([blocked])
+        self.assertEqual(stats["skipped"], 1)
+        self.assertEqual(Reservation.objects.get(external_id="smoobu:4100").status, ReservationStatus.CANCELLED)
+        # La cancelación libera el inventario aunque sea un UPDATE sin señales
+        self.assertFalse(RoomInventoryDay.objects.filter(reservation=block_res).exists())
+
+
+class FakeGoogleCalendar:
+    """Cliente falso de Calendar: responde list_events y execute_batch en memoria."""
+
+    def __init__(self):
+        self.calendars = {}
+        self.listings = {}
+        self.batches = []
+        self._seq = 0
+
+    def list_events(self, creds, calendar_id, time_min=None, time_max=None, sync_token=None):
+        return self.listings[(calendar_id, sync_token)]
+
+    def execute_batch(self, creds, calls):
+        self.batches.append([method for _, method, _ in calls])
+        results = {}
+        for request_id, method, kw in calls:
+            events = self.calendars.setdefault(kw["calendarId"], {})
+            if method == "list":
+                prop = kw["privateExtendedProperty"].split("=", 1)[1]
+                items = [e for e in events.values() if e["extendedProperties"]["private"]["alojasys_reservation_id"] == prop]
+                results[request_id] = ({"items": items}, None)
+            elif method == "insert":
+                self._seq += 1
+                event = {**kw["body"], "id": f"ev{self._seq}"}
+                events[event["id"]] = event
+                results[request_id] = (event, None)
+            elif method == "update":
+                events[kw["eventId"]] = {**kw["body"], "id": kw["eventId"]}
+                results[request_id] = (events[kw["eventId"]], None)
+            elif method == "delete":
+                events.pop(kw["eventId"], None)
+                results[request_id] = ({}, None)
+        return results
+
+
+@override_settings(CACHES=LOCMEM_CACHE, OTA_GOOGLE_SHARD_SIZE=2)
+class GoogleCalendarBatchSyncTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel Google", email="google@hotel.com")
+        OtaConfig.objects.create(hotel=self.hotel, provider=OtaProvider.GOOGLE, is_active=True, credentials={"type": "service_account"})
+        self.fake = FakeGoogleCalendar()
+        for name in ("list_events", "execute_batch"):
+            patcher = mock.patch.object(google_sync_service, name, getattr(self.fake, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.start = date.today() + timedelta(days=20)
+
+    def _room(self, n, direction=OtaRoomMapping.SyncDirection.BOTH):
+        room = Room.objects.create(
+            name=f"G-{n}", hotel=self.hotel, floor="1", room_type="double", number=900 + n,
+            base_price=Decimal("100.00"), base_currency=self.currency, capacity=2, max_capacity=2,
+        )
+        mapping = OtaRoomMapping.objects.create(
+            hotel=self.hotel, room=room, provider=OtaProvider.GOOGLE, external_id=f"cal-{n}", sync_direction=direction,
+        )
+        return room, mapping
+
+    def _event(self, uid, offset, summary="Reserva - Ana"):
+        d = self.start + timedelta(days=offset)
+        return {"id": uid, "summary": summary, "start": {"date": d.isoformat()}, "end": {"date": (d + timedelta(days=3)).isoformat()}}
+
+    def test_exports_and_deletes_go_in_two_batch_rounds(self):
+        rooms = [self._room(i)[0] for i in range(2)]
+        reservations = [
+            Reservation.objects.create(
+                hotel=self.hotel, room=rooms[i % 2], guests_data=[{"name": f"Huésped {i}", "email": f"h{i}@x.com", "is_primary": True}],
+                check_in=self.start + timedelta(days=4 * i), check_out=self.start + timedelta(days=4 * i + 2),
+                status=ReservationStatus.CONFIRMED,
+            )
+            for i in range(4)
+        ]
+        out = google_sync_service.sync_reservations_to_google(reservations)
+        self.assertEqual(self.fake.batches, [["list"] * 4, ["insert"] * 4])
+        self.assertEqual({r["action"] for res in out.values() for r in res["results"]}, {"created"})
+        self.assertEqual(OtaImportedEvent.objects.filter(provider=OtaProvider.GOOGLE).count(), 4)
+
+        self.fake.batches.clear()
+        google_sync_service.sync_reservations_to_google(reservations)
+        self.assertEqual(self.fake.batches, [["list"] * 4, ["update"] * 4])
+
+        self.fake.batches.clear()
+        Reservation.objects.filter(pk=reservations[0].pk).update(status=ReservationStatus.CANCELLED)
+        reservations[0].refresh_from_db()
+        out = google_sync_service.delete_reservation_from_google(reservations[0])
+        self.assertEqual(out["results"][0]["action"], "deleted")
+        self.assertEqual(self.fake.batches, [["list"], ["delete"]])
+        self.assertEqual(sum(len(events) for events in self.fake.calendars.values()), 3)
+
+    def test_import_is_set_based_and_incremental_keeps_unchanged_events(self):
+        room, mapping = self._room(1, OtaRoomMapping.SyncDirection.IMPORT)
+        self.fake.listings[("cal-1", None)] = {
+            "items": [self._event(f"g{i}", 4 * i, summary=f"Reserva - Ana {i}") for i in range(3)],
+            "nextSyncToken": "t1",
+        }
+        stats = google_sync_service.import_events_for_mapping(mapping)
+        self.assertEqual((stats["created"], stats["errors"]), (3, 0))
+        self.assertEqual(OtaImportedEvent.objects.filter(room=room, provider=OtaProvider.GOOGLE).count(), 3)
+        mapping.refresh_from_db()
+        self.assertEqual(mapping.google_sync_token, "t1")
+
+        moved = self._event("g1", 30, summary="Reserva - Ana 1")
+        self.fake.listings[("cal-1", "t1")] = {"items": [{"id": "g0", "status": "cancelled"}, moved], "nextSyncToken": "t2"}
+        with CaptureQueriesContext(connection) as ctx:
+            stats = google_sync_service.import_events_for_mapping(mapping)
+        self.assertEqual((stats["created"], stats["updated"], stats["cancelled"]), (0, 1, 1))
+        tracking_reads = [q for q in ctx.captured_queries if q["sql"].startswith('SELECT "otas_otaimportedevent"')]
+        self.assertEqual(len(tracking_reads), 1)
+
+        status = dict(Reservation.objects.filter(room=room).values_list("external_id", "status"))
+        self.assertEqual(status["g0"], ReservationStatus.CANCELLED)
+        self.assertNotEqual(status["g2"], ReservationStatus.CANCELLED)
+        self.assertEqual(Reservation.objects.get(external_id="g1").check_in, self.start + timedelta(days=30))
+        self.assertEqual(
+            set(OtaImportedEvent.objects.filter(room=room, provider=OtaProvider.GOOGLE).values_list("uid", flat=True)),
+            {"g1", "g2"},
+        )
+
+    def test_import_all_google_dispatches_shards(self):
+        mappings = [self._room(i, OtaRoomMapping.SyncDirection.IMPORT)[1] for i in range(5)]
+        with mock.patch.object(import_google_shard_task, "apply_async") as dispatch:
+            out = import_all_google.run()
+        self.assertEqual(out, {"scheduled_mappings": 5, "shards": 3})
+        shards = [c.kwargs["args"][0] for c in dispatch.call_args_list]
+        self.assertEqual(shards, [[m.id for m in mappings[i:i + 2]] for i in (0, 2, 4)])
+
+        for m in mappings[:2]:
+            self.fake.listings[(m.external_id, None)] = {"items": [self._event(f"{m.external_id}-e", 0)], "nextSyncToken": "t"}
+        cache.add(f"otas:google:import:{mappings[1].id}", True, timeout=60)
+        summary = import_google_shard_task.run(shards[0])
+        self.assertEqual(summary, {"processed_mappings": 1, "skipped_locked": 1})
+        self.assertTrue(Reservation.objects.filter(external_id="cal-0-e").exists())
+        self.assertIsNone(cache.get(f"otas:google:import:{mappings[0].id}"))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class IcalExportCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel Feed", email="feed@hotel.com")
+        OtaConfig.objects.create(hotel=self.hotel, provider=OtaProvider.ICAL, is_active=True, ical_out_token="tok")
+        self.room = Room.objects.create(
+            name="F-1", hotel=self.hotel, floor="1", room_type="double", number=701,
+            base_price=Decimal("100.00"), base_currency=self.currency, capacity=2, max_capacity=2,
+        )
+        self.start = date.today() + timedelta(days=15)
+        with self.captureOnCommitCallbacks():
+            self.reservation = Reservation.objects.create(
+                hotel=self.hotel, room=self.room, check_in=self.start, check_out=self.start + timedelta(days=2),
+                guests_data=[{"name": "Ana", "email": "ana@x.com", "is_primary": True}], status=ReservationStatus.CONFIRMED,
+            )
+        self.url = reverse("otas-ical-room", args=[self.room.id]) + "?token=tok"
+
+    @staticmethod
+    def _run_ical_invalidations(callbacks):
+        # Solo la invalidación del feed; el resto de los on_commit encola tasks de Celery
+        for callback in callbacks:
+            if callback.__qualname__.startswith("invalidate_ical_feeds_on_commit"):
+                callback()
+
+    def test_repeated_poll_is_cache_hit_and_conditional_304(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn(b"RES-%d" % self.reservation.id, first.content)
+        etag = first["ETag"]
+        self.assertTrue(etag.startswith('"') and first["Last-Modified"])
+
+        with CaptureQueriesContext(connection) as ctx:
+            again = self.client.get(self.url)
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            since = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"])
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(again.content, first.content)
+        self.assertEqual((not_modified.status_code, since.status_code), (304, 304))
+        self.assertEqual(self.client.get(self.url.replace("tok", "bad")).status_code, 403)
+
+    def test_reservation_and_mapping_changes_invalidate_feeds(self):
+        hotel_url = reverse("otas-ical-hotel", args=[self.hotel.id]) + "?token=tok"
+        etag = self.client.get(self.url)["ETag"]
+        hotel_etag = self.client.get(hotel_url)["ETag"]
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.reservation.status = ReservationStatus.CANCELLED
+            self.reservation.save()
+        self._run_ical_invalidations(callbacks)
+        fresh = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(fresh.status_code, 200)
+        self.assertNotIn(b"RES-%d" % self.reservation.id, fresh.content)
+        self.assertNotEqual(self.client.get(hotel_url)["ETag"], hotel_etag)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            OtaRoomMapping.objects.create(
+                hotel=self.hotel, room=self.room, provider=OtaProvider.ICAL, ical_in_url="http://x.test/a.ics",
+                sync_direction=OtaRoomMapping.SyncDirection.IMPORT,
+            )
+        self._run_ical_invalidations(callbacks)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_invalid_token_does_not_render_and_sync_saves_keep_cache(self):
+        hotel_url = reverse("otas-ical-hotel", args=[self.hotel.id]) + "?token=bad"
+        room_url = reverse("otas-ical-room", args=[self.room.id]) + "?token=bad"
+        for url in (room_url, hotel_url):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.client.get(url).status_code, 403)
+            self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIsNone(ical_export.cached_room_feed(self.room.id))
+        missing = reverse("otas-ical-room", args=[self.room.id + 1000]) + "?token=tok"
+        self.assertEqual(self.client.get(missing).status_code, 403)
+
+        mapping = OtaRoomMapping.objects.create(
+            hotel=self.hotel, room=self.room, provider=OtaProvider.ICAL, ical_in_url="http://x.test/a.ics",
+        )
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        # Guardados de sincronización (last_synced, estado de rates) no tocan el feed exportado
+        with self.captureOnCommitCallbacks() as callbacks:
+            mapping.last_synced = timezone.now()
+            mapping.save(update_fields=["last_synced"])
+            mapping.rate_push_state = {"fp": "x"}
+            mapping.save(update_fields=["rate_push_state", "updated_at"])
+        self.assertFalse(any(c.__qualname__.startswith("invalidate_ical_feeds_on_commit") for c in callbacks))
+        with self.captureOnCommitCallbacks() as callbacks:
+            mapping.sync_direction = OtaRoomMapping.SyncDirection.IMPORT
+            mapping.save(update_fields=["sync_direction"])
+        self._run_ical_invalidations(callbacks)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_render_racing_an_invalidation_is_not_served(self):
+        entry = ical_export._entry
+
+        def invalidated_while_rendering(*args, **kwargs):
+            # La reserva cambia y se invalida mientras el poll ya había consultado la base
+            ical_export.invalidate_ical_feeds(self.hotel.id, [self.room.id])
+            return entry(*args, **kwargs)
+
+        with mock.patch.object(ical_export, "_entry", side_effect=invalidated_while_rendering):
+            self.assertIsNotNone(ical_export.render_room_feed(self.room.id))
+        self.assertIsNone(ical_export.cached_room_feed(self.room.id))
+        self.assertIsNotNone(ical_export.render_room_feed(self.room.id))
+        self.assertIsNotNone(ical_export.cached_room_feed(self.room.id))
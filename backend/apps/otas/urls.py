@@ -31,6 +31,7 @@ urlpatterns = [
     path("ari/push/", views.push_ari, name="otas-ari-push"),
     # SSE events stream
     path("events/stream/", api.events_stream, name="otas-events-stream"),
+    path("events/metrics/", api.events_metrics, name="otas-events-metrics"),
     
     # Endpoints estándar (ViewSets)
     path("", include(router.urls)),
@@ -1,10 +1,12 @@
+import hmac
 from datetime import datetime, timedelta, date
 
-from django.http import HttpResponse, HttpResponseForbidden
-from django.shortcuts import get_object_or_404
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import Http404, HttpResponse, HttpResponseForbidden
 from django.utils import timezone
-
-from icalendar import Calendar, Event
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
 from rest_framework import viewsets, permissions, status, decorators
 from rest_framework.decorators import api_view, permission_classes
@@ -28,6 +30,7 @@ from .serializers import (
 from .tasks import import_ics_for_mapping_task, push_ari_for_hotel_task
 from apps.payments.services.webhook_security import WebhookSecurityService
 from .services.ota_reservation_service import OtaReservationService, PaymentInfo
+from .services.ical_export import cached_hotel_feed, cached_room_feed, render_hotel_feed, render_room_feed
 from django.conf import settings
 import os
 from decimal import Decimal
@@ -44,93 +47,90 @@ def _validate_ical_token_for_hotel(hotel_id: int, token: str) -> bool:
     ).exists()
 
 
-def _build_calendar(name: str) -> Calendar:
-    cal = Calendar()
-    cal.add("prodid", "-//AlojaSys//ICS Export//ES")
-    cal.add("version", "2.0")
-    cal.add("X-WR-CALNAME", name)
-    return cal
+def _validate_ical_token_for_room(room_id: int, token: str) -> bool:
+    if not token:
+        return False
+    return OtaConfig.objects.filter(
+        hotel__rooms__id=room_id,
+        provider=OtaProvider.ICAL,
+        is_active=True,
+        ical_out_token=token,
+    ).exists()
+
 
+def _token_in_entry(entry: dict, token: str) -> bool:
+    """El token viaja en la entrada cacheada del feed: validar no consulta la base."""
+    if not token:
+        return False
+    return any(hmac.compare_digest(str(t), token) for t in entry.get("tokens") or [])
+
+
+def _feed_response(request, entry: dict, filename: str) -> HttpResponse:
+    """Respuesta del .ics con ETag / Last-Modified; 304 si el cliente ya tiene esta versión."""
+    last_modified = entry["last_modified"]
+    not_modified = get_conditional_response(request, etag=entry["etag"], last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+    response = HttpResponse(entry["body"], content_type="text/calendar; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    response["ETag"] = entry["etag"]
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = "private, no-cache"
+    return response
 
-def _add_reservation_event(cal: Calendar, reservation: Reservation) -> None:
-    event = Event()
-    # All-day event (iCal estándar): DTEND es no-inclusivo.
-    # Para reservas hoteleras, el evento cubre [check_in, check_out) → DTEND = check_out.
-    dt_start = datetime.combine(reservation.check_in, datetime.min.time())
-    dt_end = datetime.combine(reservation.check_out, datetime.min.time())
 
-    event.add("uid", f"alojasys-reservation-{reservation.id}@alojasys")
-    event.add("summary", f"RES-{reservation.id} | {reservation.room.name}")
-    event.add("dtstart", dt_start.date())
-    event.add("dtend", dt_end.date())
-    event.add("description", f"Hotel: {reservation.hotel.name}")
-    cal.add_component(event)
+def _touch_export_mappings(room_id: int, mapping_ids: list) -> None:
+    # last_synced de los mapeos de export, como mucho una escritura por minuto y habitación
+    if not mapping_ids:
+        return
+    try:
+        if not cache.add(f"otas:ical:touch:{room_id}", 1, timeout=60):
+            return
+    except Exception:
+        pass
+    now = timezone.now()
+    OtaRoomMapping.objects.filter(id__in=mapping_ids).filter(
+        Q(last_synced__isnull=True) | Q(last_synced__lt=now - timedelta(minutes=1))
+    ).update(last_synced=now)
 
 
 def ical_export_hotel(request, hotel_id: int):
     token = request.GET.get("token")
-    if not _validate_ical_token_for_hotel(hotel_id, token):
+    entry = cached_hotel_feed(hotel_id)
+    if entry is None:
+        # Sin caché el token se valida con un exists() antes de renderizar: un token inválido
+        # no dispara el armado del feed (token inválido antes que 404, como antes)
+        if not _validate_ical_token_for_hotel(hotel_id, token):
+            return HttpResponseForbidden("Invalid token")
+        entry = render_hotel_feed(hotel_id)
+        if entry is None:
+            raise Http404("Hotel no encontrado")
+    elif not _token_in_entry(entry, token):
         return HttpResponseForbidden("Invalid token")
 
-    hotel = get_object_or_404(Hotel, id=hotel_id)
-
-    cal = _build_calendar(f"AlojaSys - {hotel.name}")
-
     # Exportamos reservas confirmadas y pendientes (bloquean inventario)
-    qs = Reservation.objects.filter(
-        hotel=hotel,
-        status__in=[ReservationStatus.CONFIRMED, ReservationStatus.PENDING],
-    ).select_related("room")
-
-    for r in qs:
-        _add_reservation_event(cal, r)
-
-    data = cal.to_ical()
-    response = HttpResponse(data, content_type="text/calendar; charset=utf-8")
-    response["Content-Disposition"] = f'attachment; filename="hotel_{hotel_id}.ics"'
-    return response
+    return _feed_response(request, entry, f"hotel_{hotel_id}.ics")
 
 
 def ical_export_room(request, room_id: int):
-    room = get_object_or_404(Room, id=room_id)
     token = request.GET.get("token")
-    if not _validate_ical_token_for_hotel(room.hotel_id, token):
+    entry = cached_room_feed(room_id)
+    if entry is None:
+        # Igual que en el feed del hotel: token inválido (o habitación inexistente) antes que 404
+        if not _validate_ical_token_for_room(room_id, token):
+            return HttpResponseForbidden("Invalid token")
+        entry = render_room_feed(room_id)
+        if entry is None:
+            raise Http404("Habitación no encontrada")
+    elif not _token_in_entry(entry, token):
         return HttpResponseForbidden("Invalid token")
 
-    # Verificar si hay mapeos activos con sync_direction que permita export
-    mappings = OtaRoomMapping.objects.filter(
-        room=room,
-        provider=OtaProvider.ICAL,
-        is_active=True,
-    )
-    # Si hay mapeos específicos, verificar sync_direction
-    if mappings.exists():
-        has_export = False
-        for m in mappings:
-            if m.sync_direction in [OtaRoomMapping.SyncDirection.EXPORT, OtaRoomMapping.SyncDirection.BOTH]:
-                has_export = True
-                # Actualizar last_synced al exportar
-                if m.last_synced is None or m.last_synced < timezone.now() - timedelta(minutes=1):
-                    m.last_synced = timezone.now()
-                    m.save(update_fields=["last_synced"])
-                break
-        if not has_export:
-            return HttpResponseForbidden("Export not allowed for this room mapping (sync_direction)")
-
-    cal = _build_calendar(f"AlojaSys - {room.hotel.name} - {room.name}")
-
-    qs = Reservation.objects.filter(
-        room=room,
-        status__in=[ReservationStatus.CONFIRMED, ReservationStatus.PENDING],
-    ).select_related("hotel", "room")
-
-    for r in qs:
-        _add_reservation_event(cal, r)
-
-    data = cal.to_ical()
-    response = HttpResponse(data, content_type="text/calendar; charset=utf-8")
-    response["Content-Disposition"] = f'attachment; filename="room_{room_id}.ics"'
-    return response
+    # Si hay mapeos iCal activos, alguno tiene que permitir export (sync_direction)
+    if not entry.get("export_allowed", True):
+        return HttpResponseForbidden("Export not allowed for this room mapping (sync_direction)")
+    _touch_export_mappings(room_id, entry.get("export_mapping_ids") or [])
+
+    return _feed_response(request, entry, f"room_{room_id}.ics")
 
 
 class OtaConfigViewSet(viewsets.ModelViewSet):
@@ -634,9 +634,7 @@ def smoobu_webhook(request):
         if is_internal_block and action not in ("cancelReservation", "deleteReservation"):
             # Si existe por corridas previas, cancelarla.
             try:
-                Reservation.objects.filter(hotel=mapping.hotel, external_id=external_id).exclude(status=ReservationStatus.CANCELLED).update(
-                    status=ReservationStatus.CANCELLED
-                )
+                OtaReservationService.cancel_internal_blocks(mapping.hotel_id, [external_id])
             except Exception:
                 pass
             job.status = OtaSyncJob.JobStatus.SUCCESS
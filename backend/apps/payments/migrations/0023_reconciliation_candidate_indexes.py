@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0022_refund_currency'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymentintent',
+            index=models.Index(fields=['hotel', 'status', 'created_at'], name='payments_pa_hotel_i_727178_idx'),
+        ),
+    ]
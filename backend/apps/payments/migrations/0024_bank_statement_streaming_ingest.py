@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_as_ingested(apps, schema_editor):
+    # Las conciliaciones previas ya cargaron sus transacciones al subir el CSV
+    BankReconciliation = apps.get_model('payments', 'BankReconciliation')
+    BankReconciliation.objects.filter(ingested_at__isnull=True).update(
+        ingested_at=F('created_at'),
+        rows_processed=F('total_transactions'),
+        bytes_processed=F('csv_file_size'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0023_reconciliation_candidate_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bankreconciliation',
+            name='bytes_processed',
+            field=models.PositiveBigIntegerField(default=0, help_text='Bytes del CSV leídos'),
+        ),
+        migrations.AddField(
+            model_name='bankreconciliation',
+            name='duplicate_transactions',
+            field=models.PositiveIntegerField(default=0, help_text='Filas ya cargadas en otro extracto del hotel'),
+        ),
+        migrations.AddField(
+            model_name='bankreconciliation',
+            name='ingested_at',
+            field=models.DateTimeField(blank=True, help_text='Fin de la carga de transacciones', null=True),
+        ),
+        migrations.AddField(
+            model_name='bankreconciliation',
+            name='rows_processed',
+            field=models.PositiveIntegerField(default=0, help_text='Filas del CSV leídas'),
+        ),
+        migrations.AddField(
+            model_name='banktransaction',
+            name='row_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='Huella de la fila normalizada (deduplicación)', max_length=64),
+        ),
+        migrations.RunPython(mark_existing_as_ingested, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,11 @@
-from django.db import models
+import os
+import threading
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from apps.core.models import Hotel
 from apps.reservations.models import Reservation
 from apps.enterprises.models import Enterprise
@@ -120,6 +126,7 @@ class PaymentIntent(models.Model):
         indexes = [
             models.Index(fields=["hotel", "status"]),
             models.Index(fields=["reservation"]),
+            models.Index(fields=["hotel", "status", "created_at"]),
         ]
 
     def __str__(self) -> str:
@@ -1246,6 +1253,12 @@ class BankReconciliation(models.Model):
     unmatched_transactions = models.PositiveIntegerField(default=0)
     pending_review_transactions = models.PositiveIntegerField(default=0)
     error_transactions = models.PositiveIntegerField(default=0)
+    duplicate_transactions = models.PositiveIntegerField(default=0, help_text="Filas ya cargadas en otro extracto del hotel")
+    
+    # Ingesta del CSV (por lotes; rows_processed es también el punto de reanudación)
+    rows_processed = models.PositiveIntegerField(default=0, help_text="Filas del CSV leídas")
+    bytes_processed = models.PositiveBigIntegerField(default=0, help_text="Bytes del CSV leídos")
+    ingested_at = models.DateTimeField(null=True, blank=True, help_text="Fin de la carga de transacciones")
     
     # Estado y procesamiento
     status = models.CharField(max_length=20, choices=ReconciliationStatus.choices, default=ReconciliationStatus.PENDING)
@@ -1283,6 +1296,15 @@ class BankReconciliation(models.Model):
         """Indica si necesita revisión manual"""
         return self.pending_review_transactions > 0 or self.unmatched_transactions > 0
 
+    @property
+    def ingest_percentage(self):
+        """Avance de la carga del CSV (por bytes leídos)"""
+        if self.ingested_at:
+            return 100.0
+        if not self.csv_file_size:
+            return 0
+        return round(min(self.bytes_processed / self.csv_file_size, 1) * 100, 2)
+
 
 class BankTransaction(models.Model):
     """Transacciones individuales del CSV bancario"""
@@ -1294,6 +1316,7 @@ class BankTransaction(models.Model):
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     currency = models.CharField(max_length=3, default="ARS")
     reference = models.CharField(max_length=100, blank=True)
+    row_hash = models.CharField(max_length=64, blank=True, db_index=True, help_text="Huella de la fila normalizada (deduplicación)")
     
     # Estado del matching
     is_matched = models.BooleanField(default=False)
@@ -1785,14 +1808,32 @@ class ReceiptNumberSequence(models.Model):
         return f"{self.get_receipt_type_display()}-{self.series:04d} (Hotel: {self.hotel.name})"
     
     def get_next_number(self):
-        """Obtiene el siguiente número en la secuencia"""
-        self.current_number += 1
-        self.save(update_fields=['current_number', 'updated_at'])
-        return self.current_number
+        """
+        Obtiene el siguiente número en la secuencia
+        
+        UPDATE atómico (current_number = current_number + 1) y lectura del valor en la misma
+        transacción: dos pagos concurrentes nunca reciben el mismo número y, si la
+        transacción del llamador se revierte, el número tampoco se consume (sin huecos).
+        """
+        return self.reserve_block(1)[0]
+    
+    def reserve_block(self, size):
+        """Reserva `size` números consecutivos con un solo UPDATE y los devuelve como range"""
+        with transaction.atomic():
+            type(self).objects.filter(pk=self.pk).update(
+                current_number=F('current_number') + size, updated_at=timezone.now()
+            )
+            current = type(self).objects.values_list('current_number', flat=True).get(pk=self.pk)
+        self.current_number = current
+        return range(current - size + 1, current + 1)
+    
+    def format_receipt_number(self, number):
+        """Número de comprobante formateado: PREFIJO-SERIE-NUMERO"""
+        return f"{self.receipt_type}-{self.series:04d}-{number:06d}"
     
     def get_formatted_receipt_number(self):
         """Retorna el número de comprobante formateado: PREFIJO-SERIE-NUMERO"""
-        return f"{self.receipt_type}-{self.series:04d}-{self.current_number:06d}"
+        return self.format_receipt_number(self.current_number)
     
     @classmethod
     def get_or_create_sequence(cls, hotel, receipt_type, series=1):
@@ -1807,7 +1848,63 @@ class ReceiptNumberSequence(models.Model):
     
     @classmethod
     def generate_receipt_number(cls, hotel, receipt_type, series=1):
-        """Genera un nuevo número de comprobante"""
+        """
+        Genera un nuevo número de comprobante
+        
+        Con RECEIPT_NUMBER_BLOCK_SIZE > 1 los números salen de un bloque reservado por
+        proceso (ver ReceiptNumberBlocks): sin contención sobre la fila de la secuencia, a
+        costa de huecos y de un orden no cronológico entre workers.
+        """
+        block_size = getattr(settings, 'RECEIPT_NUMBER_BLOCK_SIZE', 1)
         sequence = cls.get_or_create_sequence(hotel, receipt_type, series)
+        if block_size > 1:
+            return sequence.format_receipt_number(receipt_number_blocks.next_number(sequence, block_size))
         sequence.get_next_number()
-        return sequence.get_formatted_receipt_number()
\ No newline at end of file
+        return sequence.get_formatted_receipt_number()
+
+
+class ReceiptNumberBlocks:
+    """
+    Bloques de números de comprobante reservados por proceso, por secuencia
+    (hotel, tipo y serie). Solo para comprobantes no fiscales: los números de un bloque
+    que no se usan (reinicio del worker) quedan como huecos.
+    
+    Si el bloque se reserva dentro de la transacción del llamador, el resto del bloque
+    recién queda disponible en el commit: un rollback deshace el UPDATE y otro proceso
+    puede volver a reservar ese rango, así que este proceso no debe conservarlo.
+    """
+    
+    def __init__(self):
+        self._blocks = {}
+        self._lock = threading.Lock()
+        self._pid = None
+    
+    def next_number(self, sequence, block_size):
+        with self._lock:
+            # Tras un fork (prefork de Celery) el hijo no debe reutilizar los bloques del padre
+            if self._pid != os.getpid():
+                self._blocks = {}
+                self._pid = os.getpid()
+            block = self._blocks.get(sequence.pk)
+            number = next(block, None) if block is not None else None
+            if number is not None:
+                return number
+            self._blocks.pop(sequence.pk, None)
+            block = iter(sequence.reserve_block(block_size))
+            number = next(block)
+            if not transaction.get_connection().in_atomic_block:
+                self._blocks[sequence.pk] = block
+                return number
+        transaction.on_commit(lambda: self._keep(sequence.pk, block))
+        return number
+    
+    def _keep(self, key, block):
+        with self._lock:
+            self._blocks.setdefault(key, block)
+    
+    def clear(self):
+        with self._lock:
+            self._blocks = {}
+
+
+receipt_number_blocks = ReceiptNumberBlocks()
\ No newline at end of file
@@ -1,6 +1,7 @@
 """
 Serializers para Conciliación Bancaria
 """
+from django.conf import settings
 from rest_framework import serializers
 from decimal import Decimal
 from .models import (
@@ -73,6 +74,7 @@ class BankReconciliationSerializer(serializers.ModelSerializer):
     
     match_percentage = serializers.ReadOnlyField()
     needs_manual_review = serializers.ReadOnlyField()
+    ingest_percentage = serializers.ReadOnlyField()
     transactions = BankTransactionSerializer(many=True, read_only=True)
     matches = ReconciliationMatchSerializer(many=True, read_only=True)
     audit_logs = BankReconciliationLogSerializer(many=True, read_only=True)
@@ -86,13 +88,15 @@ class BankReconciliationSerializer(serializers.ModelSerializer):
             'status', 'processing_started_at', 'processing_completed_at',
             'created_by', 'created_at', 'updated_at', 'processing_notes',
             'error_details', 'match_percentage', 'needs_manual_review',
+            'duplicate_transactions', 'rows_processed', 'bytes_processed', 'ingested_at', 'ingest_percentage',
             'transactions', 'matches', 'audit_logs'
         ]
         read_only_fields = [
             'id', 'csv_file_size', 'total_transactions', 'matched_transactions',
             'unmatched_transactions', 'pending_review_transactions', 'error_transactions',
             'processing_started_at', 'processing_completed_at', 'created_at', 'updated_at',
-            'match_percentage', 'needs_manual_review'
+            'match_percentage', 'needs_manual_review',
+            'duplicate_transactions', 'rows_processed', 'bytes_processed', 'ingested_at', 'ingest_percentage'
         ]
 
 
@@ -108,8 +112,9 @@ class BankReconciliationCreateSerializer(serializers.ModelSerializer):
         if not value.name.endswith('.csv'):
             raise serializers.ValidationError("El archivo debe ser un CSV")
         
-        if value.size > 10 * 1024 * 1024:  # 10MB
-            raise serializers.ValidationError("El archivo es demasiado grande (máximo 10MB)")
+        max_bytes = getattr(settings, 'BANK_RECONCILIATION_MAX_CSV_BYTES', 50 * 1024 * 1024)
+        if value.size > max_bytes:
+            raise serializers.ValidationError(f"El archivo es demasiado grande (máximo {max_bytes // (1024 * 1024)}MB)")
         
         return value
     
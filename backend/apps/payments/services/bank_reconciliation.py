@@ -2,22 +2,47 @@
 Servicio de Conciliación Bancaria
 Maneja el procesamiento automático de conciliaciones bancarias
 """
+import base64
 import csv
+import hashlib
 import io
+import tempfile
 from decimal import Decimal, ROUND_HALF_UP
-from datetime import date, timedelta
-from typing import List, Dict, Tuple, Optional
+from datetime import date
+from typing import Iterator, List, Dict, Tuple
+from django.conf import settings
 from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
 from apps.core.models import Hotel
-from apps.reservations.models import Payment, Reservation
 from ..models import (
     BankReconciliation, BankTransaction, ReconciliationMatch, BankReconciliationLog,
     BankReconciliationConfig, ReconciliationStatus, MatchType, ReconciliationEventType
 )
 from apps.payments.models import PaymentIntent, BankTransferPayment
+from .reconciliation_matcher import ReconciliationMatcher
+
+# Subidas en base64: se decodifican por bloques y pasan a disco por encima de SPOOL_MAX_BYTES
+BASE64_BLOCK_CHARS = 4 * 256 * 1024
+SPOOL_MAX_BYTES = 5 * 1024 * 1024
+
+
+class CsvRowError(ValidationError):
+    """Fila del CSV con formato inválido (no se reintenta)"""
+
+    def __init__(self, row_num: int, error: Exception):
+        self.row_num = row_num
+        message = error.messages[0] if isinstance(error, ValidationError) else str(error)
+        super().__init__(f"Error en fila {row_num}: {message}")
+
+
+# Campos de BankTransaction que escribe la conciliación
+TRANSACTION_MATCH_FIELDS = [
+    'is_matched', 'is_reversal', 'match_confidence', 'match_type', 'matched_payment_id',
+    'matched_payment_type', 'matched_reservation_id', 'amount_difference', 'date_difference_days', 'updated_at',
+]
 
 
 class BankReconciliationService:
@@ -39,10 +64,15 @@ class BankReconciliationService:
         return config
     
     def create_reconciliation(self, csv_file, reconciliation_date: date, created_by=None) -> BankReconciliation:
-        """Crea una nueva conciliación bancaria"""
+        """
+        Crea una nueva conciliación bancaria.
+
+        Solo se guarda el archivo y se valida el encabezado: la carga de las filas se
+        hace en process_reconciliation (tarea), leyendo el archivo en streaming.
+        """
         try:
-            # Validar y parsear CSV
-            transactions_data = self._parse_csv(csv_file)
+            # Validar encabezado
+            self._validate_csv_header(csv_file)
             
             # Crear conciliación
             reconciliation = BankReconciliation.objects.create(
@@ -51,18 +81,14 @@ class BankReconciliationService:
                 csv_file=csv_file,
                 csv_filename=csv_file.name,
                 csv_file_size=csv_file.size,
-                total_transactions=len(transactions_data),
                 created_by=created_by
             )
             
-            # Crear transacciones bancarias
-            self._create_bank_transactions(reconciliation, transactions_data)
-            
             # Log del evento
             self._log_event(
                 reconciliation,
                 ReconciliationEventType.CSV_UPLOADED,
-                f"CSV subido con {len(transactions_data)} transacciones",
+                f"CSV subido ({csv_file.size} bytes)",
                 created_by=created_by,
                 csv_filename=csv_file.name
             )
@@ -84,42 +110,37 @@ class BankReconciliationService:
                                         reconciliation_date: date, created_by=None) -> BankReconciliation:
         """Crea una nueva conciliación bancaria desde archivo base64"""
         try:
-            import base64
-            from django.core.files.base import ContentFile
+            from django.core.files import File
             
-            # Decodificar base64
-            if ',' in csv_file_base64:
+            # Decodificar base64 por bloques a un archivo temporal (en disco si es grande)
+            if ',' in csv_file_base64[:256]:
                 header, data = csv_file_base64.split(',', 1)
             else:
                 data = csv_file_base64
             
-            csv_content = base64.b64decode(data)
-            
-            # Crear archivo temporal sin name para evitar conflicto
-            csv_file = ContentFile(csv_content)
-            
-            # Validar y parsear CSV
-            transactions_data = self._parse_csv_from_content(csv_content.decode(self.config.csv_encoding))
-            
-            # Crear conciliación
-            reconciliation = BankReconciliation.objects.create(
-                hotel=self.hotel,
-                reconciliation_date=reconciliation_date,
-                csv_file=csv_file,
-                csv_filename=csv_filename,
-                csv_file_size=len(csv_content),
-                total_transactions=len(transactions_data),
-                created_by=created_by
-            )
-            
-            # Crear transacciones bancarias
-            self._create_bank_transactions(reconciliation, transactions_data)
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as tmp:
+                size = self._decode_base64_to(data, tmp)
+                tmp.seek(0)
+                csv_file = File(tmp, name=csv_filename or 'extracto.csv')
+                
+                # Validar encabezado
+                self._validate_csv_header(csv_file)
+                
+                # Crear conciliación
+                reconciliation = BankReconciliation.objects.create(
+                    hotel=self.hotel,
+                    reconciliation_date=reconciliation_date,
+                    csv_file=csv_file,
+                    csv_filename=csv_filename,
+                    csv_file_size=size,
+                    created_by=created_by
+                )
             
             # Log del evento
             self._log_event(
                 reconciliation,
                 ReconciliationEventType.CSV_UPLOADED,
-                f"CSV subido con {len(transactions_data)} transacciones",
+                f"CSV subido ({size} bytes)",
                 created_by=created_by,
                 csv_filename=csv_filename
             )
@@ -137,6 +158,30 @@ class BankReconciliationService:
                 )
             raise ValidationError(f"Error al procesar CSV: {str(e)}")
     
+    @staticmethod
+    def _decode_base64_to(data: str, out) -> int:
+        """
+        Decodifica base64 por bloques y devuelve los bytes escritos.
+
+        Los saltos de línea / espacios se quitan bloque a bloque en todo el texto (no solo al
+        principio) y el resto que no completa 4 caracteres pasa al bloque siguiente, así cada
+        decodificación queda alineada; un carácter fuera del alfabeto base64 es un error.
+        """
+        size = 0
+        pending = ''
+        step = BASE64_BLOCK_CHARS
+        for i in range(0, len(data), step):
+            pending += ''.join(data[i:i + step].split())
+            cut = len(pending) - len(pending) % 4
+            if cut:
+                chunk = base64.b64decode(pending[:cut], validate=True)
+                out.write(chunk)
+                size += len(chunk)
+                pending = pending[cut:]
+        if pending:
+            raise ValueError("Base64 inválido: longitud incompleta")
+        return size
+    
     def process_reconciliation(self, reconciliation_id: int) -> BankReconciliation:
         """Procesa una conciliación bancaria automáticamente"""
         reconciliation = BankReconciliation.objects.get(id=reconciliation_id)
@@ -155,69 +200,44 @@ class BankReconciliationService:
                 csv_filename=reconciliation.csv_filename
             )
             
-            # Obtener transacciones bancarias
-            bank_transactions = reconciliation.transactions.all()
-            
-            # Obtener pagos pendientes del hotel
-            pending_payments = self._get_pending_payments()
-            
-            # Procesar cada transacción
-            matched_count = 0
-            pending_review_count = 0
-            unmatched_count = 0
-            error_count = 0
-            
-            for bank_transaction in bank_transactions:
-                try:
-                    # Detectar reversiones
-                    if bank_transaction.amount < 0:
-                        self._handle_reversal(bank_transaction, reconciliation)
-                        continue
-                    
-                    # Buscar matches
-                    matches = self._find_matches(bank_transaction, pending_payments)
-                    
-                    if matches:
-                        best_match = max(matches, key=lambda x: x['confidence_score'])
-                        
-                        if best_match['confidence_score'] >= self.config.auto_confirm_threshold:
-                            # Auto-confirmar
-                            self._confirm_match(bank_transaction, best_match, reconciliation)
-                            matched_count += 1
-                            
-                        elif best_match['confidence_score'] >= self.config.pending_review_threshold:
-                            # Marcar para revisión manual
-                            self._create_pending_match(bank_transaction, best_match, reconciliation)
-                            pending_review_count += 1
-                            
-                        else:
-                            # Sin match suficiente
-                            unmatched_count += 1
-                            self._log_event(
-                                reconciliation,
-                                ReconciliationEventType.UNMATCHED,
-                                f"Transacción sin match suficiente: {bank_transaction.amount}",
-                                bank_transaction_id=bank_transaction.id,
-                                details={'confidence': best_match['confidence_score']}
-                            )
-                    else:
-                        # Sin matches encontrados
-                        unmatched_count += 1
-                        self._log_event(
-                            reconciliation,
-                            ReconciliationEventType.UNMATCHED,
-                            f"Transacción sin matches: {bank_transaction.amount}",
-                            bank_transaction_id=bank_transaction.id
-                        )
-                        
-                except Exception as e:
-                    error_count += 1
-                    self._log_event(
-                        reconciliation,
-                        ReconciliationEventType.ERROR,
-                        f"Error procesando transacción {bank_transaction.id}: {str(e)}",
-                        bank_transaction_id=bank_transaction.id
-                    )
+            # Carga del CSV (reanuda desde rows_processed si una ejecución anterior se cortó)
+            if reconciliation.ingested_at is None:
+                self.ingest_csv(reconciliation)
+            
+            # Propuestas por tramos de transacciones (candidatos por rango indexado) y
+            # asignación global: cada pago se concilia con una sola transacción
+            matcher = ReconciliationMatcher(self)
+            size = self._chunk_size()
+            proposals, best_scores = [], {}
+            chunk = []
+            rows = reconciliation.transactions.values_list('id', 'transaction_date', 'amount', 'currency')
+            for position, (tx_id, tx_date, amount, currency) in enumerate(rows.iterator(chunk_size=size)):
+                if amount < 0:
+                    continue
+                chunk.append((tx_id, position, tx_date, amount, currency))
+                if len(chunk) >= size:
+                    found, best = matcher.propose(chunk)
+                    proposals += found
+                    best_scores.update(best)
+                    chunk = []
+            found, best = matcher.propose(chunk)
+            proposals += found
+            best_scores.update(best)
+            assignment = matcher.assign(proposals)
+
+            # Escritura por tramos
+            counts = {'matched': 0, 'pending_review': 0, 'unmatched': 0, 'errors': 0}
+            batch = []
+            for bank_transaction in reconciliation.transactions.all().iterator(chunk_size=size):
+                batch.append(bank_transaction)
+                if len(batch) >= size:
+                    self._apply_assignment(reconciliation, batch, assignment, best_scores, counts)
+                    batch = []
+            self._apply_assignment(reconciliation, batch, assignment, best_scores, counts)
+            matched_count = counts['matched']
+            pending_review_count = counts['pending_review']
+            unmatched_count = counts['unmatched']
+            error_count = counts['errors']
             
             # Actualizar estadísticas
             reconciliation.matched_transactions = matched_count
@@ -249,6 +269,8 @@ class BankReconciliationService:
         except Exception as e:
             reconciliation.status = ReconciliationStatus.FAILED
             reconciliation.processing_notes = str(e)
+            if isinstance(e, CsvRowError):
+                reconciliation.error_details = {'row': e.row_num, 'error': e.messages[0]}
             reconciliation.save()
             
             self._log_event(
@@ -258,56 +280,153 @@ class BankReconciliationService:
             )
             raise
     
-    def _parse_csv(self, csv_file) -> List[Dict]:
-        """Parsea el archivo CSV bancario"""
-        try:
-            csv_file.seek(0)
-            content = csv_file.read().decode(self.config.csv_encoding)
-            csv_file.seek(0)
-            
-            return self._parse_csv_from_content(content)
-            
-        except Exception as e:
-            raise ValidationError(f"Error al parsear CSV: {str(e)}")
+    def _validate_csv_header(self, csv_file):
+        """Valida que el encabezado del CSV tenga las columnas configuradas (lee solo la primera línea)"""
+        csv_file.seek(0)
+        first_line = csv_file.readline()
+        csv_file.seek(0)
+        if isinstance(first_line, bytes):
+            first_line = first_line.decode(self.config.csv_encoding)
+        header = next(csv.reader([first_line.lstrip('\ufeff')], delimiter=self.config.csv_separator), [])
+        missing = [col for col in self.config.csv_columns if col not in header]
+        if missing:
+            raise ValidationError(f"Columnas no encontradas en el encabezado: {', '.join(missing)}")
     
-    def _parse_csv_from_content(self, content: str) -> List[Dict]:
-        """Parsea el contenido CSV desde string"""
-        try:
-            reader = csv.DictReader(io.StringIO(content), delimiter=self.config.csv_separator)
-            transactions = []
-            
-            for row_num, row in enumerate(reader, 1):
-                try:
-                    # Validar columnas requeridas
-                    required_columns = self.config.csv_columns
-                    for col in required_columns:
-                        if col not in row:
-                            raise ValidationError(f"Columna '{col}' no encontrada en fila {row_num}")
-                    
-                    # Parsear datos
-                    transaction_date = self._parse_date(row['fecha'])
-                    amount = self._parse_amount(row['importe'])
-                    currency = row.get('moneda', 'ARS')
-                    
-                    # Convertir moneda si es necesario
-                    if currency != self.config.default_currency:
-                        amount = self._convert_currency(amount, currency, transaction_date)
-                    
-                    transactions.append({
-                        'transaction_date': transaction_date,
-                        'description': row['descripcion'].strip(),
-                        'amount': amount,
-                        'currency': self.config.default_currency,
-                        'reference': row.get('referencia', '').strip()
-                    })
-                    
-                except Exception as e:
-                    raise ValidationError(f"Error en fila {row_num}: {str(e)}")
-            
-            return transactions
-            
-        except Exception as e:
-            raise ValidationError(f"Error al parsear CSV: {str(e)}")
+    def _iter_csv_rows(self, reconciliation: BankReconciliation) -> Iterator[Tuple[int, Dict, int]]:
+        """
+        Recorre el CSV guardado sin cargarlo entero: (número de fila, fila, bytes leídos).
+        Los bytes leídos son la posición del archivo (incluye el buffer de lectura).
+        """
+        with reconciliation.csv_file.open('rb') as raw:
+            text = io.TextIOWrapper(raw, encoding=self.config.csv_encoding, newline='')
+            try:
+                reader = csv.DictReader(text, delimiter=self.config.csv_separator)
+                if reader.fieldnames:
+                    reader.fieldnames = [reader.fieldnames[0].lstrip('\ufeff')] + list(reader.fieldnames[1:])
+                for row_num, row in enumerate(reader, 1):
+                    yield row_num, row, raw.tell()
+            finally:
+                text.detach()
+    
+    def _parse_row(self, row: Dict) -> Dict:
+        """Normaliza una fila del CSV a los campos de BankTransaction (sin la huella)"""
+        # Validar columnas requeridas
+        for col in self.config.csv_columns:
+            if col not in row:
+                raise ValidationError(f"Columna '{col}' no encontrada")
+        
+        # Parsear datos
+        transaction_date = self._parse_date(row['fecha'])
+        amount = self._parse_amount(row['importe'])
+        currency = (row.get('moneda') or 'ARS').strip().upper()
+        description = ' '.join((row.get('descripcion') or '').split())
+        reference = (row.get('referencia') or '').strip()
+        
+        # La huella se calcula sobre los valores originales (antes de convertir moneda)
+        key = '|'.join([transaction_date.isoformat(), str(amount), currency, description.lower(), reference.lower()])
+        
+        # Convertir moneda si es necesario
+        if currency != self.config.default_currency:
+            amount = self._convert_currency(amount, currency, transaction_date)
+        
+        return {
+            'transaction_date': transaction_date,
+            'description': description,
+            'amount': amount,
+            'currency': self.config.default_currency,
+            'reference': reference,
+            'key': key,
+        }
+    
+    def ingest_csv(self, reconciliation: BankReconciliation) -> BankReconciliation:
+        """
+        Carga las filas del CSV como BankTransaction en lotes de tamaño fijo.
+
+        - Cada fila se normaliza y se identifica con una huella estable (sha256 de los
+          campos normalizados + n° de aparición de esa fila en el día, para que dos
+          movimientos idénticos legítimos no se confundan)
+        - Las filas cuya huella ya existe en otro extracto del hotel se descartan como
+          duplicadas: volver a subir un extracto es idempotente
+        - Cada lote se inserta con bulk_create junto con el avance (rows_processed,
+          bytes_processed) en la misma transacción; un reintento salta las filas ya cargadas
+        - Un error de formato corta la carga y queda registrado con el número de fila
+        """
+        size = self._ingest_batch_size()
+        resume_from = reconciliation.rows_processed
+        # Apariciones por huella sólo del día en curso (el extracto viene ordenado por fecha):
+        # la memoria no crece con el archivo. Si un día reapareciera fuera de orden sus filas
+        # idénticas repetirían huella, lo que no rompe la deduplicación de re-subidas
+        occurrences: Dict[str, int] = {}
+        current_date = None
+        batch: List[Tuple[str, Dict]] = []
+        row_num, position = resume_from, reconciliation.bytes_processed
+        
+        for row_num, row, position in self._iter_csv_rows(reconciliation):
+            try:
+                data = self._parse_row(row)
+            except Exception as e:
+                raise CsvRowError(row_num, e)
+            
+            key = data.pop('key')
+            if data['transaction_date'] != current_date:
+                current_date = data['transaction_date']
+                occurrences = {}
+            occurrences[key] = occurrences.get(key, 0) + 1
+            if row_num <= resume_from:
+                continue
+            row_hash = hashlib.sha256(f"{key}|{occurrences[key]}".encode()).hexdigest()
+            batch.append((row_hash, data))
+            if len(batch) >= size:
+                self._flush_ingest_batch(reconciliation, batch, row_num, position)
+                batch = []
+        
+        self._flush_ingest_batch(reconciliation, batch, row_num, position)
+        reconciliation.ingested_at = timezone.now()
+        reconciliation.bytes_processed = reconciliation.csv_file_size
+        reconciliation.save(update_fields=['ingested_at', 'bytes_processed', 'updated_at'])
+        
+        self._log_event(
+            reconciliation,
+            ReconciliationEventType.CSV_UPLOADED,
+            f"CSV cargado: {reconciliation.total_transactions} transacciones, "
+            f"{reconciliation.duplicate_transactions} duplicadas",
+            details={
+                'rows': reconciliation.rows_processed,
+                'transactions': reconciliation.total_transactions,
+                'duplicates': reconciliation.duplicate_transactions,
+            }
+        )
+        return reconciliation
+    
+    def _flush_ingest_batch(self, reconciliation: BankReconciliation, batch: List[Tuple[str, Dict]],
+                            rows_processed: int, bytes_processed: int):
+        """Inserta un lote (descartando huellas ya cargadas en el hotel) y guarda el avance"""
+        hashes = [row_hash for row_hash, _ in batch]
+        existing = set()
+        if hashes:
+            existing = set(
+                BankTransaction.objects.filter(reconciliation__hotel_id=reconciliation.hotel_id, row_hash__in=hashes)
+                .exclude(reconciliation=reconciliation)
+                .values_list('row_hash', flat=True)
+            )
+        rows = [
+            BankTransaction(reconciliation=reconciliation, row_hash=row_hash, **data)
+            for row_hash, data in batch if row_hash not in existing
+        ]
+        duplicates = len(batch) - len(rows)
+        with transaction.atomic():
+            BankTransaction.objects.bulk_create(rows, batch_size=len(rows) or None)
+            BankReconciliation.objects.filter(pk=reconciliation.pk).update(
+                total_transactions=F('total_transactions') + len(rows),
+                duplicate_transactions=F('duplicate_transactions') + duplicates,
+                rows_processed=rows_processed,
+                bytes_processed=min(bytes_processed, reconciliation.csv_file_size),
+                updated_at=timezone.now(),
+            )
+        reconciliation.total_transactions += len(rows)
+        reconciliation.duplicate_transactions += duplicates
+        reconciliation.rows_processed = rows_processed
+        reconciliation.bytes_processed = min(bytes_processed, reconciliation.csv_file_size)
     
     def _parse_date(self, date_str: str) -> date:
         """Parsea una fecha desde string"""
@@ -344,108 +463,10 @@ class BankReconciliationService:
         
         return amount
     
-    def _create_bank_transactions(self, reconciliation: BankReconciliation, transactions_data: List[Dict]):
-        """Crea las transacciones bancarias en la base de datos"""
-        for data in transactions_data:
-            BankTransaction.objects.create(
-                reconciliation=reconciliation,
-                **data
-            )
-    
-    def _get_pending_payments(self) -> Dict[str, List]:
-        """Obtiene todos los pagos pendientes del hotel"""
-        # Obtener reservas del hotel
-        reservations = Reservation.objects.filter(hotel=self.hotel)
-        reservation_ids = reservations.values_list('id', flat=True)
-        
-        # Pagos manuales pendientes (Payment)
-        manual_payments = Payment.objects.filter(
-            reservation_id__in=reservation_ids
-        ).select_related('reservation')
-        
-        # PaymentIntents pendientes
-        payment_intents = PaymentIntent.objects.filter(
-            hotel=self.hotel,
-            status__in=['pending', 'created']
-        ).select_related('reservation')
-        
-        # BankTransferPayments pendientes
-        bank_transfers = BankTransferPayment.objects.filter(
-            hotel=self.hotel,
-            status__in=['uploaded', 'pending_review']
-        ).select_related('reservation')
-        
-        return {
-            'manual_payments': list(manual_payments),
-            'payment_intents': list(payment_intents),
-            'bank_transfers': list(bank_transfers)
-        }
-    
-    def _find_matches(self, bank_transaction: BankTransaction, pending_payments: Dict[str, List]) -> List[Dict]:
-        """Encuentra matches para una transacción bancaria"""
-        matches = []
-        
-        # Buscar en pagos manuales
-        for payment in pending_payments['manual_payments']:
-            match = self._calculate_match(bank_transaction, payment, 'payment')
-            if match:
-                matches.append(match)
-        
-        # Buscar en PaymentIntents
-        for payment_intent in pending_payments['payment_intents']:
-            match = self._calculate_match(bank_transaction, payment_intent, 'payment_intent')
-            if match:
-                matches.append(match)
-        
-        # Buscar en BankTransferPayments
-        for bank_transfer in pending_payments['bank_transfers']:
-            match = self._calculate_match(bank_transaction, bank_transfer, 'bank_transfer')
-            if match:
-                matches.append(match)
-        
-        return matches
-    
-    def _calculate_match(self, bank_transaction: BankTransaction, payment, payment_type: str) -> Optional[Dict]:
-        """Calcula el match entre una transacción bancaria y un pago"""
-        # Obtener datos del pago
-        if payment_type == 'payment':
-            payment_amount = payment.amount
-            payment_date = payment.date
-            payment_id = payment.id
-            reservation_id = payment.reservation_id
-        elif payment_type == 'payment_intent':
-            payment_amount = payment.amount
-            payment_date = payment.created_at.date()
-            payment_id = payment.id
-            reservation_id = payment.reservation_id
-        elif payment_type == 'bank_transfer':
-            payment_amount = payment.amount
-            payment_date = payment.transfer_date
-            payment_id = payment.id
-            reservation_id = payment.reservation_id
-        else:
-            return None
-        
-        # Calcular diferencias
-        amount_diff = abs(bank_transaction.amount - payment_amount)
-        date_diff = abs((bank_transaction.transaction_date - payment_date).days)
-        
-        # Verificar tolerancias y calcular confianza
-        confidence = self._calculate_confidence(amount_diff, date_diff, payment_amount)
-        
-        if confidence > 0:
-            return {
-                'payment_id': payment_id,
-                'payment_type': payment_type,
-                'reservation_id': reservation_id,
-                'confidence_score': confidence,
-                'amount_difference': amount_diff,
-                'date_difference_days': date_diff,
-                'match_type': self._get_match_type(amount_diff, date_diff, payment_amount)
-            }
-        
-        return None
-    
+    def _amount_tolerance(self, payment_amount: Decimal, percent: float) -> Decimal:
+        """Tolerancia de monto (el porcentaje de la config es float)"""
+        return payment_amount * Decimal(str(percent)) / 100
+
     def _calculate_confidence(self, amount_diff: Decimal, date_diff: int, payment_amount: Decimal) -> float:
         """Calcula la confianza del match basado en tolerancias"""
         # Match exacto
@@ -453,19 +474,19 @@ class BankReconciliationService:
             return 100.0
         
         # Match fuzzy
-        amount_tolerance = payment_amount * (self.config.fuzzy_match_amount_tolerance_percent / 100)
-        if (amount_diff <= amount_tolerance and date_diff <= self.config.fuzzy_match_date_tolerance):
+        amount_tolerance = self._amount_tolerance(payment_amount, self.config.fuzzy_match_amount_tolerance_percent)
+        if (amount_tolerance > 0 and amount_diff <= amount_tolerance and date_diff <= self.config.fuzzy_match_date_tolerance):
             # Calcular confianza basada en proximidad
-            amount_score = max(0, 100 - (amount_diff / amount_tolerance) * 20)
-            date_score = max(0, 100 - (date_diff / self.config.fuzzy_match_date_tolerance) * 20)
+            amount_score = max(0.0, 100 - float(amount_diff / amount_tolerance) * 20)
+            date_score = max(0.0, 100 - (date_diff / (self.config.fuzzy_match_date_tolerance or 1)) * 20)
             return (amount_score + date_score) / 2
         
         # Match parcial
-        amount_tolerance = payment_amount * (self.config.partial_match_amount_tolerance_percent / 100)
-        if (amount_diff <= amount_tolerance and date_diff <= self.config.partial_match_date_tolerance):
+        amount_tolerance = self._amount_tolerance(payment_amount, self.config.partial_match_amount_tolerance_percent)
+        if (amount_tolerance > 0 and amount_diff <= amount_tolerance and date_diff <= self.config.partial_match_date_tolerance):
             # Calcular confianza más baja
-            amount_score = max(0, 60 - (amount_diff / amount_tolerance) * 30)
-            date_score = max(0, 60 - (date_diff / self.config.partial_match_date_tolerance) * 30)
+            amount_score = max(0.0, 60 - float(amount_diff / amount_tolerance) * 30)
+            date_score = max(0.0, 60 - (date_diff / (self.config.partial_match_date_tolerance or 1)) * 30)
             return (amount_score + date_score) / 2
         
         return 0.0
@@ -475,93 +496,126 @@ class BankReconciliationService:
         if amount_diff == 0 and date_diff <= self.config.exact_match_date_tolerance:
             return MatchType.EXACT
         
-        amount_tolerance = payment_amount * (self.config.fuzzy_match_amount_tolerance_percent / 100)
+        amount_tolerance = self._amount_tolerance(payment_amount, self.config.fuzzy_match_amount_tolerance_percent)
         if amount_diff <= amount_tolerance and date_diff <= self.config.fuzzy_match_date_tolerance:
             return MatchType.FUZZY
         
         return MatchType.PARTIAL
     
-    def _confirm_match(self, bank_transaction: BankTransaction, match: Dict, reconciliation: BankReconciliation):
-        """Confirma un match automáticamente"""
-        with transaction.atomic():
-            # Crear el match
-            reconciliation_match = ReconciliationMatch.objects.create(
-                reconciliation=reconciliation,
-                bank_transaction=bank_transaction,
-                payment_id=match['payment_id'],
-                payment_type=match['payment_type'],
-                reservation_id=match['reservation_id'],
-                match_type=match['match_type'],
-                confidence_score=match['confidence_score'],
-                amount_difference=match['amount_difference'],
-                date_difference_days=match['date_difference_days'],
-                is_confirmed=True
-            )
-            
-            # Actualizar transacción bancaria
-            bank_transaction.is_matched = True
-            bank_transaction.match_confidence = match['confidence_score']
-            bank_transaction.match_type = match['match_type']
-            bank_transaction.matched_payment_id = match['payment_id']
-            bank_transaction.matched_payment_type = match['payment_type']
-            bank_transaction.matched_reservation_id = match['reservation_id']
-            bank_transaction.amount_difference = match['amount_difference']
-            bank_transaction.date_difference_days = match['date_difference_days']
-            bank_transaction.save()
-            
-            # Confirmar el pago si es necesario
-            self._confirm_payment(match['payment_id'], match['payment_type'])
-            
-            # Log del evento
-            self._log_event(
-                reconciliation,
-                ReconciliationEventType.AUTO_MATCHED,
-                f"Match automático confirmado: {bank_transaction.amount}",
-                bank_transaction_id=bank_transaction.id,
-                payment_id=match['payment_id'],
-                payment_type=match['payment_type'],
-                reservation_id=match['reservation_id'],
-                confidence_score=match['confidence_score']
-            )
-    
-    def _create_pending_match(self, bank_transaction: BankTransaction, match: Dict, reconciliation: BankReconciliation):
-        """Crea un match pendiente de revisión manual"""
+    def _chunk_size(self) -> int:
+        return max(int(getattr(settings, 'BANK_RECONCILIATION_CHUNK_SIZE', 1000)), 1)
+
+    def _ingest_batch_size(self) -> int:
+        return max(int(getattr(settings, 'BANK_RECONCILIATION_INGEST_BATCH_SIZE', 2000)), 1)
+
+    def _apply_assignment(self, reconciliation: BankReconciliation, transactions: List[BankTransaction],
+                          assignment: Dict, best_scores: Dict[int, float], counts: Dict[str, int]):
+        """Persiste matches, reversiones y logs de un tramo de transacciones con escrituras bulk"""
+        if not transactions:
+            return
+        now = timezone.now()
+        matches, logs, to_update, approved_intents = [], [], [], []
         with transaction.atomic():
-            # Crear el match
-            reconciliation_match = ReconciliationMatch.objects.create(
-                reconciliation=reconciliation,
-                bank_transaction=bank_transaction,
-                payment_id=match['payment_id'],
-                payment_type=match['payment_type'],
-                reservation_id=match['reservation_id'],
-                match_type=match['match_type'],
-                confidence_score=match['confidence_score'],
-                amount_difference=match['amount_difference'],
-                date_difference_days=match['date_difference_days'],
-                is_confirmed=False
-            )
-            
-            # Actualizar transacción bancaria
-            bank_transaction.match_confidence = match['confidence_score']
-            bank_transaction.match_type = match['match_type']
-            bank_transaction.matched_payment_id = match['payment_id']
-            bank_transaction.matched_payment_type = match['payment_type']
-            bank_transaction.matched_reservation_id = match['reservation_id']
-            bank_transaction.amount_difference = match['amount_difference']
-            bank_transaction.date_difference_days = match['date_difference_days']
-            bank_transaction.save()
-            
-            # Log del evento
-            self._log_event(
-                reconciliation,
-                ReconciliationEventType.PENDING_REVIEW,
-                f"Match pendiente de revisión: {bank_transaction.amount}",
-                bank_transaction_id=bank_transaction.id,
-                payment_id=match['payment_id'],
-                payment_type=match['payment_type'],
-                reservation_id=match['reservation_id'],
-                confidence_score=match['confidence_score']
-            )
+            for bank_transaction in transactions:
+                # Detectar reversiones
+                if bank_transaction.amount < 0:
+                    bank_transaction.is_reversal = True
+                    to_update.append(bank_transaction)
+                    # TODO: Crear Refund asociado
+                    logs.append(self._log_entry(
+                        reconciliation,
+                        ReconciliationEventType.REVERSAL_DETECTED,
+                        f"Reversión detectada: {bank_transaction.amount}",
+                        bank_transaction_id=bank_transaction.id
+                    ))
+                    continue
+
+                proposal = assignment.get(bank_transaction.id)
+                if proposal is None:
+                    counts['unmatched'] += 1
+                    if bank_transaction.id in best_scores:
+                        logs.append(self._log_entry(
+                            reconciliation,
+                            ReconciliationEventType.UNMATCHED,
+                            f"Transacción sin match suficiente: {bank_transaction.amount}",
+                            bank_transaction_id=bank_transaction.id,
+                            details={'confidence': best_scores[bank_transaction.id]}
+                        ))
+                    else:
+                        logs.append(self._log_entry(
+                            reconciliation,
+                            ReconciliationEventType.UNMATCHED,
+                            f"Transacción sin matches: {bank_transaction.amount}",
+                            bank_transaction_id=bank_transaction.id
+                        ))
+                    continue
+
+                match = proposal.as_match()
+                confirmed = match['confidence_score'] >= self.config.auto_confirm_threshold
+                if confirmed and match['payment_type'] == 'bank_transfer':
+                    # Confirmar la transferencia crea el Payment asociado: una por vez
+                    try:
+                        with transaction.atomic():
+                            self._confirm_payment(match['payment_id'], match['payment_type'])
+                    except Exception as e:
+                        counts['errors'] += 1
+                        logs.append(self._log_entry(
+                            reconciliation,
+                            ReconciliationEventType.ERROR,
+                            f"Error procesando transacción {bank_transaction.id}: {str(e)}",
+                            bank_transaction_id=bank_transaction.id
+                        ))
+                        continue
+                elif confirmed and match['payment_type'] == 'payment_intent':
+                    approved_intents.append(match['payment_id'])
+
+                bank_transaction.is_matched = confirmed
+                bank_transaction.match_confidence = match['confidence_score']
+                bank_transaction.match_type = match['match_type']
+                bank_transaction.matched_payment_id = match['payment_id']
+                bank_transaction.matched_payment_type = match['payment_type']
+                bank_transaction.matched_reservation_id = match['reservation_id']
+                bank_transaction.amount_difference = match['amount_difference']
+                bank_transaction.date_difference_days = match['date_difference_days']
+                to_update.append(bank_transaction)
+                matches.append(ReconciliationMatch(
+                    reconciliation=reconciliation,
+                    bank_transaction=bank_transaction,
+                    payment_id=match['payment_id'],
+                    payment_type=match['payment_type'],
+                    reservation_id=match['reservation_id'],
+                    match_type=match['match_type'],
+                    confidence_score=match['confidence_score'],
+                    amount_difference=match['amount_difference'],
+                    date_difference_days=match['date_difference_days'],
+                    is_confirmed=confirmed
+                ))
+                if confirmed:
+                    counts['matched'] += 1
+                    event_type = ReconciliationEventType.AUTO_MATCHED
+                    description = f"Match automático confirmado: {bank_transaction.amount}"
+                else:
+                    counts['pending_review'] += 1
+                    event_type = ReconciliationEventType.PENDING_REVIEW
+                    description = f"Match pendiente de revisión: {bank_transaction.amount}"
+                logs.append(self._log_entry(
+                    reconciliation,
+                    event_type,
+                    description,
+                    bank_transaction_id=bank_transaction.id,
+                    payment_id=match['payment_id'],
+                    payment_type=match['payment_type'],
+                    reservation_id=match['reservation_id'],
+                    confidence_score=match['confidence_score']
+                ))
+
+            for bank_transaction in to_update:
+                bank_transaction.updated_at = now
+            ReconciliationMatch.objects.bulk_create(matches, ignore_conflicts=True)
+            BankTransaction.objects.bulk_update(to_update, TRANSACTION_MATCH_FIELDS)
+            if approved_intents:
+                PaymentIntent.objects.filter(id__in=approved_intents).update(status='approved', updated_at=now)
+            BankReconciliationLog.objects.bulk_create(logs)
     
     def _confirm_payment(self, payment_id: int, payment_type: str):
         """Confirma un pago según su tipo"""
@@ -574,43 +628,35 @@ class BankReconciliationService:
             bank_transfer = BankTransferPayment.objects.get(id=payment_id)
             bank_transfer.mark_as_confirmed()
     
-    def _handle_reversal(self, bank_transaction: BankTransaction, reconciliation: BankReconciliation):
-        """Maneja una reversión (monto negativo)"""
-        bank_transaction.is_reversal = True
-        bank_transaction.save()
-        
-        # TODO: Crear Refund asociado
-        # Por ahora solo logueamos el evento
-        
-        self._log_event(
-            reconciliation,
-            ReconciliationEventType.REVERSAL_DETECTED,
-            f"Reversión detectada: {bank_transaction.amount}",
-            bank_transaction_id=bank_transaction.id
-        )
-    
     def _send_notifications(self, reconciliation: BankReconciliation):
         """Envía notificaciones si es necesario"""
         if not self.config.email_notifications:
             return
         
         # Verificar si hay muchos pagos sin conciliar
+        if not reconciliation.total_transactions:
+            return
         unmatched_percentage = (reconciliation.unmatched_transactions / reconciliation.total_transactions) * 100
         
         if unmatched_percentage > self.config.notification_threshold_percent:
             # TODO: Enviar email de notificación
             pass
     
-    def _log_event(self, reconciliation: BankReconciliation, event_type: ReconciliationEventType, 
-                   description: str, created_by=None, **kwargs):
-        """Crea un log de auditoría"""
+    def _log_entry(self, reconciliation: BankReconciliation, event_type: ReconciliationEventType,
+                   description: str, created_by=None, **kwargs) -> BankReconciliationLog:
+        """Log de auditoría sin guardar (para bulk_create)"""
         log_kwargs = dict(kwargs)
         if 'csv_filename' not in log_kwargs:
             log_kwargs['csv_filename'] = reconciliation.csv_filename
-        BankReconciliationLog.objects.create(
+        return BankReconciliationLog(
             reconciliation=reconciliation,
             event_type=event_type,
             event_description=description,
             created_by=created_by,
             **log_kwargs
         )
+
+    def _log_event(self, reconciliation: BankReconciliation, event_type: ReconciliationEventType, 
+                   description: str, created_by=None, **kwargs):
+        """Crea un log de auditoría"""
+        self._log_entry(reconciliation, event_type, description, created_by=created_by, **kwargs).save()
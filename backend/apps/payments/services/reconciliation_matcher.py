@@ -0,0 +1,212 @@
+"""
+Motor de matching de la conciliación bancaria.
+
+Antes process_reconciliation cargaba todos los pagos del hotel y puntuaba cada
+transacción contra cada pago (O(transacciones × pagos)). El motor:
+
+- recorre las transacciones del extracto por fecha en tramos acotados
+- por tramo trae solo los candidatos dentro de la banda de montos y la ventana de
+  fechas que admiten las tolerancias, con consultas por rango sobre columnas indexadas
+- indexa los candidatos por moneda y monto (bisect) y puntúa solo los que caen en la
+  banda de cada transacción
+- resuelve conflictos con una asignación global: las propuestas (transacción, pago)
+  se aceptan de mayor a menor confianza y cada pago se usa una sola vez
+
+La memoria depende del tramo y de las propuestas que superan el umbral de revisión,
+no del total de pagos del hotel.
+"""
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Tuple
+
+from django.utils import timezone
+
+from apps.reservations.models import Payment
+
+from ..models import BankTransferPayment, PaymentIntent
+
+# Orden de recorrido de los tipos (desempate igual que el recorrido anterior)
+PAYMENT_TYPES = ("payment", "payment_intent", "bank_transfer")
+PENDING_INTENT_STATUSES = ("pending", "created")
+PENDING_TRANSFER_STATUSES = ("uploaded", "pending_review")
+
+CandidateKey = Tuple[str, int]
+
+
+@dataclass
+class Candidate:
+    payment_type: str
+    payment_id: int
+    reservation_id: int
+    amount: Decimal
+    date: date
+    currency: str
+    rank: tuple
+
+    @property
+    def key(self) -> CandidateKey:
+        return (self.payment_type, self.payment_id)
+
+
+@dataclass
+class Proposal:
+    """Match propuesto para una transacción (puntuado, todavía sin asignar)."""
+    transaction_id: int
+    position: int
+    candidate: Candidate
+    confidence_score: float
+    amount_difference: Decimal
+    date_difference_days: int
+    match_type: str
+
+    def as_match(self) -> Dict:
+        return {
+            "payment_id": self.candidate.payment_id,
+            "payment_type": self.candidate.payment_type,
+            "reservation_id": self.candidate.reservation_id,
+            "confidence_score": self.confidence_score,
+            "amount_difference": self.amount_difference,
+            "date_difference_days": self.date_difference_days,
+            "match_type": self.match_type,
+        }
+
+
+class CandidateIndex:
+    """Candidatos de un tramo agrupados por moneda y ordenados por monto."""
+
+    def __init__(self, candidates: Iterable[Candidate]):
+        by_currency: Dict[str, List[Candidate]] = defaultdict(list)
+        for c in candidates:
+            by_currency[c.currency].append(c)
+        self._rows: Dict[str, List[Candidate]] = {}
+        self._amounts: Dict[str, List[Decimal]] = {}
+        for currency, rows in by_currency.items():
+            rows.sort(key=lambda c: (c.amount, c.rank))
+            self._rows[currency] = rows
+            self._amounts[currency] = [c.amount for c in rows]
+
+    def within(self, currency: str, low: Decimal, high: Decimal) -> List[Candidate]:
+        amounts = self._amounts.get(currency)
+        if not amounts:
+            return []
+        rows = self._rows[currency]
+        return rows[bisect_left(amounts, low):bisect_right(amounts, high)]
+
+
+class ReconciliationMatcher:
+    """Propuestas por transacción y asignación global para un BankReconciliationService."""
+
+    def __init__(self, service):
+        self.service = service
+        self.config = service.config
+        self.hotel = service.hotel
+        pct = max(self.config.fuzzy_match_amount_tolerance_percent, self.config.partial_match_amount_tolerance_percent)
+        self.max_pct = Decimal(str(pct)) / 100
+        self.date_window = max(
+            self.config.exact_match_date_tolerance,
+            self.config.fuzzy_match_date_tolerance,
+            self.config.partial_match_date_tolerance,
+        )
+
+    # ---- banda de candidatos ----
+    def amount_band(self, amount: Decimal) -> Tuple[Decimal, Decimal]:
+        """Montos de pago P que cumplen |amount - P| <= P * tolerancia máxima."""
+        low = amount / (1 + self.max_pct)
+        high = amount / (1 - self.max_pct) if self.max_pct < 1 else amount * 1000
+        return low.quantize(Decimal("0.01")) - Decimal("0.01"), high.quantize(Decimal("0.01")) + Decimal("0.01")
+
+    def load_candidates(self, date_from: date, date_to: date, amount_low: Decimal, amount_high: Decimal) -> List[Candidate]:
+        """Pagos, intents y transferencias del hotel dentro de la ventana (tres consultas por rango)."""
+        default_currency = self.config.default_currency
+        start = date_from - timedelta(days=self.date_window)
+        end = date_to + timedelta(days=self.date_window)
+        candidates: List[Candidate] = []
+
+        payments = Payment.objects.filter(
+            reservation__hotel=self.hotel,
+            date__range=(start, end),
+            amount__range=(amount_low, amount_high),
+        ).values_list("id", "reservation_id", "amount", "date", "currency")
+        for pk, reservation_id, amount, day, currency in payments:
+            candidates.append(Candidate("payment", pk, reservation_id, amount, day, currency or default_currency, (0, pk)))
+
+        # created_at es datetime: margen de un día para cubrir el corrimiento de zona horaria
+        tz = timezone.get_current_timezone()
+        intents = PaymentIntent.objects.filter(
+            hotel=self.hotel,
+            status__in=PENDING_INTENT_STATUSES,
+            amount__range=(amount_low, amount_high),
+            created_at__gte=timezone.make_aware(datetime.combine(start - timedelta(days=1), time.min), tz),
+            created_at__lt=timezone.make_aware(datetime.combine(end + timedelta(days=2), time.min), tz),
+        ).values_list("id", "reservation_id", "amount", "created_at", "currency")
+        for pk, reservation_id, amount, created_at, currency in intents:
+            candidates.append(Candidate(
+                "payment_intent", pk, reservation_id, amount, created_at.date(), currency or default_currency, (1, pk),
+            ))
+
+        transfers = BankTransferPayment.objects.filter(
+            hotel=self.hotel,
+            status__in=PENDING_TRANSFER_STATUSES,
+            transfer_date__range=(start, end),
+            amount__range=(amount_low, amount_high),
+        ).values_list("id", "reservation_id", "amount", "transfer_date", "created_at")
+        for pk, reservation_id, amount, day, created_at in transfers:
+            # Las transferencias se recorrían por -created_at (ordering del modelo)
+            rank = (2, -created_at.timestamp(), -pk)
+            candidates.append(Candidate("bank_transfer", pk, reservation_id, amount, day, default_currency, rank))
+        return candidates
+
+    # ---- propuestas ----
+    def propose(self, chunk: List[Tuple[int, int, date, Decimal, str]]) -> Tuple[List[Proposal], Dict[int, float]]:
+        """
+        chunk: [(transaction_id, posición, fecha, monto, moneda)] con montos positivos.
+        Devuelve las propuestas que superan el umbral de revisión y la mejor confianza
+        de cada transacción (para el log de las que quedan sin match).
+        """
+        if not chunk:
+            return [], {}
+        bands = {tx_id: self.amount_band(amount) for tx_id, _, _, amount, _ in chunk}
+        index = CandidateIndex(self.load_candidates(
+            min(row[2] for row in chunk),
+            max(row[2] for row in chunk),
+            min(b[0] for b in bands.values()),
+            max(b[1] for b in bands.values()),
+        ))
+        threshold = self.config.pending_review_threshold
+        proposals: List[Proposal] = []
+        best: Dict[int, float] = {}
+        for tx_id, position, tx_date, amount, currency in chunk:
+            low, high = bands[tx_id]
+            for c in index.within(currency, low, high):
+                date_diff = abs((tx_date - c.date).days)
+                if date_diff > self.date_window:
+                    continue
+                amount_diff = abs(amount - c.amount)
+                confidence = self.service._calculate_confidence(amount_diff, date_diff, c.amount)
+                if confidence <= 0:
+                    continue
+                best[tx_id] = max(best.get(tx_id, 0.0), confidence)
+                if confidence >= threshold:
+                    proposals.append(Proposal(
+                        tx_id, position, c, confidence, amount_diff, date_diff,
+                        self.service._get_match_type(amount_diff, date_diff, c.amount),
+                    ))
+        return proposals, best
+
+    @staticmethod
+    def assign(proposals: List[Proposal]) -> Dict[int, Proposal]:
+        """Asignación global: mayor confianza primero, una transacción y un pago por match."""
+        ordered = sorted(proposals, key=lambda p: (-p.confidence_score, p.position, p.candidate.rank))
+        assigned: Dict[int, Proposal] = {}
+        used = set()
+        for p in ordered:
+            if p.transaction_id in assigned or p.candidate.key in used:
+                continue
+            assigned[p.transaction_id] = p
+            used.add(p.candidate.key)
+        return assigned
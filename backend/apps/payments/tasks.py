@@ -18,7 +18,7 @@ from django.core.mail import EmailMessage
 from .models import Refund, RefundStatus, PaymentGatewayConfig, PaymentIntent, BankReconciliation
 from apps.reservations.models import Payment
 from .services.refund_processor_v2 import RefundProcessorV2
-from .services.bank_reconciliation import BankReconciliationService
+from .services.bank_reconciliation import BankReconciliationService, CsvRowError
 from .services.pdf_generator import ModernPDFGenerator
 from apps.notifications.services import NotificationService
 
@@ -996,6 +996,11 @@ def process_bank_reconciliation(self, reconciliation_id: int):
         logger.error(f"Conciliación {reconciliation_id} no encontrada")
         return {'status': 'error', 'message': 'Conciliación no encontrada'}
         
+    except CsvRowError as e:
+        # Error de formato en el extracto: reintentar no cambia el resultado
+        logger.error(f"CSV inválido en conciliación {reconciliation_id}: {e.messages[0]}")
+        return {'status': 'error', 'reconciliation_id': reconciliation_id, 'message': e.messages[0]}
+        
     except Exception as e:
         logger.error(f"Error procesando conciliación {reconciliation_id}: {str(e)}")
         raise self.retry(exc=e)
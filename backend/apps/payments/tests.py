@@ -0,0 +1,352 @@
+import base64
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.db import OperationalError, connection, transaction
+from django.core.exceptions import ValidationError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.core.models import Currency, Hotel
+from apps.rooms.models import Room
+from apps.reservations.models import Payment, Reservation, ReservationStatus
+from apps.payments.models import (
+    BankReconciliation,
+    BankReconciliationLog,
+    BankTransaction,
+    MatchType,
+    PaymentIntent,
+    ReceiptNumberBlocks,
+    ReceiptNumberSequence,
+    ReconciliationEventType,
+    ReconciliationMatch,
+    ReconciliationStatus,
+)
+from apps.payments.services.bank_reconciliation import BankReconciliationService
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class BankReconciliationMatcherTest(TestCase):
+    def setUp(self):
+        self.currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel Banco", email="banco@hotel.com")
+        self.room = Room.objects.create(
+            name="B-1", hotel=self.hotel, floor="1", room_type="double", number=501,
+            base_price=Decimal("100.00"), base_currency=self.currency, capacity=2, max_capacity=2,
+        )
+        self.today = timezone.now().date()
+        self.service = BankReconciliationService(self.hotel)
+        self._n = 0
+
+    def _reservation(self):
+        self._n += 1
+        check_in = self.today + timedelta(days=10 + 3 * self._n)
+        return Reservation.objects.create(
+            hotel=self.hotel, room=self.room, check_in=check_in, check_out=check_in + timedelta(days=2),
+            guests_data=[{"name": f"Cliente {self._n}", "email": f"c{self._n}@x.com", "is_primary": True}],
+            status=ReservationStatus.CONFIRMED,
+        )
+
+    def _payment(self, amount, days=0):
+        return Payment.objects.create(
+            reservation=self._reservation(), date=self.today + timedelta(days=days), method="transfer", amount=Decimal(amount),
+        )
+
+    def _reconciliation(self, rows):
+        reconciliation = BankReconciliation.objects.create(
+            hotel=self.hotel, reconciliation_date=self.today, csv_file="extracto.csv",
+            csv_filename="extracto.csv", csv_file_size=1, total_transactions=len(rows), ingested_at=timezone.now(),
+        )
+        for amount, days in rows:
+            BankTransaction.objects.create(
+                reconciliation=reconciliation, transaction_date=self.today + timedelta(days=days),
+                description="mov", amount=Decimal(amount),
+            )
+        return reconciliation
+
+    def _tx(self, reconciliation, amount):
+        return BankTransaction.objects.get(reconciliation=reconciliation, amount=Decimal(amount))
+
+    def test_global_assignment_fuzzy_review_and_reversals(self):
+        exact = self._payment("1000.00")
+        near = self._payment("1003.00", days=1)
+        self._payment("50.00")  # fuera de banda: no es candidato
+        intent = PaymentIntent.objects.create(
+            reservation=self._reservation(), hotel=self.hotel, amount=Decimal("500.00"), status="pending",
+        )
+        reconciliation = self._reconciliation([
+            ("1000.00", 0), ("1000.00", 1), ("498.50", 2), ("-200.00", 0), ("12345.00", 0),
+        ])
+
+        result = self.service.process_reconciliation(reconciliation.id)
+        self.assertEqual(
+            (result.matched_transactions, result.pending_review_transactions, result.unmatched_transactions, result.error_transactions),
+            (2, 1, 1, 0),
+        )
+
+        # Las dos transacciones de 1000 coinciden exacto con el mismo pago: se usa una sola vez
+        first, second = BankTransaction.objects.filter(reconciliation=reconciliation, amount=Decimal("1000.00"))
+        self.assertEqual((first.matched_payment_id, first.match_type, first.is_matched), (exact.id, MatchType.EXACT, True))
+        self.assertEqual((second.matched_payment_id, second.match_type, second.is_matched), (near.id, MatchType.FUZZY, True))
+        self.assertGreater(second.match_confidence, 90)
+
+        review = self._tx(reconciliation, "498.50")
+        self.assertEqual((review.matched_payment_type, review.matched_payment_id, review.is_matched), ("payment_intent", intent.id, False))
+        intent.refresh_from_db()
+        self.assertEqual(intent.status, "pending")
+
+        self.assertTrue(self._tx(reconciliation, "-200.00").is_reversal)
+        self.assertEqual(ReconciliationMatch.objects.filter(reconciliation=reconciliation).count(), 3)
+        events = list(BankReconciliationLog.objects.filter(reconciliation=reconciliation).values_list("event_type", flat=True))
+        for event in (ReconciliationEventType.AUTO_MATCHED, ReconciliationEventType.PENDING_REVIEW,
+                      ReconciliationEventType.REVERSAL_DETECTED, ReconciliationEventType.UNMATCHED):
+            self.assertIn(event, events)
+
+    def test_query_count_does_not_grow_with_statement_size(self):
+        def run(n):
+            rows = []
+            for i in range(n):
+                amount = f"{1000 + 37 * i}.00"
+                self._payment(amount)
+                rows.append((amount, 0))
+            reconciliation = self._reconciliation(rows)
+            with CaptureQueriesContext(connection) as ctx:
+                result = self.service.process_reconciliation(reconciliation.id)
+            self.assertEqual(result.matched_transactions, n)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(run(3), run(12))
+
+    @override_settings(BANK_RECONCILIATION_CHUNK_SIZE=2)
+    def test_chunks_keep_assignment_global(self):
+        payment = self._payment("800.00")
+        reconciliation = self._reconciliation([("800.00", 0), ("800.00", 1), ("800.00", 1)])
+        result = self.service.process_reconciliation(reconciliation.id)
+        self.assertEqual((result.matched_transactions, result.unmatched_transactions), (1, 2))
+        self.assertEqual(
+            list(BankTransaction.objects.filter(reconciliation=reconciliation, is_matched=True).values_list("matched_payment_id", flat=True)),
+            [payment.id],
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHE, BANK_RECONCILIATION_INGEST_BATCH_SIZE=2)
+class BankStatementIngestTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.hotel = Hotel.objects.create(name="Hotel Extracto", email="extracto@hotel.com")
+        self.service = BankReconciliationService(self.hotel)
+        self.today = timezone.now().date()
+
+    def _csv(self, rows):
+        lines = ["fecha,descripcion,importe,moneda,referencia"] + rows
+        return ("\n".join(lines) + "\n").encode()
+
+    def _upload(self, content):
+        return self.service.create_reconciliation_from_base64(
+            csv_file_base64="data:text/csv;base64," + base64.b64encode(content).decode(),
+            csv_filename="extracto.csv", reconciliation_date=self.today,
+        )
+
+    def test_streaming_ingest_batches_progress_and_idempotent_reupload(self):
+        content = self._csv([
+            "2024-05-01,Transferencia  Juan,1000.00,ARS,T1",
+            "2024-05-01,Transferencia Juan,1000.00,ARS,T1",  # mismo movimiento dos veces en el día
+            "2024-05-02,Deposito,250.50,ARS,",
+            "2024-05-03,Comision,-30.00,ARS,C9",
+            "2024-05-03,Tarjeta,99.90,ARS,",
+        ])
+        first = self._upload(content)
+        # La subida solo guarda el archivo: la carga corre en el procesamiento
+        self.assertEqual((first.total_transactions, first.ingested_at, first.csv_file_size), (0, None, len(content)))
+        self.assertFalse(BankTransaction.objects.filter(reconciliation=first).exists())
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.service.ingest_csv(first)
+        inserts = [q for q in ctx.captured_queries if q["sql"].startswith('INSERT INTO "payments_banktransaction"')]
+        self.assertEqual(len(inserts), 3)  # 5 filas en lotes de 2
+
+        first.refresh_from_db()
+        self.assertEqual((first.total_transactions, first.rows_processed, first.duplicate_transactions), (5, 5, 0))
+        self.assertEqual((first.bytes_processed, first.ingest_percentage), (len(content), 100.0))
+        hashes = list(BankTransaction.objects.filter(reconciliation=first).values_list("row_hash", flat=True))
+        self.assertEqual(len(set(hashes)), 5)
+        self.assertEqual(BankTransaction.objects.filter(reconciliation=first, description="Transferencia Juan").count(), 2)
+
+        # Re-subir el mismo extracto (con una fila nueva) solo carga lo nuevo
+        second = self._upload(content + b"2024-05-04,Nueva,10.00,ARS,\n")
+        second = self.service.process_reconciliation(second.id)
+        self.assertEqual(second.status, ReconciliationStatus.COMPLETED)
+        self.assertEqual((second.total_transactions, second.duplicate_transactions), (1, 5))
+        self.assertEqual(list(second.transactions.values_list("description", flat=True)), ["Nueva"])
+
+    def test_unsorted_statement_and_wrapped_base64(self):
+        content = self._csv([
+            "2024-07-01,Transferencia,500.00,ARS,T7",
+            "2024-07-02,Deposito,80.00,ARS,",
+            "2024-07-01,Transferencia,500.00,ARS,T7",  # mismo movimiento, fuera de orden
+        ] + [f"2024-07-03,Movimiento {i},{i}.00,ARS," for i in range(40)])
+        # base64 partido en líneas de 76 (MIME) más allá del primer KB y bloques chicos que cortan líneas
+        encoded = base64.encodebytes(content).decode()
+        self.assertGreater(len(encoded), 2048)
+        with mock.patch("apps.payments.services.bank_reconciliation.BASE64_BLOCK_CHARS", 10):
+            reconciliation = self.service.create_reconciliation_from_base64(
+                csv_file_base64=encoded, csv_filename="extracto.csv", reconciliation_date=self.today,
+            )
+        self.assertEqual(reconciliation.csv_file_size, len(content))
+
+        self.service.ingest_csv(reconciliation)
+        reconciliation.refresh_from_db()
+        self.assertEqual((reconciliation.total_transactions, reconciliation.duplicate_transactions), (43, 0))
+        self.assertEqual(reconciliation.transactions.filter(description="Transferencia").count(), 2)
+
+        with self.assertRaises(ValidationError):
+            self.service.create_reconciliation_from_base64(
+                csv_file_base64=encoded.replace("A", "*", 1), csv_filename="roto.csv", reconciliation_date=self.today,
+            )
+
+    def test_resume_and_row_errors(self):
+        reconciliation = self._upload(self._csv([
+            "2024-06-01,A,10.00,ARS,",
+            "2024-06-01,B,20.00,ARS,",
+            "2024-06-02,C,30.00,ARS,",
+        ]))
+        # Corte después del primer lote: el reintento no duplica las filas cargadas
+        flush = BankReconciliationService._flush_ingest_batch
+        calls = []
+
+        def flaky(service, *args):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("worker caído")
+            return flush(service, *args)
+
+        with mock.patch.object(BankReconciliationService, "_flush_ingest_batch", flaky):
+            with self.assertRaises(RuntimeError):
+                self.service.ingest_csv(reconciliation)
+        reconciliation.refresh_from_db()
+        self.assertEqual((reconciliation.rows_processed, reconciliation.ingested_at), (2, None))
+        self.assertGreater(reconciliation.ingest_percentage, 0)
+
+        self.service.ingest_csv(reconciliation)
+        self.assertEqual(sorted(reconciliation.transactions.values_list("description", flat=True)), ["A", "B", "C"])
+        self.assertEqual(reconciliation.total_transactions, 3)
+
+        with self.assertRaises(ValidationError):
+            self._upload(b"fecha,importe\n2024-06-01,10.00\n")
+
+        broken = self._upload(self._csv(["2024-06-01,A,10.00,ARS,", "no-es-fecha,B,20.00,ARS,"]))
+        with self.assertRaises(ValidationError):
+            self.service.process_reconciliation(broken.id)
+        broken.refresh_from_db()
+        self.assertEqual(broken.status, ReconciliationStatus.FAILED)
+        self.assertEqual(broken.error_details["row"], 2)
+
+
+class ReceiptNumberSequenceConcurrencyTest(TransactionTestCase):
+    WORKERS = 8
+    PER_WORKER = 15
+
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name="Hotel Recibos", email="recibos@hotel.com")
+
+    def _run_concurrently(self, target):
+        """Lanza WORKERS hilos a la vez (cada uno con su conexión) y junta sus resultados."""
+        barrier = threading.Barrier(self.WORKERS)
+        results, errors = [], []
+
+        def worker(index):
+            try:
+                barrier.wait()
+                for _ in range(self.PER_WORKER):
+                    results.append(self._retry_if_locked(target, index))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        self.assertEqual(errors, [])
+        return results
+
+    @staticmethod
+    def _retry_if_locked(target, index):
+        # La base SQLite de tests (memoria compartida) no espera el lock sino que falla: se
+        # reintenta la operación completa. En PostgreSQL el UPDATE espera la fila bloqueada.
+        while True:
+            try:
+                return target(index)
+            except OperationalError as e:
+                if connection.vendor != "sqlite" or "locked" not in str(e):
+                    raise
+                time.sleep(0.001)
+
+    def test_concurrent_receipts_are_unique_and_gap_free(self):
+        receipt_type = ReceiptNumberSequence.ReceiptType.PAYMENT
+        ReceiptNumberSequence.get_or_create_sequence(self.hotel, receipt_type)
+        numbers = self._run_concurrently(
+            lambda _: ReceiptNumberSequence.generate_receipt_number(self.hotel, receipt_type)
+        )
+        total = self.WORKERS * self.PER_WORKER
+        self.assertEqual(sorted(numbers), [f"P-0001-{n:06d}" for n in range(1, total + 1)])
+
+        # Un rollback del llamador no consume número
+        sequence = ReceiptNumberSequence.objects.get(hotel=self.hotel, receipt_type=receipt_type)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            sequence.get_next_number()
+            raise RuntimeError("pago revertido")
+        self.assertEqual(sequence.get_next_number(), total + 1)
+
+    @override_settings(RECEIPT_NUMBER_BLOCK_SIZE=10)
+    def test_block_reservation_per_process_never_repeats_numbers(self):
+        receipt_type = ReceiptNumberSequence.ReceiptType.DEPOSIT
+        sequence = ReceiptNumberSequence.get_or_create_sequence(self.hotel, receipt_type)
+        # Un pool por hilo simula procesos distintos reservando bloques de la misma secuencia
+        pools = [ReceiptNumberBlocks() for _ in range(self.WORKERS)]
+        numbers = self._run_concurrently(lambda index: pools[index].next_number(sequence, 10))
+        self.assertEqual(len(set(numbers)), len(numbers))
+        sequence.refresh_from_db()
+        # 15 números por proceso en bloques de 10: dos reservas (una fila tocada 16 veces, no 120)
+        self.assertEqual(sequence.current_number, self.WORKERS * 20)
+
+        with mock.patch("apps.payments.models.receipt_number_blocks", ReceiptNumberBlocks()):
+            first = ReceiptNumberSequence.generate_receipt_number(self.hotel, receipt_type)
+            second = ReceiptNumberSequence.generate_receipt_number(self.hotel, receipt_type)
+        self.assertEqual((first, second), (f"S-0001-{self.WORKERS * 20 + 1:06d}", f"S-0001-{self.WORKERS * 20 + 2:06d}"))
+
+    @override_settings(RECEIPT_NUMBER_BLOCK_SIZE=10)
+    def test_block_reserved_inside_rolled_back_transaction_is_not_kept(self):
+        receipt_type = ReceiptNumberSequence.ReceiptType.REFUND
+        sequence = ReceiptNumberSequence.get_or_create_sequence(self.hotel, receipt_type)
+        pool, other_process = ReceiptNumberBlocks(), ReceiptNumberBlocks()
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.assertEqual(pool.next_number(sequence, 10), 1)
+            raise RuntimeError("devolución revertida")
+        sequence.refresh_from_db()
+        self.assertEqual(sequence.current_number, 0)
+
+        # El rango 1..10 vuelve a estar libre: otro proceso lo reserva y este no lo repite
+        self.assertEqual(other_process.next_number(sequence, 10), 1)
+        self.assertEqual(pool.next_number(sequence, 10), 11)
+
+        # Confirmado el commit, el resto del bloque queda para las siguientes llamadas
+        with transaction.atomic():
+            pool.clear()
+            self.assertEqual(pool.next_number(sequence, 10), 21)
+        self.assertEqual(pool.next_number(sequence, 10), 22)
@@ -2362,7 +2362,7 @@ def generate_invoice_from_payment_extended(request, payment_id):
             total_amount = sum(p.amount for p in payments)
             
             # Generar número de factura
-            next_number = afip_config.get_next_invoice_number()
+            next_number = afip_config.allocate_invoice_number()
             formatted_number = afip_config.format_invoice_number(next_number)
             
             # Obtener datos del cliente
@@ -2409,41 +2409,27 @@ def generate_invoice_from_payment_extended(request, payment_id):
             }
             InvoiceItem.objects.create(**item_data)
             
-            # Actualizar número en configuración
-            afip_config.update_invoice_number(next_number)
-            
-            # Si se debe enviar a AFIP
+            # Si se debe enviar a AFIP: después del commit, sin retener el lock de la serie
             if serializer.validated_data.get('send_to_afip', False):
-                try:
-                    from apps.invoicing.services.afip_service import AfipService
-                    afip_service = AfipService(afip_config)
-                    result = afip_service.send_invoice(invoice)
-                    
-                    if result['success']:
-                        invoice.mark_as_approved(result['cae'], result['cae_expiration'])
-                    else:
-                        invoice.mark_as_error(result['error'])
-                        
-                except Exception as e:
-                    logger.error(f"Error enviando factura {invoice.number} a AFIP: {str(e)}")
-                    invoice.mark_as_error(str(e))
+                from apps.invoicing.services.afip_service import send_invoice_on_commit
+                send_invoice_on_commit(afip_config, invoice)
             
             # Generar PDF de la factura
             from apps.invoicing.tasks import generate_invoice_pdf
             generate_invoice_pdf.delay(invoice.id)
-            
-            return Response({
-                'message': 'Factura generada exitosamente',
-                'invoice': {
-                    'id': invoice.id,
-                    'number': invoice.number,
-                    'total': float(invoice.total),
-                    'status': invoice.status,
-                    'cae': invoice.cae,
-                    'payments_included': reference_payments
-                }
-            }, status=status.HTTP_201_CREATED)
-            
+        
+        return Response({
+            'message': 'Factura generada exitosamente',
+            'invoice': {
+                'id': invoice.id,
+                'number': invoice.number,
+                'total': float(invoice.total),
+                'status': invoice.status,
+                'cae': invoice.cae,
+                'payments_included': reference_payments
+            }
+        }, status=status.HTTP_201_CREATED)
+        
     except Exception as e:
         logger.error(f"Error generando factura desde pagos: {str(e)}", exc_info=True)
         return Response({
@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 class RatesConfig(AppConfig):
     name = 'apps.rates'
-    verbose_name = 'Tarifas'
\ No newline at end of file
+    verbose_name = 'Tarifas'
+
+    def ready(self):
+        # Invalida el índice compilado de reglas al cambiar planes/reglas/impuestos
+        import apps.rates.signals
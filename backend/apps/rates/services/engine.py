@@ -1,8 +1,9 @@
-from datetime import date
+from datetime import date, timedelta
 from decimal import Decimal
-from typing import Optional
+from typing import List, Optional
 from apps.rooms.models import Room
-from apps.rates.models import RateRule, RatePlan, PromoRule, TaxRule, DiscountType, PriceMode
+from apps.rates.models import RateRule, PromoRule, TaxRule, DiscountType, PriceMode
+from apps.rates.services.rule_index import HotelRateIndex, get_hotel_rate_index
 
 def _is_rule_applicable(rule: RateRule, room: Room, on_date: date, channel: Optional[str] = None) -> bool:
     if not (rule.start_date <= on_date <= rule.end_date):
@@ -34,29 +35,37 @@ def get_applicable_rule(room: Room, on_date: date, channel: Optional[str] = None
 
     - include_closed=True: considera reglas cerradas (para restricciones CTA/CTD, min/max stay, closed).
     - include_closed=False: ignora reglas con closed=True (similar a pricing).
+
+    Se resuelve contra el índice compilado del hotel (ver rule_index), sin queries por fecha.
     """
-    plans_qs = RatePlan.objects.filter(hotel=room.hotel, is_active=True).order_by('-priority', 'id').prefetch_related('rules')
-    for plan in plans_qs:
-        rules = sorted(plan.rules.all(), key=lambda r: r.priority, reverse=True)
-        for rule in rules:
-            if not (rule.start_date <= on_date <= rule.end_date):
-                continue
-            weekday = on_date.weekday()
-            dow_map = [rule.apply_mon, rule.apply_tue, rule.apply_wed, rule.apply_thu, rule.apply_fri, rule.apply_sat, rule.apply_sun]
-            if not dow_map[weekday]:
-                continue
-            if rule.target_room_id and rule.target_room_id != room.id:
-                continue
-            if rule.target_room_type and rule.target_room_type != room.room_type:
-                continue
-            if rule.channel and channel and rule.channel != channel:
-                continue
-            if rule.channel and channel is None:
-                continue
-            if not include_closed and rule.closed:
-                continue
-            return rule
-    return None
+    return get_hotel_rate_index(room.hotel_id).rule_for(room, on_date, channel, include_closed=include_closed)
+
+def _load_promos(room: Room, promotion_code: Optional[str], date_from: date, date_to: date) -> List[PromoRule]:
+    """Promos por código vigentes en algún día del rango [date_from, date_to] (una sola query)."""
+    if not promotion_code:
+        return []
+    return list(
+        PromoRule.objects.filter(
+            hotel_id=room.hotel_id,
+            is_active=True,
+            start_date__lte=date_to,
+            end_date__gte=date_from,
+            code__iexact=str(promotion_code),
+        ).order_by('-priority', 'id')
+    )
+
+def _load_voucher(room: Room, voucher_code: Optional[str]):
+    if not voucher_code:
+        return None
+    from apps.payments.models import RefundVoucher
+    try:
+        return RefundVoucher.objects.get(
+            code__iexact=str(voucher_code),
+            hotel_id=room.hotel_id,
+            status='active'
+        )
+    except RefundVoucher.DoesNotExist:
+        return None
 
 def compute_rate_for_date(
     room: Room,
@@ -74,6 +83,72 @@ def compute_rate_for_date(
       - "primary" (default): usa room.base_price
       - "secondary": usa room.secondary_price si existe; si no, hace fallback a base_price
     """
+    return _price_night(
+        room,
+        guests,
+        on_date,
+        channel,
+        promotion_code,
+        price_source,
+        index=get_hotel_rate_index(room.hotel_id),
+        promos=_load_promos(room, promotion_code, on_date, on_date),
+        voucher=_load_voucher(room, voucher_code),
+    )
+
+def compute_rate_for_range(
+    room: Room,
+    guests: int,
+    check_in: date,
+    check_out: date,
+    channel: Optional[str] = None,
+    promotion_code: Optional[str] = None,
+    voucher_code: Optional[str] = None,
+    price_source: Optional[str] = None,
+) -> List[dict]:
+    """
+    Pricing por noche para [check_in, check_out) con el mismo resultado que llamar a
+    compute_rate_for_date noche a noche, pero cargando reglas, precios por ocupación,
+    promos, voucher e impuestos una sola vez para toda la estadía (cantidad de queries
+    constante, sin importar la cantidad de noches).
+
+    Devuelve [{"date": d, **pricing}, ...] (sin promos/impuestos PER_RESERVATION, que se
+    prorratean fuera).
+    """
+    if not check_in or not check_out or check_out <= check_in:
+        return []
+    index = get_hotel_rate_index(room.hotel_id)
+    promos = _load_promos(room, promotion_code, check_in, check_out - timedelta(days=1))
+    voucher = _load_voucher(room, voucher_code)
+    nights = []
+    current = check_in
+    while current < check_out:
+        parts = _price_night(
+            room,
+            guests,
+            current,
+            channel,
+            promotion_code,
+            price_source,
+            index=index,
+            promos=promos,
+            voucher=voucher,
+        )
+        nights.append({"date": current, **parts})
+        current += timedelta(days=1)
+    return nights
+
+def _price_night(
+    room: Room,
+    guests: int,
+    on_date: date,
+    channel: Optional[str],
+    promotion_code: Optional[str],
+    price_source: Optional[str],
+    *,
+    index: HotelRateIndex,
+    promos: List[PromoRule],
+    voucher,
+) -> dict:
     if str(price_source or "").lower() == "secondary" and room.secondary_price is not None:
         base_room_price = room.secondary_price
     else:
@@ -83,61 +158,40 @@ def compute_rate_for_date(
     guest = max(int(guests or 1), 1)
     extra_guests = max(guest - included_capacity, 0)
     
-    # Buscar planes activos en el hotel por prioridad
-    plans_qs = RatePlan.objects.filter(hotel=room.hotel, is_active=True).order_by('-priority', "id")
-    candidate_rules = []
-    for plan in plans_qs:
-        rules = [
-            r for r in plan.rules.all()
-            if _is_rule_applicable(r, room, on_date, channel)
-        ]
-        candidate_rules.extend([(plan.priority, r.priority, r) for r in rules])
-    
-    candidate_rules.sort(key=lambda x: (x[0], x[1]), reverse=True)
+    # Regla ganadora (no cerrada) según el índice compilado del hotel
+    rule = index.rule_for(room, on_date, channel, include_closed=False)
 
     base_rate = base_room_price
     extra_guest_fee = (room.extra_guest_fee or Decimal('0.00')) * Decimal(extra_guests)
 
     used_occupancy_price = False
 
-    for _, _, rule in candidate_rules:
+    if rule is not None:
         # Occupancy price match exacto
-        occ = rule.occupancy_prices.filter(occupancy=guest).first()
-        if occ:
-            base_rate = occ.price
+        occ_price = index.occupancy_price(rule, guest)
+        if occ_price is not None:
+            base_rate = occ_price
             extra_guest_fee = Decimal('0.00')
             used_occupancy_price = True
-            break
-        
-        # Sin price por ocupación, usar base_amount si existe
-        if rule.base_amount is not None:
-            if rule.price_mode == PriceMode.ABSOLUTE:
-                base_rate = rule.base_amount
-            else:
-                base_rate = (base_room_price + rule.base_amount).quantize(Decimal('0.01'))
+        else:
+            # Sin price por ocupación, usar base_amount si existe
+            if rule.base_amount is not None:
+                if rule.price_mode == PriceMode.ABSOLUTE:
+                    base_rate = rule.base_amount
+                else:
+                    base_rate = (base_room_price + rule.base_amount).quantize(Decimal('0.01'))
 
-        # Override de extra_guest_fee si fue provisto
-        if rule.extra_guest_fee_amount is not None:
-            extra_guest_fee = (rule.extra_guest_fee_amount or Decimal("00.0")) * Decimal(extra_guests)
-        
-        # Tomoamos esa regla y salimos (ya que estan ordenadas por prioridad)
-        break
+            # Override de extra_guest_fee si fue provisto
+            if rule.extra_guest_fee_amount is not None:
+                extra_guest_fee = (rule.extra_guest_fee_amount or Decimal("00.0")) * Decimal(extra_guests)
 
     # Aplicar promociones (solo si se ingresó código)
     discount = Decimal('0.00')
-    if promotion_code:
-        promos_qs = PromoRule.objects.filter(
-            hotel=room.hotel,
-            is_active=True,
-            start_date__lte=on_date,
-            end_date__gte=on_date,
-            code__iexact=str(promotion_code),
-        ).order_by('-priority')
-    else:
-        promos_qs = PromoRule.objects.none()
     applied_promos = []
     applied_promos_detail = []
-    for promo in promos_qs:
+    for promo in promos:
+        if not (promo.start_date <= on_date <= promo.end_date):
+            continue
         # Promos de alcance por reserva no se aplican aquí (se prorratean fuera)
         if promo.scope == PromoRule.PromoScope.PER_RESERVATION:
             continue
@@ -183,27 +237,17 @@ def compute_rate_for_date(
     voucher_discount = Decimal('0.00')
     applied_vouchers = []
     applied_vouchers_detail = []
-    if voucher_code:
-        from apps.payments.models import RefundVoucher
-        try:
-            voucher = RefundVoucher.objects.get(
-                code__iexact=str(voucher_code),
-                hotel=room.hotel,
-                status='active'
-            )
-            if voucher.can_be_used():
-                # El voucher se aplica como descuento fijo
-                voucher_discount = min(voucher.remaining_amount, (base_rate + (Decimal('0.00') if used_occupancy_price else extra_guest_fee) - discount))
-                if voucher_discount > 0:
-                    applied_vouchers.append(voucher.id)
-                    applied_vouchers_detail.append({
-                        'id': voucher.id,
-                        'code': voucher.code,
-                        'amount': float(voucher_discount),
-                        'remaining_amount': float(voucher.remaining_amount)
-                    })
-        except RefundVoucher.DoesNotExist:
-            pass
+    if voucher is not None and voucher.can_be_used():
+        # El voucher se aplica como descuento fijo
+        voucher_discount = min(voucher.remaining_amount, (base_rate + (Decimal('0.00') if used_occupancy_price else extra_guest_fee) - discount))
+        if voucher_discount > 0:
+            applied_vouchers.append(voucher.id)
+            applied_vouchers_detail.append({
+                'id': voucher.id,
+                'code': voucher.code,
+                'amount': float(voucher_discount),
+                'remaining_amount': float(voucher.remaining_amount)
+            })
 
     # Total de descuentos (promociones + vouchers)
     total_discount = discount + voucher_discount
@@ -213,13 +257,8 @@ def compute_rate_for_date(
     taxable_base = (base_rate + (Decimal('0.00') if used_occupancy_price else extra_guest_fee) - total_discount)
     if taxable_base < 0:
         taxable_base = Decimal('0.00')
-    taxes_qs = TaxRule.objects.filter(hotel=room.hotel, is_active=True).order_by('-priority')
     applied_taxes_detail = []
-    for t in taxes_qs:
-        if t.channel and channel and t.channel != channel:
-            continue
-        if t.channel and channel is None:
-            continue
+    for t in index.taxes_for(channel):
         # calcular por alcance/tipo
         if t.amount_type == TaxRule.TaxAmountType.PERCENT:
             base_for_tax = taxable_base
@@ -0,0 +1,274 @@
+"""
+Índice compilado de reglas tarifarias por hotel.
+
+Carga una sola vez todos los RatePlan/RateRule activos del hotel (con sus precios
+por ocupación) y los TaxRule activos, y responde "qué regla gana en esta fecha"
+en memoria, sin volver a la base por cada noche.
+
+- Las reglas se ordenan por (prioridad de plan, prioridad de regla) desc, igual
+  que el motor de pricing.
+- Por cada combinación (habitación, tipo, canal) se compila perezosamente una
+  tabla de intervalos: segmentos de fechas x día de semana -> regla ganadora.
+- El índice base se comparte entre procesos vía cache (Redis) usando una
+  versión por hotel; cada proceso guarda además una copia local.
+- Se invalida desde apps.rates.signals cuando cambian RatePlan, RateRule,
+  RateOccupancyPrice o TaxRule.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_right
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from apps.rates.models import RateRule, RateOccupancyPrice, TaxRule
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION_KEY = "rates:index:version:{hotel_id}"
+CACHE_INDEX_KEY = "rates:index:{hotel_id}:{version}"
+CACHE_TTL = 60 * 60 * 6  # 6 horas (el cache global no expira por defecto, ver settings)
+
+# Cada cuánto re-validar la copia local contra la versión compartida (segundos).
+# Dentro del mismo proceso la invalidación es inmediata.
+LOCAL_CHECK_INTERVAL = 2.0
+# Edad máxima de una copia local construida sin versión compartida (Redis caído)
+LOCAL_MAX_AGE = 60.0
+
+
+def _weekday_mask(rule) -> int:
+    flags = [rule.apply_mon, rule.apply_tue, rule.apply_wed, rule.apply_thu, rule.apply_fri, rule.apply_sat, rule.apply_sun]
+    mask = 0
+    for idx, enabled in enumerate(flags):
+        if enabled:
+            mask |= 1 << idx
+    return mask
+
+
+def _channel_matches(rule_channel: Optional[str], channel: Optional[str]) -> bool:
+    # Misma semántica que el motor: regla sin canal aplica a todos; regla con canal
+    # requiere canal explícito (un canal vacío "" no filtra).
+    if not rule_channel:
+        return True
+    if channel is None:
+        return False
+    if not channel:
+        return True
+    return rule_channel == channel
+
+
+class _IndexedRule:
+    __slots__ = ("rule", "start", "end", "mask", "room_id", "room_type", "channel", "closed")
+
+    def __init__(self, rule: RateRule):
+        self.rule = rule
+        self.start = rule.start_date.toordinal()
+        self.end = rule.end_date.toordinal()
+        self.mask = _weekday_mask(rule)
+        self.room_id = rule.target_room_id or None
+        self.room_type = rule.target_room_type or None
+        self.channel = rule.channel or None
+        self.closed = bool(rule.closed)
+
+
+class _IntervalTable:
+    """Segmentos de fechas ordenados; cada segmento guarda, por día de semana, la
+    regla ganadora considerando cerradas (any) y sin considerarlas (open)."""
+
+    __slots__ = ("bounds", "winners")
+
+    def __init__(self, candidates: List[_IndexedRule]):
+        points = set()
+        for c in candidates:
+            points.add(c.start)
+            points.add(c.end + 1)
+        self.bounds: List[int] = sorted(points)
+        self.winners: List[Tuple[Tuple[Optional[RateRule], ...], Tuple[Optional[RateRule], ...]]] = []
+        for seg_start in self.bounds[:-1]:
+            any_w: List[Optional[RateRule]] = [None] * 7
+            open_w: List[Optional[RateRule]] = [None] * 7
+            pending_any = 7
+            pending_open = 7
+            for c in candidates:
+                if not (c.start <= seg_start <= c.end):
+                    continue
+                for wd in range(7):
+                    if not (c.mask >> wd) & 1:
+                        continue
+                    if any_w[wd] is None:
+                        any_w[wd] = c.rule
+                        pending_any -= 1
+                    if not c.closed and open_w[wd] is None:
+                        open_w[wd] = c.rule
+                        pending_open -= 1
+                if pending_any == 0 and pending_open == 0:
+                    break
+            self.winners.append((tuple(any_w), tuple(open_w)))
+
+    def lookup(self, on_date: date, include_closed: bool) -> Optional[RateRule]:
+        pos = bisect_right(self.bounds, on_date.toordinal()) - 1
+        if pos < 0 or pos >= len(self.winners):
+            return None
+        any_w, open_w = self.winners[pos]
+        return (any_w if include_closed else open_w)[on_date.weekday()]
+
+
+class HotelRateIndex:
+    """Reglas, precios por ocupación e impuestos activos de un hotel, listos para consultar en memoria."""
+
+    def __init__(self, hotel_id: int, rules: List[RateRule], occupancy: Dict[int, Dict[int, Decimal]], taxes: List[TaxRule]):
+        self.hotel_id = hotel_id
+        self.rules = rules
+        self.occupancy = occupancy
+        self.taxes = taxes
+        self._entries = [_IndexedRule(r) for r in rules]
+        self._tables: Dict[Tuple, _IntervalTable] = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Las tablas compiladas y el lock son locales al proceso
+        return {"hotel_id": self.hotel_id, "rules": self.rules, "occupancy": self.occupancy, "taxes": self.taxes}
+
+    def __setstate__(self, state):
+        self.__init__(state["hotel_id"], state["rules"], state["occupancy"], state["taxes"])
+
+    def _table_for(self, room, channel: Optional[str]) -> _IntervalTable:
+        room_type = room.room_type or None
+        key = (room.id, room_type, channel)
+        table = self._tables.get(key)
+        if table is not None:
+            return table
+        candidates = [
+            e for e in self._entries
+            if (e.room_id is None or e.room_id == room.id)
+            and (e.room_type is None or e.room_type == room_type)
+            and _channel_matches(e.channel, channel)
+        ]
+        table = _IntervalTable(candidates)
+        with self._lock:
+            self._tables[key] = table
+        return table
+
+    def rule_for(self, room, on_date: date, channel: Optional[str] = None, include_closed: bool = True) -> Optional[RateRule]:
+        """Regla ganadora para la habitación/fecha/canal (None si ninguna aplica)."""
+        return self._table_for(room, channel).lookup(on_date, include_closed)
+
+    def occupancy_price(self, rule: RateRule, guests: int) -> Optional[Decimal]:
+        return self.occupancy.get(rule.id, {}).get(guests)
+
+    def taxes_for(self, channel: Optional[str] = None) -> List[TaxRule]:
+        return [t for t in self.taxes if _channel_matches(t.channel, channel)]
+
+
+def build_hotel_rate_index(hotel_id: int) -> HotelRateIndex:
+    """Construye el índice desde la base (3 queries, independiente de la cantidad de noches)."""
+    rules = list(
+        RateRule.objects.filter(plan__hotel_id=hotel_id, plan__is_active=True)
+        .select_related("plan")
+        .order_by("-plan__priority", "-priority", "plan_id", "start_date", "end_date", "id")
+    )
+    occupancy: Dict[int, Dict[int, Decimal]] = {}
+    if rules:
+        for rule_id, occ, price in RateOccupancyPrice.objects.filter(rule__in=[r.id for r in rules]).values_list("rule_id", "occupancy", "price"):
+            occupancy.setdefault(rule_id, {})[occ] = price
+    taxes = list(TaxRule.objects.filter(hotel_id=hotel_id, is_active=True).order_by("-priority", "id"))
+    return HotelRateIndex(hotel_id, rules, occupancy, taxes)
+
+
+# Copia local por proceso: hotel_id -> (versión, índice, momento de validación, momento de construcción)
+_local_indexes: Dict[int, Tuple[Optional[str], HotelRateIndex, float, float]] = {}
+_local_lock = threading.Lock()
+
+
+def _shared_version(hotel_id: int) -> Optional[str]:
+    try:
+        return cache.get(CACHE_VERSION_KEY.format(hotel_id=hotel_id))
+    except Exception as e:
+        logger.debug(f"No se pudo leer versión del índice tarifario (hotel {hotel_id}): {e}")
+        return None
+
+
+def get_hotel_rate_index(hotel_id: int) -> HotelRateIndex:
+    """
+    Devuelve el índice tarifario del hotel.
+
+    Orden de búsqueda: copia local vigente -> cache compartido -> base de datos.
+    """
+    now = time.monotonic()
+    local = _local_indexes.get(hotel_id)
+    if local is not None:
+        version, index, checked_at, built_at = local
+        if now - checked_at < LOCAL_CHECK_INTERVAL:
+            return index
+        shared = _shared_version(hotel_id)
+        if shared is not None and shared == version:
+            with _local_lock:
+                _local_indexes[hotel_id] = (version, index, now, built_at)
+            return index
+        if shared is None and version is None and now - built_at < LOCAL_MAX_AGE:
+            with _local_lock:
+                _local_indexes[hotel_id] = (version, index, now, built_at)
+            return index
+    else:
+        shared = _shared_version(hotel_id)
+
+    index = None
+    local_version = shared
+    if shared is not None:
+        try:
+            index = cache.get(CACHE_INDEX_KEY.format(hotel_id=hotel_id, version=shared))
+        except Exception:
+            index = None
+
+    if index is None:
+        index = build_hotel_rate_index(hotel_id)
+        # No publicar índices construidos dentro de una transacción abierta: podrían
+        # contener datos que terminen en rollback (localmente quedan sin versión).
+        if connection.in_atomic_block:
+            local_version = None
+        else:
+            try:
+                if shared is None:
+                    shared = uuid.uuid4().hex
+                    if not cache.add(CACHE_VERSION_KEY.format(hotel_id=hotel_id), shared, timeout=None):
+                        shared = _shared_version(hotel_id) or shared
+                cache.set(CACHE_INDEX_KEY.format(hotel_id=hotel_id, version=shared), index, timeout=CACHE_TTL)
+                local_version = shared
+            except Exception as e:
+                logger.debug(f"No se pudo publicar el índice tarifario (hotel {hotel_id}): {e}")
+
+    with _local_lock:
+        _local_indexes[hotel_id] = (local_version, index, now, now)
+    return index
+
+
+def _bump_shared_version(hotel_id: int) -> None:
+    try:
+        cache.set(CACHE_VERSION_KEY.format(hotel_id=hotel_id), uuid.uuid4().hex, timeout=None)
+    except Exception as e:
+        logger.warning(f"No se pudo invalidar el índice tarifario compartido (hotel {hotel_id}): {e}")
+
+
+def invalidate_hotel_rate_index(hotel_id: Optional[int]) -> None:
+    """
+    Invalida el índice del hotel: la copia local se descarta en el acto y la versión
+    compartida se renueva al confirmar la transacción (otros procesos reconstruyen).
+    """
+    if not hotel_id:
+        return
+    with _local_lock:
+        _local_indexes.pop(hotel_id, None)
+    transaction.on_commit(lambda: _bump_shared_version(hotel_id))
+
+
+def clear_local_rate_indexes() -> None:
+    """Descarta todas las copias locales (útil en tests)."""
+    with _local_lock:
+        _local_indexes.clear()
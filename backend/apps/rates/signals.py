@@ -0,0 +1,37 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.rates.models import RatePlan, RateRule, RateOccupancyPrice, TaxRule
+from apps.rates.services.rule_index import invalidate_hotel_rate_index
+
+
+def _hotel_id_for_rule_id(rule_id):
+    return (
+        RateRule.objects.filter(pk=rule_id).values_list("plan__hotel_id", flat=True).first()
+        if rule_id else None
+    )
+
+
+@receiver(post_save, sender=RatePlan)
+@receiver(post_delete, sender=RatePlan)
+def rate_plan_changed(sender, instance: RatePlan, **kwargs):
+    invalidate_hotel_rate_index(instance.hotel_id)
+
+
+@receiver(post_save, sender=RateRule)
+@receiver(post_delete, sender=RateRule)
+def rate_rule_changed(sender, instance: RateRule, **kwargs):
+    hotel_id = RatePlan.objects.filter(pk=instance.plan_id).values_list("hotel_id", flat=True).first()
+    invalidate_hotel_rate_index(hotel_id)
+
+
+@receiver(post_save, sender=RateOccupancyPrice)
+@receiver(post_delete, sender=RateOccupancyPrice)
+def rate_occupancy_price_changed(sender, instance: RateOccupancyPrice, **kwargs):
+    invalidate_hotel_rate_index(_hotel_id_for_rule_id(instance.rule_id))
+
+
+@receiver(post_save, sender=TaxRule)
+@receiver(post_delete, sender=TaxRule)
+def tax_rule_changed(sender, instance: TaxRule, **kwargs):
+    invalidate_hotel_rate_index(instance.hotel_id)
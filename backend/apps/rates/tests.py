@@ -0,0 +1,127 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.test import TestCase, override_settings
+
+from apps.core.models import Currency, Hotel
+from apps.rooms.models import Room
+from apps.rates.models import RatePlan, RateRule, RateOccupancyPrice, TaxRule, PromoRule
+from apps.rates.services.engine import compute_rate_for_date, compute_rate_for_range, get_applicable_rule
+from apps.rates.services.rule_index import clear_local_rate_indexes, get_hotel_rate_index
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def _reference_rule(room, on_date, channel=None, include_closed=True):
+    """Búsqueda lineal equivalente al motor previo (orden por prioridad plan/regla)."""
+    rules = RateRule.objects.filter(plan__hotel=room.hotel, plan__is_active=True).order_by(
+        "-plan__priority", "-priority", "plan_id", "start_date", "end_date", "id"
+    )
+    for rule in rules:
+        if not (rule.start_date <= on_date <= rule.end_date):
+            continue
+        dow = [rule.apply_mon, rule.apply_tue, rule.apply_wed, rule.apply_thu, rule.apply_fri, rule.apply_sat, rule.apply_sun]
+        if not dow[on_date.weekday()]:
+            continue
+        if rule.target_room_id and rule.target_room_id != room.id:
+            continue
+        if rule.target_room_type and rule.target_room_type != room.room_type:
+            continue
+        if rule.channel and channel and rule.channel != channel:
+            continue
+        if rule.channel and channel is None:
+            continue
+        if not include_closed and rule.closed:
+            continue
+        return rule
+    return None
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class HotelRateIndexTest(TestCase):
+    def setUp(self):
+        clear_local_rate_indexes()
+        self.currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel Index", email="idx@hotel.com")
+        self.room = Room.objects.create(
+            name="IDX-101", hotel=self.hotel, floor="1", room_type="double", number=101,
+            base_price=Decimal("100.00"), base_currency=self.currency, capacity=2, max_capacity=4,
+            extra_guest_fee=Decimal("10.00"),
+        )
+        self.other_room = Room.objects.create(
+            name="IDX-102", hotel=self.hotel, floor="1", room_type="single", number=102,
+            base_price=Decimal("80.00"), base_currency=self.currency, capacity=1, max_capacity=2,
+        )
+        self.start = date(2025, 3, 1)
+        plan = RatePlan.objects.create(hotel=self.hotel, name="Base", code="BASE", priority=100)
+        promo_plan = RatePlan.objects.create(hotel=self.hotel, name="Alta", code="ALTA", priority=200)
+        RateRule.objects.create(plan=plan, name="General", start_date=self.start, end_date=self.start + timedelta(days=60), base_amount=Decimal("120.00"))
+        RateRule.objects.create(
+            plan=plan, name="Finde doble", start_date=self.start, end_date=self.start + timedelta(days=30),
+            apply_mon=False, apply_tue=False, apply_wed=False, apply_thu=False,
+            target_room_type="double", priority=150, base_amount=Decimal("30.00"), price_mode="delta",
+        )
+        booking = RateRule.objects.create(
+            plan=promo_plan, name="Booking", start_date=self.start + timedelta(days=10), end_date=self.start + timedelta(days=20),
+            channel="booking", base_amount=Decimal("150.00"),
+        )
+        RateOccupancyPrice.objects.create(rule=booking, occupancy=3, price=Decimal("210.00"))
+        RateRule.objects.create(
+            plan=promo_plan, name="Cierre", start_date=self.start + timedelta(days=5), end_date=self.start + timedelta(days=7),
+            target_room=self.room, closed=True, priority=300,
+        )
+        TaxRule.objects.create(hotel=self.hotel, name="IVA", percent=Decimal("21.00"))
+
+    def test_index_matches_linear_lookup(self):
+        for room in (self.room, self.other_room):
+            for channel in (None, "booking", "direct"):
+                for include_closed in (True, False):
+                    for offset in range(-3, 65):
+                        d = self.start + timedelta(days=offset)
+                        expected = _reference_rule(room, d, channel, include_closed)
+                        got = get_applicable_rule(room, d, channel, include_closed=include_closed)
+                        self.assertEqual(got.id if got else None, expected.id if expected else None, (room.id, channel, include_closed, d))
+
+    def test_lookups_do_not_query_per_night(self):
+        get_hotel_rate_index(self.hotel.id)
+        with self.assertNumQueries(0):
+            for offset in range(30):
+                get_applicable_rule(self.room, self.start + timedelta(days=offset), "booking")
+
+    def test_occupancy_price_and_taxes_from_index(self):
+        parts = compute_rate_for_date(self.room, 3, self.start + timedelta(days=12), channel="booking")
+        self.assertEqual(parts["base_rate"], Decimal("210.00"))
+        self.assertEqual(parts["extra_guest_fee"], Decimal("0.00"))
+        self.assertEqual(parts["tax"], Decimal("44.10"))
+        self.assertEqual(parts["total_night"], Decimal("254.10"))
+
+    def test_rule_change_invalidates_index(self):
+        d = self.start + timedelta(days=40)
+        self.assertEqual(compute_rate_for_date(self.room, 2, d)["base_rate"], Decimal("120.00"))
+        rule = RateRule.objects.get(name="General")
+        rule.base_amount = Decimal("130.00")
+        rule.save()
+        self.assertEqual(compute_rate_for_date(self.room, 2, d)["base_rate"], Decimal("130.00"))
+        TaxRule.objects.all().delete()
+        self.assertEqual(compute_rate_for_date(self.room, 2, d)["tax"], Decimal("0.00"))
+
+    def test_range_matches_per_night_pricing(self):
+        PromoRule.objects.create(
+            hotel=self.hotel, name="Verano", code="VERANO", start_date=self.start + timedelta(days=8),
+            end_date=self.start + timedelta(days=15), discount_value=Decimal("10.00"),
+        )
+        check_out = self.start + timedelta(days=25)
+        for channel in (None, "booking"):
+            for guests in (1, 3):
+                nights = compute_rate_for_range(self.room, guests, self.start, check_out, channel, "verano")
+                self.assertEqual(len(nights), 25)
+                for night in nights:
+                    expected = compute_rate_for_date(self.room, guests, night["date"], channel, "verano")
+                    self.assertEqual({k: v for k, v in night.items() if k != "date"}, expected)
+
+    def test_range_query_count_is_constant(self):
+        get_hotel_rate_index(self.hotel.id)
+        with self.assertNumQueries(1):
+            compute_rate_for_range(self.room, 2, self.start, self.start + timedelta(days=3), "booking", "PROMO")
+        with self.assertNumQueries(1):
+            compute_rate_for_range(self.room, 2, self.start, self.start + timedelta(days=60), "booking", "PROMO")
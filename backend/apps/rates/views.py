@@ -8,7 +8,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from apps.rooms.models import Room, RoomType
-from apps.rates.services.engine import compute_rate_for_date
+from apps.rates.services.engine import compute_rate_for_date, compute_rate_for_range
 from apps.reservations.models import ReservationChannel
 from decimal import Decimal
 from apps.rates.models import PromoRule, DiscountType
@@ -150,14 +150,10 @@ def preview_rate_range(request):
     except Room.DoesNotExist:
         return Response({"detail": "room_id no encontrado."}, status=status.HTTP_404_NOT_FOUND)
 
-    current = start
-    raw_days = []
-    while current <= end:
-        raw_days.append({
-            "date": current,
-            "pricing": compute_rate_for_date(room, guests, current, channel, promo_code),
-        })
-        current += timedelta(days=1)
+    raw_days = [
+        {"date": night["date"], "pricing": {k: v for k, v in night.items() if k != "date"}}
+        for night in compute_rate_for_range(room, guests, start, end + timedelta(days=1), channel, promo_code)
+    ]
 
     # Manejar promos de alcance por reserva: calcular descuento total y prorratear
     bases = []
@@ -0,0 +1,60 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+
+from apps.core.models import Hotel
+from apps.reservations.services.inventory import refresh_room_inventory
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye/reconcilia el inventario diario (RoomInventoryDay) desde reservas y bloqueos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hotel-id',
+            type=int,
+            help='ID del hotel específico (por defecto: todos los hoteles activos)'
+        )
+        parser.add_argument(
+            '--from',
+            dest='date_from',
+            type=str,
+            help='Fecha desde (YYYY-MM-DD). Por defecto es hoy.'
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=730,
+            help='Cantidad de días a reconciliar desde --from (por defecto: 730)'
+        )
+
+    def handle(self, *args, **options):
+        start = date.today()
+        if options['date_from']:
+            try:
+                start = date.fromisoformat(options['date_from'])
+            except ValueError:
+                self.stdout.write(self.style.ERROR('Formato de fecha inválido. Use YYYY-MM-DD'))
+                return
+        end = start + timedelta(days=max(options['days'], 1))
+
+        hotels = Hotel.objects.filter(is_active=True)
+        if options['hotel_id']:
+            hotels = Hotel.objects.filter(id=options['hotel_id'])
+            if not hotels.exists():
+                self.stdout.write(self.style.ERROR(f'Hotel con ID {options["hotel_id"]} no encontrado'))
+                return
+
+        drift = 0
+        for hotel in hotels:
+            stats = refresh_room_inventory(hotel.id, start, end)
+            changed = stats['created'] + stats['updated'] + stats['deleted']
+            drift += changed
+            self.stdout.write(
+                f'  {hotel.name}: {stats["created"]} creadas, {stats["updated"]} actualizadas, '
+                f'{stats["deleted"]} eliminadas ({start} → {end})'
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Inventario reconciliado. Filas corregidas: {drift}.')
+        )
@@ -0,0 +1,81 @@
+# Generated by Django 4.2.7
+
+from datetime import date, timedelta
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+ACTIVE_STATUSES = ("pending", "confirmed", "check_in")
+
+
+def populate_inventory(apps, schema_editor):
+    """Carga inicial del inventario desde hoy (el histórico se puede reconstruir con rebuild_room_inventory)."""
+    Reservation = apps.get_model("reservations", "Reservation")
+    RoomBlock = apps.get_model("reservations", "RoomBlock")
+    RoomInventoryDay = apps.get_model("reservations", "RoomInventoryDay")
+
+    today = date.today()
+    rows = {}
+
+    def _row(hotel_id, room_id, d):
+        key = (room_id, d)
+        if key not in rows:
+            rows[key] = RoomInventoryDay(hotel_id=hotel_id, room_id=room_id, date=d)
+        return rows[key]
+
+    reservations = Reservation.objects.filter(status__in=ACTIVE_STATUSES, check_out__gt=today).order_by("check_in", "id")
+    for res_id, hotel_id, room_id, check_in, check_out in reservations.values_list("id", "hotel_id", "room_id", "check_in", "check_out"):
+        d = max(check_in, today)
+        while d < check_out:
+            row = _row(hotel_id, room_id, d)
+            if not row.occupied:
+                row.occupied = True
+                row.reservation_id = res_id
+            d += timedelta(days=1)
+
+    blocks = RoomBlock.objects.filter(is_active=True, end_date__gt=today)
+    for hotel_id, room_id, start_date, end_date, block_type in blocks.values_list("hotel_id", "room_id", "start_date", "end_date", "block_type"):
+        d = max(start_date, today)
+        while d < end_date:
+            row = _row(hotel_id, room_id, d)
+            if block_type == "out_of_service":
+                row.out_of_order = True
+            else:
+                row.blocked = True
+            d += timedelta(days=1)
+
+    RoomInventoryDay.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        ('rooms', '0001_initial'),
+        ('reservations', '0027_reservation_created_by'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomInventoryDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('occupied', models.BooleanField(default=False)),
+                ('blocked', models.BooleanField(default=False)),
+                ('out_of_order', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('hotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_days', to='core.hotel')),
+                ('reservation', models.ForeignKey(blank=True, help_text='Reserva activa que ocupa el día (si hay)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='reservations.reservation')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_days', to='rooms.room')),
+            ],
+            options={
+                'verbose_name': 'Inventario diario de habitación',
+                'verbose_name_plural': 'Inventario diario de habitaciones',
+                'indexes': [models.Index(fields=['hotel', 'date'], name='reservation_hotel_i_cd9a81_idx')],
+                'unique_together': {('room', 'date')},
+            },
+        ),
+        migrations.RunPython(populate_inventory, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.2.7
+
+from django.db import migrations, models
+
+
+def populate_search_text(apps, schema_editor):
+    """Completa search_text de las reservas existentes (misma regla que Reservation.build_search_text)."""
+    Reservation = apps.get_model("reservations", "Reservation")
+    batch = []
+    rows = Reservation.objects.only("id", "external_id", "group_code", "guests_data").order_by("id")
+    for r in rows.iterator(chunk_size=2000):
+        parts = [r.external_id, r.group_code]
+        for guest in r.guests_data or []:
+            if isinstance(guest, dict):
+                parts += [guest.get("name"), guest.get("email")]
+        r.search_text = " ".join(str(p).strip().lower() for p in parts if p)
+        batch.append(r)
+        if len(batch) >= 2000:
+            Reservation.objects.bulk_update(batch, ["search_text"])
+            batch = []
+    if batch:
+        Reservation.objects.bulk_update(batch, ["search_text"])
+
+
+def create_trigram_index(apps, schema_editor):
+    # LIKE '%texto%' sobre search_text usa este índice; fuera de Postgres queda el scan
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS reservation_search_trgm_idx "
+        "ON reservations_reservation USING gin (search_text gin_trgm_ops)"
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS reservation_search_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0028_roominventoryday'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['hotel', 'status', 'check_in'], name='reservation_hotel_i_bfed68_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['hotel', 'check_out'], name='reservation_hotel_i_72c6bc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['hotel', '-check_in', '-id'], name='reservation_hotel_i_7725b6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['hotel', '-created_at', '-id'], name='reservation_hotel_i_fc2ce8_idx'),
+        ),
+        migrations.RunPython(populate_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -31,6 +31,9 @@ class ReservationChannel(models.TextChoices):
     AIRBNB = "airbnb", "Airbnb"
     OTHER = "other", "Otro"
 
+# Campos que alimentan Reservation.search_text
+SEARCH_SOURCE_FIELDS = frozenset({"guests_data", "external_id", "group_code"})
+
 class Reservation(models.Model):
     class PriceSource(models.TextChoices):
         PRIMARY = "primary", "Tarifa principal"
@@ -91,6 +94,9 @@ class Reservation(models.Model):
         blank=True,
         help_text="Snapshot de la política de cancelación al momento de crear la reserva"
     )
+    # Texto de búsqueda denormalizado (nombres / emails de huéspedes, IDs externos, grupo)
+    # en minúsculas; en Postgres lleva un índice trigram (migración 0029)
+    search_text = models.TextField(blank=True, default="", editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(
@@ -174,8 +180,11 @@ class Reservation(models.Model):
             if start_rule and start_rule.max_stay and nights > start_rule.max_stay:
                 raise ValidationError({"__all__": f"Máximo de estadía: {start_rule.max_stay} noches."})
             
-    def save(self, *args, **kwargs):
-        skip_clean = kwargs.pop('skip_clean', False)
+    def apply_pricing_defaults(self):
+        """
+        Completa moneda y total aproximado como lo hace save(). Las cargas bulk (import de
+        OTAs por lotes) no pasan por save() y lo llaman antes de escribir.
+        """
         # Importante:
         # - Para reservas DIRECTAS (sin external_id) calculamos el total aproximado con base_price.
         # - Para reservas OTA (con external_id), si ya vino un total desde el channel manager/OTA,
@@ -206,6 +215,22 @@ class Reservation(models.Model):
             self.total_price = (Decimal(max(nights, 0)) * (Decimal(base_nightly) + Decimal(extra_fee))).quantize(Decimal('0.01'))
             if self.hotel_id is None:
                 self.hotel = self.room.hotel
+
+    def build_search_text(self) -> str:
+        """Valor de search_text: IDs externos, grupo y nombre / email de cada huésped."""
+        parts = [self.external_id, self.group_code]
+        for guest in self.guests_data or []:
+            if isinstance(guest, dict):
+                parts += [guest.get("name"), guest.get("email")]
+        return " ".join(str(p).strip().lower() for p in parts if p)
+
+    def save(self, *args, **kwargs):
+        skip_clean = kwargs.pop('skip_clean', False)
+        self.apply_pricing_defaults()
+        self.search_text = self.build_search_text()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & SEARCH_SOURCE_FIELDS:
+            kwargs['update_fields'] = {*update_fields, 'search_text'}
         if skip_clean:
             # Saltar clean() para reservas importadas desde OTAs que pueden tener solapamientos
             super().save(*args, **kwargs)
@@ -220,6 +245,11 @@ class Reservation(models.Model):
             models.Index(fields=["hotel", "check_in"]),
             models.Index(fields=["status"]),
             models.Index(fields=["external_id"]),  # Para búsquedas por ID externo (OTAs)
+            # Combinaciones de filtros del listado y orden estable para la paginación keyset
+            models.Index(fields=["hotel", "status", "check_in"]),
+            models.Index(fields=["hotel", "check_out"]),
+            models.Index(fields=["hotel", "-check_in", "-id"]),
+            models.Index(fields=["hotel", "-created_at", "-id"]),
         ]
         # Django crea automáticamente estos permisos:
         # - reservations.add_reservation
@@ -311,6 +341,35 @@ class ReservationNight(models.Model):
         ]
 
 
+class RoomInventoryDay(models.Model):
+    """
+    Inventario diario materializado por habitación (tabla dispersa: solo existen filas
+    para días ocupados, bloqueados o fuera de servicio; sin fila = libre).
+
+    Se mantiene desde las señales de Reservation/RoomBlock (ver services/inventory.py)
+    y se reconcilia con `manage.py rebuild_room_inventory`.
+    """
+    hotel = models.ForeignKey(Hotel, on_delete=models.CASCADE, related_name='inventory_days')
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='inventory_days')
+    date = models.DateField()
+    occupied = models.BooleanField(default=False)
+    blocked = models.BooleanField(default=False)
+    out_of_order = models.BooleanField(default=False)
+    reservation = models.ForeignKey(
+        Reservation, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+        help_text='Reserva activa que ocupa el día (si hay)',
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Inventario diario de habitación"
+        verbose_name_plural = "Inventario diario de habitaciones"
+        unique_together = ('room', 'date')
+        indexes = [
+            models.Index(fields=['hotel', 'date']),
+        ]
+
+
 class ReservationCharge(models.Model):
     reservation = models.ForeignKey(Reservation, on_delete=models.CASCADE, related_name='charges')
     date = models.DateField()
@@ -432,6 +491,12 @@ class Payment(models.Model):
                 logger = logging.getLogger(__name__)
                 logger.error(f"Error creando notificación para comprobante {self.id}: {notif_error}")
 
+    class Meta:
+        indexes = [
+            # Búsqueda de candidatos por rango en la conciliación bancaria
+            models.Index(fields=["date", "amount"]),
+        ]
+
 class ReservationStatusChange(models.Model):
     reservation = models.ForeignKey(Reservation, on_delete=models.CASCADE, related_name='status_changes')
     from_status = models.CharField(max_length=20, choices=ReservationStatus.choices, null=True, blank=True)
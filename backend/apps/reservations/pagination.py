@@ -0,0 +1,113 @@
+"""
+Paginación keyset para el listado de reservas.
+
+PageNumberPagination (la global) hace COUNT(*) y OFFSET: en hoteles grandes las páginas
+profundas recorren toda la tabla. En modo keyset (?pagination=cursor o ?cursor=...) el
+cursor guarda la posición (valor del campo de orden, id) de la última fila y la página
+siguiente filtra `(campo, id) < (valor, id)` sobre el índice (hotel, campo, id): el costo
+de una página no depende de su profundidad ni del tamaño de la tabla. No hay total ni
+página anterior.
+"""
+from __future__ import annotations
+
+import base64
+import json
+from typing import List, Optional, Tuple
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+# Campos de orden admitidos (el desempate siempre es id, en el mismo sentido)
+KEYSET_FIELDS = ("check_in", "check_out", "created_at", "id")
+
+
+class ReservationKeysetPagination(BasePagination):
+    cursor_query_param = "cursor"
+    ordering_query_param = "ordering"
+    page_size_query_param = "page_size"
+    default_ordering = "-check_in"
+    max_page_size = 200
+
+    def __init__(self, page_size: Optional[int] = None):
+        self.default_page_size = page_size or api_settings.PAGE_SIZE or 20
+        self.next_position: Optional[Tuple[str, int]] = None
+        self.request = None
+
+    # ---- parámetros ----
+    def get_ordering(self, request) -> Tuple[str, bool]:
+        """(campo, descendente) a partir de ?ordering; fuera de KEYSET_FIELDS cae al default."""
+        ordering = request.query_params.get(self.ordering_query_param) or self.default_ordering
+        if ordering.lstrip("-") not in KEYSET_FIELDS:
+            ordering = self.default_ordering
+        return ordering.lstrip("-"), ordering.startswith("-")
+
+    def get_page_size(self, request) -> int:
+        try:
+            size = int(request.query_params.get(self.page_size_query_param) or self.default_page_size)
+        except (TypeError, ValueError):
+            size = self.default_page_size
+        return min(max(size, 1), self.max_page_size)
+
+    @staticmethod
+    def encode_cursor(position: Tuple[str, int]) -> str:
+        raw = json.dumps(list(position), separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[str, int]:
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            value, pk = json.loads(raw)
+            return str(value), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound("Cursor inválido.")
+
+    # ---- paginación ----
+    def paginate_queryset(self, queryset, request, view=None) -> List:
+        self.request = request
+        field, descending = self.get_ordering(request)
+        page_size = self.get_page_size(request)
+        sign = "-" if descending else ""
+        queryset = queryset.order_by(f"{sign}{field}", f"{sign}id") if field != "id" else queryset.order_by(f"{sign}id")
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(cursor)
+            op = "lt" if descending else "gt"
+            if field == "id":
+                queryset = queryset.filter(**{f"id__{op}": pk})
+            else:
+                queryset = queryset.filter(Q(**{f"{field}__{op}": value}) | Q(**{field: value, f"id__{op}": pk}))
+
+        rows = list(queryset[: page_size + 1])
+        self.next_position = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            value = getattr(last, field)
+            self.next_position = (value.isoformat() if hasattr(value, "isoformat") else str(value), last.pk)
+        return rows
+
+    def get_next_link(self) -> Optional[str]:
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "previous": None, "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
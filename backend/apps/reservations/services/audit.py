@@ -39,4 +39,40 @@ def build_diff(old_obj: Reservation | None, new_obj: Reservation, fields: list[s
                 "old": str(old) if old is not None else None,
                 "new": str(new) if new is not None else None,
             }
-    return diff
\ No newline at end of file
+    return diff
+
+
+def build_snapshots(reservations) -> dict:
+    """build_snapshot para varias reservas con una consulta agregada por tabla (cargas por lotes)."""
+    reservations = [r for r in reservations if r.pk]
+    ids = [r.pk for r in reservations]
+    if not ids:
+        return {}
+    from apps.reservations.models import Payment, ReservationCharge, ReservationNight
+
+    def _sums(model, field):
+        rows = model.objects.filter(reservation_id__in=ids).values("reservation_id").annotate(s=Sum(field))
+        return {row["reservation_id"]: row["s"] for row in rows}
+
+    nights = _sums(ReservationNight, "total_night")
+    charges = _sums(ReservationCharge, "amount")
+    payments = _sums(Payment, "amount")
+    return {
+        r.pk: {
+            "id": r.id,
+            "hotel_id": r.hotel_id,
+            "room_id": r.room_id,
+            "check_in": str(r.check_in),
+            "check_out": str(r.check_out),
+            "guests": r.guests,
+            "status": r.status,
+            "channel": r.channel,
+            "totals": {
+                "nights_total": _to_str_money(nights.get(r.pk) or Decimal('0.00')),
+                "charges_total": _to_str_money(charges.get(r.pk) or Decimal('0.00')),
+                "payments_total": _to_str_money(payments.get(r.pk) or Decimal('0.00')),
+                "total_price": _to_str_money(r.total_price or 0),
+            },
+        }
+        for r in reservations
+    }
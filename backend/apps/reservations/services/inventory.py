@@ -0,0 +1,182 @@
+"""
+Inventario diario materializado (RoomInventoryDay).
+
+La tabla es dispersa: una fila por (habitación, día) solo cuando el día está ocupado por
+una reserva activa, bloqueado por un RoomBlock o fuera de servicio. Consultar
+disponibilidad para un rango pasa a ser un scan por índice (hotel, date) en lugar del
+join de solapamiento contra Reservation y RoomBlock.
+
+- refresh_room_inventory: recalcula (por diferencias) las filas de habitaciones/rango;
+  lo usan las señales de Reservation/RoomBlock dentro de la misma transacción.
+- available_rooms / rooms_left_by_type: lecturas para las vistas de disponibilidad.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count
+
+from apps.rooms.models import Room, RoomStatus
+from apps.reservations.models import Reservation, RoomBlock, RoomBlockType, RoomInventoryDay
+from .occupancy import ACTIVE_STATUSES
+
+INVENTORY_FLAGS = ("occupied", "blocked", "out_of_order", "reservation_id")
+
+
+def compute_room_inventory(
+    hotel_id: int, start: date, end: date, room_ids: Optional[Iterable[int]] = None
+) -> Dict[Tuple[int, date], dict]:
+    """Estado esperado del inventario en [start, end) a partir de Reservation/RoomBlock (2 queries)."""
+    expected: Dict[Tuple[int, date], dict] = {}
+    if end <= start:
+        return expected
+
+    def _row(room_id: int, d: date) -> dict:
+        key = (room_id, d)
+        row = expected.get(key)
+        if row is None:
+            row = expected[key] = {"occupied": False, "blocked": False, "out_of_order": False, "reservation_id": None}
+        return row
+
+    reservations = Reservation.objects.filter(
+        hotel_id=hotel_id,
+        status__in=ACTIVE_STATUSES,
+        check_in__lt=end,
+        check_out__gt=start,
+    )
+    blocks = RoomBlock.objects.filter(
+        hotel_id=hotel_id,
+        is_active=True,
+        start_date__lt=end,
+        end_date__gt=start,
+    )
+    if room_ids is not None:
+        room_ids = list(room_ids)
+        reservations = reservations.filter(room_id__in=room_ids)
+        blocks = blocks.filter(room_id__in=room_ids)
+
+    for res_id, room_id, check_in, check_out in reservations.order_by("check_in", "id").values_list(
+        "id", "room_id", "check_in", "check_out"
+    ):
+        d = max(check_in, start)
+        last = min(check_out, end)
+        while d < last:
+            row = _row(room_id, d)
+            if not row["occupied"]:
+                row["occupied"] = True
+                row["reservation_id"] = res_id
+            d += timedelta(days=1)
+
+    for room_id, b_start, b_end, block_type in blocks.values_list("room_id", "start_date", "end_date", "block_type"):
+        flag = "out_of_order" if block_type == RoomBlockType.OUT_OF_SERVICE else "blocked"
+        d = max(b_start, start)
+        last = min(b_end, end)
+        while d < last:
+            _row(room_id, d)[flag] = True
+            d += timedelta(days=1)
+
+    return expected
+
+
+def refresh_room_inventory(
+    hotel_id: int, start: date, end: date, room_ids: Optional[Iterable[int]] = None
+) -> Dict[str, int]:
+    """
+    Lleva RoomInventoryDay al estado esperado en [start, end) tocando solo las filas que
+    cambian. Devuelve {"created", "updated", "deleted"} (sirve para medir drift).
+    """
+    stats = {"created": 0, "updated": 0, "deleted": 0}
+    if not hotel_id or not start or not end or end <= start:
+        return stats
+    if room_ids is not None:
+        room_ids = [rid for rid in set(room_ids) if rid]
+        if not room_ids:
+            return stats
+
+    expected = compute_room_inventory(hotel_id, start, end, room_ids)
+    existing_qs = RoomInventoryDay.objects.filter(hotel_id=hotel_id, date__gte=start, date__lt=end)
+    if room_ids is not None:
+        existing_qs = existing_qs.filter(room_id__in=room_ids)
+
+    with transaction.atomic():
+        stale_ids = []
+        to_update = []
+        for row in existing_qs.select_for_update():
+            wanted = expected.pop((row.room_id, row.date), None)
+            if wanted is None:
+                stale_ids.append(row.id)
+                continue
+            if any(getattr(row, f) != wanted[f] for f in INVENTORY_FLAGS):
+                for f in INVENTORY_FLAGS:
+                    setattr(row, f, wanted[f])
+                to_update.append(row)
+        if stale_ids:
+            RoomInventoryDay.objects.filter(id__in=stale_ids).delete()
+        if to_update:
+            RoomInventoryDay.objects.bulk_update(to_update, ["occupied", "blocked", "out_of_order", "reservation", "updated_at"])
+        if expected:
+            # Otro refresco concurrente puede haber creado la misma (habitación, día) después de
+            # nuestra lectura: upsert sobre la clave única en lugar de duplicar o fallar
+            RoomInventoryDay.objects.bulk_create(
+                [
+                    RoomInventoryDay(hotel_id=hotel_id, room_id=room_id, date=d, **flags)
+                    for (room_id, d), flags in expected.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["room", "date"],
+                update_fields=["occupied", "blocked", "out_of_order", "reservation", "updated_at"],
+            )
+
+    stats["deleted"] = len(stale_ids)
+    stats["updated"] = len(to_update)
+    stats["created"] = len(expected)
+    return stats
+
+
+def unavailable_room_ids(check_in: date, check_out: date, hotel_id: Optional[int] = None):
+    """Subquery con ids de habitaciones que tienen algún día no disponible en [check_in, check_out)."""
+    qs = RoomInventoryDay.objects.filter(date__gte=check_in, date__lt=check_out)
+    if hotel_id:
+        qs = qs.filter(hotel_id=hotel_id)
+    return qs.values("room_id").distinct()
+
+
+def available_rooms(queryset, check_in: date, check_out: date, hotel_id: Optional[int] = None):
+    """Filtra un queryset de Room dejando solo las libres en todo el rango (scan por índice)."""
+    return queryset.exclude(id__in=unavailable_room_ids(check_in, check_out, hotel_id))
+
+
+def rooms_left_by_type(hotel_id: int, start: date, end: date) -> Dict[date, Dict[str, int]]:
+    """Habitaciones libres por tipo y día en [start, end): {date: {room_type: libres}}."""
+    totals: Dict[str, int] = {
+        row["room_type"]: row["total"]
+        for row in Room.objects.filter(hotel_id=hotel_id, is_active=True)
+        .exclude(status=RoomStatus.OUT_OF_SERVICE)
+        .values("room_type")
+        .annotate(total=Count("id"))
+    }
+    taken: Dict[date, Dict[str, int]] = defaultdict(dict)
+    rows = (
+        RoomInventoryDay.objects.filter(
+            hotel_id=hotel_id,
+            date__gte=start,
+            date__lt=end,
+            room__is_active=True,
+        )
+        .exclude(room__status=RoomStatus.OUT_OF_SERVICE)
+        .values("date", "room__room_type")
+        .annotate(taken=Count("id"))
+    )
+    for row in rows:
+        taken[row["date"]][row["room__room_type"]] = row["taken"]
+
+    result: Dict[date, Dict[str, int]] = {}
+    d = start
+    while d < end:
+        day_taken = taken.get(d, {})
+        result[d] = {room_type: max(total - day_taken.get(room_type, 0), 0) for room_type, total in totals.items()}
+        d += timedelta(days=1)
+    return result
@@ -0,0 +1,181 @@
+"""
+Motor de ocupación por bitsets.
+
+Carga en pocas queries (habitaciones, reservas, bloqueos) la ocupación de un hotel para
+una ventana de fechas y arma, por habitación, enteros usados como bitsets donde el bit i
+representa el día `start + i`. Las consultas de ocupación / habitaciones libres / días
+cerrados pasan a ser operaciones de bits en memoria en lugar de loops días x habitaciones
+x reservas.
+
+La ventana es semiabierta [start, end), igual que las noches de una reserva.
+"""
+from __future__ import annotations
+
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from apps.rooms.models import Room
+from apps.reservations.models import Reservation, ReservationStatus, RoomBlock
+
+ACTIVE_STATUSES = (
+    ReservationStatus.PENDING,
+    ReservationStatus.CONFIRMED,
+    ReservationStatus.CHECK_IN,
+)
+
+
+class OccupancyGrid:
+    """Ocupación, bloqueos y días cerrados por habitación para una ventana de fechas."""
+
+    def __init__(self, hotel_id: int, start: date, end: date, rooms: List[Room]):
+        self.hotel_id = hotel_id
+        self.start = start
+        self.end = end
+        self.days = max((end - start).days, 0)
+        self.rooms = rooms
+        self.occupied: Dict[int, int] = {r.id: 0 for r in rooms}
+        self.blocked: Dict[int, int] = {r.id: 0 for r in rooms}
+        self.closed: Dict[int, int] = {r.id: 0 for r in rooms}
+        # room_id -> [(idx_inicio, idx_fin, reserva)] en orden de check_in
+        self._reservations: Dict[int, List[Tuple[int, int, Reservation]]] = {}
+        self._full = (1 << self.days) - 1
+
+    @classmethod
+    def load(
+        cls,
+        hotel_id: int,
+        start: date,
+        end: date,
+        *,
+        rooms: Optional[Iterable[Room]] = None,
+        statuses: Optional[Iterable[str]] = ACTIVE_STATUSES,
+        include_blocks: bool = True,
+        keep_reservations: bool = False,
+        channel: Optional[str] = None,
+        include_closed: bool = False,
+    ) -> "OccupancyGrid":
+        """
+        Construye la grilla para el hotel en [start, end).
+
+        - rooms: habitaciones a considerar (default: activas del hotel).
+        - statuses: estados de reserva que ocupan (None = todos).
+        - keep_reservations: conserva las reservas para `reservation_on`.
+        - include_closed: marca días cerrados según reglas tarifarias para `channel`.
+        """
+        if rooms is None:
+            rooms = Room.objects.filter(hotel_id=hotel_id, is_active=True).order_by("floor", "name")
+        rooms = list(rooms)
+        grid = cls(hotel_id, start, end, rooms)
+        if not rooms or grid.days == 0:
+            return grid
+        room_ids = [r.id for r in rooms]
+
+        res_qs = Reservation.objects.filter(
+            hotel_id=hotel_id,
+            room_id__in=room_ids,
+            check_in__lt=end,
+            check_out__gt=start,
+        ).order_by("check_in", "id")
+        if statuses is not None:
+            res_qs = res_qs.filter(status__in=list(statuses))
+        if keep_reservations:
+            for res in res_qs:
+                a, b = grid._span(res.check_in, res.check_out)
+                grid.occupied[res.room_id] |= grid._bits(a, b)
+                grid._reservations.setdefault(res.room_id, []).append((a, b, res))
+        else:
+            for room_id, check_in, check_out in res_qs.values_list("room_id", "check_in", "check_out"):
+                grid.occupied[room_id] |= grid._bits(*grid._span(check_in, check_out))
+
+        if include_blocks:
+            blocks = RoomBlock.objects.filter(
+                hotel_id=hotel_id,
+                room_id__in=room_ids,
+                is_active=True,
+                start_date__lt=end,
+                end_date__gt=start,
+            ).values_list("room_id", "start_date", "end_date")
+            for room_id, b_start, b_end in blocks:
+                grid.blocked[room_id] |= grid._bits(*grid._span(b_start, b_end))
+
+        if include_closed:
+            grid.load_closed(channel)
+        return grid
+
+    def load_closed(self, channel: Optional[str] = None) -> None:
+        """Marca días cerrados (RateRule.closed) usando el índice tarifario en memoria."""
+        from apps.rates.services.rule_index import get_hotel_rate_index
+
+        index = get_hotel_rate_index(self.hotel_id)
+        dates = [self.start + timedelta(days=i) for i in range(self.days)]
+        for room in self.rooms:
+            bits = 0
+            for i, d in enumerate(dates):
+                rule = index.rule_for(room, d, channel, include_closed=True)
+                if rule is not None and rule.closed:
+                    bits |= 1 << i
+            self.closed[room.id] = bits
+
+    # --- helpers de bits ---
+    def _span(self, a: date, b: date) -> Tuple[int, int]:
+        return max((a - self.start).days, 0), min((b - self.start).days, self.days)
+
+    @staticmethod
+    def _bits(a: int, b: int) -> int:
+        if b <= a:
+            return 0
+        return ((1 << (b - a)) - 1) << a
+
+    def mask(self, a: Optional[date] = None, b: Optional[date] = None) -> int:
+        """Máscara de bits para [a, b) recortada a la ventana (default: ventana completa)."""
+        if a is None and b is None:
+            return self._full
+        return self._bits(*self._span(a or self.start, b or self.end))
+
+    def _bit(self, d: date) -> int:
+        i = (d - self.start).days
+        if i < 0 or i >= self.days:
+            return 0
+        return 1 << i
+
+    # --- consultas ---
+    def unavailable_bits(self, room_id: int) -> int:
+        return self.occupied.get(room_id, 0) | self.blocked.get(room_id, 0) | self.closed.get(room_id, 0)
+
+    def is_occupied(self, room_id: int, d: date) -> bool:
+        return bool(self.occupied.get(room_id, 0) & self._bit(d))
+
+    def is_blocked(self, room_id: int, d: date) -> bool:
+        return bool(self.blocked.get(room_id, 0) & self._bit(d))
+
+    def is_closed(self, room_id: int, d: date) -> bool:
+        return bool(self.closed.get(room_id, 0) & self._bit(d))
+
+    def is_free(self, room_id: int, a: Optional[date] = None, b: Optional[date] = None) -> bool:
+        """True si la habitación no está ocupada, bloqueada ni cerrada en [a, b)."""
+        return not (self.unavailable_bits(room_id) & self.mask(a, b))
+
+    def free_rooms(self, a: Optional[date] = None, b: Optional[date] = None) -> List[Room]:
+        m = self.mask(a, b)
+        return [r for r in self.rooms if not (self.unavailable_bits(r.id) & m)]
+
+    def first_closed_day(self, room_id: int, a: Optional[date] = None, b: Optional[date] = None) -> Optional[date]:
+        bits = self.closed.get(room_id, 0) & self.mask(a, b)
+        if not bits:
+            return None
+        return self.start + timedelta(days=(bits & -bits).bit_length() - 1)
+
+    def free_count(self, d: date) -> int:
+        """Cantidad de habitaciones libres en el día d."""
+        bit = self._bit(d)
+        return sum(1 for r in self.rooms if not (self.unavailable_bits(r.id) & bit))
+
+    def reservation_on(self, room_id: int, d: date) -> Optional[Reservation]:
+        """Primera reserva (por check_in) que ocupa la habitación en d. Requiere keep_reservations."""
+        if not self.is_occupied(room_id, d):
+            return None
+        i = (d - self.start).days
+        for a, b, res in self._reservations.get(room_id, ()):
+            if a <= i < b:
+                return res
+        return None
@@ -1,7 +1,7 @@
 from decimal import Decimal
-from datetime import timedelta, date
+from datetime import date
 from apps.reservations.models import ReservationNight
-from apps.rates.services.engine import compute_rate_for_date
+from apps.rates.services.engine import compute_rate_for_date, compute_rate_for_range
 from apps.rates.models import PromoRule, DiscountType, TaxRule
 from django.db import models
 from django.conf import settings
@@ -36,22 +36,17 @@ def quote_reservation_total(
     if check_out <= check_in:
         return {"nights": [], "nights_count": 0, "total": Decimal("0.00")}
 
-    current = check_in
-    nights = []
-
     # 1) Calcular cada noche con engine (sin promos por reserva, se prorratean después)
-    while current < check_out:
-        base_parts = compute_rate_for_date(
-            room,
-            guests,
-            current,
-            channel,
-            promotion_code,
-            voucher_code,
-            price_source,
-        )
-        nights.append({"date": current, **base_parts})
-        current += timedelta(days=1)
+    nights = compute_rate_for_range(
+        room,
+        guests,
+        check_in,
+        check_out,
+        channel,
+        promotion_code,
+        voucher_code,
+        price_source,
+    )
 
     # 2) Promos por reserva (PER_RESERVATION) solo si hay promotion_code explícito
     per_res_promos = PromoRule.objects.none()
@@ -210,23 +205,17 @@ def compute_nightly_rate(room, guests, on_date=None, channel=None, price_source:
     return compute_rate_for_date(room, guests, on_date, channel, price_source=price_source)
 
 def generate_nights_for_reservation(reservation):
-    from apps.rates.services.engine import compute_rate_for_date
-    ReservationNight.objects.filter(reservation=reservation).delete()
-    current = reservation.check_in
-    nights = []
     # Primero calcular sin aplicar promos de alcance por reserva para obtener bases
-    while current < reservation.check_out:
-        base_parts = compute_rate_for_date(
-            reservation.room,
-            reservation.guests,
-            current,
-            reservation.channel,
-            reservation.promotion_code,
-            getattr(reservation, 'voucher_code', None),
-            getattr(reservation, "price_source", None),
-        )
-        nights.append({ 'date': current, **base_parts })
-        current += timedelta(days=1)
+    nights = compute_rate_for_range(
+        reservation.room,
+        reservation.guests,
+        reservation.check_in,
+        reservation.check_out,
+        reservation.channel,
+        reservation.promotion_code,
+        getattr(reservation, 'voucher_code', None),
+        getattr(reservation, "price_source", None),
+    )
 
     # Aplicar promos por reserva SOLO si hay promotion_code explícito
     # Evita descuentos "fantasma" cuando no se ingresó cupón
@@ -344,18 +333,70 @@ def generate_nights_for_reservation(reservation):
                 new_prorated.append(nn)
             prorated = new_prorated
 
-    # Guardar noches
-    for n in prorated:
-        filtered_parts = {k: v for k, v in n.items() if k in [
-            'base_rate', 'extra_guest_fee', 'discount', 'tax', 'total_night'
-        ]}
-        ReservationNight.objects.create(
-            reservation=reservation,
-            hotel=reservation.hotel,
-            room=reservation.room,
-            date=n['date'],
-            **filtered_parts,
-        )
+    # Guardar noches (upsert por diferencias)
+    sync_reservation_nights(reservation, prorated)
+
+NIGHT_AMOUNT_FIELDS = ('base_rate', 'extra_guest_fee', 'discount', 'tax', 'total_night')
+
+def sync_reservation_nights(reservation, rows) -> dict:
+    """
+    Materializa las noches de la reserva a partir de `rows` ([{date, base_rate, ...}]) tocando
+    solo lo que cambió: crea fechas nuevas, actualiza las que cambiaron de habitación/montos y
+    borra las que ya no forman parte de la estadía. Todo con operaciones bulk.
+
+    Devuelve contadores {"created", "updated", "deleted"}.
+    """
+    return sync_nights_bulk([(reservation, rows)])
+
+def sync_nights_bulk(pairs) -> dict:
+    """
+    sync_reservation_nights para varias reservas [(reservation, rows)] con una sola lectura
+    de noches existentes y a lo sumo un delete / bulk_update / bulk_create en total.
+    """
+    pairs = [(r, rows) for r, rows in pairs if r.pk]
+    existing_by_res = {}
+    if pairs:
+        for n in ReservationNight.objects.filter(reservation_id__in=[r.pk for r, _ in pairs]):
+            existing_by_res.setdefault(n.reservation_id, {})[n.date] = n
+    to_create = []
+    to_update = []
+    stale_ids = []
+    for reservation, rows in pairs:
+        existing = existing_by_res.get(reservation.pk, {})
+        seen = set()
+        for row in rows:
+            d = row['date']
+            seen.add(d)
+            amounts = {k: Decimal(row.get(k) or 0).quantize(Decimal('0.01')) for k in NIGHT_AMOUNT_FIELDS}
+            night = existing.get(d)
+            if night is None:
+                to_create.append(ReservationNight(
+                    reservation=reservation,
+                    hotel_id=reservation.hotel_id,
+                    room_id=reservation.room_id,
+                    date=d,
+                    **amounts,
+                ))
+                continue
+            changed = night.room_id != reservation.room_id or night.hotel_id != reservation.hotel_id
+            for field, value in amounts.items():
+                if getattr(night, field) != value:
+                    changed = True
+            if changed:
+                night.room_id = reservation.room_id
+                night.hotel_id = reservation.hotel_id
+                for field, value in amounts.items():
+                    setattr(night, field, value)
+                to_update.append(night)
+        stale_ids.extend(n.id for d, n in existing.items() if d not in seen)
+
+    if stale_ids:
+        ReservationNight.objects.filter(id__in=stale_ids).delete()
+    if to_update:
+        ReservationNight.objects.bulk_update(to_update, ['room', 'hotel', *NIGHT_AMOUNT_FIELDS])
+    if to_create:
+        ReservationNight.objects.bulk_create(to_create)
+    return {"created": len(to_create), "updated": len(to_update), "deleted": len(stale_ids)}
 
 def recalc_reservation_totals(reservation):
     from django.db.models import Sum
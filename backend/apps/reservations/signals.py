@@ -1,10 +1,12 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
+from datetime import date
 from django.contrib.auth import get_user_model
 from apps.reservations.models import Reservation, ReservationChangeLog, ReservationStatusChange, ReservationChangeEvent, ReservationChannel, ReservationStatus
 from .services.pricing import generate_nights_for_reservation, recalc_reservation_totals
 from django.conf import settings
-from .models import Reservation, ReservationCharge, ChannelCommission
+from .models import Reservation, ReservationCharge, ChannelCommission, RoomBlock
+from .services.inventory import refresh_room_inventory
 from .services.audit import build_snapshot, build_diff
 from .middleware import get_current_user
 
@@ -58,6 +60,7 @@ def upsert_channel_commission(reservation: Reservation):
 
 @receiver(post_save, sender=Reservation)
 def reservation_post_save_first(sender, instance: Reservation, created, **kwargs):
+    # Única materialización de noches/totales por save (reservation_post_save_log solo audita)
     if not instance.check_in or not instance.check_out or not instance.room_id:
         return
     if _should_autogenerate_pricing(instance):
@@ -77,11 +80,6 @@ def reservation_pre_save(sender, instance: Reservation, **kwargs):
 
 @receiver(post_save, sender=Reservation)
 def reservation_post_save_log(sender, instance: Reservation, created, **kwargs):
-    if instance.check_in and instance.check_out and instance.room_id:
-        if _should_autogenerate_pricing(instance):
-            generate_nights_for_reservation(instance)
-            recalc_reservation_totals(instance)
-
     prev = getattr(instance, "_prev", None)
     user = get_current_user()
 
@@ -198,4 +196,63 @@ def reservation_export_to_google(sender, instance: Reservation, created, **kwarg
         # Ejecutar después del commit para evitar inconsistencias
         transaction.on_commit(_run)
     except Exception as e:
-        logger.error(f"Reservation {instance.id}: Error scheduling Google Calendar export: {str(e)}", exc_info=True)
\ No newline at end of file
+        logger.error(f"Reservation {instance.id}: Error scheduling Google Calendar export: {str(e)}", exc_info=True)
+
+
+# --- Inventario diario (RoomInventoryDay) ---
+
+def _refresh_inventory_for(*spans):
+    """Recalcula el inventario para los tramos (hotel_id, room_id, desde, hasta) afectados."""
+    by_hotel = {}
+    for hotel_id, room_id, start, end in spans:
+        if not (hotel_id and room_id and start and end):
+            continue
+        if isinstance(start, str):
+            start = date.fromisoformat(start)
+        if isinstance(end, str):
+            end = date.fromisoformat(end)
+        entry = by_hotel.setdefault(hotel_id, [set(), start, end])
+        entry[0].add(room_id)
+        entry[1] = min(entry[1], start)
+        entry[2] = max(entry[2], end)
+    for hotel_id, (room_ids, start, end) in by_hotel.items():
+        refresh_room_inventory(hotel_id, start, end, room_ids)
+
+
+@receiver(post_save, sender=Reservation)
+def reservation_inventory_post_save(sender, instance: Reservation, created, **kwargs):
+    prev = getattr(instance, "_prev", None)
+    spans = [(instance.hotel_id, instance.room_id, instance.check_in, instance.check_out)]
+    if prev is not None:
+        spans.append((prev.hotel_id, prev.room_id, prev.check_in, prev.check_out))
+    _refresh_inventory_for(*spans)
+
+
+@receiver(post_delete, sender=Reservation)
+def reservation_inventory_post_delete(sender, instance: Reservation, **kwargs):
+    _refresh_inventory_for((instance.hotel_id, instance.room_id, instance.check_in, instance.check_out))
+
+
+@receiver(pre_save, sender=RoomBlock)
+def room_block_pre_save(sender, instance: RoomBlock, **kwargs):
+    instance._prev_span = None
+    if instance.pk:
+        instance._prev_span = (
+            RoomBlock.objects.filter(pk=instance.pk)
+            .values_list("hotel_id", "room_id", "start_date", "end_date")
+            .first()
+        )
+
+
+@receiver(post_save, sender=RoomBlock)
+def room_block_inventory_post_save(sender, instance: RoomBlock, created, **kwargs):
+    spans = [(instance.hotel_id, instance.room_id, instance.start_date, instance.end_date)]
+    prev_span = getattr(instance, "_prev_span", None)
+    if prev_span:
+        spans.append(prev_span)
+    _refresh_inventory_for(*spans)
+
+
+@receiver(post_delete, sender=RoomBlock)
+def room_block_inventory_post_delete(sender, instance: RoomBlock, **kwargs):
+    _refresh_inventory_for((instance.hotel_id, instance.room_id, instance.start_date, instance.end_date))
@@ -1,3 +1,300 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from apps.core.models import Currency, Hotel
+from apps.rooms.models import Room
+from apps.rates.models import RatePlan, RateRule
+from apps.reservations.models import Reservation, ReservationNight, ReservationStatus, RoomBlock, RoomBlockType, RoomInventoryDay
+from apps.reservations.services.inventory import available_rooms, rooms_left_by_type
+from apps.reservations.services.occupancy import OccupancyGrid
+from apps.reservations.services.pricing import generate_nights_for_reservation
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ReservationNightMaterializationTest(TestCase):
+    def setUp(self):
+        self.currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel Nights", email="nights@hotel.com")
+        self.room = Room.objects.create(
+            name="N-101", hotel=self.hotel, floor="1", room_type="double", number=101,
+            base_price=Decimal("100.00"), base_currency=self.currency, capacity=2, max_capacity=2,
+        )
+        self.other_room = Room.objects.create(
+            name="N-102", hotel=self.hotel, floor="1", room_type="double", number=102,
+            base_price=Decimal("150.00"), base_currency=self.currency, capacity=2, max_capacity=2,
+        )
+        self.check_in = date.today() + timedelta(days=10)
+        self.reservation = Reservation.objects.create(
+            hotel=self.hotel, room=self.room, guests=2,
+            guests_data=[{"name": "Ana", "email": "ana@test.com", "is_primary": True}],
+            check_in=self.check_in, check_out=self.check_in + timedelta(days=3),
+            status=ReservationStatus.PENDING,
+        )
+
+    def test_save_materializes_nights_and_total(self):
+        nights = list(self.reservation.nights.order_by("date"))
+        self.assertEqual([n.date for n in nights], [self.check_in + timedelta(days=i) for i in range(3)])
+        self.reservation.refresh_from_db()
+        self.assertEqual(self.reservation.total_price, Decimal("300.00"))
+
+    def test_unchanged_save_keeps_existing_rows(self):
+        ids = set(self.reservation.nights.values_list("id", flat=True))
+        self.reservation.notes = "Llega tarde"
+        self.reservation.save()
+        self.assertEqual(set(self.reservation.nights.values_list("id", flat=True)), ids)
+
+    def test_regeneration_without_changes_only_reads(self):
+        with self.assertNumQueries(1):
+            generate_nights_for_reservation(self.reservation)
+
+    def test_extending_stay_only_adds_new_nights(self):
+        ids = set(self.reservation.nights.values_list("id", flat=True))
+        self.reservation.check_out = self.check_in + timedelta(days=5)
+        self.reservation.save()
+        current_ids = set(self.reservation.nights.values_list("id", flat=True))
+        self.assertTrue(ids.issubset(current_ids))
+        self.assertEqual(len(current_ids), 5)
+        self.reservation.refresh_from_db()
+        self.assertEqual(self.reservation.total_price, Decimal("500.00"))
+
+    def test_room_change_updates_nights_in_place(self):
+        ids = set(self.reservation.nights.values_list("id", flat=True))
+        self.reservation.room = self.other_room
+        self.reservation.check_in = self.check_in + timedelta(days=1)
+        self.reservation.save()
+        nights = list(ReservationNight.objects.filter(reservation=self.reservation).order_by("date"))
+        self.assertEqual(len(nights), 2)
+        self.assertTrue({n.id for n in nights}.issubset(ids))
+        self.assertTrue(all(n.room_id == self.other_room.id and n.total_night == Decimal("150.00") for n in nights))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class OccupancyGridTest(TestCase):
+    def setUp(self):
+        self.currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel Grid", email="grid@hotel.com")
+        self.rooms = [
+            Room.objects.create(
+                name=f"G-{i}", hotel=self.hotel, floor="1", room_type="double", number=200 + i,
+                base_price=Decimal("100.00"), base_currency=self.currency, capacity=2, max_capacity=2,
+            )
+            for i in range(4)
+        ]
+        self.start = date.today() + timedelta(days=30)
+        self.reservations = [
+            Reservation.objects.create(
+                hotel=self.hotel, room=self.rooms[0], guests=1,
+                guests_data=[{"name": "Ana", "email": "ana@test.com", "is_primary": True}],
+                check_in=self.start + timedelta(days=2), check_out=self.start + timedelta(days=5),
+                status=ReservationStatus.CONFIRMED,
+            ),
+            Reservation.objects.create(
+                hotel=self.hotel, room=self.rooms[1], guests=1,
+                guests_data=[{"name": "Beto", "email": "beto@test.com", "is_primary": True}],
+                check_in=self.start - timedelta(days=3), check_out=self.start + timedelta(days=1),
+                status=ReservationStatus.CHECK_IN,
+            ),
+            Reservation.objects.create(
+                hotel=self.hotel, room=self.rooms[2], guests=1,
+                guests_data=[{"name": "Cata", "email": "cata@test.com", "is_primary": True}],
+                check_in=self.start, check_out=self.start + timedelta(days=4),
+                status=ReservationStatus.CANCELLED,
+            ),
+        ]
+        RoomBlock.objects.create(
+            hotel=self.hotel, room=self.rooms[3], block_type=RoomBlockType.MAINTENANCE,
+            start_date=self.start + timedelta(days=6), end_date=self.start + timedelta(days=8),
+        )
+        plan = RatePlan.objects.create(hotel=self.hotel, name="Base", code="BASE")
+        RateRule.objects.create(
+            plan=plan, name="Cierre", start_date=self.start + timedelta(days=9), end_date=self.start + timedelta(days=9),
+            target_room=self.rooms[2], closed=True,
+        )
+
+    def _naive_occupied(self, room, d):
+        return any(
+            r.room_id == room.id and r.status in (ReservationStatus.PENDING, ReservationStatus.CONFIRMED, ReservationStatus.CHECK_IN)
+            and r.check_in <= d < r.check_out
+            for r in self.reservations
+        )
+
+    def test_grid_matches_naive_overlap(self):
+        grid = OccupancyGrid.load(self.hotel.id, self.start, self.start + timedelta(days=12), include_closed=True)
+        for room in self.rooms:
+            for offset in range(12):
+                d = self.start + timedelta(days=offset)
+                self.assertEqual(grid.is_occupied(room.id, d), self._naive_occupied(room, d), (room.name, d))
+        self.assertTrue(grid.is_blocked(self.rooms[3].id, self.start + timedelta(days=7)))
+        self.assertFalse(grid.is_blocked(self.rooms[3].id, self.start + timedelta(days=8)))
+        self.assertEqual(grid.first_closed_day(self.rooms[2].id), self.start + timedelta(days=9))
+
+    def test_free_rooms_for_range(self):
+        grid = OccupancyGrid.load(self.hotel.id, self.start, self.start + timedelta(days=12), include_closed=True)
+        free = grid.free_rooms(self.start + timedelta(days=1), self.start + timedelta(days=3))
+        self.assertEqual([r.id for r in free], [self.rooms[1].id, self.rooms[2].id, self.rooms[3].id])
+        free = grid.free_rooms(self.start + timedelta(days=5), self.start + timedelta(days=10))
+        self.assertEqual([r.id for r in free], [self.rooms[0].id, self.rooms[1].id])
+        self.assertEqual(grid.free_count(self.start), 3)
+
+    def test_reservation_on_keeps_all_statuses(self):
+        grid = OccupancyGrid.load(self.hotel.id, self.start, self.start + timedelta(days=5), statuses=None, keep_reservations=True)
+        self.assertEqual(grid.reservation_on(self.rooms[2].id, self.start + timedelta(days=1)), self.reservations[2])
+        self.assertIsNone(grid.reservation_on(self.rooms[0].id, self.start + timedelta(days=1)))
+
+    def test_query_count_is_constant(self):
+        with self.assertNumQueries(3):
+            OccupancyGrid.load(self.hotel.id, self.start, self.start + timedelta(days=60))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RoomInventoryTest(TestCase):
+    def setUp(self):
+        self.currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel Inventario", email="inv@hotel.com")
+        self.room = Room.objects.create(
+            name="I-1", hotel=self.hotel, floor="1", room_type="double", number=301,
+            base_price=Decimal("100.00"), base_currency=self.currency, capacity=2, max_capacity=2,
+        )
+        self.other_room = Room.objects.create(
+            name="I-2", hotel=self.hotel, floor="1", room_type="double", number=302,
+            base_price=Decimal("100.00"), base_currency=self.currency, capacity=2, max_capacity=2,
+        )
+        self.start = date.today() + timedelta(days=20)
+        self.reservation = Reservation.objects.create(
+            hotel=self.hotel, room=self.room, guests=1,
+            guests_data=[{"name": "Ana", "email": "ana@test.com", "is_primary": True}],
+            check_in=self.start, check_out=self.start + timedelta(days=3),
+            status=ReservationStatus.CONFIRMED,
+        )
+
+    def _days(self, room, **flags):
+        return sorted(RoomInventoryDay.objects.filter(room=room, **flags).values_list("date", flat=True))
+
+    def test_reservation_writes_keep_inventory_current(self):
+        self.assertEqual(self._days(self.room, occupied=True), [self.start + timedelta(days=i) for i in range(3)])
+        self.assertEqual(RoomInventoryDay.objects.filter(room=self.room).first().reservation_id, self.reservation.id)
+
+        self.reservation.check_in = self.start + timedelta(days=1)
+        self.reservation.check_out = self.start + timedelta(days=5)
+        self.reservation.save()
+        self.assertEqual(self._days(self.room, occupied=True), [self.start + timedelta(days=i) for i in range(1, 5)])
+
+        self.reservation.room = self.other_room
+        self.reservation.save()
+        self.assertEqual(self._days(self.room), [])
+        self.assertEqual(len(self._days(self.other_room, occupied=True)), 4)
+
+        self.reservation.status = ReservationStatus.CANCELLED
+        self.reservation.save()
+        self.assertFalse(RoomInventoryDay.objects.exists())
+
+    def test_blocks_mark_blocked_and_out_of_order(self):
+        block = RoomBlock.objects.create(
+            hotel=self.hotel, room=self.other_room, block_type=RoomBlockType.OUT_OF_SERVICE,
+            start_date=self.start, end_date=self.start + timedelta(days=2),
+        )
+        self.assertEqual(len(self._days(self.other_room, out_of_order=True)), 2)
+        block.block_type = RoomBlockType.HOLD
+        block.save()
+        self.assertEqual(len(self._days(self.other_room, blocked=True, out_of_order=False)), 2)
+        block.delete()
+        self.assertEqual(self._days(self.other_room), [])
+
+    def test_available_rooms_and_rooms_left(self):
+        qs = Room.objects.filter(hotel=self.hotel).order_by("id")
+        free = available_rooms(qs, self.start + timedelta(days=2), self.start + timedelta(days=4), hotel_id=self.hotel.id)
+        self.assertEqual(list(free), [self.other_room])
+        free = available_rooms(qs, self.start + timedelta(days=3), self.start + timedelta(days=4), hotel_id=self.hotel.id)
+        self.assertEqual(list(free), [self.room, self.other_room])
+        left = rooms_left_by_type(self.hotel.id, self.start - timedelta(days=1), self.start + timedelta(days=1))
+        self.assertEqual(left, {self.start - timedelta(days=1): {"double": 2}, self.start: {"double": 1}})
+
+    def test_rebuild_command_reconciles_drift(self):
+        RoomInventoryDay.objects.filter(date=self.start).delete()
+        Reservation.objects.filter(pk=self.reservation.pk).update(check_out=self.start + timedelta(days=2))
+        out = StringIO()
+        call_command("rebuild_room_inventory", hotel_id=self.hotel.id, stdout=out)
+        self.assertIn("1 creadas, 0 actualizadas, 1 eliminadas", out.getvalue())
+        self.assertEqual(self._days(self.room, occupied=True), [self.start, self.start + timedelta(days=1)])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ReservationListKeysetSearchTest(TestCase):
+    def setUp(self):
+        self.currency = Currency.objects.create(code="ARS", name="Peso")
+        self.hotel = Hotel.objects.create(name="Hotel Lista", email="lista@hotel.com")
+        self.rooms = [
+            Room.objects.create(
+                name=f"L-{i}", hotel=self.hotel, floor="1", room_type="double", number=300 + i,
+                base_price=Decimal("100.00"), base_currency=self.currency, capacity=2, max_capacity=2,
+            )
+            for i in range(3)
+        ]
+        start = date.today() + timedelta(days=5)
+        self.reservations = []
+        for i in range(7):
+            # Dos reservas por fecha de llegada (en habitaciones distintas): el desempate es id
+            check_in = start + timedelta(days=3 * (i // 2))
+            self.reservations.append(Reservation.objects.create(
+                hotel=self.hotel, room=self.rooms[i % 2], check_in=check_in, check_out=check_in + timedelta(days=2),
+                guests_data=[{"name": f"Huésped {i}", "email": f"guest{i}@Mail.com", "is_primary": True}],
+                status=ReservationStatus.CONFIRMED,
+            ))
+        user = get_user_model().objects.create_user(username="lista", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.url = "/api/reservations/"
+
+    def _walk(self, params):
+        ids, url, pages = [], self.url, 0
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                resp = self.client.get(url, params if pages == 0 else None)
+            self.assertEqual(resp.status_code, 200)
+            self.assertFalse(any("COUNT(" in q["sql"].upper() for q in ctx.captured_queries))
+            ids += [r["id"] for r in resp.json()["results"]]
+            url, pages = resp.json()["next"], pages + 1
+        return ids, pages
+
+    def test_keyset_pages_follow_ordering_without_count(self):
+        expected = [r.id for r in sorted(self.reservations, key=lambda r: (r.check_in, r.id), reverse=True)]
+        ids, pages = self._walk({"hotel": self.hotel.id, "pagination": "cursor", "page_size": 3})
+        self.assertEqual((ids, pages), (expected, 3))
+
+        expected = [r.id for r in sorted(self.reservations, key=lambda r: (r.created_at, r.id))]
+        ids, _ = self._walk({"hotel": self.hotel.id, "pagination": "cursor", "page_size": 2, "ordering": "created_at"})
+        self.assertEqual(ids, expected)
+
+        default = self.client.get(self.url, {"hotel": self.hotel.id}).json()
+        self.assertEqual(default["count"], 7)
+        self.assertEqual(self.client.get(self.url, {"cursor": "no-es-un-cursor"}).status_code, 404)
+
+    def test_search_uses_denormalized_guest_and_external_fields(self):
+        target = self.reservations[3]
+        self.assertIn("guest3@mail.com", target.search_text)
+
+        def found(term):
+            resp = self.client.get(self.url, {"hotel": self.hotel.id, "search": term})
+            return {r["id"] for r in resp.json()["results"]}
+
+        self.assertEqual(found("GUEST3@mail"), {target.id})
+        self.assertEqual(found("L-1"), {r.id for r in self.reservations if r.room_id == self.rooms[1].id})
+
+        target.guests_data = [{"name": "Bruno Díaz", "email": "bruno@x.com", "is_primary": True}]
+        target.save(update_fields=["guests_data"])
+        other = self.reservations[0]
+        other.external_id, other.channel = "BK-991", "booking"
+        other.save(update_fields=["external_id", "channel"])
+        self.assertEqual(found("bruno"), {target.id})
+        self.assertEqual(found("guest3"), set())
+        self.assertEqual(found("bk-991"), {other.id})
@@ -9,7 +9,9 @@ from django.utils.dateparse import parse_date, parse_datetime
 from django.db.models import Q
 from apps.rooms.models import Room, RoomStatus
 from apps.rooms.serializers import RoomSerializer
+from apps.core.models import Hotel
 from .models import Reservation, ReservationStatus, ReservationChannel, RoomBlock, ReservationNight
+from .pagination import ReservationKeysetPagination
 from .serializers import (
     ReservationSerializer,
     PaymentSerializer,
@@ -21,9 +23,11 @@ from rest_framework.decorators import action, api_view
 from decimal import Decimal
 from django.db import models, transaction
 from django.db.models import Sum
-from .services.pricing import compute_nightly_rate, recalc_reservation_totals, generate_nights_for_reservation
-from apps.rates.models import RatePlan, DiscountType, PromoRule
-from apps.rates.services.engine import get_applicable_rule, compute_rate_for_date
+from .services.pricing import compute_nightly_rate, recalc_reservation_totals
+from .services.occupancy import OccupancyGrid
+from .services.inventory import available_rooms
+from apps.rates.models import DiscountType, PromoRule
+from apps.rates.services.engine import get_applicable_rule, compute_rate_for_range
 import uuid
 import logging
 
@@ -34,6 +38,15 @@ class ReservationViewSet(viewsets.ModelViewSet):
     serializer_class = ReservationSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    @property
+    def paginator(self):
+        # Paginación keyset opcional: ?pagination=cursor (o un ?cursor= de una página anterior)
+        if not hasattr(self, "_paginator") and self.request is not None:
+            params = self.request.query_params
+            if params.get("pagination") == "cursor" or "cursor" in params:
+                self._paginator = ReservationKeysetPagination()
+        return super().paginator
+
     def get_queryset(self):
         qs = Reservation.objects.select_related("hotel", "room")
         hotel_id = self.request.query_params.get("hotel")
@@ -153,20 +166,25 @@ class ReservationViewSet(viewsets.ModelViewSet):
 
         # Búsqueda simple (no rompe compatibilidad si el frontend también filtra):
         # - id exacto si es numérico
-        # - group_code / external_id / status / channel / hotel / room por contains
+        # - huéspedes / emails / external_id / group_code sobre search_text (índice trigram)
+        # - status / channel contra los valores de las choices (sin LIKE sobre la tabla)
+        # - hotel / habitación por nombre, resueltos a ids sobre sus tablas
         if search:
-            q = Q()
+            term = search.lower()
+            q = Q(search_text__contains=term)
             if search.isdigit():
-                try:
-                    q |= Q(id=int(search))
-                except Exception:
-                    pass
-            q |= Q(group_code__icontains=search)
-            q |= Q(external_id__icontains=search)
-            q |= Q(status__icontains=search)
-            q |= Q(channel__icontains=search)
-            q |= Q(hotel__name__icontains=search)
-            q |= Q(room__name__icontains=search)
+                q |= Q(id=int(search))
+            statuses = [value for value, _ in ReservationStatus.choices if term in value]
+            if statuses:
+                q |= Q(status__in=statuses)
+            channels = [value for value, _ in ReservationChannel.choices if term in value]
+            if channels:
+                q |= Q(channel__in=channels)
+            rooms = Room.objects.filter(name__icontains=search)
+            if hotel_id and hotel_id.isdigit():
+                rooms = rooms.filter(hotel_id=hotel_id)
+            q |= Q(room_id__in=rooms.values("id"))
+            q |= Q(hotel_id__in=Hotel.objects.filter(name__icontains=search).values("id"))
             qs = qs.filter(q)
         
         # Validar que el campo de ordenamiento sea válido
@@ -187,15 +205,8 @@ class ReservationViewSet(viewsets.ModelViewSet):
         try:
             serializer = self.get_serializer(data=request.data)
             serializer.is_valid(raise_exception=True)
+            # Noches/totales se materializan en el post_save (signals) y quedan reflejados en la instancia
             instance = serializer.save()
-            # Recalcular noches/totales inmediatamente para reflejar impuestos/promos en la respuesta
-            if instance.check_in and instance.check_out and instance.room_id:
-                generate_nights_for_reservation(instance)
-                recalc_reservation_totals(instance)
-                try:
-                    instance.refresh_from_db(fields=["total_price"])  # asegurar valor actualizado
-                except Exception:
-                    pass
             output = self.get_serializer(instance)
             headers = self.get_success_headers(output.data)
             return Response(output.data, status=status.HTTP_201_CREATED, headers=headers)
@@ -218,13 +229,6 @@ class ReservationViewSet(viewsets.ModelViewSet):
             serializer = self.get_serializer(instance, data=request.data, partial=partial)
             serializer.is_valid(raise_exception=True)
             instance = serializer.save()
-            if instance.check_in and instance.check_out and instance.room_id:
-                generate_nights_for_reservation(instance)
-                recalc_reservation_totals(instance)
-                try:
-                    instance.refresh_from_db(fields=["total_price"])  # asegurar valor actualizado
-                except Exception:
-                    pass
             return Response(self.get_serializer(instance).data)
         except ValidationError as e:
             # Convertir ValidationError a formato JSON
@@ -288,18 +292,9 @@ class ReservationViewSet(viewsets.ModelViewSet):
                     }
                     res_serializer = ReservationSerializer(data=single_payload, context=self.get_serializer_context())
                     res_serializer.is_valid(raise_exception=True)
+                    # Noches y totales se materializan en el post_save de cada reserva
                     instance = res_serializer.save()
                     created_reservations.append(instance)
-
-                # Regenerar noches y totales para todas las reservas creadas
-                for instance in created_reservations:
-                    if instance.check_in and instance.check_out and instance.room_id:
-                        generate_nights_for_reservation(instance)
-                        recalc_reservation_totals(instance)
-                        try:
-                            instance.refresh_from_db(fields=["total_price"])
-                        except Exception:
-                            pass
         except ValidationError as e:
             if hasattr(e, 'message_dict'):
                 return Response(e.message_dict, status=status.HTTP_400_BAD_REQUEST)
@@ -1082,27 +1077,16 @@ class AvailabilityView(GenericAPIView):
         if start > end:
             return Response({"detail": "la fecha de check-in debe ser anterior a la fecha de check-out"}, status=status.HTTP_400_BAD_REQUEST)
 
-        active_status = [
-            ReservationStatus.PENDING,
-            ReservationStatus.CONFIRMED,
-            ReservationStatus.CHECK_IN,
-        ]
-
-        rooms = (
+        # Habitaciones libres según el inventario diario (reservas activas + bloqueos);
+        # la ventana tiene al menos un día
+        rooms = available_rooms(
             Room.objects.select_related("hotel")
             .filter(hotel_id=hotel_id)
             .exclude(status=RoomStatus.OUT_OF_SERVICE)
-            .exclude(
-                reservations__status__in=active_status,
-                reservations__check_in__lt=end,
-                reservations__check_out__gt=start,
-            )
-            .exclude(
-                room_blocks__is_active=True,
-                room_blocks__start_date__lt=end,
-                room_blocks__end_date__gt=start,
-            )
-            .distinct()
+            .order_by("id"),
+            start,
+            max(end, start + timedelta(days=1)),
+            hotel_id=hotel_id,
         )
 
         page = self.paginate_queryset(rooms)
@@ -1112,33 +1096,14 @@ class AvailabilityView(GenericAPIView):
 
         # Si se solicita calendario detallado, devolver por habitación el estado por día
         if calendar in ("1", "true", "True"):
-            def get_applicable_rule(room, on_date, channel_value):
-                plans = RatePlan.objects.filter(hotel=room.hotel, is_active=True).order_by("-priority", "id").prefetch_related("rules")
-                for plan in plans:
-                    rules = sorted(plan.rules.all(), key=lambda r: r.priority, reverse=True)
-                    for rule in rules:
-                        if not (rule.start_date <= on_date <= rule.end_date):
-                            continue
-                        dow = on_date.weekday()
-                        if not [rule.apply_mon, rule.apply_tue, rule.apply_wed, rule.apply_thu, rule.apply_fri, rule.apply_sat, rule.apply_sun][dow]:
-                            continue
-                        if rule.target_room_id and rule.target_room_id != room.id:
-                            continue
-                        if rule.target_room_type and rule.target_room_type != room.room_type:
-                            continue
-                        if rule.channel and channel_value and rule.channel != channel_value:
-                            continue
-                        if rule.channel and not channel_value:
-                            continue
-                        return rule
-                return None
-
+            # Un canal vacío equivale a "sin canal" (reglas con canal no aplican)
+            channel_value = channel or None
             results = []
             for room in rooms:
                 days = []
                 current = start
                 while current <= end:
-                    rule = get_applicable_rule(room, current, channel)
+                    rule = get_applicable_rule(room, current, channel_value)
                     day_info = {
                         "date": current,
                         "available": True,
@@ -1247,12 +1212,11 @@ def can_book(request):
         return Response({"ok": False, "reason": "max_stay", "value": start_rule.max_stay}, status=status.HTTP_200_OK)
 
     # Días cerrados
-    current = check_in
-    while current < check_out:
-        rule = get_applicable_rule(room, current, channel, include_closed=True)
-        if rule and rule.closed:
-            return Response({"ok": False, "reason": "closed", "date": current}, status=status.HTTP_200_OK)
-        current += timedelta(days=1)
+    grid = OccupancyGrid(room.hotel_id, check_in, check_out, [room])
+    grid.load_closed(channel)
+    closed_day = grid.first_closed_day(room.id)
+    if closed_day is not None:
+        return Response({"ok": False, "reason": "closed", "date": closed_day}, status=status.HTTP_200_OK)
 
     return Response({"ok": True}, status=status.HTTP_200_OK)
 
@@ -1302,20 +1266,28 @@ def quote_range(request):
         return Response({"ok": False, "reason": "max_stay", "value": start_rule.max_stay}, status=status.HTTP_200_OK)
 
     current = check_in
-    raw_days = []
+    night_rules = []
     while current < check_out:
         rule = get_applicable_rule(room, current, channel, include_closed=True)
         if rule and rule.closed:
             return Response({"ok": False, "reason": "closed", "date": current}, status=status.HTTP_200_OK)
-        pricing = compute_rate_for_date(
-            room,
-            guests,
-            current,
-            channel,
-            promo_code,
-            voucher_code,
-            price_source,
-        )
+        night_rules.append(rule)
+        current += timedelta(days=1)
+
+    priced_nights = compute_rate_for_range(
+        room,
+        guests,
+        check_in,
+        check_out,
+        channel,
+        promo_code,
+        voucher_code,
+        price_source,
+    )
+    raw_days = []
+    for rule, night in zip(night_rules, priced_nights):
+        current = night["date"]
+        pricing = {k: v for k, v in night.items() if k != "date"}
         applied_rule = None
         if rule:
             applied_rule = {
@@ -1331,7 +1303,6 @@ def quote_range(request):
             "pricing": pricing,
             "rule": applied_rule,
         })
-        current += timedelta(days=1)
 
     # Prorrateo de promos por reserva
     bases = []
@@ -1513,21 +1484,29 @@ def quote(request):
 
     # Días cerrados y pricing
     current = check_in
-    days = []
-    total = Decimal('0.00')
+    night_rules = []
     while current < check_out:
         rule = get_applicable_rule(room, current, channel, include_closed=True)
         if rule and rule.closed:
             return Response({"ok": False, "reason": "closed", "date": current}, status=status.HTTP_200_OK)
-        pricing = compute_rate_for_date(
-            room,
-            guests,
-            current,
-            channel,
-            promo_code,
-            voucher_code,
-            price_source,
-        )
+        night_rules.append(rule)
+        current += timedelta(days=1)
+
+    priced_nights = compute_rate_for_range(
+        room,
+        guests,
+        check_in,
+        check_out,
+        channel,
+        promo_code,
+        voucher_code,
+        price_source,
+    )
+    days = []
+    total = Decimal('0.00')
+    for rule, night in zip(night_rules, priced_nights):
+        current = night["date"]
+        pricing = {k: v for k, v in night.items() if k != "date"}
         applied_rule = None
         if rule:
             applied_rule = {
@@ -1544,7 +1523,6 @@ def quote(request):
             "rule": applied_rule,
         })
         total += pricing["total_night"]
-        current += timedelta(days=1)
 
     adr = (total / Decimal(nights)).quantize(Decimal('0.01')) if nights else Decimal('0.00')
     currency_code = None
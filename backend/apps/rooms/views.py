@@ -3,7 +3,6 @@ from rest_framework.response import Response
 from datetime import date
 from .models import Room, RoomStatus
 from .serializers import RoomSerializer, RoomTypeSerializer
-from apps.reservations.models import ReservationStatus
 from .models import RoomType
 
 class RoomViewSet(viewsets.ModelViewSet):
@@ -60,34 +59,11 @@ class RoomViewSet(viewsets.ModelViewSet):
                     # Si las fechas son inválidas, retornar queryset vacío
                     return qs.none()
                 
-                # Estados de reserva que ocupan la habitación
-                active_status = [
-                    ReservationStatus.PENDING,
-                    ReservationStatus.CONFIRMED,
-                    ReservationStatus.CHECK_IN,
-                ]
-                
-                # Excluir habitaciones con reservas activas en el rango de fechas
-                # Una reserva ocupa la habitación si:
-                # - check_in de la reserva < check_out solicitado Y
-                # - check_out de la reserva > check_in solicitado
-                qs = qs.exclude(
-                    reservations__status__in=active_status,
-                    reservations__check_in__lt=check_out_date,
-                    reservations__check_out__gt=check_in_date,
-                )
-                
-                # Excluir habitaciones con bloqueos activos en el rango de fechas
-                # Importar RoomBlock aquí para evitar importaciones circulares
-                from apps.reservations.models import RoomBlock
-                qs = qs.exclude(
-                    room_blocks__is_active=True,
-                    room_blocks__start_date__lt=check_out_date,
-                    room_blocks__end_date__gt=check_in_date,
-                )
-                
-                # Usar distinct() para evitar duplicados por las relaciones
-                qs = qs.distinct()
+                # Excluir habitaciones con algún día ocupado/bloqueado en el rango según el
+                # inventario diario materializado (reservas activas + bloqueos activos).
+                # Importar aquí para evitar importaciones circulares
+                from apps.reservations.services.inventory import available_rooms
+                qs = available_rooms(qs, check_in_date, check_out_date, hotel_id=hotel_id)
                 
             except (ValueError, TypeError):
                 # Si las fechas son inválidas, ignorar el filtro
@@ -1,3 +1,4 @@
+import json
 import os
 from pathlib import Path
 from decouple import config
@@ -347,6 +348,14 @@ CELERY_BEAT_SCHEDULE = {
         "task": "apps.invoicing.tasks.retry_failed_invoices_task",
         "schedule": crontab(minute=15),  # Cada hora a los 15 minutos
     },
+    "send_pending_invoices_daily": {
+        "task": "apps.invoicing.tasks.send_pending_invoices_task",
+        "schedule": crontab(hour=22, minute=30),  # Diario a las 10:30 PM (antes del reporte diario)
+    },
+    "renew_expiring_afip_tickets": {
+        "task": "apps.invoicing.tasks.renew_expiring_afip_tickets_task",
+        "schedule": crontab(minute="*/5"),  # Cada 5 minutos (TA por vencer)
+    },
     "cleanup_expired_invoices_daily": {
         "task": "apps.invoicing.tasks.cleanup_expired_invoices_task",
         "schedule": crontab(hour=2, minute=0),  # Diario a las 2:00 AM
@@ -376,6 +385,60 @@ CELERY_BEAT_SCHEDULE = {
     },
 }
 
+# Descarga concurrente de feeds iCal (import_all_ics)
+OTA_ICAL_FETCH_CONCURRENCY = config('OTA_ICAL_FETCH_CONCURRENCY', default=8, cast=int)
+OTA_ICAL_FETCH_TIMEOUT = config('OTA_ICAL_FETCH_TIMEOUT', default=20, cast=int)
+# Feeds iCal de salida: TTL de la caché (además se invalidan por signals)
+OTA_ICAL_EXPORT_CACHE_SECONDS = config('OTA_ICAL_EXPORT_CACHE_SECONDS', default=3600, cast=int)
+
+# Import de Google Calendar (import_all_google): mapeos por shard (un task cada uno),
+# listados concurrentes dentro del shard y lock por mapeo para no solapar ciclos
+OTA_GOOGLE_SHARD_SIZE = config('OTA_GOOGLE_SHARD_SIZE', default=20, cast=int)
+OTA_GOOGLE_FETCH_CONCURRENCY = config('OTA_GOOGLE_FETCH_CONCURRENCY', default=8, cast=int)
+OTA_GOOGLE_IMPORT_LOCK_SECONDS = config('OTA_GOOGLE_IMPORT_LOCK_SECONDS', default=300, cast=int)
+
+# Política de OtaSyncLog (ver apps/otas/services/sync_log.py): nivel mínimo, muestreo de
+# entradas INFO por evento y overrides por hotel, p. ej. '{"12": {"level": "warning", "sample_rate": 0.1}}'
+OTA_SYNC_LOG_LEVEL = config('OTA_SYNC_LOG_LEVEL', default='info')
+OTA_SYNC_LOG_SAMPLE_RATE = config('OTA_SYNC_LOG_SAMPLE_RATE', default=1.0, cast=float)
+OTA_SYNC_LOG_HOTEL_POLICIES = config('OTA_SYNC_LOG_HOTEL_POLICIES', default='{}', cast=json.loads)
+
+# Publicador de eventos de OTAs (apps/otas/services/event_bus.py): pool compartido por proceso
+OTA_EVENTS_REDIS_TIMEOUT = config('OTA_EVENTS_REDIS_TIMEOUT', default=0.5, cast=float)
+OTA_EVENTS_REDIS_MAX_CONNECTIONS = config('OTA_EVENTS_REDIS_MAX_CONNECTIONS', default=10, cast=int)
+OTA_EVENTS_BACKOFF_SECONDS = config('OTA_EVENTS_BACKOFF_SECONDS', default=30, cast=int)
+# Stream SSE bajo ASGI (apps/otas/services/event_fanout.py)
+OTA_EVENTS_REPLAY_BUFFER = config('OTA_EVENTS_REPLAY_BUFFER', default=500, cast=int)
+OTA_EVENTS_CLIENT_QUEUE = config('OTA_EVENTS_CLIENT_QUEUE', default=100, cast=int)
+OTA_EVENTS_HEARTBEAT_SECONDS = config('OTA_EVENTS_HEARTBEAT_SECONDS', default=15, cast=int)
+
+# Push de ARI por deltas (apps/otas/services/ari_engine.py): ventana de coalescencia de
+# cambios y tope de rangos por request al canal
+OTA_ARI_DEBOUNCE_SECONDS = config('OTA_ARI_DEBOUNCE_SECONDS', default=10, cast=int)
+OTA_ARI_MAX_ITEMS_PER_PUSH = config('OTA_ARI_MAX_ITEMS_PER_PUSH', default=200, cast=int)
+
+# Cliente HTTP de adapters de canales (apps/otas/services/http_client.py): pool keep-alive
+# por host, reintentos reprogramados en Celery y circuit breaker por proveedor
+OTA_HTTP_CONNECT_TIMEOUT = config('OTA_HTTP_CONNECT_TIMEOUT', default=3.05, cast=float)
+OTA_HTTP_READ_TIMEOUT = config('OTA_HTTP_READ_TIMEOUT', default=10, cast=float)
+OTA_HTTP_POOL_MAXSIZE = config('OTA_HTTP_POOL_MAXSIZE', default=10, cast=int)
+OTA_HTTP_MAX_RETRIES = config('OTA_HTTP_MAX_RETRIES', default=5, cast=int)
+OTA_HTTP_RETRY_BASE_SECONDS = config('OTA_HTTP_RETRY_BASE_SECONDS', default=5, cast=int)
+OTA_HTTP_RETRY_MAX_SECONDS = config('OTA_HTTP_RETRY_MAX_SECONDS', default=300, cast=int)
+OTA_HTTP_BREAKER_THRESHOLD = config('OTA_HTTP_BREAKER_THRESHOLD', default=5, cast=int)
+OTA_HTTP_BREAKER_COOLDOWN_SECONDS = config('OTA_HTTP_BREAKER_COOLDOWN_SECONDS', default=60, cast=int)
+
+# Verificación de disponibilidad en OTAs antes de confirmar (services/availability_checker.py):
+# consultas en paralelo con deadline global y caché corta por habitación y rango
+OTA_AVAILABILITY_DEADLINE_SECONDS = config('OTA_AVAILABILITY_DEADLINE_SECONDS', default=2.5, cast=float)
+OTA_AVAILABILITY_PROVIDER_TIMEOUT = config('OTA_AVAILABILITY_PROVIDER_TIMEOUT', default=2.0, cast=float)
+OTA_AVAILABILITY_CACHE_SECONDS = config('OTA_AVAILABILITY_CACHE_SECONDS', default=30, cast=int)
+OTA_AVAILABILITY_STALE_SECONDS = config('OTA_AVAILABILITY_STALE_SECONDS', default=600, cast=int)
+OTA_AVAILABILITY_MAX_WORKERS = config('OTA_AVAILABILITY_MAX_WORKERS', default=8, cast=int)
+
+# Pull de reservas (pull_reservations_for_hotel): reservas por lote de upsert bulk
+OTA_PULL_BATCH_SIZE = config('OTA_PULL_BATCH_SIZE', default=200, cast=int)
+
 # Asegurar registro explícito de tareas de OTAs en Celery (además del autodiscover)
 CELERY_IMPORTS = (
     "apps.otas.tasks",
@@ -506,10 +569,31 @@ AFIP_USE_MOCK = config('AFIP_USE_MOCK', default=False, cast=bool)
 AFIP_CERTIFICATE_PATH = config('AFIP_CERTIFICATE_PATH', default='')
 AFIP_PRIVATE_KEY_PATH = config('AFIP_PRIVATE_KEY_PATH', default='')
 
+# WSFEv1: comprobantes por FECAESolicitar (acotado además por FECompTotXRequest) y pool HTTP
+AFIP_CAE_BATCH_SIZE = config('AFIP_CAE_BATCH_SIZE', default=250, cast=int)
+AFIP_HTTP_POOL_MAXSIZE = config('AFIP_HTTP_POOL_MAXSIZE', default=4, cast=int)
+# Facturas en 'sent' sin CAE por más de estos minutos (worker caído) vuelven a reintentarse
+AFIP_SENT_STALE_MINUTES = config('AFIP_SENT_STALE_MINUTES', default=30, cast=int)
+
+# WSAA: renovar el TA en segundo plano cuando le quedan menos de estos segundos y espera máxima
+# de los workers mientras otro pide un TA nuevo (avisados por pub/sub, sin sondeo)
+AFIP_TA_RENEW_BEFORE_SECONDS = config('AFIP_TA_RENEW_BEFORE_SECONDS', default=900, cast=int)
+AFIP_TA_WAIT_TIMEOUT_SECONDS = config('AFIP_TA_WAIT_TIMEOUT_SECONDS', default=90, cast=int)
+
 # Configuración de reintentos
 INVOICE_MAX_RETRIES = config('INVOICE_MAX_RETRIES', default=3, cast=int)
 INVOICE_RETRY_DELAY = config('INVOICE_RETRY_DELAY', default=300, cast=int)  # 5 minutos
 
 # Configuración de PDFs
 INVOICE_PDF_TEMPLATE = 'invoicing/invoice_template.html'
-INVOICE_PDF_LOGO_PATH = os.path.join(STATIC_ROOT, 'img', 'logo.png')
\ No newline at end of file
+INVOICE_PDF_LOGO_PATH = os.path.join(STATIC_ROOT, 'img', 'logo.png')
+
+# Conciliación bancaria: transacciones por tramo (propuestas y escrituras bulk)
+BANK_RECONCILIATION_CHUNK_SIZE = config('BANK_RECONCILIATION_CHUNK_SIZE', default=1000, cast=int)
+# Conciliación bancaria: filas por lote de carga del CSV y tamaño máximo del extracto
+BANK_RECONCILIATION_INGEST_BATCH_SIZE = config('BANK_RECONCILIATION_INGEST_BATCH_SIZE', default=2000, cast=int)
+BANK_RECONCILIATION_MAX_CSV_BYTES = config('BANK_RECONCILIATION_MAX_CSV_BYTES', default=50 * 1024 * 1024, cast=int)
+
+# Recibos no fiscales (seña / pago / devolución): con un valor > 1 cada proceso reserva bloques de
+# números y evita la contención sobre la fila de la secuencia (admite huecos). 1 = sin huecos
+RECEIPT_NUMBER_BLOCK_SIZE = config('RECEIPT_NUMBER_BLOCK_SIZE', default=1, cast=int)